@@ -39,6 +39,12 @@ flags.DEFINE_string('eval_sstable', None,
                     'Path of the SSTable to read the input tf.Examples from.')
 flags.DEFINE_string('stats_file', None,
                     'Path of the statistics file to use for normalization.')
+flags.DEFINE_integer('crop_batch_size', None,
+                     'If set, the number of crops fed to the network per '
+                     'session run. By default, crops are run one at a time. '
+                     'Models with batch norm normalize with the statistics of '
+                     'the batch they are fed, so they ignore this flag and '
+                     'always run crops one at a time.')
 
 FLAGS = flags.FLAGS
 
@@ -224,9 +230,30 @@ def compute_one_prediction(
                       debug_steps,
                       crop_size_x, crop_size_y,
                       crop_step_x, crop_step_y, eval_config.pyramid_weights)
+  crop_batch_size = eval_config.get('crop_batch_size', 0)
+  if crop_batch_size and experiment.model.uses_batch_statistics:
+    # The network normalizes with the statistics of the batch it is fed, so
+    # batching crops together would change their predictions.
+    logging.log_first_n(
+        logging.WARNING, 'The network uses batch statistics, ignoring '
+        'crop_batch_size %d and running crops one at a time.', 1,
+        crop_batch_size)
+    crop_batch_size = 1
   # Accumulate all crops, starting and ending half off the square.
-  for i in range(-crop_size_x // 2, length - crop_size_x // 2, crop_step_x):
-    for j in range(-crop_size_y // 2, length - crop_size_y // 2, crop_step_y):
+  crop_offsets = [
+      (i, j)
+      for i in range(-crop_size_x // 2, length - crop_size_x // 2, crop_step_x)
+      for j in range(-crop_size_y // 2, length - crop_size_y // 2, crop_step_y)
+  ]
+  if crop_batch_size:
+    (prob_accum, softmax_prob_accum, ss_accum, asa_accum, torsions_accum,
+     weights_1d_accum) = compute_crops_batched(
+         sess, experiment, output_fetches, inputs_1d, residue_index,
+         prob_weights, batch, length, crop_offsets, crop_size_x, crop_size_y,
+         crop_batch_size, num_bins, torsion_bins)
+    num_crops_local = len(crop_offsets)
+  else:
+    for i, j in crop_offsets:
       # The ideal crop.
       patch = compute_one_patch(
           sess, experiment, output_fetches, inputs_1d, residue_index,
@@ -296,43 +323,14 @@ def compute_one_patch(sess, experiment, output_fetches, inputs_1d,
   end_x = i + crop_size_x
   end_y = j + crop_size_y
   crop_limits = np.array([[i, end_x, j, end_y]], dtype=np.int32)
-  ic = max(0, i)
-  jc = max(0, j)
   end_x_cropped = min(length, end_x)
   end_y_cropped = min(length, end_y)
   prepad_x = max(0, -i)
   prepad_y = max(0, -j)
   postpad_x = end_x - end_x_cropped
   postpad_y = end_y - end_y_cropped
-
-  # Precrop the 2D features:
-  inputs_2d = np.pad(batch['inputs_2d'][
-      :, jc:end_y, ic:end_x, :],
-                     [[0, 0],
-                      [prepad_y, postpad_y],
-                      [prepad_x, postpad_x],
-                      [0, 0]], mode='constant')
-  assert inputs_2d.shape[1] == crop_size_y
-  assert inputs_2d.shape[2] == crop_size_x
-
-  # Generate the corresponding crop, but it might be truncated.
-  cxx = batch['inputs_2d'][:, ic:end_x, ic:end_x, :]
-  cyy = batch['inputs_2d'][:, jc:end_y, jc:end_y, :]
-  if cxx.shape[1] < inputs_2d.shape[1]:
-    cxx = np.pad(cxx, [[0, 0],
-                       [prepad_x, max(0, i + crop_size_y - length)],
-                       [prepad_x, postpad_x],
-                       [0, 0]], mode='constant')
-  assert cxx.shape[1] == crop_size_y
-  assert cxx.shape[2] == crop_size_x
-  if cyy.shape[2] < inputs_2d.shape[2]:
-    cyy = np.pad(cyy, [[0, 0],
-                       [prepad_y, postpad_y],
-                       [prepad_y, max(0, j + crop_size_x - length)],
-                       [0, 0]], mode='constant')
-  assert cyy.shape[1] == crop_size_y
-  assert cyy.shape[2] == crop_size_x
-  inputs_2d = np.concatenate([inputs_2d, cxx, cyy], 3)
+  inputs_2d = _crop_inputs_2d(
+      batch['inputs_2d'], length, i, j, crop_size_x, crop_size_y)
 
   output_results = sess.run(output_fetches, feed_dict={
       experiment.inputs_1d_placeholder: inputs_1d,
@@ -370,6 +368,141 @@ def compute_one_patch(sess, experiment, output_fetches, inputs_1d,
   return patch
 
 
+def _crop_inputs_2d(inputs_2d, length, i, j, crop_size_x, crop_size_y):
+  """Crops the 2D features, stacked with their diagonal crops, for one crop."""
+  end_x = i + crop_size_x
+  end_y = j + crop_size_y
+  ic = max(0, i)
+  jc = max(0, j)
+  end_x_cropped = min(length, end_x)
+  end_y_cropped = min(length, end_y)
+  prepad_x = max(0, -i)
+  prepad_y = max(0, -j)
+  postpad_x = end_x - end_x_cropped
+  postpad_y = end_y - end_y_cropped
+
+  # Precrop the 2D features:
+  inputs_2d_crop = np.pad(inputs_2d[:, jc:end_y, ic:end_x, :],
+                          [[0, 0],
+                           [prepad_y, postpad_y],
+                           [prepad_x, postpad_x],
+                           [0, 0]], mode='constant')
+  assert inputs_2d_crop.shape[1] == crop_size_y
+  assert inputs_2d_crop.shape[2] == crop_size_x
+
+  # Generate the corresponding crop, but it might be truncated.
+  cxx = inputs_2d[:, ic:end_x, ic:end_x, :]
+  cyy = inputs_2d[:, jc:end_y, jc:end_y, :]
+  if cxx.shape[1] < inputs_2d_crop.shape[1]:
+    cxx = np.pad(cxx, [[0, 0],
+                       [prepad_x, max(0, i + crop_size_y - length)],
+                       [prepad_x, postpad_x],
+                       [0, 0]], mode='constant')
+  assert cxx.shape[1] == crop_size_y
+  assert cxx.shape[2] == crop_size_x
+  if cyy.shape[2] < inputs_2d_crop.shape[2]:
+    cyy = np.pad(cyy, [[0, 0],
+                       [prepad_y, postpad_y],
+                       [prepad_y, max(0, j + crop_size_x - length)],
+                       [0, 0]], mode='constant')
+  assert cyy.shape[1] == crop_size_y
+  assert cyy.shape[2] == crop_size_x
+  return np.concatenate([inputs_2d_crop, cxx, cyy], 3)
+
+
+def compute_crops_batched(sess, experiment, output_fetches, inputs_1d,
+                          residue_index, prob_weights, batch, length,
+                          crop_offsets, crop_size_x, crop_size_y,
+                          crop_batch_size, num_bins, torsion_bins):
+  """Computes and accumulates all crops, running them in batches.
+
+  Gives the same sums as calling `compute_one_patch` for each crop in
+  `crop_offsets` and accumulating the patches. The accumulators are padded by
+  a crop on each side, so that every crop is added whole and the parts off
+  the protein fall in the padding, which is dropped at the end.
+
+  Args:
+    sess: A tf.train.Session.
+    experiment: An experiment class.
+    output_fetches: Dict of tensors to fetch for each batch of crops.
+    inputs_1d: 1D input features of the protein, with a batch size of 1.
+    residue_index: Residue index of the protein, with a batch size of 1.
+    prob_weights: Weights of the positions of a crop, or 1.
+    batch: The example, as returned by `experiment.get_one_example`.
+    length: Length of the protein.
+    crop_offsets: List of (i, j) offsets of the crops.
+    crop_size_x: Size of the crops along x.
+    crop_size_y: Size of the crops along y.
+    crop_batch_size: Number of crops to run per session run.
+    num_bins: The number of bins in the distance histogram.
+    torsion_bins: The number of bins the torsion angles are discretised into.
+
+  Returns:
+    A tuple of the accumulated probs and weights [length, length, 2], softmax
+    probs [length, length, num_bins], secondary structure [length, 8], ASA
+    [length], torsions [length, torsion_bins**2] and 1D weights [length].
+  """
+  pad_1d = max(crop_size_x, crop_size_y)
+  padded_length_1d = length + 2 * pad_1d
+  prob_accum = np.zeros(
+      (length + 2 * crop_size_y, length + 2 * crop_size_x, 2))
+  softmax_prob_accum = np.zeros(
+      (length + 2 * crop_size_y, length + 2 * crop_size_x, num_bins),
+      dtype=np.float32)
+  ss_accum = np.zeros((padded_length_1d, 8))
+  torsions_accum = np.zeros((padded_length_1d, torsion_bins**2))
+  asa_accum = np.zeros((padded_length_1d,))
+  weights_1d_accum = np.zeros((padded_length_1d,))
+  weights = np.broadcast_to(prob_weights, (crop_size_y, crop_size_x))
+  weights_3d = np.expand_dims(weights, 2)
+
+  for start in range(0, len(crop_offsets), crop_batch_size):
+    offsets = crop_offsets[start:start + crop_batch_size]
+    num_crops = len(offsets)
+    output_results = sess.run(output_fetches, feed_dict={
+        experiment.inputs_1d_placeholder: np.repeat(
+            inputs_1d, num_crops, axis=0),
+        experiment.residue_index_placeholder: np.repeat(
+            residue_index, num_crops, axis=0),
+        experiment.inputs_2d_placeholder: np.concatenate([
+            _crop_inputs_2d(batch['inputs_2d'], length, i, j, crop_size_x,
+                            crop_size_y) for i, j in offsets]),
+        experiment.crop_placeholder: np.array(
+            [[i, i + crop_size_x, j, j + crop_size_y] for i, j in offsets],
+            dtype=np.int32),
+    })
+    for k, (i, j) in enumerate(offsets):
+      x = slice(i + crop_size_x, i + 2 * crop_size_x)
+      y = slice(j + crop_size_y, j + 2 * crop_size_y)
+      x_1d = slice(i + pad_1d, i + pad_1d + crop_size_x)
+      y_1d = slice(j + pad_1d, j + pad_1d + crop_size_y)
+      prob_accum[y, x, 0] += output_results['probs'][k] * weights
+      prob_accum[y, x, 1] += weights
+      softmax_prob_accum[y, x, :] += (
+          output_results['softmax_probs'][k] * weights_3d)
+      weights_1d_accum[y_1d] += 1
+      weights_1d_accum[x_1d] += 1
+      if 'asa_output' in output_results:
+        asa = np.squeeze(output_results['asa_output'][k], axis=1)
+        asa_accum[x_1d] += asa[:crop_size_x]
+        asa_accum[y_1d] += asa[crop_size_x:crop_size_x + crop_size_y]
+      if 'secstruct_probs' in output_results:
+        ss = output_results['secstruct_probs'][k]
+        ss_accum[x_1d] += ss[:crop_size_x]
+        ss_accum[y_1d] += ss[crop_size_x:crop_size_x + crop_size_y]
+      if 'torsion_probs' in output_results:
+        torsions = output_results['torsion_probs'][k]
+        torsions_accum[x_1d] += torsions[:crop_size_x]
+        torsions_accum[y_1d] += torsions[crop_size_x:crop_size_x + crop_size_y]
+
+  live_2d = (slice(crop_size_y, crop_size_y + length),
+             slice(crop_size_x, crop_size_x + length))
+  live_1d = slice(pad_1d, pad_1d + length)
+  return (prob_accum[live_2d], softmax_prob_accum[live_2d], ss_accum[live_1d],
+          asa_accum[live_1d], torsions_accum[live_1d],
+          weights_1d_accum[live_1d])
+
+
 def main(argv):
   del argv  # Unused.
 
@@ -384,6 +517,8 @@ def main(argv):
     config.eval_config.stats_file = FLAGS.stats_file
   if FLAGS.output_path:
     config.eval_config.output_path = FLAGS.output_path
+  if FLAGS.crop_batch_size:
+    config.eval_config.crop_batch_size = FLAGS.crop_batch_size
 
   with tf.device('/cpu:0' if FLAGS.cpu else None):
     evaluate(checkpoint_path=FLAGS.checkpoint_path, **config)
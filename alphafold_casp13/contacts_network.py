@@ -103,6 +103,12 @@ class ContactsNet(sonnet.AbstractModule):
             [self._position_specific_bias_size, self._num_bins or 1],
             initializer=tf.zeros_initializer())
 
+  @property
+  def uses_batch_statistics(self):
+    """Whether evaluation normalizes with the statistics of the fed batch."""
+    return bool(self._collapsed_batch_norm or
+                self._network_2d_deep.use_batch_norm)
+
   def quant_threshold(self, threshold=8.0):
     """Find the bin that is 8A+: we sum mass below this bin gives contact prob.
 
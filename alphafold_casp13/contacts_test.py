@@ -0,0 +1,160 @@
+# Copyright 2019 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for batched crop inference in contacts."""
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+
+from alphafold_casp13 import config_dict
+from alphafold_casp13 import contacts
+
+_NUM_BINS = 4
+_TORSION_BINS = 3
+_NUM_2D_FEATURES = 2
+
+
+class _FakeModel(object):
+
+  def __init__(self, uses_batch_statistics):
+    self.uses_batch_statistics = uses_batch_statistics
+
+  def update_crop_fetches(self, fetches):
+    fetches['secstruct_probs'] = 'secstruct_probs'
+    fetches['torsion_probs'] = 'torsion_probs'
+    fetches['asa_output'] = 'asa_output'
+
+
+class _FakeExperiment(object):
+  """Experiment whose placeholders and fetches are names for `_FakeSession`."""
+
+  inputs_1d_placeholder = 'inputs_1d'
+  residue_index_placeholder = 'residue_index'
+  inputs_2d_placeholder = 'inputs_2d'
+  crop_placeholder = 'crop'
+  eval_probs = 'probs'
+  eval_probs_softmax = 'softmax_probs'
+
+  def __init__(self, example, crop_size_x, crop_size_y,
+               uses_batch_statistics=False):
+    self._example = example
+    self.crop_size_x = crop_size_x
+    self.crop_size_y = crop_size_y
+    self.model = _FakeModel(uses_batch_statistics)
+
+  def get_one_example(self, sess):
+    del sess
+    return self._example
+
+
+class _FakeSession(object):
+  """Computes every output of a crop from the inputs fed for that crop.
+
+  The 2D outputs are functions of the cropped 2D features, including their
+  zero padding, and the 1D outputs of the crop limits, so any mix-up of crops
+  or of their padding changes the accumulated predictions.
+  """
+
+  def __init__(self):
+    self.batch_sizes = []
+
+  def run(self, fetches, feed_dict):
+    inputs_2d = feed_dict['inputs_2d']
+    crops = feed_dict['crop']
+    batch_size = crops.shape[0]
+    self.batch_sizes.append(batch_size)
+    assert feed_dict['inputs_1d'].shape[0] == batch_size
+    assert feed_dict['residue_index'].shape[0] == batch_size
+    assert inputs_2d.shape[0] == batch_size
+
+    # Positions along x then along y, as in the 1D outputs of the network.
+    positions = np.stack([
+        np.concatenate([np.arange(i, end_x), np.arange(j, end_y)])
+        for i, end_x, j, end_y in crops]).astype(np.float64)
+    outputs = {
+        'probs': np.tanh(inputs_2d.sum(axis=3)),
+        'softmax_probs': np.sin(
+            inputs_2d[..., :1] * np.arange(1, _NUM_BINS + 1)),
+        'secstruct_probs': np.cos(positions[..., None] * np.arange(1, 9)),
+        'torsion_probs': np.sin(
+            positions[..., None] * np.arange(1, _TORSION_BINS**2 + 1)),
+        'asa_output': np.cos(positions[..., None] / 7.),
+    }
+    return {key: outputs[value] for key, value in fetches.items()}
+
+
+def _make_example(length, seed=0):
+  rng = np.random.RandomState(seed)
+  return {
+      'sequence_lengths': np.array([length]),
+      'domain_name': np.array([[b'T0000']]),
+      'chain_name': np.array([[b'A']]),
+      'sequences': np.array([['A' * length]]),
+      'inputs_1d': rng.normal(size=(1, length, 3)).astype(np.float32),
+      'inputs_2d': rng.normal(
+          size=(1, length, length, _NUM_2D_FEATURES)).astype(np.float32),
+  }
+
+
+def _make_eval_config(crop_batch_size):
+  return config_dict.ConfigDict(
+      crop_shingle_x=2, crop_shingle_y=2, pyramid_weights=0.5,
+      crop_batch_size=crop_batch_size)
+
+
+class ComputeCropsBatchedTest(parameterized.TestCase):
+
+  @parameterized.parameters(
+      # The protein spans several crops, so that there are inner crops as well
+      # as crops hanging off either end.
+      (21, 8, 3),
+      # A last batch with fewer crops.
+      (21, 6, 4),
+      # A protein shorter than a crop, padded on both sides.
+      (5, 8, 2),
+      (10, 16, 3),
+  )
+  def test_matches_one_crop_at_a_time(self, length, crop_size,
+                                      crop_batch_size):
+    example = _make_example(length)
+    experiment = _FakeExperiment(example, crop_size, crop_size)
+    expected = contacts.compute_one_prediction(
+        0, experiment, _FakeSession(), _make_eval_config(0), _NUM_BINS,
+        _TORSION_BINS)
+
+    sess = _FakeSession()
+    prediction = contacts.compute_one_prediction(
+        0, experiment, sess, _make_eval_config(crop_batch_size), _NUM_BINS,
+        _TORSION_BINS)
+
+    self.assertEqual(prediction.num_crops_local, expected.num_crops_local)
+    self.assertGreater(max(sess.batch_sizes), 1)
+    self.assertLessEqual(max(sess.batch_sizes), crop_batch_size)
+    self.assertEqual(sum(sess.batch_sizes), expected.num_crops_local)
+    for field in ['softmax_probs', 'ss', 'asa', 'torsions']:
+      np.testing.assert_allclose(
+          getattr(prediction, field), getattr(expected, field), rtol=1e-5,
+          atol=1e-6, err_msg=field)
+
+  def test_batch_statistics_run_one_crop_at_a_time(self):
+    example = _make_example(13)
+    sess = _FakeSession()
+    experiment = _FakeExperiment(example, 8, 8, uses_batch_statistics=True)
+    prediction = contacts.compute_one_prediction(
+        0, experiment, sess, _make_eval_config(4), _NUM_BINS, _TORSION_BINS)
+    self.assertEqual(sess.batch_sizes, [1] * prediction.num_crops_local)
+
+
+if __name__ == '__main__':
+  absltest.main()
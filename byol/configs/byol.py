@@ -71,6 +71,7 @@ def get_config(num_epochs: int, batch_size: int):
           use_checkpointing=True,
           checkpoint_dir='/tmp/byol',
           save_checkpoint_interval=300,
+          async_save=True,
           filename='pretrain.pkl'
       ),
   )
@@ -58,6 +58,7 @@ def get_config(checkpoint_to_evaluate: Text, batch_size: int):
           use_checkpointing=True,
           checkpoint_dir='/tmp/byol',
           save_checkpoint_interval=300,
+          async_save=True,
           filename='linear-eval.pkl'
       ),
   )
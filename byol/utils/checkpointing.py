@@ -12,19 +12,32 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Checkpoint saving and restoring utilities."""
+"""Checkpoint saving and restoring utilities.
+
+A checkpoint is a directory holding one `.npy` file per array of the saved
+pytree, and a small pickle with the tree structure and the step. Checkpoints are
+written from a background thread and swapped in with an atomic rename, and are
+restored lazily by memory-mapping the array files. Checkpoints pickled as a
+single file by earlier versions can still be loaded.
+"""
 
 import os
+import shutil
+import threading
 import time
-from typing import Mapping, Text, Tuple, Union
+from typing import Any, Mapping, Optional, Text, Tuple, Union
 
 from absl import logging
 import dill
 import jax
 import jax.numpy as jnp
+import numpy as np
 
 from byol.utils import helpers
 
+_TREE_FILENAME = 'tree.pkl'
+_ARRAY_FILENAME = '{:06d}.npy'
+
 
 class Checkpointer:
   """A checkpoint saving and loading class."""
@@ -34,7 +47,8 @@ class Checkpointer:
       use_checkpointing: bool,
       checkpoint_dir: Text,
       save_checkpoint_interval: int,
-      filename: Text):
+      filename: Text,
+      async_save: bool = True):
     if (not use_checkpointing or
         checkpoint_dir is None or
         save_checkpoint_interval <= 0):
@@ -48,6 +62,9 @@ class Checkpointer:
     self._checkpoint_path = os.path.join(self._checkpoint_dir, filename)
     self._last_checkpoint_time = 0
     self._checkpoint_every = save_checkpoint_interval
+    self._async_save = async_save
+    self._writer = None
+    self._writer_error = None
 
   def maybe_save_checkpoint(
       self,
@@ -55,29 +72,62 @@ class Checkpointer:
       step: int,
       rng: jnp.ndarray,
       is_final: bool):
-    """Saves a checkpoint if enough time has passed since the previous one."""
+    """Saves a checkpoint if enough time has passed since the previous one.
+
+    The arrays are snapshotted on device and copied to host asynchronously, so
+    training is only stalled for the time needed to dispatch these copies (and
+    to wait for the previous checkpoint, if it is still being written). The
+    final checkpoint is written synchronously.
+
+    Args:
+      experiment_state: the replicated experiment state to save.
+      step: the current training step.
+      rng: the random number generator state.
+      is_final: whether this is the last checkpoint of the experiment.
+    """
     current_time = time.time()
     if (not self._checkpoint_enabled or
         jax.host_id() != 0 or  # Only checkpoint the first worker.
         (not is_final and
          current_time - self._last_checkpoint_time < self._checkpoint_every)):
       return
+    self.wait_until_finished()
     checkpoint_data = dict(
-        experiment_state=jax.tree_map(
-            lambda x: jax.device_get(x[0]), experiment_state),
-        step=step,
+        experiment_state=jax.tree_util.tree_map(
+            lambda x: x[0], experiment_state),
         rng=rng)
-    with open(self._checkpoint_path + '_tmp', 'wb') as checkpoint_file:
-      dill.dump(checkpoint_data, checkpoint_file, protocol=2)
-    try:
-      os.rename(self._checkpoint_path, self._checkpoint_path + '_old')
-      remove_old = True
-    except FileNotFoundError:
-      remove_old = False  # No previous checkpoint to remove
-    os.rename(self._checkpoint_path + '_tmp', self._checkpoint_path)
-    if remove_old:
-      os.remove(self._checkpoint_path + '_old')
+    for leaf in jax.tree_util.tree_leaves(checkpoint_data):
+      if isinstance(leaf, jax.Array):
+        leaf.copy_to_host_async()
+
+    if self._async_save and not is_final:
+      self._writer = threading.Thread(
+          target=self._write, args=(checkpoint_data, step), daemon=True)
+      self._writer.start()
+    else:
+      self._write(checkpoint_data, step)
     self._last_checkpoint_time = current_time
+    logging.info('Checkpointing at step %d stalled training for %.1fms.',
+                 step, (time.time() - current_time) * 1e3)
+
+  def wait_until_finished(self):
+    """Waits for the checkpoint being written in the background, if any."""
+    if self._writer is not None:
+      self._writer.join()
+      self._writer = None
+    if self._writer_error is not None:
+      error, self._writer_error = self._writer_error, None
+      raise error
+
+  def _write(self, checkpoint_data: Mapping[Text, Any], step: int):
+    start_time = time.time()
+    try:
+      save_checkpoint(self._checkpoint_path, checkpoint_data, step)
+    except Exception as e:  # pylint: disable=broad-except
+      self._writer_error = e
+      return
+    logging.info('Saved checkpoint at step %d to %s in %.1fs.',
+                 step, self._checkpoint_path, time.time() - start_time)
 
   def maybe_load_checkpoint(
       self) -> Union[Tuple[Mapping[Text, jnp.ndarray], int, jnp.ndarray], None]:
@@ -88,18 +138,85 @@ class Checkpointer:
       return None
     step = checkpoint_data['step']
     rng = checkpoint_data['rng']
-    experiment_state = jax.tree_map(
+    experiment_state = jax.tree_util.tree_map(
         helpers.bcast_local_devices, checkpoint_data['experiment_state'])
     del checkpoint_data
     return experiment_state, step, rng
 
 
-def load_checkpoint(checkpoint_path):
+def save_checkpoint(
+    checkpoint_path: Text,
+    checkpoint_data: Mapping[Text, Any],
+    step: int):
+  """Writes a checkpoint directory, replacing any previous checkpoint.
+
+  Args:
+    checkpoint_path: the directory to write the checkpoint to.
+    checkpoint_data: a pytree of arrays.
+    step: the training step, saved with the tree structure.
+  """
+  leaves, treedef = jax.tree_util.tree_flatten(checkpoint_data)
+  tmp_path = checkpoint_path + '_tmp'
+  if os.path.exists(tmp_path):
+    _remove(tmp_path)  # Left over by an interrupted save.
+  os.makedirs(tmp_path)
+  for i, leaf in enumerate(leaves):
+    np.save(os.path.join(tmp_path, _ARRAY_FILENAME.format(i)),
+            np.asarray(leaf), allow_pickle=False)
+  tree = jax.tree_util.tree_unflatten(treedef, range(len(leaves)))
+  with open(os.path.join(tmp_path, _TREE_FILENAME), 'wb') as tree_file:
+    dill.dump(dict(tree=tree, step=step), tree_file, protocol=2)
+
+  old_path = checkpoint_path + '_old'
+  if os.path.exists(checkpoint_path):
+    if os.path.exists(old_path):
+      _remove(old_path)  # Left over by an interrupted save.
+    os.rename(checkpoint_path, old_path)
+  # Otherwise, an `old_path` left over by an interrupted save is the previous
+  # checkpoint, which is kept until the new one is in place.
+  os.rename(tmp_path, checkpoint_path)
+  if os.path.exists(old_path):
+    _remove(old_path)
+
+
+def load_checkpoint(checkpoint_path: Text) -> Optional[Mapping[Text, Any]]:
+  """Loads a checkpoint, memory-mapping its arrays.
+
+  Args:
+    checkpoint_path: a checkpoint directory, or a pickled checkpoint file.
+
+  Returns:
+    A dictionary with the `experiment_state`, `step` and `rng` of the
+    checkpoint, or None if there is no checkpoint at `checkpoint_path`.
+  """
+  if (not os.path.exists(checkpoint_path) and
+      os.path.exists(checkpoint_path + '_old')):
+    # A save was interrupted between moving the previous checkpoint away and
+    # moving the new one in place.
+    checkpoint_path += '_old'
   try:
-    with open(checkpoint_path, 'rb') as checkpoint_file:
-      checkpoint_data = dill.load(checkpoint_file)
-      logging.info('Loading checkpoint from %s, saved at step %d',
-                   checkpoint_path, checkpoint_data['step'])
-      return checkpoint_data
+    if os.path.isdir(checkpoint_path):
+      with open(os.path.join(checkpoint_path, _TREE_FILENAME),
+                'rb') as tree_file:
+        saved = dill.load(tree_file)
+      checkpoint_data = jax.tree_util.tree_map(
+          lambda i: np.load(
+              os.path.join(checkpoint_path, _ARRAY_FILENAME.format(i)),
+              mmap_mode='r'),
+          saved['tree'])
+      checkpoint_data['step'] = saved['step']
+    else:
+      with open(checkpoint_path, 'rb') as checkpoint_file:
+        checkpoint_data = dill.load(checkpoint_file)
   except FileNotFoundError:
     return None
+  logging.info('Loading checkpoint from %s, saved at step %d',
+               checkpoint_path, checkpoint_data['step'])
+  return checkpoint_data
+
+
+def _remove(path: Text):
+  if os.path.isdir(path):
+    shutil.rmtree(path)
+  else:
+    os.remove(path)
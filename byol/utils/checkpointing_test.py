@@ -0,0 +1,128 @@
+# Copyright 2020 DeepMind Technologies Limited.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for BYOL's checkpointing utilities."""
+
+import os
+from typing import NamedTuple, Optional
+
+from absl.testing import absltest
+import dill
+import jax
+import numpy as np
+
+from byol.utils import checkpointing
+from byol.utils import helpers
+
+
+class _State(NamedTuple):
+  params: dict
+  opt_state: Optional[np.ndarray]
+  count: np.ndarray
+
+
+def _make_state(offset):
+  return _State(
+      params={'linear': {'w': np.arange(6.).reshape(2, 3) + offset,
+                         'b': np.zeros([3], np.float32)}},
+      opt_state=None,
+      count=np.array(offset, np.int32))
+
+
+class CheckpointingTest(absltest.TestCase):
+
+  def _assert_states_equal(self, state, expected):
+    self.assertIsInstance(state, _State)
+    self.assertIsNone(state.opt_state)
+    jax.tree_util.tree_map(np.testing.assert_array_equal, state, expected)
+
+  def test_save_and_restore(self):
+    checkpointer = checkpointing.Checkpointer(
+        use_checkpointing=True,
+        checkpoint_dir=self.create_tempdir().full_path,
+        save_checkpoint_interval=1,
+        filename='pretrain.pkl')
+    rng = jax.random.PRNGKey(0)
+    for step in range(3):
+      checkpointer.maybe_save_checkpoint(
+          helpers.bcast_local_devices(_make_state(step)),
+          step=step, rng=rng, is_final=step == 2)
+    checkpointer.wait_until_finished()
+
+    state, step, restored_rng = checkpointer.maybe_load_checkpoint()
+    self.assertEqual(step, 2)
+    np.testing.assert_array_equal(restored_rng, rng)
+    self._assert_states_equal(helpers.get_first(state), _make_state(2))
+
+  def test_load_checkpoint_is_lazy(self):
+    checkpoint_path = os.path.join(self.create_tempdir().full_path, 'ckpt')
+    checkpointing.save_checkpoint(
+        checkpoint_path, dict(experiment_state=_make_state(1), rng=None),
+        step=7)
+    checkpoint_data = checkpointing.load_checkpoint(checkpoint_path)
+    self.assertEqual(checkpoint_data['step'], 7)
+    self.assertIsInstance(
+        checkpoint_data['experiment_state'].params['linear']['w'], np.memmap)
+    self._assert_states_equal(
+        checkpoint_data['experiment_state'], _make_state(1))
+
+  def test_load_pickled_checkpoint(self):
+    checkpoint_path = os.path.join(self.create_tempdir().full_path, 'ckpt.pkl')
+    with open(checkpoint_path, 'wb') as checkpoint_file:
+      dill.dump(dict(experiment_state=_make_state(3), step=5, rng=None),
+                checkpoint_file, protocol=2)
+    checkpoint_data = checkpointing.load_checkpoint(checkpoint_path)
+    self.assertEqual(checkpoint_data['step'], 5)
+    self._assert_states_equal(
+        checkpoint_data['experiment_state'], _make_state(3))
+    self.assertIsNone(checkpointing.load_checkpoint(checkpoint_path + '_x'))
+
+  def test_save_replaces_leftover_old_checkpoint(self):
+    checkpoint_path = os.path.join(self.create_tempdir().full_path, 'ckpt')
+    checkpointing.save_checkpoint(
+        checkpoint_path, dict(experiment_state=_make_state(1), rng=None),
+        step=1)
+    # A save interrupted while removing the previous checkpoint.
+    os.makedirs(checkpoint_path + '_old')
+    with open(os.path.join(checkpoint_path + '_old', 'leftover'), 'w'):
+      pass
+    checkpointing.save_checkpoint(
+        checkpoint_path, dict(experiment_state=_make_state(2), rng=None),
+        step=2)
+    self.assertFalse(os.path.exists(checkpoint_path + '_old'))
+    checkpoint_data = checkpointing.load_checkpoint(checkpoint_path)
+    self.assertEqual(checkpoint_data['step'], 2)
+
+  def test_load_falls_back_to_old_checkpoint(self):
+    checkpoint_path = os.path.join(self.create_tempdir().full_path, 'ckpt')
+    checkpointing.save_checkpoint(
+        checkpoint_path, dict(experiment_state=_make_state(1), rng=None),
+        step=1)
+    # A save interrupted between the two renames.
+    os.rename(checkpoint_path, checkpoint_path + '_old')
+    checkpoint_data = checkpointing.load_checkpoint(checkpoint_path)
+    self.assertEqual(checkpoint_data['step'], 1)
+    self._assert_states_equal(
+        checkpoint_data['experiment_state'], _make_state(1))
+
+    # The next save keeps the old checkpoint until the new one is in place.
+    checkpointing.save_checkpoint(
+        checkpoint_path, dict(experiment_state=_make_state(2), rng=None),
+        step=2)
+    self.assertFalse(os.path.exists(checkpoint_path + '_old'))
+    self.assertEqual(checkpointing.load_checkpoint(checkpoint_path)['step'], 2)
+
+
+if __name__ == '__main__':
+  absltest.main()
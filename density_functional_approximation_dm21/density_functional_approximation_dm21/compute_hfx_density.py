@@ -68,10 +68,16 @@ Note: we compute exx and fxx for each spin channel for both restricted and
 unrestricted calculations.
 """
 
+import collections
+from concurrent import futures
+import hashlib
+import tempfile
+import time
 from typing import Generator, Optional, Tuple, Union
 
 import attr
 import numpy as np
+from pyscf import lib
 from pyscf.dft import numint
 from pyscf.gto import mole
 from pyscf.lib import logger
@@ -115,7 +121,8 @@ def _evaluate_nu(mol: mole.Mole,
 def _nu_chunk(mol: mole.Mole,
               coords: np.ndarray,
               omega: float,
-              chunk_size: int = 1000
+              chunk_size: int = 1000,
+              num_threads: int = 0
              ) -> Generator[Tuple[int, int, np.ndarray], None, None]:
   r"""Yields chunks of nu integrals over the grid.
 
@@ -126,6 +133,9 @@ def _nu_chunk(mol: mole.Mole,
       (i.e. uses the kernel v(r,r') = 1/|r-r'| instead of
       v(r,r') = erf(\omega |r-r'|) / |r-r'|)
     chunk_size: number of coordinates to evaluate the integrals at a time.
+    num_threads: number of threads evaluating chunks ahead of the one being
+      yielded. If 0, each chunk is evaluated in the calling thread when
+      requested.
 
   Yields:
     start_index, end_index, nu_{ab}(r) where
@@ -141,44 +151,223 @@ def _nu_chunk(mol: mole.Mole,
   if omega < 0:
     raise ValueError('Range-separated parameter omega must be non-negative!')
   ncoords = len(coords)
+  chunks = [(chunk_index, min(chunk_index + chunk_size, ncoords))
+            for chunk_index in range(0, ncoords, chunk_size)]
+  if num_threads < 1:
+    for start, end in chunks:
+      yield start, end, _evaluate_nu(mol, coords[start:end], omega=omega)
+    return
+
+  # libcint releases the GIL, so later chunks are evaluated while the caller
+  # works on the current one. Evaluating nu temporarily modifies the settings
+  # in mol._env, so each chunk is evaluated with its own copy of mol.
+  def evaluate(start, end):
+    return _evaluate_nu(mol.copy(), coords[start:end], omega=omega)
+
+  with futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+    pending = collections.deque()
+    for start, end in chunks:
+      pending.append((start, end, executor.submit(evaluate, start, end)))
+      if len(pending) > num_threads:
+        chunk_start, chunk_end, future = pending.popleft()
+        yield chunk_start, chunk_end, future.result()
+    while pending:
+      chunk_start, chunk_end, future = pending.popleft()
+      yield chunk_start, chunk_end, future.result()
+
+
+def _available_memory(mol: mole.Mole) -> float:
+  """Returns the memory left of mol.max_memory, in MB, but at least 2000MB.
+
+  As elsewhere in PySCF, the floor avoids degenerate chunking when the process
+  already uses close to (or more than) mol.max_memory.
+  """
+  return max(2000, mol.max_memory * .9 - lib.current_memory()[0])
+
+
+def _auto_chunk_size(ncoords: int,
+                     nao: int,
+                     max_memory: float,
+                     num_threads: int = 0) -> int:
+  """Returns the number of grid points per chunk of nu integrals.
+
+  Args:
+    ncoords: number of grid points.
+    nao: number of atomic orbitals.
+    max_memory: memory available for the chunks of nu integrals held at once,
+      in MB.
+    num_threads: number of threads evaluating chunks ahead. See _nu_chunk.
+
+  Returns:
+    The largest chunk size such that the chunks held at once fit in
+    max_memory, and, if num_threads is positive, small enough that the grid is
+    split into at least num_threads + 1 chunks so evaluation overlaps with
+    contraction.
+  """
+  nchunks = num_threads + 1
+  chunk_size = int(max_memory * 1e6 / (nchunks * nao * nao * 8))
+  if num_threads > 0:
+    chunk_size = min(chunk_size, -(-ncoords // nchunks))
+  return max(1, min(chunk_size, ncoords))
+
+
+def _precomputed_nu_chunk(
+    nu: np.ndarray,
+    chunk_size: int = 1000
+) -> Generator[Tuple[int, int, np.ndarray], None, None]:
+  """Yields chunks of precomputed nu integrals, as for _nu_chunk."""
+  ncoords = len(nu)
   for chunk_index in range(0, ncoords, chunk_size):
     end_index = min(chunk_index + chunk_size, ncoords)
-    coords_chunk = coords[chunk_index:end_index]
-    nu_chunk = _evaluate_nu(mol, coords_chunk, omega=omega)
-    yield chunk_index, end_index, nu_chunk
+    yield chunk_index, end_index, np.asarray(nu[chunk_index:end_index])
+
+
+class NuCache:
+  """Cache of nu integrals, which depend only on the molecule, grid and omega.
+
+  The nu integrals are independent of the density matrix and so can be reused
+  for each SCF iteration. Integrals are kept in memory up to max_memory and
+  spilled to memory-mapped scratch files beyond that. The cache is cleared when
+  the molecule (geometry or basis) changes.
+  """
+
+  def __init__(self,
+               max_memory: float = 4000,
+               tmpdir: Optional[str] = None):
+    """Constructs a NuCache object.
+
+    Args:
+      max_memory: the maximum memory to use for cached integrals, in MB.
+        Integrals which do not fit are stored in scratch files instead.
+      tmpdir: directory for the scratch files. Defaults to
+        pyscf.lib.param.TMPDIR.
+    """
+    self._max_memory = max_memory
+    self._tmpdir = tmpdir
+    self._mol_key = None
+    self._nus = {}
+    self._memory_used = 0
+    self.reset_statistics()
+
+  def reset_statistics(self):
+    """Resets the counters logged by log_statistics."""
+    self.compute_time = 0.
+    self.computed_bytes = 0
+    self.reused_bytes = 0
+
+  def clear(self):
+    """Removes all cached integrals, closing any scratch files."""
+    self._nus = {}
+    self._memory_used = 0
+
+  @property
+  def nbytes(self) -> int:
+    """Total size of the cached integrals, in bytes."""
+    return sum(nu.nbytes for nu in self._nus.values())
+
+  def _allocate(self, shape: Tuple[int, ...]) -> np.ndarray:
+    nbytes = np.prod(shape) * np.dtype(np.float64).itemsize
+    if self._memory_used + nbytes <= self._max_memory * 1e6:
+      self._memory_used += nbytes
+      return np.empty(shape)
+    # The scratch file is removed once the memory map is garbage collected.
+    scratch = tempfile.TemporaryFile(dir=self._tmpdir or lib.param.TMPDIR)
+    return np.memmap(scratch, dtype=np.float64, mode='w+', shape=shape)
+
+  def get_nu(self,
+             mol: mole.Mole,
+             coords: np.ndarray,
+             omega: float,
+             chunk_size: int = 1000) -> np.ndarray:
+    r"""Returns the nu integrals for coords, computing them if not cached.
+
+    Args:
+      mol: pyscf Mole object.
+      coords: coordinates, r', at which to evaluate the nu integrals, shape
+        (N,3).
+      omega: range separation parameter. See _nu_chunk.
+      chunk_size: number of coordinates to evaluate the integrals at a time.
+
+    Returns:
+      nu, array of shape (N, nao, nao), which may be memory-mapped, where
+      nu[i] contains the integrals at coords[i]. See _nu_chunk.
+    """
+    mol_key = hashlib.sha1()
+    for array in (mol._atm, mol._bas, mol._env):  # pylint: disable=protected-access
+      mol_key.update(np.ascontiguousarray(array).tobytes())
+    if mol_key.digest() != self._mol_key:
+      self.clear()
+      self._mol_key = mol_key.digest()
+    key = (omega, hashlib.sha1(np.ascontiguousarray(coords).tobytes()).digest())
+
+    if key in self._nus:
+      nu = self._nus[key]
+      self.reused_bytes += nu.nbytes
+      return nu
+
+    start_time = time.time()
+    nao = mol.nao_nr()
+    nu = self._allocate((len(coords), nao, nao))
+    for start, end, nu_chunk in _nu_chunk(mol, coords, omega, chunk_size):
+      nu[start:end] = nu_chunk
+    self._nus[key] = nu
+    self.compute_time += time.time() - start_time
+    self.computed_bytes += nu.nbytes
+    return nu
+
+  def log_statistics(self, mol: mole.Mole):
+    """Logs and resets the time and bytes spent since the last call."""
+    logger.info(
+        mol, 'nu cache: computed %.1f MB in %.2f s, reused %.1f MB, '
+        'holding %.1f MB (%.1f MB in memory).', self.computed_bytes / 1e6,
+        self.compute_time, self.reused_bytes / 1e6, self.nbytes / 1e6,
+        self._memory_used / 1e6)
+    self.reset_statistics()
 
 
 def _compute_exx_block(nu: np.ndarray,
                        e: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-  r"""Computes exx and fxx.
+  r"""Computes exx and fxx for each spin channel.
 
   Args:
     nu: batch of <i|v(r,r_k)|j> integrals, in format (k,i,j) where r_k is the
       position of the k-th grid point, i and j label atomic orbitals.
-    e: density matrix in the AO basis at each grid point.
+    e: density matrix in the AO basis at each grid point, in format (k,s,i),
+      where s labels the spin channel.
 
   Returns:
-    exx and fxx, where
-    fxx_{gb} =\sum_c nu_{gbc} e_{gc} and
-    exx_{g} = -0.5 \sum_b e_{gb} fxx_{gb}.
+    exx and fxx, of shape (k,s) and (k,s,i) respectively, where
+    fxx_{gsb} =\sum_c nu_{gbc} e_{gsc} and
+    exx_{gs} = -0.5 \sum_b e_{gsb} fxx_{gsb}.
   """
-  fxx = np.einsum('gbc,gc->gb', nu, e)
-  exx = -0.5 * np.einsum('gb,gb->g', e, fxx)
+  # nu is symmetric, so all spin channels are contracted by one batched GEMM.
+  fxx = np.matmul(e, nu)
+  exx = -0.5 * np.einsum('gsb,gsb->gs', e, fxx)
   return exx, fxx
 
 
-def _compute_jk_block(nu: np.ndarray, fxx: np.ndarray, dm: np.ndarray,
+def _compute_jk_block(nu: np.ndarray, fxx: np.ndarray, dms: np.ndarray,
                       ao_value: np.ndarray,
                       weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-  """Computes J and K contributions from the given block of nu integrals."""
-  batch_size = nu.shape[0]
-  vj = numpy_helper.dot(nu.reshape(batch_size, -1), dm.reshape(-1, 1))
-  vj = np.squeeze(vj)
-  vj_ao = np.einsum('g,gb->gb', vj * weights, ao_value)
-  j = numpy_helper.dot(ao_value.T, vj_ao)
-  w_ao = np.einsum('g,gb->gb', weights, ao_value)
-  k = numpy_helper.dot(fxx.T, w_ao)
-  return j, k
+  """Computes J and K contributions from the given block of nu integrals.
+
+  Args:
+    nu: batch of nu integrals, shape (k,i,j). See _compute_exx_block.
+    fxx: fxx for each spin channel, shape (k,s,i). See _compute_exx_block.
+    dms: density matrix for each spin channel, shape (s,i,j).
+    ao_value: atomic orbitals evaluated on the grid points, shape (k,i).
+    weights: weight of each grid point, shape (k).
+
+  Returns:
+    J and K contributions for each spin channel, each of shape (s,i,j).
+  """
+  batch_size, nspin, nao = fxx.shape
+  vj = numpy_helper.dot(nu.reshape(batch_size, -1), dms.reshape(nspin, -1).T)
+  w_ao = weights[:, None] * ao_value
+  vj_ao = (vj[:, :, None] * w_ao[:, None, :]).reshape(batch_size, -1)
+  j = numpy_helper.dot(ao_value.T, vj_ao).reshape(nao, nspin, nao)
+  k = numpy_helper.dot(fxx.reshape(batch_size, -1).T, w_ao)
+  return j.transpose(1, 0, 2), k.reshape(nspin, nao, nao)
 
 
 @attr.s(auto_attribs=True)
@@ -218,8 +407,11 @@ def get_hf_density(
     omega: float = 0.,
     deriv: int = 0,
     ao: Optional[np.ndarray] = None,
-    chunk_size: int = 1000,
+    chunk_size: Optional[int] = None,
     weights: Optional[np.ndarray] = None,
+    nu: Optional[np.ndarray] = None,
+    max_memory: Optional[float] = None,
+    num_threads: int = 1,
 ) -> HFDensityResult:
   r"""Computes the (range-separated) HF energy density.
 
@@ -241,10 +433,19 @@ def get_hf_density(
       computed if not supplied.
     chunk_size: The number of coordinates to compute the HF density for at once.
       Reducing this saves memory since we don't have to keep as many Nus (nbasis
-      x nbasis) in memory at once.
+      x nbasis) in memory at once. Calculated from max_memory if None.
     weights: weight of each grid point, shape (N). If present, the Coulomb and
       exchange matrices are also computed semi-numerically, otherwise only the
       HF density and (if deriv=1) its first derivative are computed.
+    nu: The nu integrals at coords for omega, shape (N, M, M), e.g. from
+      NuCache. These are computed chunk by chunk if not supplied.
+    max_memory: The memory available for the chunks of nu integrals held at
+      once, in MB, used to set chunk_size if it is None. Defaults to the memory
+      left of mol.max_memory, with a floor of 2000MB.
+    num_threads: The number of threads evaluating chunks of nu integrals while
+      earlier chunks are contracted. If 0, chunks are evaluated one at a time
+      in the calling thread. Note that libcint already evaluates each chunk
+      using OpenMP threads.
 
   Returns:
     HFDensityResult object with the HF density (exx), the derivative of the HF
@@ -267,69 +468,60 @@ def get_hf_density(
     raise NotImplementedError('Higher order derivatives are not implemented.')
 
   if isinstance(dm, tuple) or dm.ndim == 3:
-    dma, dmb = dm
+    dms = np.stack(dm)
     restricted = False
   else:
-    dma = dm / 2
-    dmb = dm / 2
+    # Both spin channels are identical, so only the alpha channel is computed.
+    dms = dm[np.newaxis] / 2
     restricted = True
+  nspin, nao, _ = dms.shape
+  ncoords = len(coords)
 
   logger.info(mol, 'Computing contracted density matrix ...')
   if ao is None:
     ao = numint.eval_ao(mol, coords, deriv=0)
-  e_a = np.dot(ao, dma)
-  e_b = np.dot(ao, dmb)
-
-  exxa = []
-  exxb = []
-  fxxa = []
-  fxxb = []
-  ja = np.zeros_like(dma)
-  jb = np.zeros_like(dmb)
-  ka = np.zeros_like(dma)
-  kb = np.zeros_like(dmb)
-
-  for start, end, nu in _nu_chunk(mol, coords, omega, chunk_size=chunk_size):
-    logger.info(mol, 'Computing exx %s / %s ...', end, len(e_a))
-    exxa_block, fxxa_block = _compute_exx_block(nu, e_a[start:end])
-    exxa.extend(exxa_block)
-    if not restricted:
-      exxb_block, fxxb_block = _compute_exx_block(nu, e_b[start:end])
-      exxb.extend(exxb_block)
+  e = numpy_helper.dot(ao, dms.transpose(1, 0, 2).reshape(nao, -1))
+  e = e.reshape(ncoords, nspin, nao)
+
+  exx = np.empty((nspin, ncoords))
+  fxx = np.empty((nspin, ncoords, nao)) if deriv == 1 else None
+  j = np.zeros_like(dms)
+  k = np.zeros_like(dms)
+
+  if chunk_size is None:
+    if max_memory is None:
+      max_memory = _available_memory(mol)
+    chunk_size = _auto_chunk_size(
+        ncoords, nao, max_memory, num_threads if nu is None else 0)
+  if nu is None:
+    nu_chunks = _nu_chunk(
+        mol, coords, omega, chunk_size=chunk_size, num_threads=num_threads)
+  else:
+    nu_chunks = _precomputed_nu_chunk(nu, chunk_size=chunk_size)
+  for start, end, nu_block in nu_chunks:
+    logger.info(mol, 'Computing exx %s / %s ...', end, ncoords)
+    exx_block, fxx_block = _compute_exx_block(nu_block, e[start:end])
+    exx[:, start:end] = exx_block.T
     if deriv == 1:
-      fxxa.extend(fxxa_block)
-      if not restricted:
-        fxxb.extend(fxxb_block)
-
+      fxx[:, start:end] = fxx_block.transpose(1, 0, 2)
     if weights is not None:
-      ja_block, ka_block = _compute_jk_block(nu, fxxa_block, dma, ao[start:end],
-                                             weights[start:end])
-      ja += ja_block
-      ka += ka_block
-      if not restricted:
-        jb_block, kb_block = _compute_jk_block(nu, fxxb_block, dmb,
-                                               ao[start:end],
-                                               weights[start:end])
-        jb += jb_block
-        kb += kb_block
-
-  exxa = np.asarray(exxa)
-  fxxa = np.asarray(fxxa)
+      j_block, k_block = _compute_jk_block(nu_block, fxx_block, dms,
+                                           ao[start:end], weights[start:end])
+      j += j_block
+      k += k_block
+
   if restricted:
-    exxb = exxa
-    fxxb = fxxa
+    result = HFDensityResult(exx=(exx[0], exx[0]))
+    if deriv == 1:
+      result.fxx = (fxx[0], fxx[0])
+    if weights is not None:
+      result.coulomb = 2 * j[0]
+      result.exchange = 2 * k[0]
   else:
-    exxb = np.asarray(exxb)
-    fxxb = np.asarray(fxxb)
-
-  result = HFDensityResult(exx=(exxa, exxb))
-  if deriv == 1:
-    result.fxx = (fxxa, fxxb)
-  if weights is not None:
-    if restricted:
-      result.coulomb = 2 * ja
-      result.exchange = 2 * ka
-    else:
-      result.coulomb = (ja, jb)
-      result.exchange = (ka, kb)
+    result = HFDensityResult(exx=(exx[0], exx[1]))
+    if deriv == 1:
+      result.fxx = (fxx[0], fxx[1])
+    if weights is not None:
+      result.coulomb = (j[0], j[1])
+      result.exchange = (k[0], k[1])
   return result
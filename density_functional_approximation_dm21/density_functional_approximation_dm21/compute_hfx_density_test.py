@@ -114,6 +114,51 @@ class ComputeHfxDensityTest(parameterized.TestCase):
       self.assertAlmostEqual(coulomb, target_coulomb)
       self.assertAlmostEqual(hf, target_hf)
 
+  @parameterized.named_parameters(
+      {'testcase_name': 'serial', 'chunk_size': 100, 'num_threads': 0,
+       'max_memory': None},
+      {'testcase_name': 'threaded', 'chunk_size': 100, 'num_threads': 3,
+       'max_memory': None},
+      {'testcase_name': 'auto_chunk_size', 'chunk_size': None,
+       'num_threads': 2, 'max_memory': None},
+      {'testcase_name': 'auto_chunk_size_small_memory', 'chunk_size': None,
+       'num_threads': 1, 'max_memory': 0.01},
+  )
+  def test_chunking(self, chunk_size, num_threads, max_memory):
+    mol = gto.M(atom='Li 0. 0. 0.', basis='3-21g', spin=1)
+    solver = dft.UKS(mol)
+    solver.grids.level = 1
+    solver.grids.build()
+    coords = solver.grids.coords[:1000]
+    weights = solver.grids.weights[:1000]
+    dm = solver.get_init_guess()
+    dm[1] *= 0.5
+
+    nu = compute_hfx_density._evaluate_nu(mol, coords, omega=0.4)
+    ao_value = dft.numint.eval_ao(mol, coords, deriv=0)
+    e = np.einsum('gb,sbc->sgc', ao_value, dm)
+    expected_fxx = np.einsum('gbc,sgc->sgb', nu, e)
+    expected_exx = -0.5 * np.einsum('sgb,sgb->sg', e, expected_fxx)
+    expected_j = np.einsum('gbc,sbc,g,ga,gd->sad', nu, dm, weights, ao_value,
+                           ao_value)
+    expected_k = np.einsum('sgb,g,ga->sba', expected_fxx, weights, ao_value)
+
+    results = compute_hfx_density.get_hf_density(
+        mol, dm, coords, omega=0.4, deriv=1, chunk_size=chunk_size,
+        weights=weights, max_memory=max_memory, num_threads=num_threads)
+    np.testing.assert_allclose(results.exx, expected_exx, atol=1E-12)
+    np.testing.assert_allclose(results.fxx, expected_fxx, atol=1E-12)
+    np.testing.assert_allclose(results.coulomb, expected_j, atol=1E-12)
+    np.testing.assert_allclose(results.exchange, expected_k, atol=1E-12)
+
+  def test_available_memory_floor(self):
+    mol = gto.M(atom='Li 0. 0. 0.', basis='3-21g', spin=1, max_memory=1)
+    max_memory = compute_hfx_density._available_memory(mol)
+    self.assertGreaterEqual(max_memory, 2000)
+    # The floor keeps chunks large rather than one grid point each.
+    self.assertEqual(
+        compute_hfx_density._auto_chunk_size(1000, mol.nao, max_memory), 1000)
+
 
 def _nu_test_systems():
   systems = [
@@ -221,6 +266,32 @@ class NuTest(parameterized.TestCase):
 
     np.testing.assert_allclose(result, expected_result)
 
+  @parameterized.named_parameters(
+      {'testcase_name': 'in_memory', 'max_memory': 4000},
+      {'testcase_name': 'memory_mapped', 'max_memory': 0},
+  )
+  def test_nu_cache(self, max_memory):
+    mol = gto.M(atom='He 0 0 0', basis='cc-pVDZ')
+    solver = dft.RKS(mol)
+    solver.grids.level = 2
+    solver.grids.build()
+    coords = solver.grids.coords
+    dm = solver.get_init_guess()
+    cache = compute_hfx_density.NuCache(max_memory=max_memory)
+
+    nu = cache.get_nu(mol, coords, omega=0.4, chunk_size=100)
+    self.assertEqual(cache.computed_bytes, nu.nbytes)
+    self.assertIs(cache.get_nu(mol, coords, omega=0.4), nu)
+    self.assertEqual(cache.reused_bytes, nu.nbytes)
+    self.assertIsNot(cache.get_nu(mol, coords, omega=0.), nu)
+
+    expected = compute_hfx_density.get_hf_density(
+        mol, dm, coords, omega=0.4, deriv=1, chunk_size=100)
+    results = compute_hfx_density.get_hf_density(
+        mol, dm, coords, omega=0.4, deriv=1, chunk_size=100, nu=nu)
+    np.testing.assert_allclose(results.exx, expected.exx)
+    np.testing.assert_allclose(results.fxx, expected.fxx)
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -170,7 +170,9 @@ class NeuralNumInt(numint.NumInt):
   def __init__(self,
                functional: Functional,
                *,
-               checkpoint_path: Optional[str] = None):
+               checkpoint_path: Optional[str] = None,
+               cache_nu: bool = False,
+               nu_cache_max_memory: float = 4000):
     """Constructs a NeuralNumInt object.
 
     Args:
@@ -179,6 +181,11 @@ class NeuralNumInt(numint.NumInt):
       checkpoint_path: Optional path to specify the directory containing the
         checkpoints of the DM21 family of functionals. If not specified, attempt
         to find the checkpoints using a path relative to the source code.
+      cache_nu: If true, the nu integrals for the local Hartree-Fock features
+        are computed once per grid and omega and reused in later SCF
+        iterations, rather than recomputed in every iteration.
+      nu_cache_max_memory: the maximum memory to use for cached nu integrals,
+        in MB. Integrals beyond this are stored in memory-mapped scratch files.
     """
 
     self._functional_name = functional.name
@@ -202,6 +209,11 @@ class NeuralNumInt(numint.NumInt):
     self._grid_state = None
     self._system_state = None
     self._vmat_hf = None
+    if cache_nu:
+      self._nu_cache = compute_hfx_density.NuCache(
+          max_memory=nu_cache_max_memory)
+    else:
+      self._nu_cache = None
     super().__init__()
 
   def _build_graph(self, batch_dim: Optional[int] = None):
@@ -427,6 +439,9 @@ class NeuralNumInt(numint.NumInt):
         verbose=verbose)
     vmat += self._vmat_hf + self._vmat_hf.T
 
+    if self._nu_cache is not None:
+      self._nu_cache.log_statistics(mol)
+
     # Clear internal state to prevent accidental re-use.
     self._system_state = None
     self._grid_state = None
@@ -500,6 +515,9 @@ class NeuralNumInt(numint.NumInt):
     vmat[0] += self._vmat_hf[0] + self._vmat_hf[0].T
     vmat[1] += self._vmat_hf[1] + self._vmat_hf[1].T
 
+    if self._nu_cache is not None:
+      self._nu_cache.log_statistics(mol)
+
     # Clear internal state to prevent accidental re-use.
     self._system_state = None
     self._grid_state = None
@@ -613,13 +631,18 @@ class NeuralNumInt(numint.NumInt):
     exxa, exxb = [], []
     fxxa, fxxb = [], []
     for omega in sorted(self._omega_values):
+      if self._nu_cache is not None:
+        nu = self._nu_cache.get_nu(mol, coords, omega)
+      else:
+        nu = None
       hfx_results = compute_hfx_density.get_hf_density(
           mol,
           dms,
           coords=coords,
           omega=omega,
           deriv=1,
-          ao=ao)
+          ao=ao,
+          nu=nu)
       exxa.append(hfx_results.exx[0])
       exxb.append(hfx_results.exx[1])
       fxxa.append(hfx_results.fxx[0])
@@ -100,6 +100,21 @@ class NeuralNumintTest(tf.test.TestCase, parameterized.TestCase):
     mf.run()
     self.assertAlmostEqual(mf.e_tot, expected_energy, delta=2.e-4)
 
+  def test_rks_with_nu_cache(self):
+    ni = neural_numint.NeuralNumInt(
+        neural_numint.Functional.DM21, cache_nu=True)
+
+    mol = gto.Mole()
+    mol.atom = [['Ne', 0., 0., 0.]]
+    mol.basis = 'sto-3g'
+    mol.build()
+
+    mf = dft.RKS(mol)
+    mf.small_rho_cutoff = 1.e-20
+    mf._numint = ni
+    mf.run()
+    self.assertAlmostEqual(mf.e_tot, -126.898521, delta=2.e-4)
+
   def test_exported_model(self):
 
     mol = gto.Mole()
@@ -0,0 +1,462 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tiled Enformer inference over genomic regions and variants.
+
+Regions longer than the model output are covered by windows tiled with a
+configurable stride, and the cropped predictions of the windows are stitched
+into one contiguous array of bins per region. Variants are scored by
+predicting reference and alternate sequences in the same batch.
+
+Predictions are written incrementally to memory-mapped `.npy` files, so that
+whole chromosomes can be predicted without holding them in memory.
+
+Example:
+
+  model = hub.load('https://tfhub.dev/deepmind/enformer/1').model
+  predictor = inference.TiledPredictor(
+      model.predict_on_batch, inference.FastaReader('hg38.fa'),
+      sequence_length=393_216)
+  predictor.predict_regions(inference.read_bed('regions.bed'), 'out/regions')
+  predictor.score_variants(inference.read_vcf('variants.vcf'), 'out/variants')
+"""
+import gzip
+import logging
+import os
+import time
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Mapping,
+                    NamedTuple, Optional, Sequence, Text, Tuple)
+
+import numpy as np
+
+# Same as in enformer.py, which is not imported here so that this module only
+# depends on numpy.
+SEQUENCE_LENGTH = 196_608
+BIN_SIZE = 128
+TARGET_LENGTH = 896
+
+PredictFn = Callable[[np.ndarray], Mapping[str, Any]]
+
+
+class Region(NamedTuple):
+  """Genomic interval, 0-based and half open as in BED files."""
+  chrom: str
+  start: int
+  end: int
+  name: str
+
+
+class Variant(NamedTuple):
+  """Variant with a 1-based position, as in VCF files."""
+  chrom: str
+  pos: int
+  id: str
+  ref: str
+  alt: str
+
+
+class _FastaIndexEntry(NamedTuple):
+  length: int
+  offset: int
+  line_bases: int
+  line_width: int
+
+
+class FastaReader:
+  """Random access to the sequences of a FASTA file.
+
+  Uses the samtools `.fai` index next to the FASTA file if present, and
+  otherwise indexes the file once in memory. The file itself is memory-mapped,
+  so only the requested parts of the genome are read.
+  """
+
+  def __init__(self, path: Text):
+    self._data = np.memmap(path, dtype=np.uint8, mode='r')
+    if os.path.exists(path + '.fai'):
+      self._index = _read_fasta_index(path + '.fai')
+    else:
+      self._index = _build_fasta_index(path)
+
+  @property
+  def chromosome_sizes(self) -> Dict[str, int]:
+    return {chrom: entry.length for chrom, entry in self._index.items()}
+
+  def fetch(self, chrom: str, start: int, end: int) -> str:
+    """Returns the upper case sequence, padded with N outside the chromosome."""
+    entry = self._index[chrom]
+    trimmed_start = min(max(start, 0), entry.length)
+    trimmed_end = max(min(end, entry.length), trimmed_start)
+    def file_offset(position):
+      return (entry.offset + (position // entry.line_bases) * entry.line_width +
+              position % entry.line_bases)
+    if trimmed_end <= trimmed_start:
+      return 'N' * (end - start)
+    raw = self._data[file_offset(trimmed_start):
+                     file_offset(trimmed_end - 1) + 1].tobytes()
+    sequence = raw.replace(b'\n', b'').replace(b'\r', b'').upper().decode()
+    return ('N' * (trimmed_start - start) + sequence +
+            'N' * (end - trimmed_end))
+
+  def close(self):
+    del self._data
+
+
+def _read_fasta_index(path: Text) -> Dict[str, _FastaIndexEntry]:
+  index = {}
+  with open(path) as f:
+    for line in f:
+      name, length, offset, line_bases, line_width = line.split('\t')[:5]
+      index[name] = _FastaIndexEntry(
+          int(length), int(offset), int(line_bases), int(line_width))
+  return index
+
+
+def _build_fasta_index(path: Text) -> Dict[str, _FastaIndexEntry]:
+  """Builds the equivalent of a samtools `.fai` index of a FASTA file."""
+  index = {}
+  name = None
+  with open(path, 'rb') as f:
+    offset = 0
+    for line in f:
+      if line.startswith(b'>'):
+        name = line[1:].split()[0].decode()
+        index[name] = None
+        length = 0
+        sequence_offset = offset + len(line)
+        line_bases = line_width = None
+      elif name is not None:
+        bases = len(line.rstrip(b'\r\n'))
+        if line_bases is None:
+          line_bases, line_width = bases, len(line)
+        length += bases
+        index[name] = _FastaIndexEntry(
+            length, sequence_offset, line_bases, line_width)
+      offset += len(line)
+  return {name: entry for name, entry in index.items() if entry is not None}
+
+
+def read_bed(path: Text) -> List[Region]:
+  """Returns the regions of a BED file, named after column 4 if present."""
+  regions = []
+  with _open(path) as f:
+    for line in f:
+      if line.startswith(('#', 'track', 'browser')) or not line.strip():
+        continue
+      fields = line.rstrip('\n').split('\t')
+      chrom, start, end = fields[0], int(fields[1]), int(fields[2])
+      name = fields[3] if len(fields) > 3 else f'{chrom}:{start}-{end}'
+      regions.append(Region(chrom, start, end, name))
+  return regions
+
+
+def read_vcf(path: Text, chr_prefix: str = '') -> List[Variant]:
+  """Returns one variant per alternate allele of each record in a VCF file."""
+  variants = []
+  with _open(path) as f:
+    for line in f:
+      if line.startswith('#'):
+        continue
+      chrom, pos, variant_id, ref, alt_list = line.split('\t')[:5]
+      for alt in alt_list.split(','):
+        variants.append(
+            Variant(chr_prefix + chrom, int(pos), variant_id, ref, alt))
+  return variants
+
+
+def chromosome_regions(fasta: FastaReader,
+                       chromosomes: Optional[Sequence[str]] = None
+                      ) -> List[Region]:
+  """Returns regions covering whole chromosomes, all of them by default."""
+  sizes = fasta.chromosome_sizes
+  return [Region(chrom, 0, sizes[chrom], chrom)
+          for chrom in (chromosomes or sizes)]
+
+
+def _one_hot_encode(sequence: str) -> np.ndarray:
+  """One-hot encodes ACGT as enformer.one_hot_encode, with zeros for N."""
+  codes = np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)
+  return _ONE_HOT_TABLE[codes]
+
+
+_ONE_HOT_TABLE = np.zeros((256, 4), np.float32)
+_ONE_HOT_TABLE[np.frombuffer(b'ACGT', np.uint8)] = np.eye(4, dtype=np.float32)
+
+
+def _open(path):
+  return gzip.open(path, 'rt') if path.endswith('.gz') else open(path)
+
+
+class _Window(NamedTuple):
+  """Window of a region and the bins of the region it predicts."""
+  region_index: int
+  input_start: int
+  first_bin: int  # In the window output.
+  region_bins: Tuple[int, int]
+
+
+class TiledPredictor:
+  """Batched and stitched Enformer predictions over regions and variants."""
+
+  def __init__(self,
+               predict_fn: PredictFn,
+               fasta: FastaReader,
+               head: str = 'human',
+               track_indices: Optional[Sequence[int]] = None,
+               batch_size: int = 4,
+               sequence_length: int = SEQUENCE_LENGTH,
+               target_length: int = TARGET_LENGTH,
+               bin_size: int = BIN_SIZE,
+               dtype: Any = np.float32,
+               log_every_n_batches: int = 100):
+    """Creates a TiledPredictor.
+
+    Args:
+      predict_fn: Function mapping a batch of one-hot encoded sequences of shape
+        [batch_size, sequence_length, 4] to a dictionary with predictions of
+        shape [batch_size, target_length, num_tracks] per head, e.g.
+        `Enformer.predict_on_batch`.
+      fasta: Reference genome.
+      head: Which head of the predictions to use.
+      track_indices: Tracks of the head to keep. All tracks if None.
+      batch_size: Number of windows per batch. Variant scoring uses batches of
+        `batch_size // 2` variants, each with a reference and alternate window.
+      sequence_length: Input length of predict_fn.
+      target_length: Number of bins output by predict_fn, centered in the input.
+      bin_size: Number of base pairs per output bin.
+      dtype: Data type of the written predictions.
+      log_every_n_batches: How often to log the throughput.
+    """
+    self._predict_fn = predict_fn
+    self._fasta = fasta
+    self._head = head
+    self._track_indices = (None if track_indices is None
+                           else np.asarray(track_indices))
+    self._batch_size = batch_size
+    self._sequence_length = sequence_length
+    self._target_length = target_length
+    self._bin_size = bin_size
+    self._target_offset = (sequence_length - target_length * bin_size) // 2
+    if self._target_offset < 0:
+      raise ValueError('The target is longer than the input sequence.')
+    self._dtype = dtype
+    self._log_every_n_batches = log_every_n_batches
+    self.reset_statistics()
+
+  def reset_statistics(self):
+    self._num_batches = 0
+    self._num_predicted_bp = 0
+    self._predict_seconds = 0.
+    self._start_time = time.time()
+
+  @property
+  def statistics(self) -> Dict[str, float]:
+    """Throughput since the last call to reset_statistics.
+
+    `bp_per_second` counts the base pairs of the predicted targets over the
+    wall time, including reading and encoding the sequences.
+    """
+    elapsed = max(time.time() - self._start_time, 1e-9)
+    return {
+        'num_batches': self._num_batches,
+        'predicted_bp': self._num_predicted_bp,
+        'bp_per_second': self._num_predicted_bp / elapsed,
+        'model_seconds': self._predict_seconds,
+        'total_seconds': elapsed,
+    }
+
+  def _predict(self, inputs: np.ndarray) -> np.ndarray:
+    """Returns the predictions of the selected head and tracks."""
+    start_time = time.time()
+    predictions = np.asarray(self._predict_fn(inputs)[self._head])
+    if self._track_indices is not None:
+      predictions = predictions[..., self._track_indices]
+    self._predict_seconds += time.time() - start_time
+    self._num_batches += 1
+    self._num_predicted_bp += (
+        inputs.shape[0] * self._target_length * self._bin_size)
+    if self._num_batches % self._log_every_n_batches == 0:
+      stats = self.statistics
+      logging.info('%d batches, %d bp in %.1fs (%.0f bp/s, %.0f%% in model)',
+                   stats['num_batches'], stats['predicted_bp'],
+                   stats['total_seconds'], stats['bp_per_second'],
+                   100 * stats['model_seconds'] / stats['total_seconds'])
+    return predictions
+
+  def _one_hot(self, chrom: str, start: int) -> np.ndarray:
+    return _one_hot_encode(
+        self._fasta.fetch(chrom, start, start + self._sequence_length))
+
+  def _tile(self, region_index: int, region: Region,
+            stride_bins: int) -> Iterator[_Window]:
+    """Yields the windows covering a region.
+
+    Window k predicts the bins [k * stride_bins, k * stride_bins +
+    target_length) of the region. Where windows overlap, each bin is taken from
+    the window whose center is closest, i.e. the one with the most context
+    around the bin.
+
+    Args:
+      region_index: Index of the region.
+      region: The region.
+      stride_bins: Number of bins between the starts of consecutive windows.
+    """
+    num_bins = -(-(region.end - region.start) // self._bin_size)
+    num_windows = max(
+        1, -(-(num_bins - self._target_length) // stride_bins) + 1)
+    margin = (self._target_length - stride_bins) // 2
+    for k in range(num_windows):
+      window_start = k * stride_bins
+      first = 0 if k == 0 else window_start + margin
+      last = (num_bins if k == num_windows - 1
+              else window_start + stride_bins + margin)
+      yield _Window(
+          region_index=region_index,
+          input_start=(region.start + window_start * self._bin_size -
+                       self._target_offset),
+          first_bin=first - window_start,
+          region_bins=(first, last))
+
+  def predict_regions(self,
+                      regions: Sequence[Region],
+                      output_prefix: Text,
+                      stride: Optional[int] = None) -> np.ndarray:
+    """Predicts contiguous tracks over regions.
+
+    Writes `{output_prefix}.npy`, an array of shape [total_bins, num_tracks]
+    with the bins of all regions one after the other, and
+    `{output_prefix}.regions.tsv` with the chromosome, start, end, name, first
+    bin and number of bins of each region. Bin i of a region covers the base
+    pairs [start + i * bin_size, start + (i + 1) * bin_size).
+
+    Args:
+      regions: Regions to predict, e.g. from read_bed or chromosome_regions.
+      output_prefix: Prefix of the output files.
+      stride: Number of base pairs between consecutive windows, a multiple of
+        bin_size. Defaults to the target length, i.e. non-overlapping targets.
+
+    Returns:
+      The memory-mapped predictions.
+    """
+    span = self._target_length * self._bin_size
+    stride = stride or span
+    if stride % self._bin_size or not 0 < stride <= span:
+      raise ValueError(f'stride must be a multiple of {self._bin_size} '
+                       f'between 1 and {span}, got {stride}.')
+    num_bins = [-(-(r.end - r.start) // self._bin_size) for r in regions]
+    region_offsets = np.concatenate([[0], np.cumsum(num_bins)])
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_prefix)), exist_ok=True)
+    with open(output_prefix + '.regions.tsv', 'w') as f:
+      for region, offset, n in zip(regions, region_offsets, num_bins):
+        f.write(f'{region.chrom}\t{region.start}\t{region.end}\t{region.name}'
+                f'\t{offset}\t{n}\n')
+
+    windows = (window
+               for i, region in enumerate(regions)
+               for window in self._tile(i, region, stride // self._bin_size))
+    outputs = None
+    for batch in _batched(windows, self._batch_size):
+      inputs = np.stack([
+          self._one_hot(regions[w.region_index].chrom, w.input_start)
+          for w in batch])
+      predictions = self._predict(inputs)
+      if outputs is None:
+        outputs = np.lib.format.open_memmap(
+            output_prefix + '.npy', mode='w+', dtype=self._dtype,
+            shape=(int(region_offsets[-1]), predictions.shape[-1]))
+      for window, prediction in zip(batch, predictions):
+        first, last = window.region_bins
+        offset = region_offsets[window.region_index]
+        outputs[offset + first:offset + last] = prediction[
+            window.first_bin:window.first_bin + last - first]
+    if outputs is not None:
+      outputs.flush()
+    return outputs
+
+  def _variant_inputs(self, variant: Variant) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns reference and alternate windows centered on the variant.
+
+    The alternate allele replaces the reference allele, keeping the sequence
+    upstream of the variant fixed and trimming or extending it downstream.
+
+    Args:
+      variant: The variant.
+    """
+    position = variant.pos - 1
+    start = position - self._sequence_length // 2
+    extra = max(len(variant.ref) - len(variant.alt), 0)
+    sequence = self._fasta.fetch(
+        variant.chrom, start, start + self._sequence_length + extra)
+    center = position - start
+    if sequence[center:center + len(variant.ref)] != variant.ref.upper():
+      logging.warning('Reference allele %s of variant %s does not match the '
+                      'genome (%s).', variant.ref, variant.id,
+                      sequence[center:center + len(variant.ref)])
+    alternate = (sequence[:center] + variant.alt.upper() +
+                 sequence[center + len(variant.ref):])
+    return (_one_hot_encode(sequence[:self._sequence_length]),
+            _one_hot_encode(alternate[:self._sequence_length]))
+
+  def score_variants(self,
+                     variants: Sequence[Variant],
+                     output_prefix: Text) -> np.ndarray:
+    """Scores the effects of variants as alternate minus reference prediction.
+
+    The score of each track is the SNP activity difference (SAD), the mean over
+    bins of the alternate prediction minus the reference prediction.
+    Writes `{output_prefix}.npy`, an array of shape [num_variants, num_tracks],
+    and `{output_prefix}.variants.tsv` with the chromosome, position, id,
+    reference and alternate allele of each variant.
+
+    Args:
+      variants: Variants to score, e.g. from read_vcf.
+      output_prefix: Prefix of the output files.
+
+    Returns:
+      The memory-mapped scores.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(output_prefix)), exist_ok=True)
+    with open(output_prefix + '.variants.tsv', 'w') as f:
+      for variant in variants:
+        f.write('\t'.join(str(field) for field in variant) + '\n')
+
+    scores = None
+    offset = 0
+    for batch in _batched(variants, max(self._batch_size // 2, 1)):
+      reference, alternate = zip(*map(self._variant_inputs, batch))
+      # Reference and alternate windows go through the model together.
+      predictions = self._predict(np.stack(reference + alternate))
+      predictions = predictions.astype(np.float32)
+      if scores is None:
+        scores = np.lib.format.open_memmap(
+            output_prefix + '.npy', mode='w+', dtype=self._dtype,
+            shape=(len(variants), predictions.shape[-1]))
+      num_variants = len(batch)
+      scores[offset:offset + num_variants] = (
+          predictions[num_variants:].mean(axis=1) -
+          predictions[:num_variants].mean(axis=1))
+      offset += num_variants
+    if scores is not None:
+      scores.flush()
+    return scores
+
+
+def _batched(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+  batch = []
+  for item in items:
+    batch.append(item)
+    if len(batch) == batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
@@ -0,0 +1,131 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test tiled inference with a model that counts the bases of each bin.
+
+Test:
+
+$ python inference_test.py
+"""
+
+import os
+import random
+import tempfile
+import unittest
+
+import enformer
+import inference
+import numpy as np
+
+SEQUENCE_LENGTH = 64
+TARGET_LENGTH = 4
+BIN_SIZE = 8
+
+
+def _count_bases(inputs):
+  """Returns the number of each base in each bin of the target."""
+  offset = (SEQUENCE_LENGTH - TARGET_LENGTH * BIN_SIZE) // 2
+  target = inputs[:, offset:offset + TARGET_LENGTH * BIN_SIZE]
+  return {'human': target.reshape(
+      inputs.shape[0], TARGET_LENGTH, BIN_SIZE, 4).sum(axis=2)}
+
+
+class TestInference(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    random.seed(0)
+    self._dir = tempfile.mkdtemp()
+    self._genome = {
+        'chr1': ''.join(random.choice('ACGT') for _ in range(1000)),
+        'chr2': ''.join(random.choice('ACGTN') for _ in range(130)),
+    }
+    fasta_path = os.path.join(self._dir, 'genome.fa')
+    with open(fasta_path, 'w') as f:
+      for chrom, sequence in self._genome.items():
+        f.write(f'>{chrom} description\n')
+        for i in range(0, len(sequence), 60):
+          f.write(sequence[i:i + 60].lower() + '\n')
+    self._fasta = inference.FastaReader(fasta_path)
+
+  def _make_predictor(self, **kwargs):
+    return inference.TiledPredictor(
+        _count_bases, self._fasta, batch_size=3,
+        sequence_length=SEQUENCE_LENGTH, target_length=TARGET_LENGTH,
+        bin_size=BIN_SIZE, **kwargs)
+
+  def test_fetch(self):
+    self.assertEqual(self._fasta.chromosome_sizes, {'chr1': 1000, 'chr2': 130})
+    self.assertEqual(self._fasta.fetch('chr1', 55, 185),
+                     self._genome['chr1'][55:185])
+    self.assertEqual(self._fasta.fetch('chr2', -3, 2),
+                     'NNN' + self._genome['chr2'][:2])
+    self.assertEqual(self._fasta.fetch('chr2', 128, 133),
+                     self._genome['chr2'][128:] + 'NNN')
+
+  def test_matches_enformer(self):
+    self.assertEqual(inference.SEQUENCE_LENGTH, enformer.SEQUENCE_LENGTH)
+    self.assertEqual(inference.TARGET_LENGTH, enformer.TARGET_LENGTH)
+    self.assertEqual(inference.BIN_SIZE, enformer.BIN_SIZE)
+    sequence = 'ACGTNacgtnX' + self._genome['chr1']
+    np.testing.assert_array_equal(
+        inference._one_hot_encode(sequence),  # pylint: disable=protected-access
+        enformer.one_hot_encode(sequence))
+
+  def test_predict_regions(self):
+    regions = [inference.Region('chr1', 0, 1000, 'chr1'),
+               inference.Region('chr1', 37, 101, 'short'),
+               inference.Region('chr2', 3, 130, 'chr2')]
+    for stride in (32, 16, 8):
+      predictor = self._make_predictor()
+      output_prefix = os.path.join(self._dir, f'stride_{stride}')
+      outputs = predictor.predict_regions(regions, output_prefix, stride)
+      offset = 0
+      for region in regions:
+        num_bins = -(-(region.end - region.start) // BIN_SIZE)
+        sequence = self._fasta.fetch(
+            region.chrom, region.start, region.start + num_bins * BIN_SIZE)
+        expected = enformer.one_hot_encode(sequence).reshape(
+            -1, BIN_SIZE, 4).sum(axis=1)
+        np.testing.assert_array_equal(
+            outputs[offset:offset + len(expected)], expected)
+        offset += len(expected)
+      self.assertEqual(offset, len(outputs))
+      np.testing.assert_array_equal(np.load(output_prefix + '.npy'), outputs)
+      self.assertGreater(predictor.statistics['bp_per_second'], 0)
+
+  def test_score_variants(self):
+    sequence = self._genome['chr1']
+    position = 500
+    ref = sequence[position - 1]
+    alt = 'C' if ref != 'C' else 'G'
+    variants = [
+        inference.Variant('chr1', position, 'snv', ref, alt),
+        inference.Variant('chr1', position, 'same', ref, ref),
+        inference.Variant('chr1', position, 'deletion',
+                          sequence[position - 1:position + 1], ref),
+    ]
+    scores = self._make_predictor(track_indices=[0, 1, 2, 3]).score_variants(
+        variants, os.path.join(self._dir, 'variants'))
+    self.assertEqual(scores.shape, (3, 4))
+    expected = np.zeros(4)
+    expected['ACGT'.index(ref)] = -1. / TARGET_LENGTH
+    expected['ACGT'.index(alt)] = 1. / TARGET_LENGTH
+    np.testing.assert_allclose(scores[0], expected)
+    np.testing.assert_allclose(scores[1], np.zeros(4))
+    # Deleting a base shifts the downstream bases into each target bin.
+    self.assertAlmostEqual(scores[2].sum(), 0.)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -33,21 +33,20 @@ def sym_op(x, zero_trace=False):
   the lower triangular of A (with the diagonal divided by 2).
 
   Args:
-    x: The matrix from which to construct the operator
+    x: The matrix from which to construct the operator, or a stack of such
+      matrices of shape [..., n, n].
     zero_trace (optional): If true, restrict the operator to only act on
       matrices with zero trace, effectively reducing the dimensionality by one.
   Returns:
-    A matrix Y such that vec(L(A)) = Y @ vec(A).
+    A matrix Y such that vec(L(A)) = Y @ vec(A), or a stack of such matrices.
   """
-  n = x.shape[0]
-  # Remember to subtract off the diagonal once
-  xx = (np.einsum('ik,jl->ijkl', x, x) +
-        np.einsum('il,jk->ijkl', x, x) -
-        np.einsum('ik,jl,kl->ijkl', x, x, np.eye(n)))
-  xx = xx[np.tril_indices(n)]
-  xx = xx.transpose(1, 2, 0)
-  xx = xx[np.tril_indices(n)]
-  xx = xx.T
+  n = x.shape[-1]
+  rows, cols = np.tril_indices(n)
+  # Y[(i, j), (k, l)] = x_ik x_jl + x_il x_jk, counting the diagonal once.
+  i, j = rows[:, None], cols[:, None]
+  k, l = rows[None, :], cols[None, :]
+  xx = (x[..., i, k] * x[..., j, l] +
+        (k != l) * x[..., i, l] * x[..., j, k])
   if zero_trace:
     diag_idx = np.cumsum([0]+list(range(2, n)))
     proj_op = np.eye(n*(n+1)//2)[:, :-1]
@@ -55,19 +54,30 @@ def sym_op(x, zero_trace=False):
     # multiply by operator that completes last element of diagonal
     # for a zero-trace matrix
     xx = xx @  proj_op
-    xx = xx[:-1]
+    xx = xx[..., :-1, :]
   return xx
 
 
 def vec_to_sym(x, n, zero_trace=False):
-  y = np.zeros((n, n))
+  """Inverse of the lower triangular vectorization used by sym_op.
+
+  Args:
+    x: The lower triangular elements of the matrix, or a stack of them of shape
+      [..., n*(n+1)//2] (one fewer if zero_trace).
+    n: The size of the matrix.
+    zero_trace (optional): If true, the last diagonal element is omitted from x
+      and set so that the matrix has zero trace.
+  Returns:
+    The symmetric matrix, or a stack of them of shape [..., n, n].
+  """
+  y = np.zeros(x.shape[:-1] + (n, n))
   if zero_trace:
-    x = np.append(x, 0.0)
-  y[np.tril_indices(n)] = x
-  y += y.T
-  y[np.diag_indices(n)] /= 2.0
+    x = np.concatenate([x, np.zeros(x.shape[:-1] + (1,))], axis=-1)
+  y[(Ellipsis,) + np.tril_indices(n)] = x
+  y += np.swapaxes(y, -1, -2)
+  y[(Ellipsis,) + np.diag_indices(n)] /= 2.0
   if zero_trace:
-    y[-1, -1] = -np.trace(y)
+    y[..., -1, -1] = -np.trace(y, axis1=-2, axis2=-1)
   return y
 
 
@@ -138,79 +148,152 @@ def make_nearest_neighbors_graph(data, k, n=1000):
     n (optional): number of neighbors to compute simultaneously
 
   Returns:
-    A scipy sparse matrix in LIL format giving the symmetric nn graph.
+    A scipy sparse matrix in CSR format with sorted indices giving the symmetric
+    nn graph.
   """
-  shape = data.shape
-  assert shape[0] % n == 0
-  nbr_graph = scipy.sparse.lil_matrix((shape[0], shape[0]))
+  num_points = data.shape[0]
   norm = np.sum(data**2, axis=1)
-  cols = np.meshgrid(np.arange(n), np.ones(k+1))[0]
-  for i in tqdm(range(0, shape[0], n)):
+  nbrs = []
+  for i in tqdm(range(0, num_points, n)):
     dot = data @ data[i:i+n].T
     dists = np.sqrt(np.abs(norm[:, None] - 2*dot + norm[i:i+n][None, :]))
     idx = np.argpartition(dists, k, axis=0)[:k+1]
-    nbrs = idx[np.argsort(dists[idx, cols], axis=0), cols][1:]
-    for j in range(n):
-      nbr_graph[i+j, nbrs[:, j]] = 1
+    order = np.argsort(np.take_along_axis(dists, idx, axis=0), axis=0)
+    nbrs.append(np.take_along_axis(idx, order, axis=0)[1:].T)
+  nbrs = np.concatenate(nbrs)
+  nbr_graph = scipy.sparse.csr_matrix(
+      (np.ones(nbrs.size), nbrs.ravel(), np.arange(0, nbrs.size + 1, k)),
+      shape=(num_points, num_points))
   # Symmetrize graph
-  for i in tqdm(range(shape[0])):
-    for j in nbr_graph.rows[i]:
-      if nbr_graph[j, i] == 0:
-        nbr_graph[j, i] = nbr_graph[i, j]
+  nbr_graph = nbr_graph.maximum(nbr_graph.T).tocsr()
+  nbr_graph.sort_indices()
   logging.info('Symmetrized neighbor graph')
   return nbr_graph
 
 
-def make_tangents(data, neighbor_graph, k):
-  """Construct all tangent vectors for the dataset."""
+def _batches(num_items, batch_size):
+  """Yields slices covering range(num_items) in batches of batch_size."""
+  for start in tqdm(range(0, num_items, batch_size)):
+    yield slice(start, min(start + batch_size, num_items))
+
+
+def make_tangents(data, neighbor_graph, k, batch_size=10000):
+  """Construct all tangent vectors for the dataset.
+
+  Points are grouped by their number of neighbors so that the SVDs of their
+  neighborhoods can be computed in batches.
+
+  Args:
+    data: The dataset, each row is one point.
+    neighbor_graph: The neighbor graph from make_nearest_neighbors_graph.
+    k: The dimensionality of the manifold.
+    batch_size (optional): The number of neighborhoods to decompose at once.
+
+  Returns:
+    An array of shape [num_points, k, data.shape[1]] with the tangent basis at
+    each point.
+  """
   tangents = np.zeros((data.shape[0], k, data.shape[1]), dtype=np.float32)
-  for i in tqdm(range(data.shape[0])):
-    diff = data[neighbor_graph.rows[i]] - data[i]
-    _, _, u = np.linalg.svd(diff, full_matrices=False)
-    tangents[i] = u[:k]
+  degrees = np.diff(neighbor_graph.indptr)
+  for degree in np.unique(degrees):
+    points = np.flatnonzero(degrees == degree)
+    for batch in _batches(len(points), batch_size):
+      rows = points[batch]
+      nbrs = neighbor_graph.indices[
+          neighbor_graph.indptr[rows][:, None] + np.arange(degree)]
+      diff = data[nbrs] - data[rows][:, None]
+      _, _, u = np.linalg.svd(diff, full_matrices=False)
+      tangents[rows] = u[:, :k]
   logging.info('Computed all tangents')
   return tangents
 
 
-def make_connection(tangents, neighbor_graph):
-  """Make connection matrices for all edges of the neighbor graph."""
-  connection = {}
-  for i in tqdm(range(tangents.shape[0])):
-    for j in neighbor_graph.rows[i]:
-      if j > i:
-        uy, _, ux = np.linalg.svd(tangents[j] @ tangents[i].T,
-                                  full_matrices=False)
-        conn = uy @ ux
-        connection[(i, j)] = conn
-        connection[(j, i)] = conn.T
+def reverse_edges(neighbor_graph):
+  """For each edge (i, j) of the graph, finds the index of the edge (j, i).
+
+  Args:
+    neighbor_graph: A structurally symmetric CSR graph with sorted indices.
+
+  Returns:
+    An array r of shape [nnz] such that neighbor_graph.indices[r[e]] is the row
+    of edge e, for edges indexed in CSR order.
+  """
+  edge_index = scipy.sparse.csr_matrix(
+      (np.arange(1, neighbor_graph.nnz + 1), neighbor_graph.indices,
+       neighbor_graph.indptr), shape=neighbor_graph.shape).T.tocsr()
+  edge_index.sort_indices()
+  return edge_index.data - 1
+
+
+def make_connection(tangents, neighbor_graph, batch_size=100000):
+  """Make connection matrices for all edges of the neighbor graph.
+
+  Args:
+    tangents: The tangent bases from make_tangents.
+    neighbor_graph: The neighbor graph from make_nearest_neighbors_graph.
+    batch_size (optional): The number of edges to decompose at once.
+
+  Returns:
+    An array of shape [nnz, k, k] with the connection matrix of each edge (i, j)
+    of neighbor_graph, indexed in CSR order, i.e. like neighbor_graph.indices.
+  """
+  rows = np.repeat(np.arange(neighbor_graph.shape[0]),
+                   np.diff(neighbor_graph.indptr))
+  cols = neighbor_graph.indices
+  reverse = reverse_edges(neighbor_graph)
+  # Each edge (i, j) with i < j also gives the connection of (j, i).
+  edges = np.flatnonzero(rows < cols)
+  k = tangents.shape[1]
+  connection = np.zeros((neighbor_graph.nnz, k, k), dtype=tangents.dtype)
+  for batch in _batches(len(edges), batch_size):
+    edge = edges[batch]
+    uy, _, ux = np.linalg.svd(
+        tangents[cols[edge]] @ tangents[rows[edge]].transpose(0, 2, 1),
+        full_matrices=False)
+    conn = uy @ ux
+    connection[edge] = conn
+    connection[reverse[edge]] = conn.transpose(0, 2, 1)
   logging.info('Constructed all connection matrices')
   return connection
 
 
-def make_laplacian(connection, neighbor_graph, sym=True, zero_trace=True):
-  """Make symmetric zero-trace second-order graph connection Laplacian."""
+def make_laplacian(connection, neighbor_graph, sym=True, zero_trace=True,
+                   batch_size=100000):
+  """Make symmetric zero-trace second-order graph connection Laplacian.
+
+  Args:
+    connection: The connection matrices from make_connection.
+    neighbor_graph: The neighbor graph from make_nearest_neighbors_graph.
+    sym (optional): If true, the Laplacian acts on symmetric matrices.
+    zero_trace (optional): If true and sym, the Laplacian acts on symmetric
+      matrices with zero trace.
+    batch_size (optional): The number of edges to build blocks for at once.
+
+  Returns:
+    The Laplacian as a scipy sparse matrix in BSR format.
+  """
   n = neighbor_graph.shape[0]
-  k = list(connection.values())[0].shape[0]
+  k = connection.shape[-1]
   bsz = (k*(k+1)//2 - 1 if zero_trace else k*(k+1)//2) if sym else k**2
+  degrees = np.diff(neighbor_graph.indptr)
+  rows = np.repeat(np.arange(n), degrees)
+  reverse = reverse_edges(neighbor_graph)
+  # Each row holds its diagonal block followed by one block per neighbor.
+  indptr = neighbor_graph.indptr + np.arange(n + 1)
+  diagonal = indptr[:-1]
+  off_diagonal = np.arange(neighbor_graph.nnz) + rows + 1
   data = np.zeros((neighbor_graph.nnz + n, bsz, bsz), dtype=np.float32)
-  indptr = []
-  indices = np.zeros(neighbor_graph.nnz + n)
-  index = 0
-  for i in tqdm(range(n)):
-    indptr.append(index)
-    data[index] = len(neighbor_graph.rows[i]) * np.eye(bsz)
-    indices[index] = i
-    index += 1
-    for j in neighbor_graph.rows[i]:
-      if sym:
-        kron = sym_op(connection[(j, i)], zero_trace=zero_trace)
-      else:
-        kron = np.kron(connection[(j, i)], connection[(j, i)])
-      data[index] = -kron
-      indices[index] = j
-      index += 1
-  indptr.append(index)
-  indptr = np.array(indptr)
+  indices = np.zeros(neighbor_graph.nnz + n, dtype=np.int64)
+  data[diagonal] = degrees[:, None, None] * np.eye(bsz)
+  indices[diagonal] = np.arange(n)
+  indices[off_diagonal] = neighbor_graph.indices
+  for batch in _batches(neighbor_graph.nnz, batch_size):
+    conn = connection[reverse[batch]]
+    if sym:
+      kron = sym_op(conn, zero_trace=zero_trace)
+    else:
+      kron = np.einsum('eab,ecd->eacbd', conn, conn).reshape(-1, bsz, bsz)
+    data[off_diagonal[batch]] = -kron
 
   laplacian = scipy.sparse.bsr_matrix((data, indices, indptr),
                                       shape=(n*bsz, n*bsz))
@@ -269,12 +352,12 @@ def fit(data, k, gamma=None, nnbrs=None, neig=10, shard_size=1000):
   else:  # If no threshold is provided, just use the largest gap in the spectrum
     nm = np.argmax(eigvals[1:] - eigvals[:-1]) + 1
   eigvecs = eigvecs.reshape(data.shape[0], bsz, neig)
-  omega = np.zeros((nm, k, k), dtype=np.float32)
+  omegas = vec_to_sym(eigvecs[:, :, :nm].transpose(0, 2, 1), k,
+                      zero_trace=True).astype(np.float32)
   components = []
   for i in tqdm(range(data.shape[0])):
-    for j in range(nm):
-      omega[j] = vec_to_sym(eigvecs[i, :, j], k, zero_trace=True)
-    components.append([tangents[i].T @ x.T for x in cluster_subspaces(omega)])
+    components.append(
+        [tangents[i].T @ x.T for x in cluster_subspaces(omegas[i])])
   logging.info('GEOMANCER completed')
   return components, eigvals
 
@@ -298,8 +381,9 @@ def eval_unaligned(data, tangents, true_data, true_tangents, k=10, n=1000):
   for i in tqdm(range(data.shape[0])):
     tangent = np.concatenate(tangents[i], axis=1)
     true_tangent = np.concatenate([t[i] for t in true_tangents], axis=1)
-    dx_true = (true_data[nbrs.rows[i]] - true_data[i]) @ true_tangent
-    dx_result = (data[nbrs.rows[i]] - data[i]) @ tangent
+    nbrs_i = nbrs.indices[nbrs.indptr[i]:nbrs.indptr[i+1]]
+    dx_true = (true_data[nbrs_i] - true_data[i]) @ true_tangent
+    dx_result = (data[nbrs_i] - data[i]) @ tangent
 
     # compute canonical correlations between the two dxs
     xx = dx_true.T @ dx_true
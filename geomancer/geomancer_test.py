@@ -44,6 +44,14 @@ class GeomancerTest(parameterized.TestCase):
     y_ = geomancer.vec_to_sym(vec_y, n, zero_trace=zero_trace)
     np.testing.assert_allclose(y_, y)
 
+    # Stacks of matrices are handled like each matrix separately.
+    qs = np.stack([q, np.eye(n), -q])
+    sym_qs = geomancer.sym_op(qs, zero_trace=zero_trace)
+    np.testing.assert_allclose(sym_qs[0], sym_q)
+    np.testing.assert_allclose(
+        geomancer.vec_to_sym(sym_qs @ tril_x, n, zero_trace=zero_trace),
+        np.stack([y, x, y]))
+
   def test_ffdiag(self):
     k = 2
     n = 5
@@ -71,11 +79,51 @@ class GeomancerTest(parameterized.TestCase):
       data[i, 1] = np.cos(i*2*np.pi/n)
     graph = geomancer.make_nearest_neighbors_graph(data, 4, n=10)
     for i in range(n):
-      self.assertLen(graph.rows[i], 4)
-      self.assertIn((i+1) % n, graph.rows[i])
-      self.assertIn((i+2) % n, graph.rows[i])
-      self.assertIn((i-1) % n, graph.rows[i])
-      self.assertIn((i-2) % n, graph.rows[i])
+      nbrs = graph.indices[graph.indptr[i]:graph.indptr[i+1]]
+      self.assertLen(nbrs, 4)
+      self.assertIn((i+1) % n, nbrs)
+      self.assertIn((i+2) % n, nbrs)
+      self.assertIn((i-1) % n, nbrs)
+      self.assertIn((i-2) % n, nbrs)
+
+  @parameterized.parameters(
+      {'sym': True, 'zero_trace': True},
+      {'sym': True, 'zero_trace': False},
+      {'sym': False, 'zero_trace': False})
+  def test_make_laplacian(self, sym, zero_trace):
+    """Laplacian blocks match the per-edge connection matrices?"""
+    k = 2
+    data = np.random.randn(60, 5)
+    graph = geomancer.make_nearest_neighbors_graph(data, 2*k, n=7)
+    tangents = geomancer.make_tangents(data, graph, k, batch_size=8)
+    connection = geomancer.make_connection(tangents, graph, batch_size=16)
+    laplacian = geomancer.make_laplacian(
+        connection, graph, sym=sym, zero_trace=zero_trace,
+        batch_size=16).toarray()
+    bsz = laplacian.shape[0] // data.shape[0]
+    reverse = geomancer.reverse_edges(graph)
+    for i in range(data.shape[0]):
+      np.testing.assert_allclose(
+          tangents[i] @ tangents[i].T, np.eye(k), atol=1e-5)
+      start, end = graph.indptr[i], graph.indptr[i+1]
+      blocks = laplacian[i*bsz:(i+1)*bsz].reshape(bsz, -1, bsz)
+      not_nbrs = np.setdiff1d(np.arange(data.shape[0]),
+                              np.append(graph.indices[start:end], i))
+      np.testing.assert_array_equal(blocks[:, not_nbrs], 0.)
+      np.testing.assert_allclose(laplacian[i*bsz:(i+1)*bsz, i*bsz:(i+1)*bsz],
+                                 (end - start) * np.eye(bsz))
+      for e in range(start, end):
+        j = graph.indices[e]
+        uy, _, ux = np.linalg.svd(tangents[j] @ tangents[i].T)
+        np.testing.assert_allclose(connection[e], uy @ ux, atol=1e-5)
+        np.testing.assert_array_equal(connection[reverse[e]], connection[e].T)
+        conn = connection[reverse[e]]
+        if sym:
+          kron = geomancer.sym_op(conn, zero_trace=zero_trace)
+        else:
+          kron = np.kron(conn, conn)
+        np.testing.assert_allclose(
+            laplacian[i*bsz:(i+1)*bsz, j*bsz:(j+1)*bsz], -kron, atol=1e-6)
 
 
 if __name__ == '__main__':
@@ -19,6 +19,7 @@ The architecture and performance of this model is described in our publication:
 """
 
 import functools
+import itertools
 from typing import Any, Dict, Text, Tuple, Optional
 
 from graph_nets import graphs
@@ -29,6 +30,85 @@ import sonnet as snt
 import tensorflow.compat.v1 as tf
 
 
+def _get_periodic_displacements(
+    positions: tf.Tensor,
+    senders: tf.Tensor,
+    receivers: tf.Tensor,
+    box: tf.Tensor) -> tf.Tensor:
+  """Returns the relative positions of receivers to senders.
+
+  Args:
+    positions: particle positions with shape [n_particles, 3].
+    senders: indices of the first particle of each pair with shape [n_pairs].
+    receivers: indices of the second particle of each pair with shape
+      [n_pairs].
+    box: dimensions of the periodic box with shape [3].
+  """
+  cross_positions = (tf.gather(positions, receivers) -
+                     tf.gather(positions, senders))
+  # Enforces periodic boundary conditions.
+  box_ = box[tf.newaxis, :]
+  cross_positions += tf.cast(cross_positions < -box_ / 2., tf.float32) * box_
+  cross_positions -= tf.cast(cross_positions > box_ / 2., tf.float32) * box_
+  return cross_positions
+
+
+def _get_neighbor_candidates(
+    positions: tf.Tensor,
+    box: tf.Tensor,
+    edge_threshold: float) -> Tuple[tf.Tensor, tf.Tensor]:
+  """Returns all pairs of particles in the same or in adjacent cells.
+
+  The box is divided into a grid of cells at least edge_threshold wide, so that
+  all particles within edge_threshold of each other are in the same or in
+  adjacent cells, taking periodic boundary conditions into account.
+  Pairs are returned once per adjacent cell, so a pair may repeat if the grid
+  has fewer than three cells along a dimension.
+
+  Args:
+    positions: particle positions with shape [n_particles, 3].
+    box: dimensions of the periodic box with shape [3].
+    edge_threshold: the minimal width of the cells.
+
+  Returns:
+    senders and receivers of the candidate pairs, each with shape [n_pairs].
+  """
+  n_particles = tf.shape(positions)[0]
+  # The margin ensures that cells are wider than the threshold despite rounding.
+  n_cells = tf.maximum(tf.floor(box / (edge_threshold * (1. + 1e-6))), 1.)
+  cells = tf.cast(tf.floor(positions / box * n_cells), tf.int32)
+  n_cells = tf.cast(n_cells, tf.int32)
+  strides = tf.stack([n_cells[1] * n_cells[2], n_cells[2], 1])
+
+  # Sorts particles by cell, such that the particles in a cell are contiguous.
+  cell_ids = tf.reduce_sum(tf.floormod(cells, n_cells) * strides, axis=-1)
+  order = tf.argsort(cell_ids, stable=True)
+  n_cells_total = tf.reduce_prod(n_cells)
+  cell_counts = tf.math.bincount(
+      cell_ids, minlength=n_cells_total, maxlength=n_cells_total)
+  cell_starts = tf.cumsum(cell_counts, exclusive=True)
+
+  # Finds the cells adjacent to the cell of each particle: [n_particles * 27].
+  offsets = tf.constant(list(itertools.product((-1, 0, 1), repeat=3)),
+                        dtype=tf.int32)
+  neighbor_cells = tf.floormod(
+      cells[:, tf.newaxis, :] + offsets[tf.newaxis, :, :], n_cells)
+  neighbor_cell_ids = tf.reshape(
+      tf.reduce_sum(neighbor_cells * strides, axis=-1), [-1])
+  cell_senders = tf.repeat(tf.range(n_particles), tf.shape(offsets)[0])
+
+  # Pairs each particle with all particles in each adjacent cell.
+  counts = tf.gather(cell_counts, neighbor_cell_ids)
+  senders = tf.repeat(cell_senders, counts)
+  index_in_cell = (tf.range(tf.reduce_sum(counts)) -
+                   tf.repeat(tf.cumsum(counts, exclusive=True), counts))
+  receivers = tf.gather(
+      order,
+      tf.repeat(tf.gather(cell_starts, neighbor_cell_ids), counts) +
+      index_in_cell)
+  return senders, receivers
+
+
 def make_graph_from_static_structure(
     positions: tf.Tensor,
     types: tf.Tensor,
@@ -41,6 +121,10 @@ def make_graph_from_static_structure(
   Two particles at a distance less than the threshold are connected by an edge.
   The relative distance vector is stored as an edge feature.
 
+  Neighbors are found using a cell list, so the cost grows linearly with the
+  number of particles. The edges are the same as comparing all pairs of
+  particles, sorted by sender and then by receiver.
+
   Args:
     positions: particle positions with shape [n_particles, 3].
     types: particle types with shape [n_particles].
@@ -48,22 +132,23 @@ def make_graph_from_static_structure(
     edge_threshold: particles at distance less than threshold are connected by
       an edge.
   """
-  # Calculate pairwise relative distances between particles: shape [n, n, 3].
-  cross_positions = positions[tf.newaxis, :, :] - positions[:, tf.newaxis, :]
-  # Enforces periodic boundary conditions.
-  box_ = box[tf.newaxis, tf.newaxis, :]
-  cross_positions += tf.cast(cross_positions < -box_ / 2., tf.float32) * box_
-  cross_positions -= tf.cast(cross_positions > box_ / 2., tf.float32) * box_
-  # Calculates adjacency matrix in a sparse format (indices), based on the given
-  # distances and threshold.
+  senders, receivers = _get_neighbor_candidates(positions, box, edge_threshold)
+  cross_positions = _get_periodic_displacements(
+      positions, senders, receivers, box)
   distances = tf.norm(cross_positions, axis=-1)
-  indices = tf.where(distances < edge_threshold)
+  mask = distances < edge_threshold
+
+  # Removes duplicate candidates and sorts the pairs.
+  n_particles = tf.cast(tf.shape(positions)[0], tf.int64)
+  pair_ids = (tf.cast(tf.boolean_mask(senders, mask), tf.int64) * n_particles +
+              tf.cast(tf.boolean_mask(receivers, mask), tf.int64))
+  pair_ids = tf.sort(tf.unique(pair_ids).y)
+  senders = pair_ids // n_particles
+  receivers = pair_ids % n_particles
 
   # Defines graph.
   nodes = types[:, tf.newaxis]
-  senders = indices[:, 0]
-  receivers = indices[:, 1]
-  edges = tf.gather_nd(cross_positions, indices)
+  edges = _get_periodic_displacements(positions, senders, receivers, box)
 
   return graphs.GraphsTuple(
       nodes=tf.cast(nodes, tf.float32),
@@ -105,6 +105,29 @@ class GraphModelTest(tf.test.TestCase, parameterized.TestCase):
     np.testing.assert_almost_equal(graphs_tuple.globals, np.array([[0.0]]))
     np.testing.assert_almost_equal(graphs_tuple.edges, self._edges)
 
+  @parameterized.named_parameters(('many_cells', [8.0, 8.0, 8.0]),
+                                  ('few_cells', [3.0, 5.0, 8.0]))
+  def test_make_graph_from_static_structure_matches_all_pairs(self, box):
+    """Tests the cell list against comparing all pairs of particles."""
+    box = np.array(box, dtype=np.float32)
+    positions = (np.random.RandomState(0).uniform(size=(300, 3)) *
+                 box).astype(np.float32)
+    cross_positions = positions[np.newaxis, :, :] - positions[:, np.newaxis, :]
+    cross_positions += (cross_positions < -box / 2.) * box
+    cross_positions -= (cross_positions > box / 2.) * box
+    senders, receivers = np.where(
+        np.linalg.norm(cross_positions, axis=-1) < self._edge_threshold)
+
+    graphs_tuple = self.evaluate(graph_model.make_graph_from_static_structure(
+        tf.constant(positions),
+        tf.zeros([300], dtype=tf.int32),
+        tf.constant(box),
+        self._edge_threshold))
+    np.testing.assert_equal(graphs_tuple.senders, senders)
+    np.testing.assert_equal(graphs_tuple.receivers, receivers)
+    np.testing.assert_almost_equal(graphs_tuple.edges,
+                                   cross_positions[senders, receivers])
+
   def _is_equal_up_to_rotation(self, x, y):
     for axes in itertools.permutations([0, 1, 2]):
       for mirrors in itertools.product([1, -1], repeat=3):
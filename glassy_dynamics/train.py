@@ -17,6 +17,8 @@
 
 import collections
 import enum
+import hashlib
+import os
 import pickle
 from typing import Any, Dict, List, Optional, Text, Tuple, Sequence
 
@@ -103,6 +105,67 @@ def load_data(
   return static_structures
 
 
+def get_graph_cache_filename(
+    graph_cache_dir: Text,
+    file_pattern: Text,
+    time_index: int,
+    max_files_to_load: Optional[int],
+    edge_threshold: float) -> Text:
+  """Returns the file used by tf.data to cache the graphs of a dataset.
+
+  The filename identifies the dataset and all arguments the cached graphs,
+  targets and types depend on, so changing any of them starts a new cache.
+
+  Args:
+    graph_cache_dir: directory containing the cache files.
+    file_pattern: pattern matching the files with the simulation data.
+    time_index: the time index of the targets.
+    max_files_to_load: the maximum number of files to load.
+    edge_threshold: particles at distance less than threshold are connected by
+      an edge.
+  """
+  key = repr((file_pattern, time_index, max_files_to_load, edge_threshold))
+  return os.path.join(
+      graph_cache_dir,
+      'graphs_' + hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def make_graph_dataset(
+    static_structures: GlassSimulationData,
+    edge_threshold: float,
+    cache_filename: Text = '') -> tf.data.Dataset:
+  """Returns a dataset of the graphs, targets and types of static structures.
+
+  The graphs are computed during the first pass through the dataset and
+  cached, so that later passes read them from the cache.
+
+  Args:
+    static_structures: static structures stacked along a leading dimension,
+      e.g. placeholders fed when initializing an iterator over the dataset.
+    edge_threshold: particles at distance less than threshold are connected by
+      an edge.
+    cache_filename: if set, the graphs are cached in files with this prefix.
+      Once the cache is complete, e.g. in a later run, the graphs are read from
+      it instead of from `static_structures`. Otherwise they are cached in
+      memory.
+  """
+  # Defines a wrapper function, which can directly be passed to the
+  # tf.data.Dataset.map function.
+  def _make_graph_from_static_structure(static_structure):
+    """Converts static structure to graph, targets and types."""
+    return (graph_model.make_graph_from_static_structure(
+        static_structure.positions,
+        static_structure.types,
+        static_structure.box,
+        edge_threshold),
+            static_structure.targets,
+            static_structure.types)
+
+  dataset = tf.data.Dataset.from_tensor_slices(static_structures)
+  dataset = dataset.map(_make_graph_from_static_structure)
+  return dataset.cache(cache_filename)
+
+
 def get_loss_ops(
     prediction: tf.Tensor,
     target: tf.Tensor,
@@ -180,7 +243,8 @@ def train_model(train_file_pattern: Text,
                 mlp_kwargs: Optional[Dict[Text, Any]] = None,
                 edge_threshold: float = 2.0,
                 measurement_store_interval: int = 1000,
-                checkpoint_path: Optional[Text] = None) -> float:  # pytype: disable=annotation-type-mismatch
+                checkpoint_path: Optional[Text] = None,
+                graph_cache_dir: Optional[Text] = None) -> float:  # pytype: disable=annotation-type-mismatch
   """Trains GraphModel using tensorflow.
 
   Args:
@@ -202,6 +266,9 @@ def train_model(train_file_pattern: Text,
       (loss and correlation).
     checkpoint_path: path used to store the checkpoint with the highest
       correlation on the test set.
+    graph_cache_dir: if set, the graphs of the train and test datasets are
+      cached in files in this directory, and loaded from them in later runs
+      instead of being recomputed. Otherwise they are cached in memory.
 
   Returns:
     Correlation on the test dataset of best model encountered during training.
@@ -215,19 +282,21 @@ def train_model(train_file_pattern: Text,
       max_files_to_load=max_files_to_load)
   training_data = load_data(train_file_pattern, **dataset_kwargs)
   test_data = load_data(test_file_pattern, **dataset_kwargs)
-
-  # Defines wrapper functions, which can directly be passed to the
+  if graph_cache_dir:
+    tf.io.gfile.makedirs(graph_cache_dir)
+    # The train and test datasets may be read from the same files, but each
+    # tf.data cache needs a file of its own.
+    train_cache_filename = get_graph_cache_filename(
+        graph_cache_dir, train_file_pattern, edge_threshold=edge_threshold,
+        **dataset_kwargs) + '_train'
+    test_cache_filename = get_graph_cache_filename(
+        graph_cache_dir, test_file_pattern, edge_threshold=edge_threshold,
+        **dataset_kwargs) + '_test'
+  else:
+    train_cache_filename = test_cache_filename = ''
+
+  # Defines a wrapper function, which can directly be passed to the
   # tf.data.Dataset.map function.
-  def _make_graph_from_static_structure(static_structure):
-    """Converts static structure to graph, targets and types."""
-    return (graph_model.make_graph_from_static_structure(
-        static_structure.positions,
-        static_structure.types,
-        static_structure.box,
-        edge_threshold),
-            static_structure.targets,
-            static_structure.types)
-
   def _apply_random_rotation(graph, targets, types):
     """Applies random rotations to the graph and forwards targets and types."""
     return graph_model.apply_random_rotation(graph), targets, types
@@ -240,9 +309,8 @@ def train_model(train_file_pattern: Text,
   # iterators before the main training loop.
   placeholders = GlassSimulationData._make(
       tf.placeholder(s.dtype, (None,) + s.shape) for s in training_data[0])
-  dataset = tf.data.Dataset.from_tensor_slices(placeholders)
-  dataset = dataset.map(_make_graph_from_static_structure)
-  dataset = dataset.cache()
+  dataset = make_graph_dataset(placeholders, edge_threshold,
+                               train_cache_filename)
   dataset = dataset.shuffle(400)
   # Augments data. This has to be done after calling dataset.cache!
   if augment_data_using_rotations:
@@ -250,9 +318,8 @@ def train_model(train_file_pattern: Text,
   dataset = dataset.repeat()
   train_iterator = dataset.make_initializable_iterator()
 
-  dataset = tf.data.Dataset.from_tensor_slices(placeholders)
-  dataset = dataset.map(_make_graph_from_static_structure)
-  dataset = dataset.cache()
+  dataset = make_graph_dataset(placeholders, edge_threshold,
+                               test_cache_filename)
   dataset = dataset.repeat()
   test_iterator = dataset.make_initializable_iterator()
 
@@ -40,6 +40,10 @@ flags.DEFINE_string(
     'checkpoint_path',
     None,
     'Path used to store a checkpoint of the best model.')
+flags.DEFINE_string(
+    'graph_cache_dir',
+    None,
+    'Directory used to cache the graphs of the static structures across runs.')
 flags.DEFINE_boolean(
     'use_jax',
     False,
@@ -58,7 +62,8 @@ def main(argv):
       test_file_pattern=test_file_pattern,
       max_files_to_load=FLAGS.max_files_to_load,
       time_index=FLAGS.time_index,
-      checkpoint_path=FLAGS.checkpoint_path)
+      checkpoint_path=FLAGS.checkpoint_path,
+      graph_cache_dir=FLAGS.graph_cache_dir)
 
 
 if __name__ == '__main__':
@@ -117,6 +117,46 @@ class TensorflowTrainTest(tf.test.TestCase):
     correlation_value = np.corrcoef(predictions[0], targets)[0, 1]
     self.assertGreater(correlation_value, 0.5)
 
+  def test_graph_cache_round_trip(self):
+    """Tests that cached graphs are read back instead of being recomputed."""
+    file_pattern = os.path.join(os.path.dirname(__file__), 'testdata',
+                                'test_small.pickle')
+    data = train.load_data(file_pattern, 0)
+    static_structures = train.GlassSimulationData._make(
+        np.stack(x) for x in zip(*data))
+    # Closer particles give a graph with more edges.
+    moved_static_structures = static_structures._replace(
+        positions=static_structures.positions * 0.5)
+    cache_filename = train.get_graph_cache_filename(
+        self.get_temp_dir(), file_pattern, time_index=0,
+        max_files_to_load=None, edge_threshold=5.)
+
+    expected = _read_dataset(lambda: train.make_graph_dataset(
+        static_structures, 5., cache_filename))
+    self.assertNotEmpty(tf.io.gfile.glob(cache_filename + '*'))
+    self.assertLen(expected, 1)
+    cached = _read_dataset(lambda: train.make_graph_dataset(
+        moved_static_structures, 5., cache_filename))
+    for x, y in zip(tf.nest.flatten(cached), tf.nest.flatten(expected)):
+      np.testing.assert_array_equal(x, y)
+
+    recomputed = _read_dataset(lambda: train.make_graph_dataset(
+        moved_static_structures, 5.))
+    self.assertGreater(recomputed[0][0].n_edge[0], expected[0][0].n_edge[0])
+
+
+def _read_dataset(dataset_fn):
+  """Returns all elements of the dataset built by dataset_fn in a new graph."""
+  elements = []
+  with tf.Graph().as_default():
+    next_element = tf.data.make_one_shot_iterator(dataset_fn()).get_next()
+    with tf.Session() as session:
+      while True:
+        try:
+          elements.append(session.run(next_element))
+        except tf.errors.OutOfRangeError:
+          return elements
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -16,7 +16,10 @@
 
 import enum
 import functools
+import hashlib
+import itertools
 import logging
+import os
 import pickle
 import random
 import haiku as hk
@@ -43,6 +46,69 @@ class ParticleType(enum.IntEnum):
   B = 1
 
 
+def _get_periodic_displacements(positions, senders, receivers, box):
+  """Returns the relative positions of receivers to senders.
+
+  Args:
+    positions: particle positions with shape [n_particles, 3].
+    senders: indices of the first particle of each pair with shape [n_pairs].
+    receivers: indices of the second particle of each pair with shape
+      [n_pairs].
+    box: dimensions of the periodic box with shape [3].
+  """
+  cross_positions = positions[receivers] - positions[senders]
+  # Enforces periodic boundary conditions.
+  box_ = box[None, :]
+  cross_positions += (cross_positions < -box_ / 2.).astype(np.float32) * box_
+  cross_positions -= (cross_positions > box_ / 2.).astype(np.float32) * box_
+  return cross_positions
+
+
+def _get_neighbor_candidates(positions, box, edge_threshold):
+  """Returns all pairs of particles in the same or in adjacent cells.
+
+  The box is divided into a grid of cells at least edge_threshold wide, so that
+  all particles within edge_threshold of each other are in the same or in
+  adjacent cells, taking periodic boundary conditions into account.
+  Pairs are returned once per adjacent cell, so a pair may repeat if the grid
+  has fewer than three cells along a dimension.
+
+  Args:
+    positions: particle positions with shape [n_particles, 3].
+    box: dimensions of the periodic box with shape [3].
+    edge_threshold: the minimal width of the cells.
+
+  Returns:
+    senders and receivers of the candidate pairs, each with shape [n_pairs].
+  """
+  # The margin ensures that cells are wider than the threshold despite rounding.
+  n_cells = np.maximum(np.floor(box / (edge_threshold * (1. + 1e-6))), 1.)
+  cells = np.floor(positions / box * n_cells).astype(np.int64)
+  n_cells = n_cells.astype(np.int64)
+  strides = np.array([n_cells[1] * n_cells[2], n_cells[2], 1])
+
+  # Sorts particles by cell, such that the particles in a cell are contiguous.
+  cell_ids = np.sum(np.mod(cells, n_cells) * strides, axis=-1)
+  order = np.argsort(cell_ids, kind='stable')
+  cell_counts = np.bincount(cell_ids, minlength=np.prod(n_cells))
+  cell_starts = np.cumsum(cell_counts) - cell_counts
+
+  # Finds the cells adjacent to the cell of each particle: [n_particles * 27].
+  offsets = np.array(list(itertools.product((-1, 0, 1), repeat=3)))
+  neighbor_cells = np.mod(cells[:, None, :] + offsets[None, :, :], n_cells)
+  neighbor_cell_ids = np.sum(neighbor_cells * strides, axis=-1).ravel()
+  cell_senders = np.repeat(np.arange(positions.shape[0]), len(offsets))
+
+  # Pairs each particle with all particles in each adjacent cell.
+  counts = cell_counts[neighbor_cell_ids]
+  senders = np.repeat(cell_senders, counts)
+  index_in_cell = (np.arange(np.sum(counts)) -
+                   np.repeat(np.cumsum(counts) - counts, counts))
+  receivers = order[
+      np.repeat(cell_starts[neighbor_cell_ids], counts) + index_in_cell]
+  return senders, receivers
+
+
 def make_graph_from_static_structure(positions, types, box, edge_threshold):
   """Returns graph representing the static structure of the glass.
 
@@ -51,6 +117,10 @@ def make_graph_from_static_structure(positions, types, box, edge_threshold):
   Two particles at a distance less than the threshold are connected by an edge.
   The relative distance vector is stored as an edge feature.
 
+  Neighbors are found using a cell list, so the cost grows linearly with the
+  number of particles. The edges are the same as comparing all pairs of
+  particles, sorted by sender and then by receiver.
+
   Args:
     positions: particle positions with shape [n_particles, 3].
     types: particle types with shape [n_particles].
@@ -58,21 +128,21 @@ def make_graph_from_static_structure(positions, types, box, edge_threshold):
     edge_threshold: particles at distance less than threshold are connected by
       an edge.
   """
-  # Calculate pairwise relative distances between particles: shape [n, n, 3].
-  cross_positions = positions[None, :, :] - positions[:, None, :]
-  # Enforces periodic boundary conditions.
-  box_ = box[None, None, :]
-  cross_positions += (cross_positions < -box_ / 2.).astype(np.float32) * box_
-  cross_positions -= (cross_positions > box_ / 2.).astype(np.float32) * box_
-  # Calculates adjacency matrix in a sparse format (indices), based on the given
-  # distances and threshold.
+  senders, receivers = _get_neighbor_candidates(positions, box, edge_threshold)
+  cross_positions = _get_periodic_displacements(
+      positions, senders, receivers, box)
   distances = np.linalg.norm(cross_positions, axis=-1)
-  indices = np.where(distances < edge_threshold)
+  mask = distances < edge_threshold
+
+  # Removes duplicate candidates and sorts the pairs.
+  n_particles = positions.shape[0]
+  pair_ids = np.unique(senders[mask] * n_particles + receivers[mask])
+  senders = pair_ids // n_particles
+  receivers = pair_ids % n_particles
+
   # Defines graph.
   nodes = types[:, None]
-  senders = indices[0]
-  receivers = indices[1]
-  edges = cross_positions[indices]
+  edges = _get_periodic_displacements(positions, senders, receivers, box)
 
   return jraph.pad_with_graphs(jraph.GraphsTuple(
       nodes=nodes.astype(np.float32),
@@ -100,13 +170,42 @@ def get_targets(initial_positions, trajectory_target_positions):
   return targets.astype(np.float32)
 
 
-def load_data(file_pattern, time_index, max_files_to_load=None):
+def _load_or_make_graph(filename, data, edge_threshold, graph_cache_dir):
+  """Returns the graph of a static structure, cached in graph_cache_dir."""
+  if graph_cache_dir:
+    # Train and test files share their basenames, so the full path is hashed.
+    cache_filename = os.path.join(
+        graph_cache_dir, '{}_{}_threshold{}.pickle'.format(
+            os.path.basename(filename),
+            hashlib.sha1(filename.encode('utf-8')).hexdigest()[:16],
+            edge_threshold))
+    if tf.io.gfile.exists(cache_filename):
+      with tf.io.gfile.GFile(cache_filename, 'rb') as f:
+        return pickle.load(f)
+  graph = make_graph_from_static_structure(
+      data['positions'].astype(np.float32),
+      data['types'].astype(np.int32),
+      data['box'].astype(np.float32),
+      edge_threshold=edge_threshold)
+  if graph_cache_dir:
+    tf.io.gfile.makedirs(graph_cache_dir)
+    with tf.io.gfile.GFile(cache_filename, 'wb') as f:
+      pickle.dump(graph, f)
+  return graph
+
+
+def load_data(file_pattern, time_index, max_files_to_load=None,
+              edge_threshold=2.0, graph_cache_dir=None):
   """Returns a graphs and targets of the training or test dataset.
 
   Args:
     file_pattern: pattern matching the files with the simulation data.
     time_index: the time index of the targets.
     max_files_to_load: the maximum number of files to load.
+    edge_threshold: particles at distance less than threshold are connected by
+      an edge.
+    graph_cache_dir: if set, the graph of each file is stored in this directory
+      and loaded from it in later runs instead of being recomputed.
   """
   filenames = tf.io.gfile.glob(file_pattern)
   if max_files_to_load:
@@ -124,11 +223,7 @@ def load_data(file_pattern, time_index, max_files_to_load=None):
     targets = np.concatenate(
         [targets, np.zeros((1,), dtype=np.float32)], axis=-1)
     graphs_and_targets.append(
-        (make_graph_from_static_structure(
-            data['positions'].astype(np.float32),
-            data['types'].astype(np.int32),
-            data['box'].astype(np.float32),
-            edge_threshold=2.0),
+        (_load_or_make_graph(filename, data, edge_threshold, graph_cache_dir),
          targets,
          mask))
   return graphs_and_targets
@@ -209,7 +304,8 @@ def train_model(train_file_pattern,
                 learning_rate=1e-4,
                 grad_clip=1.0,
                 measurement_store_interval=1000,
-                checkpoint_path=None):
+                checkpoint_path=None,
+                graph_cache_dir=None):
   """Trains GraphModel using tensorflow.
 
   Args:
@@ -224,6 +320,8 @@ def train_model(train_file_pattern,
     measurement_store_interval: number of steps between storing objective values
       (loss and correlation).
     checkpoint_path: ignored by this implementation.
+    graph_cache_dir: if set, the graphs are stored in this directory and
+      loaded from it in later runs instead of being recomputed.
   """
   if checkpoint_path:
     logging.warning('The checkpoint_path argument is ignored.')
@@ -232,7 +330,8 @@ def train_model(train_file_pattern,
   # Loads train and test dataset.
   dataset_kwargs = dict(
       time_index=time_index,
-      max_files_to_load=max_files_to_load)
+      max_files_to_load=max_files_to_load,
+      graph_cache_dir=graph_cache_dir)
   logging.info('Load training data')
   training_data = load_data(train_file_pattern, **dataset_kwargs)
   logging.info('Load test data')
@@ -0,0 +1,110 @@
+# Copyright 2019 Deepmind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for train_using_jax."""
+
+import os
+import pickle
+import tempfile
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+
+from glassy_dynamics import train_using_jax
+
+
+def _load_test_data():
+  filename = os.path.join(os.path.dirname(__file__), 'testdata',
+                          'test_small.pickle')
+  with open(filename, 'rb') as f:
+    return filename, pickle.load(f)
+
+
+def _assert_graphs_equal(graph, expected_graph):
+  for field in expected_graph._fields:
+    np.testing.assert_array_equal(getattr(graph, field),
+                                  getattr(expected_graph, field))
+
+
+class TrainUsingJaxTest(parameterized.TestCase):
+
+  @parameterized.named_parameters(('many_cells', [8.0, 8.0, 8.0]),
+                                  ('few_cells', [3.0, 5.0, 8.0]),
+                                  ('one_cell', [3.5, 3.5, 3.5]))
+  def test_make_graph_from_static_structure_matches_all_pairs(self, box):
+    """Tests the cell list against comparing all pairs of particles."""
+    edge_threshold = 2.
+    box = np.array(box, dtype=np.float32)
+    positions = (np.random.RandomState(0).uniform(size=(300, 3)) *
+                 box).astype(np.float32)
+    cross_positions = positions[np.newaxis, :, :] - positions[:, np.newaxis, :]
+    cross_positions += (cross_positions < -box / 2.) * box
+    cross_positions -= (cross_positions > box / 2.) * box
+    senders, receivers = np.where(
+        np.linalg.norm(cross_positions, axis=-1) < edge_threshold)
+
+    graph = train_using_jax.make_graph_from_static_structure(
+        positions, np.zeros([300], dtype=np.int32), box, edge_threshold)
+    n_edge = graph.n_edge[0]
+    self.assertEqual(graph.n_node[0], 300)
+    np.testing.assert_equal(graph.senders[:n_edge], senders)
+    np.testing.assert_equal(graph.receivers[:n_edge], receivers)
+    np.testing.assert_almost_equal(graph.edges[:n_edge],
+                                   cross_positions[senders, receivers])
+
+  def test_graph_cache_round_trip(self):
+    """Tests that cached graphs are read back instead of being recomputed."""
+    filename, data = _load_test_data()
+    graph_cache_dir = self.enter_context(tempfile.TemporaryDirectory())
+    # Closer particles give a graph with more edges.
+    moved_data = dict(data, positions=data['positions'] * 0.5)
+
+    expected_graph = train_using_jax._load_or_make_graph(  # pylint: disable=protected-access
+        filename, data, 5., graph_cache_dir)
+    self.assertLen(os.listdir(graph_cache_dir), 1)
+    graph = train_using_jax._load_or_make_graph(  # pylint: disable=protected-access
+        filename, moved_data, 5., graph_cache_dir)
+    _assert_graphs_equal(graph, expected_graph)
+
+    recomputed_graph = train_using_jax._load_or_make_graph(  # pylint: disable=protected-access
+        filename, moved_data, 5., None)
+    self.assertGreater(recomputed_graph.n_edge[0], expected_graph.n_edge[0])
+    # Another threshold has a cache file of its own.
+    graph = train_using_jax._load_or_make_graph(  # pylint: disable=protected-access
+        filename, moved_data, 4., graph_cache_dir)
+    self.assertLen(os.listdir(graph_cache_dir), 2)
+    _assert_graphs_equal(
+        graph, train_using_jax.make_graph_from_static_structure(
+            moved_data['positions'].astype(np.float32),
+            moved_data['types'].astype(np.int32),
+            moved_data['box'].astype(np.float32), 4.))
+
+  def test_load_data_with_graph_cache(self):
+    filename, _ = _load_test_data()
+    graph_cache_dir = self.enter_context(tempfile.TemporaryDirectory())
+    expected = train_using_jax.load_data(filename, 0)
+    for _ in range(2):
+      graphs_and_targets = train_using_jax.load_data(
+          filename, 0, graph_cache_dir=graph_cache_dir)
+      self.assertLen(graphs_and_targets, 1)
+      (graph, targets, mask), = graphs_and_targets
+      (expected_graph, expected_targets, expected_mask), = expected
+      _assert_graphs_equal(graph, expected_graph)
+      np.testing.assert_array_equal(targets, expected_targets)
+      np.testing.assert_array_equal(mask, expected_mask)
+
+
+if __name__ == '__main__':
+  absltest.main()
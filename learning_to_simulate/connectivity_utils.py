@@ -117,3 +117,159 @@ def compute_connectivity_for_batch_pyfunc(
   n_edge.set_shape(n_node.get_shape())
   return senders, receivers, n_edge
 
+
+def _neighbour_cell_offsets(num_dims):
+  """Returns all offsets in {-1, 0, 1}^num_dims, shape [3**num_dims, num_dims]."""
+  return np.stack(
+      np.meshgrid(*[[-1, 0, 1]] * num_dims, indexing="ij"),
+      axis=-1).reshape([-1, num_dims]).astype(np.int64)
+
+
+def _get_graph_ids(n_node):
+  """Returns the index of the graph of each node, shape [num_nodes_in_batch]."""
+  row_splits = tf.concat(
+      [tf.zeros([1], dtype=tf.int64), tf.cumsum(tf.cast(n_node, tf.int64))],
+      axis=0)
+  return tf.ragged.row_splits_to_segment_ids(row_splits)
+
+
+def _count_edges_per_graph(senders, graph_ids, n_node):
+  return tf.math.unsorted_segment_sum(
+      tf.ones_like(senders), tf.gather(graph_ids, senders),
+      tf.shape(n_node)[0])
+
+
+def compute_connectivity_for_batch_cell_list(
+    positions, n_node, radius, add_self_edges=True,
+    max_particles_per_cell=None):
+  """Radius connectivity for a batch of graphs, using a uniform cell list.
+
+  Equivalent to `compute_connectivity_for_batch_pyfunc`, but implemented with
+  TensorFlow ops, so it does not need to go through Python. Particles are
+  binned into a grid of cells of size `radius`, sorted by cell, and each
+  particle is only compared against the particles in its own and the
+  neighbouring cells, found with binary searches over the sorted cells.
+
+  The edges are the same as for the KDTree implementation, ordered by sender.
+
+  Args:
+    positions: Positions of nodes in the batch of graphs. Shape:
+      [num_nodes_in_batch, num_dims], with `num_dims` known statically.
+    n_node: Number of nodes for each graph in the batch. Shape:
+      [num_graphs in batch].
+    radius: Radius of connectivity.
+    add_self_edges: Whether to include self edges or not.
+    max_particles_per_cell: Optional static capacity of the per-cell neighbour
+      buffers. If set, an error is raised when any cell holds more particles.
+      If None, the candidates are enumerated exactly, without padding.
+
+  Returns:
+    senders indices [num_edges_in_batch]
+    receiver indices [num_edges_in_batch]
+    number of edges per graph [num_graphs_in_batch]
+  """
+  num_dims = positions.get_shape().as_list()[-1]
+  # Use double precision, matching the KDTree distances.
+  positions = tf.cast(positions, tf.float64)
+  radius = tf.cast(radius, tf.float64)
+  num_nodes = tf.shape(positions, out_type=tf.int64)[0]
+  graph_ids = _get_graph_ids(n_node)
+
+  # Integer cell coordinates, with a padding cell on each side so that the
+  # neighbouring cells of every particle are inside the grid.
+  cells = tf.cast(
+      tf.floor((positions - tf.reduce_min(positions, axis=0)) / radius),
+      tf.int64) + 1
+  grid_shape = tf.reduce_max(cells, axis=0) + 2
+  strides = tf.math.cumprod(grid_shape, exclusive=True)
+  num_cells = tf.reduce_prod(grid_shape)
+  cell_keys = graph_ids * num_cells + tf.reduce_sum(cells * strides, axis=-1)
+
+  # Sort the particles by cell.
+  order = tf.cast(tf.argsort(cell_keys, stable=True), tf.int64)
+  sorted_cell_keys = tf.gather(cell_keys, order)
+
+  # Range of sorted particles in each neighbouring cell of each particle.
+  neighbour_offsets = tf.reduce_sum(
+      _neighbour_cell_offsets(num_dims) * strides[tf.newaxis], axis=-1)
+  query_keys = tf.reshape(
+      cell_keys[:, tf.newaxis] + neighbour_offsets[tf.newaxis], [1, -1])
+  starts = tf.searchsorted(
+      sorted_cell_keys[tf.newaxis], query_keys, side="left",
+      out_type=tf.int64)
+  ends = tf.searchsorted(
+      sorted_cell_keys[tf.newaxis], query_keys, side="right",
+      out_type=tf.int64)
+  starts = tf.reshape(starts, [num_nodes, -1])
+  counts = tf.reshape(ends, [num_nodes, -1]) - starts
+
+  if max_particles_per_cell is None:
+    # Enumerate exactly the particles in the neighbouring cells.
+    flat_counts = tf.reshape(counts, [-1])
+    candidate_rows = tf.ragged.row_splits_to_segment_ids(tf.concat(
+        [tf.zeros([1], dtype=tf.int64), tf.cumsum(flat_counts)], axis=0))
+    row_starts = tf.cumsum(flat_counts, exclusive=True)
+    candidates = (tf.gather(tf.reshape(starts, [-1]), candidate_rows) +
+                  tf.range(tf.shape(candidate_rows, out_type=tf.int64)[0]) -
+                  tf.gather(row_starts, candidate_rows))
+    senders = candidate_rows // tf.shape(counts, out_type=tf.int64)[1]
+  else:
+    # Fixed-capacity buffer of candidate neighbours for each particle and cell,
+    # giving static intermediate shapes.
+    capacity = tf.constant(max_particles_per_cell, dtype=tf.int64)
+    assert_op = tf.debugging.assert_less_equal(
+        tf.reduce_max(counts), capacity,
+        message="Cell occupancy exceeds `max_particles_per_cell`.")
+    with tf.control_dependencies([assert_op]):
+      slots = tf.range(capacity, dtype=tf.int64)
+    candidates = starts[..., tf.newaxis] + slots
+    is_candidate = slots < counts[..., tf.newaxis]
+    senders = tf.broadcast_to(
+        tf.range(num_nodes)[:, tf.newaxis, tf.newaxis], tf.shape(candidates))
+    senders = tf.boolean_mask(senders, is_candidate)
+    candidates = tf.boolean_mask(candidates, is_candidate)
+  receivers = tf.gather(order, candidates)
+
+  # Keep the candidates within the radius.
+  distances = tf.norm(
+      tf.gather(positions, senders) - tf.gather(positions, receivers), axis=-1)
+  mask = distances <= radius
+  if not add_self_edges:
+    mask = tf.logical_and(mask, tf.not_equal(senders, receivers))
+  senders = tf.boolean_mask(senders, mask)
+  receivers = tf.boolean_mask(receivers, mask)
+
+  n_edge = _count_edges_per_graph(senders, graph_ids, n_node)
+  return (tf.cast(senders, tf.int32), tf.cast(receivers, tf.int32),
+          tf.cast(n_edge, tf.int32))
+
+
+def filter_connectivity_by_radius(positions, senders, receivers, n_node,
+                                  radius):
+  """Keeps the edges of a (larger radius) neighbour list within `radius`.
+
+  Used to reuse a neighbour list computed with `radius + skin` (a Verlet list)
+  for as long as no particle has moved more than `skin / 2`.
+
+  Args:
+    positions: Positions of nodes in the batch of graphs. Shape:
+      [num_nodes_in_batch, num_dims].
+    senders: Sender indices of the neighbour list [num_candidate_edges].
+    receivers: Receiver indices of the neighbour list [num_candidate_edges].
+    n_node: Number of nodes for each graph in the batch. Shape:
+      [num_graphs in batch].
+    radius: Radius of connectivity.
+
+  Returns:
+    senders indices [num_edges_in_batch]
+    receiver indices [num_edges_in_batch]
+    number of edges per graph [num_graphs_in_batch]
+  """
+  positions = tf.cast(positions, tf.float64)
+  distances = tf.norm(
+      tf.gather(positions, senders) - tf.gather(positions, receivers), axis=-1)
+  mask = distances <= tf.cast(radius, tf.float64)
+  senders = tf.boolean_mask(senders, mask)
+  receivers = tf.boolean_mask(receivers, mask)
+  n_edge = _count_edges_per_graph(senders, _get_graph_ids(n_node), n_node)
+  return senders, receivers, tf.cast(n_edge, tf.int32)
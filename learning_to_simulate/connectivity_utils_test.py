@@ -0,0 +1,60 @@
+# pylint: disable=g-bad-file-header
+# Copyright 2020 DeepMind Technologies Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the cell list connectivity against the KDTree connectivity."""
+
+from absl.testing import parameterized
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from learning_to_simulate import connectivity_utils
+
+
+def _edge_set(senders, receivers):
+  return sorted(zip(senders.tolist(), receivers.tolist()))
+
+
+class CellListConnectivityTest(tf.test.TestCase, parameterized.TestCase):
+
+  @parameterized.parameters(
+      (2, True, None), (2, False, None), (3, True, None), (2, True, 64))
+  def test_matches_kdtree(self, num_dims, add_self_edges,
+                          max_particles_per_cell):
+    rng = np.random.RandomState(0)
+    n_node = np.array([20, 1, 35], np.int32)
+    # Include negative positions and duplicated particles.
+    positions = rng.uniform(-0.3, 0.7, size=(n_node.sum(), num_dims))
+    positions[5] = positions[4]
+    radius = 0.15
+
+    expected_senders, expected_receivers, expected_n_edge = (
+        connectivity_utils._compute_connectivity_for_batch(  # pylint: disable=protected-access
+            positions, n_node, radius, add_self_edges))
+    senders, receivers, n_edge = self.evaluate(
+        connectivity_utils.compute_connectivity_for_batch_cell_list(
+            tf.constant(positions, tf.float32), tf.constant(n_node), radius,
+            add_self_edges=add_self_edges,
+            max_particles_per_cell=max_particles_per_cell))
+
+    self.assertAllEqual(n_edge, expected_n_edge)
+    self.assertEqual(_edge_set(senders, receivers),
+                     _edge_set(expected_senders, expected_receivers))
+    # Edges never cross graphs.
+    graph_ids = np.repeat(np.arange(len(n_node)), n_node)
+    self.assertAllEqual(graph_ids[senders], graph_ids[receivers])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -34,6 +34,12 @@ from learning_to_simulate import graph_network
 STD_EPSILON = 1e-8
 
 
+_CONNECTIVITY_FNS = {
+    "kdtree": connectivity_utils.compute_connectivity_for_batch_pyfunc,
+    "cell_list": connectivity_utils.compute_connectivity_for_batch_cell_list,
+}
+
+
 class LearnedSimulator(snt.AbstractModule):
   """Learned simulator from https://arxiv.org/pdf/2002.09405.pdf."""
 
@@ -46,6 +52,7 @@ class LearnedSimulator(snt.AbstractModule):
       normalization_stats,
       num_particle_types,
       particle_type_embedding_size,
+      connectivity_method="kdtree",
       name="LearnedSimulator"):
     """Inits the model.
 
@@ -62,12 +69,20 @@ class LearnedSimulator(snt.AbstractModule):
         fields, matching the dimensionality of the problem.
       num_particle_types: Number of different particle types.
       particle_type_embedding_size: Embedding size for the particle type.
+      connectivity_method: How to compute the radius connectivity, either
+        "kdtree" (a KDTree in a `tf.py_function`) or "cell_list" (a cell list
+        with TensorFlow ops). Both give the same edges.
       name: Name of the Sonnet module.
 
     """
     super().__init__(name=name)
 
+    if connectivity_method not in _CONNECTIVITY_FNS:
+      raise ValueError(
+          f"Unknown connectivity_method: {connectivity_method}. Expected one "
+          f"of {sorted(_CONNECTIVITY_FNS)}.")
     self._connectivity_radius = connectivity_radius
+    self._connectivity_fn = _CONNECTIVITY_FNS[connectivity_method]
     self._num_particle_types = num_particle_types
     self._boundaries = boundaries
     self._normalization_stats = normalization_stats
@@ -81,8 +96,12 @@ class LearnedSimulator(snt.AbstractModule):
             [self._num_particle_types, particle_type_embedding_size],
             trainable=True, use_resource=True)
 
+  @property
+  def connectivity_radius(self):
+    return self._connectivity_radius
+
   def _build(self, position_sequence, n_particles_per_example,
-             global_context=None, particle_types=None):
+             global_context=None, particle_types=None, connectivity=None):
     """Produces a model step, outputting the next position for each particle.
 
     Args:
@@ -95,6 +114,9 @@ class LearnedSimulator(snt.AbstractModule):
       particle_types: Integer tensor of shape [num_particles_in_batch] with
         the integer types of the particles, from 0 to `num_particle_types - 1`.
         If None, we assume all particles are the same type.
+      connectivity: Optional tuple of (senders, receivers, n_edge) with the
+        radius connectivity of the most recent positions, e.g. from a reused
+        neighbour list. If None, it is computed from the positions.
 
     Returns:
       Next position with shape [num_particles_in_batch, num_dimensions] for one
@@ -102,7 +124,7 @@ class LearnedSimulator(snt.AbstractModule):
     """
     input_graphs_tuple = self._encoder_preprocessor(
         position_sequence, n_particles_per_example, global_context,
-        particle_types)
+        particle_types, connectivity)
 
     normalized_acceleration = self._graph_network(input_graphs_tuple)
 
@@ -112,15 +134,17 @@ class LearnedSimulator(snt.AbstractModule):
     return next_position
 
   def _encoder_preprocessor(
-      self, position_sequence, n_node, global_context, particle_types):
+      self, position_sequence, n_node, global_context, particle_types,
+      connectivity=None):
     # Extract important features from the position_sequence.
     most_recent_position = position_sequence[:, -1]
     velocity_sequence = time_diff(position_sequence)  # Finite-difference.
 
     # Get connectivity of the graph.
-    (senders, receivers, n_edge
-     ) = connectivity_utils.compute_connectivity_for_batch_pyfunc(
-         most_recent_position, n_node, self._connectivity_radius)
+    if connectivity is None:
+      connectivity = self._connectivity_fn(
+          most_recent_position, n_node, self._connectivity_radius)
+    senders, receivers, n_edge = connectivity
 
     # Collect node features.
     node_features = []
@@ -43,6 +43,7 @@ from tensorflow.compat.v1 import estimator as tf_estimator
 import tree
 
 
+from learning_to_simulate import connectivity_utils
 from learning_to_simulate import learned_simulator
 from learning_to_simulate import noise_utils
 from learning_to_simulate import reading_utils
@@ -62,6 +63,13 @@ flags.DEFINE_string('model_path', None,
                           'Defaults to a temporary directory.'))
 flags.DEFINE_string('output_path', None,
                     help='The path for saving outputs (e.g. rollouts).')
+flags.DEFINE_enum('connectivity_method', 'kdtree', ['kdtree', 'cell_list'],
+                  help='How to compute the radius connectivity of the graph.')
+flags.DEFINE_float('verlet_skin', 0.,
+                   help=('Skin added to the connectivity radius of the '
+                         'neighbour list reused between rollout steps. The '
+                         'list is rebuilt once a particle has moved more than '
+                         'half the skin. 0 rebuilds it at every step.'))
 
 
 FLAGS = flags.FLAGS
@@ -216,12 +224,36 @@ def get_input_fn(data_path, batch_size, mode, split):
   return input_fn
 
 
-def rollout(simulator, features, num_steps):
-  """Rolls out a trajectory by applying the model in sequence."""
+def rollout(simulator, features, num_steps, verlet_skin=0.):
+  """Rolls out a trajectory by applying the model in sequence.
+
+  Args:
+    simulator: The `LearnedSimulator`.
+    features: Features of the trajectory to roll out.
+    num_steps: Number of steps to roll out.
+    verlet_skin: If positive, the connectivity is taken from a neighbour list
+      (a Verlet list) of radius `connectivity_radius + verlet_skin`, which is
+      only rebuilt once a particle has moved more than `verlet_skin / 2` since
+      the list was built. This gives the same edges as rebuilding the
+      connectivity at every step.
+
+  Returns:
+    Dictionary with the initial positions, predicted and ground truth rollouts
+    and particle types.
+  """
   initial_positions = features['position'][:, 0:INPUT_SEQUENCE_LENGTH]
   ground_truth_positions = features['position'][:, INPUT_SEQUENCE_LENGTH:]
   global_context = features.get('step_context')
-  def step_fn(step, current_positions, predictions):
+  n_particles_per_example = features['n_particles_per_example']
+
+  def build_neighbour_list(positions):
+    senders, receivers, _ = (
+        connectivity_utils.compute_connectivity_for_batch_cell_list(
+            positions, n_particles_per_example,
+            simulator.connectivity_radius + verlet_skin))
+    return positions, senders, receivers
+
+  def step_fn(step, current_positions, predictions, neighbour_list):
 
     if global_context is None:
       global_context_step = None
@@ -229,11 +261,29 @@ def rollout(simulator, features, num_steps):
       global_context_step = global_context[
           step + INPUT_SEQUENCE_LENGTH - 1][tf.newaxis]
 
+    if verlet_skin > 0:
+      # Rebuild the neighbour list once a particle may have entered the radius
+      # of another one that is not in the list.
+      most_recent_position = current_positions[:, -1]
+      reference_positions = neighbour_list[0]
+      max_displacement = tf.reduce_max(
+          tf.norm(most_recent_position - reference_positions, axis=-1))
+      neighbour_list = tf.cond(
+          max_displacement > verlet_skin / 2,
+          lambda: build_neighbour_list(most_recent_position),
+          lambda: neighbour_list)
+      connectivity = connectivity_utils.filter_connectivity_by_radius(
+          most_recent_position, neighbour_list[1], neighbour_list[2],
+          n_particles_per_example, simulator.connectivity_radius)
+    else:
+      connectivity = None
+
     next_position = simulator(
         current_positions,
-        n_particles_per_example=features['n_particles_per_example'],
+        n_particles_per_example=n_particles_per_example,
         particle_types=features['particle_type'],
-        global_context=global_context_step)
+        global_context=global_context_step,
+        connectivity=connectivity)
 
     # Update kinematic particles from prescribed trajectory.
     kinematic_mask = get_kinematic_mask(features['particle_type'])
@@ -247,13 +297,25 @@ def rollout(simulator, features, num_steps):
     next_positions = tf.concat([current_positions[:, 1:],
                                 next_position[:, tf.newaxis]], axis=1)
 
-    return (step + 1, next_positions, updated_predictions)
+    return (step + 1, next_positions, updated_predictions, neighbour_list)
 
   predictions = tf.TensorArray(size=num_steps, dtype=tf.float32)
-  _, _, predictions = tf.while_loop(
-      cond=lambda step, state, prediction: tf.less(step, num_steps),
+  if verlet_skin > 0:
+    neighbour_list = build_neighbour_list(initial_positions[:, -1])
+    neighbour_list_invariants = (
+        initial_positions[:, -1].get_shape(), tf.TensorShape([None]),
+        tf.TensorShape([None]))
+  else:
+    # Unused placeholder, so that the loop variables have a fixed structure.
+    neighbour_list = tf.zeros([0])
+    neighbour_list_invariants = tf.TensorShape([0])
+  _, _, predictions, _ = tf.while_loop(
+      cond=lambda step, state, prediction, neighbours: tf.less(step, num_steps),
       body=step_fn,
-      loop_vars=(0, initial_positions, predictions),
+      loop_vars=(0, initial_positions, predictions, neighbour_list),
+      shape_invariants=(
+          tf.TensorShape([]), initial_positions.get_shape(),
+          tf.TensorShape(None), neighbour_list_invariants),
       back_prop=False,
       parallel_iterations=1)
 
@@ -273,7 +335,8 @@ def _combine_std(std_x, std_y):
   return np.sqrt(std_x**2 + std_y**2)
 
 
-def _get_simulator(model_kwargs, metadata, acc_noise_std, vel_noise_std):
+def _get_simulator(model_kwargs, metadata, acc_noise_std, vel_noise_std,
+                   connectivity_method='kdtree'):
   """Instantiates the simulator."""
   # Cast statistics to numpy so they are arrays when entering the model.
   cast = lambda v: np.array(v, dtype=np.float32)
@@ -297,7 +360,8 @@ def _get_simulator(model_kwargs, metadata, acc_noise_std, vel_noise_std):
       boundaries=metadata['bounds'],
       num_particle_types=NUM_PARTICLE_TYPES,
       normalization_stats=normalization_stats,
-      particle_type_embedding_size=16)
+      particle_type_embedding_size=16,
+      connectivity_method=connectivity_method)
   return simulator
 
 
@@ -306,7 +370,8 @@ def get_one_step_estimator_fn(data_path,
                               latent_size=128,
                               hidden_size=128,
                               hidden_layers=2,
-                              message_passing_steps=10):
+                              message_passing_steps=10,
+                              connectivity_method='kdtree'):
   """Gets one step model for training simulation."""
   metadata = _read_metadata(data_path)
 
@@ -320,7 +385,8 @@ def get_one_step_estimator_fn(data_path,
     target_next_position = labels
     simulator = _get_simulator(model_kwargs, metadata,
                                vel_noise_std=noise_std,
-                               acc_noise_std=noise_std)
+                               acc_noise_std=noise_std,
+                               connectivity_method=connectivity_method)
     # Sample the noise to add to the inputs to the model during training.
     sampled_noise = noise_utils.get_random_walk_noise_for_position_sequence(
         features['position'], noise_std_last_step=noise_std)
@@ -387,7 +453,9 @@ def get_rollout_estimator_fn(data_path,
                              latent_size=128,
                              hidden_size=128,
                              hidden_layers=2,
-                             message_passing_steps=10):
+                             message_passing_steps=10,
+                             connectivity_method='kdtree',
+                             verlet_skin=0.):
   """Gets the model function for tf.estimator.Estimator."""
   metadata = _read_metadata(data_path)
 
@@ -401,10 +469,12 @@ def get_rollout_estimator_fn(data_path,
     del labels  # Labels to conform to estimator spec.
     simulator = _get_simulator(model_kwargs, metadata,
                                acc_noise_std=noise_std,
-                               vel_noise_std=noise_std)
+                               vel_noise_std=noise_std,
+                               connectivity_method=connectivity_method)
 
     num_steps = metadata['sequence_length'] - INPUT_SEQUENCE_LENGTH
-    rollout_op = rollout(simulator, features, num_steps=num_steps)
+    rollout_op = rollout(simulator, features, num_steps=num_steps,
+                         verlet_skin=verlet_skin)
     squared_error = (rollout_op['predicted_rollout'] -
                      rollout_op['ground_truth_rollout']) ** 2
     loss = tf.reduce_mean(squared_error)
@@ -434,7 +504,9 @@ def main(_):
 
   if FLAGS.mode in ['train', 'eval']:
     estimator = tf_estimator.Estimator(
-        get_one_step_estimator_fn(FLAGS.data_path, FLAGS.noise_std),
+        get_one_step_estimator_fn(
+            FLAGS.data_path, FLAGS.noise_std,
+            connectivity_method=FLAGS.connectivity_method),
         model_dir=FLAGS.model_path)
     if FLAGS.mode == 'train':
       # Train all the way through.
@@ -453,7 +525,10 @@ def main(_):
     if not FLAGS.output_path:
       raise ValueError('A rollout path must be provided.')
     rollout_estimator = tf_estimator.Estimator(
-        get_rollout_estimator_fn(FLAGS.data_path, FLAGS.noise_std),
+        get_rollout_estimator_fn(
+            FLAGS.data_path, FLAGS.noise_std,
+            connectivity_method=FLAGS.connectivity_method,
+            verlet_skin=FLAGS.verlet_skin),
         model_dir=FLAGS.model_path)
 
     # Iterate through rollouts saving them one by one.
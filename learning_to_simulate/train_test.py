@@ -0,0 +1,118 @@
+# pylint: disable=g-bad-file-header
+# Copyright 2020 DeepMind Technologies Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for rollouts reusing a Verlet neighbour list."""
+
+from unittest import mock
+
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from learning_to_simulate import connectivity_utils
+from learning_to_simulate import train
+
+_RADIUS = 0.1
+_SKIN = 0.05
+_JUMP_STEP = 5
+
+
+class _FakeSimulator(object):
+  """Moves particles at constant velocities and records the edges it gets.
+
+  At step `_JUMP_STEP`, particle 0 jumps next to particle 1, moving by more
+  than half the skin in a single step.
+  """
+
+  connectivity_radius = _RADIUS
+
+  def __init__(self, velocities):
+    self._velocities = velocities
+    self.edges = []
+
+  def __call__(self, position_sequence, n_particles_per_example,
+               particle_types, global_context, connectivity):
+    del particle_types, global_context
+    most_recent_position = position_sequence[:, -1]
+    if connectivity is None:
+      # Rebuild the connectivity from scratch, with the KDTree.
+      connectivity = connectivity_utils.compute_connectivity_for_batch_pyfunc(
+          most_recent_position, n_particles_per_example, _RADIUS)
+    senders, receivers, _ = connectivity
+    self.edges.append(
+        sorted(zip(senders.numpy().tolist(), receivers.numpy().tolist())))
+
+    next_position = most_recent_position.numpy() + self._velocities
+    if len(self.edges) == _JUMP_STEP:
+      next_position[0] = next_position[1] + [0.01, 0.]
+    return tf.constant(next_position)
+
+
+def _make_features(num_steps):
+  rng = np.random.RandomState(0)
+  n_particles_per_example = np.array([25, 15], np.int32)
+  num_particles = n_particles_per_example.sum()
+  positions = rng.uniform(0., 0.5, size=(num_particles, 2))
+  # Far away from all other particles until it jumps.
+  positions[0] = [2., 2.]
+  num_positions = train.INPUT_SEQUENCE_LENGTH + num_steps
+  position_sequence = np.repeat(positions[:, None], num_positions, axis=1)
+  return {
+      'position': tf.constant(position_sequence, tf.float32),
+      'n_particles_per_example': tf.constant(n_particles_per_example),
+      'particle_type': tf.constant(np.full([num_particles], 5, np.int64)),
+  }
+
+
+class RolloutTest(tf.test.TestCase):
+
+  def test_verlet_list_matches_rebuilding_connectivity(self):
+    num_steps = 12
+    features = _make_features(num_steps)
+    velocities = np.random.RandomState(1).uniform(
+        -0.004, 0.004, size=features['position'].shape[0:1] + (2,)).astype(
+            np.float32)
+
+    expected_simulator = _FakeSimulator(velocities)
+    expected_rollout = train.rollout(expected_simulator, features, num_steps)
+
+    simulator = _FakeSimulator(velocities)
+    cell_list = connectivity_utils.compute_connectivity_for_batch_cell_list
+    with mock.patch.object(
+        connectivity_utils, 'compute_connectivity_for_batch_cell_list',
+        side_effect=cell_list) as build_neighbour_list:
+      rollout = train.rollout(simulator, features, num_steps,
+                              verlet_skin=_SKIN)
+
+    self.assertAllClose(rollout['predicted_rollout'],
+                        expected_rollout['predicted_rollout'])
+    self.assertLen(simulator.edges, num_steps)
+    for step, (edges, expected_edges) in enumerate(
+        zip(simulator.edges, expected_simulator.edges)):
+      self.assertEqual(edges, expected_edges, msg=f'step {step}')
+    # The jump adds edges to particle 0, which only had its self edge.
+    def neighbours_of_first_particle(edges):
+      return [receiver for sender, receiver in edges
+              if sender == 0 and receiver != 0]
+    self.assertEmpty(neighbours_of_first_particle(
+        expected_simulator.edges[_JUMP_STEP - 1]))
+    self.assertNotEmpty(neighbours_of_first_particle(
+        expected_simulator.edges[_JUMP_STEP]))
+    # The list is rebuilt after the jump and as the particles drift, but is
+    # reused at most steps.
+    self.assertBetween(build_neighbour_list.call_count, 3, num_steps // 2)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,100 @@
+# pylint: disable=g-bad-file-header
+# Copyright 2020 DeepMind Technologies Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Adds precomputed mesh edges to a dataset.
+
+The mesh topology is fixed within a trajectory, so the unique mesh edges are
+computed once per trajectory and stored as a static `mesh_edges` field, which
+the models use instead of rebuilding the edges from `cells` at every step.
+"""
+
+import json
+import os
+
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('dataset_dir', None, 'Directory to load dataset from.')
+flags.DEFINE_string('output_dir', None, 'Directory to save dataset to.')
+flags.DEFINE_list('splits', ['train', 'valid', 'test'], 'Splits to convert.')
+
+
+def triangles_to_edges(faces):
+  """Numpy version of `common.triangles_to_edges`, without two-way edges.
+
+  Args:
+    faces: Triangles with shape [num_faces, 3].
+
+  Returns:
+    Unique undirected edges with shape [num_edges, 2], as (sender, receiver)
+    pairs in the same order as `common.triangles_to_edges`.
+  """
+  edges = np.concatenate([faces[:, 0:2],
+                          faces[:, 1:3],
+                          faces[:, [2, 0]]], axis=0)
+  edges = np.stack([edges.max(axis=1), edges.min(axis=1)], axis=1)
+  # keep the order of first occurrence, like tf.unique
+  _, first_index = np.unique(edges, axis=0, return_index=True)
+  return edges[np.sort(first_index)].astype(np.int32)
+
+
+def add_mesh_edges(meta, record):
+  """Returns a serialized trajectory with a `mesh_edges` field added."""
+  example = tf.train.Example.FromString(record)
+  cells_field = meta['features']['cells']
+  cells = np.frombuffer(
+      b''.join(example.features.feature['cells'].bytes_list.value),
+      dtype=cells_field['dtype']).reshape(-1, 3)
+  edges = triangles_to_edges(cells)
+  example.features.feature['mesh_edges'].bytes_list.value[:] = [
+      edges.tobytes()]
+  return example.SerializeToString()
+
+
+def main(argv):
+  del argv
+  with open(os.path.join(FLAGS.dataset_dir, 'meta.json'), 'r') as fp:
+    meta = json.loads(fp.read())
+  if meta['features']['cells']['type'] != 'static':
+    raise ValueError('Mesh edges can only be precomputed for static cells.')
+  meta['field_names'] = [name for name in meta['field_names']
+                         if name != 'mesh_edges'] + ['mesh_edges']
+  meta['features']['mesh_edges'] = {
+      'type': 'static', 'shape': [1, -1, 2], 'dtype': 'int32'}
+
+  tf.io.gfile.makedirs(FLAGS.output_dir)
+  with open(os.path.join(FLAGS.output_dir, 'meta.json'), 'w') as fp:
+    json.dump(meta, fp)
+  for split in FLAGS.splits:
+    path = os.path.join(FLAGS.dataset_dir, split+'.tfrecord')
+    if not tf.io.gfile.exists(path):
+      logging.info('Skipping missing split %s', split)
+      continue
+    output_path = os.path.join(FLAGS.output_dir, split+'.tfrecord')
+    num_trajectories = 0
+    with tf.io.TFRecordWriter(output_path) as writer:
+      for record in tf.io.tf_record_iterator(path):
+        writer.write(add_mesh_edges(meta, record))
+        num_trajectories += 1
+    logging.info('Wrote %d trajectories to %s', num_trajectories, output_path)
+
+
+if __name__ == '__main__':
+  flags.mark_flags_as_required(['dataset_dir', 'output_dir'])
+  app.run(main)
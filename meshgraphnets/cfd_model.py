@@ -44,7 +44,7 @@ class Model(snt.AbstractModule):
     node_features = tf.concat([inputs['velocity'], node_type], axis=-1)
 
     # construct graph edges
-    senders, receivers = common.triangles_to_edges(inputs['cells'])
+    senders, receivers = common.mesh_edges(inputs)
     relative_mesh_pos = (tf.gather(inputs['mesh_pos'], senders) -
                          tf.gather(inputs['mesh_pos'], receivers))
     edge_features = tf.concat([
@@ -45,7 +45,7 @@ class Model(snt.AbstractModule):
     node_features = tf.concat([velocity, node_type], axis=-1)
 
     # construct graph edges
-    senders, receivers = common.triangles_to_edges(inputs['cells'])
+    senders, receivers = common.mesh_edges(inputs)
     relative_world_pos = (tf.gather(inputs['world_pos'], senders) -
                           tf.gather(inputs['world_pos'], receivers))
     relative_mesh_pos = (tf.gather(inputs['mesh_pos'], senders) -
@@ -30,6 +30,12 @@ class NodeType(enum.IntEnum):
   SIZE = 9
 
 
+def _two_way_edges(senders, receivers):
+  """Creates two-way connectivity from a list of undirected edges."""
+  return (tf.concat([senders, receivers], axis=0),
+          tf.concat([receivers, senders], axis=0))
+
+
 def triangles_to_edges(faces):
   """Computes mesh edges from triangles."""
   # collect edges from triangles
@@ -46,5 +52,23 @@ def triangles_to_edges(faces):
   unique_edges = tf.bitcast(tf.unique(packed_edges)[0], tf.int32)
   senders, receivers = tf.unstack(unique_edges, axis=1)
   # create two-way connectivity
-  return (tf.concat([senders, receivers], axis=0),
-          tf.concat([receivers, senders], axis=0))
+  return _two_way_edges(senders, receivers)
+
+
+def mesh_edges(inputs):
+  """Returns two-way mesh edges, precomputed if the dataset has them.
+
+  Datasets preprocessed with `add_mesh_edges` store the unique mesh edges of
+  each trajectory in the `mesh_edges` field, in the order computed by
+  `triangles_to_edges`, so they don't need to be rebuilt from `cells`.
+
+  Args:
+    inputs: A frame of the dataset.
+
+  Returns:
+    Tuple of senders and receivers.
+  """
+  if 'mesh_edges' in inputs:
+    senders, receivers = tf.unstack(inputs['mesh_edges'], axis=1)
+    return _two_way_edges(senders, receivers)
+  return triangles_to_edges(inputs['cells'])
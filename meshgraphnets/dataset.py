@@ -89,30 +89,39 @@ def split_and_preprocess(ds, noise_field, noise_scale, noise_gamma):
 
 
 def batch_dataset(ds, batch_size):
-  """Batches input datasets."""
-  shapes = ds.output_shapes
-  types = ds.output_types
-  def renumber(buffer, frame):
-    nodes, cells = buffer
-    new_nodes, new_cells = frame
-    return nodes + new_nodes, tf.concat([cells, new_cells+nodes], axis=0)
-
-  def batch_accumulate(ds_window):
+  """Batches input datasets.
+
+  Frames of a batch are padded to a common size, then packed into a single
+  graph. The node indices in `cells` and `mesh_edges` are offset by the number
+  of nodes in the preceding frames of the batch, which is computed once per
+  batch rather than frame by frame.
+
+  Args:
+    ds: Dataset of frames.
+    batch_size: Number of frames per batch.
+
+  Returns:
+    Dataset of batched frames.
+  """
+  def add_sizes(frame):
+    return frame, {key: tf.shape(val)[0] for key, val in frame.items()}
+
+  def pack(frames, sizes):
+    node_offsets = tf.cumsum(sizes['node_type'], exclusive=True)
     out = {}
-    for key, ds_val in ds_window.items():
-      initial = tf.zeros((0, shapes[key][1]), dtype=types[key])
-      if key == 'cells':
-        # renumber node indices in cells
-        num_nodes = ds_window['node_type'].map(lambda x: tf.shape(x)[0])
-        cells = tf.data.Dataset.zip((num_nodes, ds_val))
-        initial = (tf.constant(0, tf.int32), initial)
-        _, out[key] = cells.reduce(initial, renumber)
-      else:
-        merge = lambda prev, cur: tf.concat([prev, cur], axis=0)
-        out[key] = ds_val.reduce(initial, merge)
+    for key, val in frames.items():
+      if key in ('cells', 'mesh_edges'):
+        # renumber node indices
+        val += node_offsets[:, tf.newaxis, tf.newaxis]
+      # remove padding
+      mask = tf.sequence_mask(sizes[key], maxlen=tf.shape(val)[1])
+      out[key] = tf.boolean_mask(val, mask)
     return out
 
   if batch_size > 1:
-    ds = ds.window(batch_size, drop_remainder=True)
-    ds = ds.map(batch_accumulate, num_parallel_calls=8)
+    ds = ds.map(add_sizes, num_parallel_calls=8)
+    ds = ds.padded_batch(batch_size, padded_shapes=ds.output_shapes,
+                         drop_remainder=True)
+    ds = ds.map(pack, num_parallel_calls=8)
+    ds = ds.prefetch(10)
   return ds
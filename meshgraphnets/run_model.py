@@ -42,6 +42,7 @@ flags.DEFINE_enum('rollout_split', 'valid', ['train', 'test', 'valid'],
                   'Dataset split to use for rollouts.')
 flags.DEFINE_integer('num_rollouts', 10, 'No. of rollout trajectories')
 flags.DEFINE_integer('num_training_steps', int(10e6), 'No. of training steps')
+flags.DEFINE_integer('batch_size', 1, 'No. of frames packed into each batch')
 
 PARAMETERS = {
     'cfd': dict(noise=0.02, gamma=1.0, field='velocity', history=False,
@@ -58,6 +59,7 @@ def learner(model, params):
   ds = dataset.split_and_preprocess(ds, noise_field=params['field'],
                                     noise_scale=params['noise'],
                                     noise_gamma=params['gamma'])
+  ds = dataset.batch_dataset(ds, FLAGS.batch_size)
   inputs = tf.data.make_one_shot_iterator(ds).get_next()
 
   loss_op = model.loss(inputs)
@@ -24,16 +24,14 @@ import haiku as hk
 import jax
 import jax.numpy as jnp
 import numpy as np
-import sklearn
-from sklearn import preprocessing
-import sklearn.linear_model
-import sklearn.svm
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
 from mmv import config
 from mmv.models import mm_embeddings
 from mmv.utils import checkpoint
+from mmv.utils import feature_store
+from mmv.utils import linear_probe
 from mmv.utils import ucf101_dataset
 
 
@@ -60,6 +58,12 @@ flags.DEFINE_integer('stride', 2,
                      'Stride for video frames.')
 flags.DEFINE_integer('ucf101_split', 1,
                      'Which split of ucf101 to use.')
+flags.DEFINE_string('feature_dir', '/tmp/ucf101_features',
+                    'The directory to store the extracted features in.')
+flags.DEFINE_bool('recompute_features', False,
+                  'Whether to extract features even if they are stored.')
+flags.DEFINE_list('svm_regularization', ['0.001'],
+                  'Values of the SVM regularization parameter C to evaluate.')
 
 
 FLAGS = flags.FLAGS
@@ -333,133 +337,156 @@ def forward_fn(images: jnp.ndarray,
                 is_training=is_training)['vid_repr']
 
 
-def main(argv):
-  del argv
-
-  sklearn_reg = 0.001
-  model_config = config.get_model_config(FLAGS.checkpoint_path)
-
-  forward = hk.without_apply_rng(hk.transform_with_state(forward_fn))
-  forward_apply = jax.jit(functools.partial(forward.apply,
-                                            is_training=False,
-                                            model_config=model_config))
+def preprocessing_config(split: str) -> Dict[str, Any]:
+  """Returns the flags which determine the features extracted for a split."""
+  preprocessing = dict(split=split,
+                       ucf101_split=FLAGS.ucf101_split,
+                       num_frames=FLAGS.num_frames,
+                       stride=FLAGS.stride,
+                       min_resize=FLAGS.min_resize,
+                       crop_size=FLAGS.crop_size)
+  if split == 'train':
+    preprocessing['num_train_epochs'] = FLAGS.num_train_epochs
+  else:
+    preprocessing['num_test_windows'] = FLAGS.num_test_windows
+  return preprocessing
 
-  # Get the UCF101 config.
-  dset_config = tfds.video.ucf101.Ucf101.BUILDER_CONFIGS[FLAGS.ucf101_split]
 
-  builder = ucf101_dataset.ModUcf101(
-      data_dir=FLAGS.dataset_folder,
-      config=dset_config)
-  # Create the tfrecord files (no-op if already exists)
-  dl_config = tfds.download.DownloadConfig(verify_ssl=False)
-  builder.download_and_prepare(download_config=dl_config)
-
-  # Generate the training dataset.
-  train_ds = builder.as_dataset(split='train', shuffle_files=False)
-  train_ds = train_ds.map(lambda x: process_samples(  # pylint: disable=g-long-lambda
-      x, num_frames=FLAGS.num_frames, stride=FLAGS.stride, is_training=True,
-      min_resize=FLAGS.min_resize, crop_size=FLAGS.crop_size))
-  train_ds = train_ds.batch(batch_size=FLAGS.train_batch_size)
-  if model_config['visual_backbone'] == 's3d':
-    train_ds = train_ds.map(space_to_depth_batch)
-  train_ds = train_ds.repeat(FLAGS.num_train_epochs)
-
-  # Generate the test dataset.
-  test_ds = builder.as_dataset(split='test', shuffle_files=False)
-  test_ds = test_ds.map(lambda x: process_samples(  # pylint: disable=g-long-lambda
-      x, num_frames=FLAGS.num_frames, stride=FLAGS.stride, is_training=False,
-      min_resize=FLAGS.min_resize, crop_size=FLAGS.crop_size,
-      num_windows=FLAGS.num_test_windows))
-  test_ds = test_ds.batch(batch_size=FLAGS.eval_batch_size)
-  test_ds = test_ds.map(lambda x: reshape_windows(  # pylint: disable=g-long-lambda
-      x, num_frames=FLAGS.num_frames))
-
-  if model_config['visual_backbone'] == 's3d':
-    test_ds = test_ds.map(space_to_depth_batch)
-  test_ds = test_ds.repeat(1)
-
-  pretrained_weights = checkpoint.load_checkpoint(FLAGS.checkpoint_path)
-  params = pretrained_weights['params']
-  state = pretrained_weights['state']
-
-  # Collect training samples.
+def extract_features(forward_apply, params, state, dataset, batch_size):
+  """Yields features and labels computed by the backbone on each batch."""
   audio_frames = 96
   mel_filters = 40
   num_tokens = 16
   dummy_audio = jnp.zeros(
-      shape=(FLAGS.train_batch_size, audio_frames, mel_filters, 1))
+      shape=(batch_size, audio_frames, mel_filters, 1))
   dummy_word_ids = jnp.zeros(
-      shape=(FLAGS.train_batch_size, num_tokens), dtype=jnp.int32)
+      shape=(batch_size, num_tokens), dtype=jnp.int32)
 
-  train_features = []
-  train_labels = []
-  print('Computing features on train')
-  training_examples = iter(tfds.as_numpy(train_ds))
-  for train_ex in training_examples:
+  for i, example in enumerate(tfds.as_numpy(dataset)):
     vid_representation, _ = forward_apply(params=params,
                                           state=state,
-                                          images=train_ex['video'],
+                                          images=example['video'],
                                           audio_spectrogram=dummy_audio,
                                           word_ids=dummy_word_ids)
-    train_labels.append(train_ex['label'])
-    train_features.append(vid_representation)
-    if len(train_labels) % 50 == 0:
-      print(f'Processed {len(train_labels)} examples.')
+    yield np.asarray(vid_representation), example['label']
+    if (i + 1) % 50 == 0:
+      print(f'Processed {i + 1} batches.')
 
-  train_labels = np.concatenate(train_labels, axis=0)
-  train_features = np.concatenate(train_features, axis=0)
+
+def main(argv):
+  del argv
+
+  regularization = [float(c) for c in FLAGS.svm_regularization]
+  model_config = config.get_model_config(FLAGS.checkpoint_path)
+
+  # Get the UCF101 config.
+  dset_config = tfds.video.ucf101.Ucf101.BUILDER_CONFIGS[FLAGS.ucf101_split]
+
+  builder = ucf101_dataset.ModUcf101(
+      data_dir=FLAGS.dataset_folder,
+      config=dset_config)
+  num_classes = builder.info.features['label'].num_classes
+
+  store = feature_store.FeatureStore(FLAGS.feature_dir)
+  train_key = feature_store.cache_key(FLAGS.checkpoint_path,
+                                      preprocessing_config('train'))
+  test_key = feature_store.cache_key(FLAGS.checkpoint_path,
+                                     preprocessing_config('test'))
+  train_data = None if FLAGS.recompute_features else store.load(
+      train_key, 'train')
+  test_data = None if FLAGS.recompute_features else store.load(
+      test_key, 'test')
+
+  # Only run the backbone for the features which are not stored yet.
+  if train_data is None or test_data is None:
+    forward = hk.without_apply_rng(hk.transform_with_state(forward_fn))
+    forward_apply = jax.jit(functools.partial(forward.apply,
+                                              is_training=False,
+                                              model_config=model_config))
+
+    # Create the tfrecord files (no-op if already exists)
+    dl_config = tfds.download.DownloadConfig(verify_ssl=False)
+    builder.download_and_prepare(download_config=dl_config)
+
+    pretrained_weights = checkpoint.load_checkpoint(FLAGS.checkpoint_path)
+    params = pretrained_weights['params']
+    state = pretrained_weights['state']
+
+  if train_data is None:
+    # Generate the training dataset.
+    train_ds = builder.as_dataset(split='train', shuffle_files=False)
+    train_ds = train_ds.map(lambda x: process_samples(  # pylint: disable=g-long-lambda
+        x, num_frames=FLAGS.num_frames, stride=FLAGS.stride, is_training=True,
+        min_resize=FLAGS.min_resize, crop_size=FLAGS.crop_size))
+    train_ds = train_ds.batch(batch_size=FLAGS.train_batch_size)
+    if model_config['visual_backbone'] == 's3d':
+      train_ds = train_ds.map(space_to_depth_batch)
+    train_ds = train_ds.repeat(FLAGS.num_train_epochs)
+
+    print('Computing features on train')
+    train_data = store.write(
+        train_key, 'train',
+        extract_features(forward_apply, params, state, train_ds,
+                         FLAGS.train_batch_size))
+  else:
+    print(f'Loaded train features from {FLAGS.feature_dir}/{train_key}')
+  train_features, train_labels = train_data
   print(f'Finish collecting train features of shape {train_features.shape}')
 
-  # Collect test samples.
-  dummy_audio = jnp.zeros(
-      shape=(FLAGS.eval_batch_size, audio_frames, mel_filters, 1))
-  dummy_word_ids = jnp.zeros(
-      shape=(FLAGS.eval_batch_size, num_tokens), dtype=jnp.int32)
-
-  test_features = []
-  test_labels = []
-  print('Computing features on test')
-  test_examples = iter(tfds.as_numpy(test_ds))
-  for test_ex in test_examples:
-    vid_representation_test, _ = forward_apply(params=params,
-                                               state=state,
-                                               images=test_ex['video'],
-                                               audio_spectrogram=dummy_audio,
-                                               word_ids=dummy_word_ids)
-    test_labels.append(test_ex['label'])
-    test_features.append(vid_representation_test)
-    if len(test_labels) % 50 == 0:
-      print(f'Processed {len(test_labels)} examples.')
-
-  test_features = np.concatenate(test_features, axis=0)
-  test_labels = np.concatenate(test_labels, axis=0)
+  if test_data is None:
+    # Generate the test dataset.
+    test_ds = builder.as_dataset(split='test', shuffle_files=False)
+    test_ds = test_ds.map(lambda x: process_samples(  # pylint: disable=g-long-lambda
+        x, num_frames=FLAGS.num_frames, stride=FLAGS.stride, is_training=False,
+        min_resize=FLAGS.min_resize, crop_size=FLAGS.crop_size,
+        num_windows=FLAGS.num_test_windows))
+    test_ds = test_ds.batch(batch_size=FLAGS.eval_batch_size)
+    test_ds = test_ds.map(lambda x: reshape_windows(  # pylint: disable=g-long-lambda
+        x, num_frames=FLAGS.num_frames))
+
+    if model_config['visual_backbone'] == 's3d':
+      test_ds = test_ds.map(space_to_depth_batch)
+    test_ds = test_ds.repeat(1)
+
+    print('Computing features on test')
+    test_data = store.write(
+        test_key, 'test',
+        extract_features(forward_apply, params, state, test_ds,
+                         FLAGS.eval_batch_size))
+  else:
+    print(f'Loaded test features from {FLAGS.feature_dir}/{test_key}')
+  test_features, test_labels = test_data
   print(f'Finish collecting test features of shape {test_features.shape}')
 
-  # Train classifier
-  print('Training linear classifier!')
-  classifier = sklearn.svm.LinearSVC(C=sklearn_reg)
-  scaler = preprocessing.StandardScaler().fit(train_features)
-  train_features = scaler.transform(train_features)
-  classifier.fit(train_features, train_labels.ravel())
+  # Train classifiers, for all regularization values at once.
+  print('Training linear classifiers!')
+  mean, scale = linear_probe.fit_standardization(train_features)
+  train_features = (train_features - mean) / scale
+  weights, biases = linear_probe.fit_linear_svms(
+      train_features, train_labels, num_classes, regularization)
   print('Training done !')
 
   # Evaluation.
-  test_features = scaler.transform(test_features)
+  test_features = (test_features - mean) / scale
   print('Running inference on train')
-  pred_train = classifier.decision_function(train_features)
+  pred_train = linear_probe.decision_function(train_features, weights, biases)
   print('Running inference on test')
-  pred_test = classifier.decision_function(test_features)
+  pred_test = linear_probe.decision_function(test_features, weights, biases)
   if FLAGS.num_test_windows > 1:
     pred_test = np.reshape(
-        pred_test, (test_labels.shape[0], -1, pred_test.shape[1]))
-    pred_test = pred_test.mean(axis=1)
+        pred_test,
+        (len(regularization), test_labels.shape[0], -1, pred_test.shape[-1]))
+    pred_test = pred_test.mean(axis=2)
 
   # Compute accuracies.
-  metrics = compute_accuracy_metrics(pred_train, train_labels[:, None],
-                                     prefix='train_')
-  metrics.update(
-      compute_accuracy_metrics(pred_test, test_labels[:, None], prefix='test_'))
-  print(metrics)
+  for c, c_pred_train, c_pred_test in zip(regularization, pred_train,
+                                          pred_test):
+    metrics = compute_accuracy_metrics(c_pred_train, train_labels[:, None],
+                                       prefix='train_')
+    metrics.update(
+        compute_accuracy_metrics(c_pred_test, test_labels[:, None],
+                                 prefix='test_'))
+    print(f'C={c}: {metrics}')
 
 if __name__ == '__main__':
   app.run(main)
@@ -0,0 +1,135 @@
+# Copyright 2020 DeepMind Technologies Limited.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory-mapped store for features extracted by a pre-trained model.
+
+Features are stored under a key identifying the checkpoint and preprocessing
+config that produced them. They are streamed to disk batch by batch and read
+back with memory mapping, so they never need to be held in memory as a whole.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Iterable, Mapping, Optional, Text, Tuple
+
+import numpy as np
+
+
+_METADATA_FILENAME = 'metadata.json'
+
+
+def cache_key(checkpoint_path: Text, config: Mapping[Text, Any]) -> Text:
+  """Returns a key identifying a checkpoint and a preprocessing config.
+
+  The checkpoint is identified by its path, size and modification time, so
+  overwriting it invalidates the stored features.
+
+  Args:
+    checkpoint_path: Path to the checkpoint file.
+    config: JSON-serializable preprocessing config.
+  Returns:
+    A hexadecimal string.
+  """
+  stat = os.stat(checkpoint_path)
+  description = dict(checkpoint_path=os.path.realpath(checkpoint_path),
+                     checkpoint_size=stat.st_size,
+                     checkpoint_mtime_ns=stat.st_mtime_ns,
+                     config=config)
+  description = json.dumps(description, sort_keys=True)
+  return hashlib.sha256(description.encode('utf-8')).hexdigest()[:16]
+
+
+class FeatureStore:
+  """Stores arrays of features and labels on disk, by key and split."""
+
+  def __init__(self, directory: Text):
+    self._directory = os.path.expanduser(directory)
+
+  def _path(self, key: Text, split: Text) -> Text:
+    return os.path.join(self._directory, key, split)
+
+  def load(self, key: Text,
+           split: Text) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Returns memory-mapped features and labels, or None if not stored."""
+    path = self._path(key, split)
+    try:
+      with open(os.path.join(path, _METADATA_FILENAME)) as metadata_file:
+        metadata = json.load(metadata_file)
+    except FileNotFoundError:
+      return None
+    return tuple(_open_array(path, name, metadata[name])
+                 for name in ('features', 'labels'))
+
+  def write(
+      self, key: Text, split: Text,
+      batches: Iterable[Tuple[np.ndarray, np.ndarray]],
+  ) -> Tuple[np.ndarray, np.ndarray]:
+    """Streams batches of features and labels to disk.
+
+    The split only becomes visible to `load` once all batches are written.
+
+    Args:
+      key: Key of the checkpoint and preprocessing config, see `cache_key`.
+      split: Name of the split.
+      batches: Tuples of features and labels, concatenated along their first
+        dimension. The number of rows of features and labels may differ, e.g.
+        with several features per label.
+    Returns:
+      The memory-mapped features and labels.
+    """
+    path = self._path(key, split)
+    tmp_path = path + '_tmp'
+    if os.path.exists(tmp_path):
+      shutil.rmtree(tmp_path)  # Left over by an interrupted write.
+    os.makedirs(tmp_path)
+
+    metadata = {}
+    files = {name: open(os.path.join(tmp_path, name + '.bin'), 'wb')
+             for name in ('features', 'labels')}
+    try:
+      for batch in batches:
+        for (name, f), array in zip(files.items(), batch):
+          array = np.ascontiguousarray(array)
+          spec = metadata.setdefault(name, dict(
+              dtype=array.dtype.str, shape=[0] + list(array.shape[1:])))
+          if array.dtype.str != spec['dtype'] or list(
+              array.shape[1:]) != spec['shape'][1:]:
+            raise ValueError(f'Inconsistent {name} batch of dtype '
+                             f'{array.dtype} and shape {array.shape}.')
+          spec['shape'][0] += array.shape[0]
+          f.write(array.tobytes())
+    finally:
+      for f in files.values():
+        f.close()
+    if not metadata:
+      raise ValueError(f'No batches to write for split {split}.')
+
+    with open(os.path.join(tmp_path, _METADATA_FILENAME), 'w') as metadata_file:
+      json.dump(metadata, metadata_file)
+    if os.path.exists(path):
+      shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    return self.load(key, split)
+
+
+def _open_array(path: Text, name: Text,
+                spec: Mapping[Text, Any]) -> np.ndarray:
+  shape = tuple(spec['shape'])
+  if not shape[0]:
+    return np.zeros(shape, spec['dtype'])
+  return np.memmap(os.path.join(path, name + '.bin'),
+                   dtype=spec['dtype'], mode='r', shape=shape)
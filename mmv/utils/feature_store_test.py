@@ -0,0 +1,59 @@
+# Copyright 2020 DeepMind Technologies Limited.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for feature_store."""
+
+import os
+
+from absl.testing import absltest
+
+import numpy as np
+
+from mmv.utils import feature_store
+
+
+class FeatureStoreTest(absltest.TestCase):
+
+  def test_write_and_load(self):
+    store = feature_store.FeatureStore(self.create_tempdir().full_path)
+    batches = [(np.full([6, 4], i, np.float32), np.arange(2) + 2 * i)
+               for i in range(3)]
+    self.assertIsNone(store.load('key', 'test'))
+
+    features, labels = store.write('key', 'test', iter(batches))
+    self.assertIsInstance(features, np.memmap)
+    np.testing.assert_array_equal(
+        features, np.concatenate([f for f, _ in batches]))
+    np.testing.assert_array_equal(labels, np.arange(6))
+
+    features, labels = store.load('key', 'test')
+    self.assertEqual(features.shape, (18, 4))
+    np.testing.assert_array_equal(labels, np.arange(6))
+
+  def test_cache_key(self):
+    checkpoint_path = self.create_tempfile(content='weights').full_path
+    key = feature_store.cache_key(checkpoint_path, dict(num_frames=32))
+    self.assertEqual(
+        key, feature_store.cache_key(checkpoint_path, dict(num_frames=32)))
+    self.assertNotEqual(
+        key, feature_store.cache_key(checkpoint_path, dict(num_frames=16)))
+
+    os.utime(checkpoint_path, ns=(0, 0))
+    self.assertNotEqual(
+        key, feature_store.cache_key(checkpoint_path, dict(num_frames=32)))
+
+
+if __name__ == '__main__':
+  absltest.main()
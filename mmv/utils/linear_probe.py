@@ -0,0 +1,134 @@
+# Copyright 2020 DeepMind Technologies Limited.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batched one-vs-rest linear SVMs for linear evaluation.
+
+The classifiers solve the same problem as `sklearn.svm.LinearSVC` (squared hinge
+loss, L2 penalty, penalized intercept with `intercept_scaling=1`), for all
+classes and for several values of the regularization parameter `C` at once.
+
+Each step minimizes the quadratic upper bound of the loss obtained by treating
+every example as a margin violation, i.e. it preconditions the gradient with
+the inverse of `I + 2 C X^T X`. Since `X^T X` is shared by all classifiers, its
+eigendecomposition is computed once, and steps are accelerated with Nesterov
+momentum.
+"""
+
+import functools
+from typing import Sequence, Tuple
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+
+def fit_standardization(features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  """Returns the mean and scale used to standardize features.
+
+  Matches `sklearn.preprocessing.StandardScaler`: constant features are left
+  unscaled.
+
+  Args:
+    features: Array of shape [num_examples, num_features].
+  Returns:
+    Mean and scale, both of shape [num_features].
+  """
+  features = np.asarray(features, np.float64)
+  mean = features.mean(axis=0)
+  scale = features.std(axis=0)
+  scale[scale == 0.] = 1.
+  return mean.astype(np.float32), scale.astype(np.float32)
+
+
+def _add_bias_feature(features: jnp.ndarray) -> jnp.ndarray:
+  return jnp.concatenate(
+      [features, jnp.ones(features.shape[:-1] + (1,), features.dtype)], axis=-1)
+
+
+@functools.partial(jax.jit, static_argnames=('num_classes', 'max_steps'))
+def _fit(features, labels, regularization, *, num_classes, max_steps, tol):
+  """Fits the classifiers; see `fit_linear_svms`."""
+  x = _add_bias_feature(features)
+  y = 2. * jax.nn.one_hot(labels, num_classes, dtype=x.dtype) - 1.
+  c = regularization[:, None, None]
+
+  eigenvalues, eigenvectors = jnp.linalg.eigh(x.T @ x)
+  inverse_curvature = 1. / (1. + 2. * c * eigenvalues[None, :, None])
+
+  def precondition(gradient):
+    gradient = jnp.einsum('de,cdk->cek', eigenvectors, gradient)
+    return jnp.einsum('de,cek->cdk', eigenvectors,
+                      inverse_curvature * gradient)
+
+  def gradient_fn(w):
+    violation = jnp.maximum(0., 1. - y * jnp.einsum('nd,cdk->cnk', x, w))
+    return w - 2. * c * jnp.einsum('nd,cnk->cdk', x, y * violation)
+
+  def cond_fn(loop_state):
+    step, _, _, _, change = loop_state
+    return (step < max_steps) & (change > tol)
+
+  def body_fn(loop_state):
+    step, w, z, t, _ = loop_state
+    next_w = z - precondition(gradient_fn(z))
+    next_t = (1. + jnp.sqrt(1. + 4. * t * t)) / 2.
+    # Restart the momentum of classifiers that are moving uphill.
+    restart = jnp.sum((z - next_w) * (next_w - w), axis=1, keepdims=True) > 0.
+    z = jnp.where(restart, next_w, next_w + (t - 1.) / next_t * (next_w - w))
+    change = jnp.max(jnp.abs(next_w - w)) / jnp.maximum(
+        jnp.max(jnp.abs(next_w)), 1e-12)
+    return step + 1, next_w, z, next_t, change
+
+  w = jnp.zeros((regularization.shape[0], x.shape[1], num_classes), x.dtype)
+  init_state = (jnp.array(0), w, w, jnp.array(1., x.dtype),
+                jnp.array(jnp.inf, x.dtype))
+  _, w, _, _, _ = jax.lax.while_loop(cond_fn, body_fn, init_state)
+  return w[:, :-1], w[:, -1]
+
+
+def fit_linear_svms(
+    features: np.ndarray,
+    labels: np.ndarray,
+    num_classes: int,
+    regularization: Sequence[float],
+    max_steps: int = 500,
+    tol: float = 1e-5,
+) -> Tuple[np.ndarray, np.ndarray]:
+  """Fits one-vs-rest linear SVMs for several regularization values.
+
+  Args:
+    features: Array of shape [num_examples, num_features].
+    labels: Integer array of shape [num_examples].
+    num_classes: Number of classes.
+    regularization: Values of the SVM parameter `C`.
+    max_steps: Maximum number of optimization steps.
+    tol: Optimization stops when the largest update of the weights is smaller
+      than `tol` times the largest weight.
+  Returns:
+    Weights of shape [len(regularization), num_features, num_classes] and
+    biases of shape [len(regularization), num_classes].
+  """
+  weights, biases = _fit(
+      jnp.asarray(features, jnp.float32),
+      jnp.asarray(labels, jnp.int32),
+      jnp.asarray(regularization, jnp.float32),
+      num_classes=num_classes, max_steps=max_steps, tol=tol)
+  return np.asarray(weights), np.asarray(biases)
+
+
+def decision_function(features: np.ndarray, weights: np.ndarray,
+                      biases: np.ndarray) -> np.ndarray:
+  """Returns scores of shape [num_regularization, num_examples, num_classes]."""
+  return np.einsum('nd,cdk->cnk', features, weights) + biases[:, None]
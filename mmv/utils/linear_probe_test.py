@@ -0,0 +1,57 @@
+# Copyright 2020 DeepMind Technologies Limited.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for linear_probe."""
+
+from absl.testing import absltest
+
+import numpy as np
+from sklearn import preprocessing
+import sklearn.svm
+
+from mmv.utils import linear_probe
+
+
+class LinearProbeTest(absltest.TestCase):
+
+  def test_matches_linear_svc(self):
+    rng = np.random.RandomState(0)
+    num_classes = 5
+    labels = rng.randint(num_classes, size=400)
+    features = (rng.normal(size=(num_classes, 16))[labels] +
+                rng.normal(size=(400, 16)) * 2.).astype(np.float32)
+
+    mean, scale = linear_probe.fit_standardization(features)
+    scaler = preprocessing.StandardScaler().fit(features)
+    np.testing.assert_allclose(mean, scaler.mean_, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(scale, scaler.scale_, rtol=1e-5)
+    features = (features - mean) / scale
+
+    regularization = [1e-3, 1e-2, 1.]
+    weights, biases = linear_probe.fit_linear_svms(
+        features, labels, num_classes, regularization)
+    scores = linear_probe.decision_function(features, weights, biases)
+    self.assertEqual(scores.shape, (3, 400, num_classes))
+
+    for c, c_scores in zip(regularization, scores):
+      classifier = sklearn.svm.LinearSVC(C=c, tol=1e-6, max_iter=100000)
+      classifier.fit(features, labels)
+      np.testing.assert_allclose(
+          c_scores, classifier.decision_function(features), rtol=1e-3,
+          atol=1e-3)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -14,8 +14,11 @@
 
 """Dynamic batching utilities."""
 
-from typing import Generator, Iterable, Iterator, Sequence, Tuple
+import collections
+from typing import (Dict, Generator, Iterable, Iterator, List, Optional,
+                    Sequence, Tuple)
 
+from absl import logging
 import jax.tree_util as tree
 import jraph
 import numpy as np
@@ -23,9 +26,61 @@ import numpy as np
 _NUMBER_FIELDS = ("n_node", "n_edge", "n_graph")
 
 
+class PaddingStats:
+  """Accumulates how much of the node/edge/graph budgets batches use.
+
+  Pass an instance to `dynamically_batch` to measure padding efficiency, e.g.
+  to tune the batch budgets.
+  """
+
+  def __init__(self, log_interval: Optional[int] = None):
+    """Constructor.
+
+    Args:
+      log_interval: If set, the statistics are logged every `log_interval`
+        batches.
+    """
+    self._log_interval = log_interval
+    self.reset()
+
+  def reset(self):
+    self.num_batches = 0
+    self.num_nodes = 0
+    self.num_edges = 0
+    self.num_graphs = 0
+    self.node_budget = 0
+    self.edge_budget = 0
+    self.graph_budget = 0
+
+  def update(self, graph: jraph.GraphsTuple, n_node: int, n_edge: int,
+             n_graph: int):
+    num_nodes, num_edges, num_graphs = _get_graph_size(graph)
+    self.num_batches += 1
+    self.num_nodes += int(num_nodes)
+    self.num_edges += int(num_edges)
+    self.num_graphs += int(num_graphs)
+    self.node_budget += n_node
+    self.edge_budget += n_edge
+    self.graph_budget += n_graph
+    if self._log_interval and self.num_batches % self._log_interval == 0:
+      logging.info("Padding efficiency: %s", self.as_dict())
+
+  def as_dict(self) -> Dict[str, float]:
+    """Returns the fraction of each budget used by real (unpadded) data."""
+    return {
+        "num_batches": self.num_batches,
+        "node_efficiency": self.num_nodes / max(self.node_budget, 1),
+        "edge_efficiency": self.num_edges / max(self.edge_budget, 1),
+        "graph_efficiency": self.num_graphs / max(self.graph_budget, 1),
+    }
+
+
 def dynamically_batch(graphs_tuple_iterator: Iterator[jraph.GraphsTuple],
                       n_node: int, n_edge: int,
-                      n_graph: int) -> Generator[jraph.GraphsTuple, None, None]:
+                      n_graph: int,
+                      lookahead: int = 0,
+                      padding_stats: Optional[PaddingStats] = None,
+                      ) -> Generator[jraph.GraphsTuple, None, None]:
   """Dynamically batches trees with `jraph.GraphsTuples` to `graph_batch_size`.
 
   Elements of the `graphs_tuple_iterator` will be incrementally added to a batch
@@ -36,11 +91,19 @@ def dynamically_batch(graphs_tuple_iterator: Iterator[jraph.GraphsTuple],
   have variable sized batches. This is especially the case if you have a loss
   defined on the variable shaped element (for example, nodes in a graph).
 
+  If `lookahead` is positive, graphs are instead buffered in a window of
+  `lookahead` graphs and packed with a best-fit-decreasing heuristic against
+  the node, edge and graph budgets at once (see `_pack_batch`). This changes
+  the order of the graphs, but fills batches more tightly.
+
   Args:
     graphs_tuple_iterator: An iterator of `jraph.GraphsTuples`.
     n_node: The maximum number of nodes in a batch.
     n_edge: The maximum number of edges in a batch.
     n_graph: The maximum number of graphs in a batch.
+    lookahead: Size of the window of graphs to pack batches from. If `0`, uses
+      greedy batching in stream order.
+    padding_stats: Optional `PaddingStats` updated with every batch.
 
   Yields:
     A `jraph.GraphsTuple` batch of graphs.
@@ -55,18 +118,26 @@ def dynamically_batch(graphs_tuple_iterator: Iterator[jraph.GraphsTuple],
     raise ValueError("The number of graphs in a batch size must be greater or "
                      f"equal to `2` for padding with graphs, got {n_graph}.")
   valid_batch_size = (n_node - 1, n_edge, n_graph - 1)
+
+  def _pad(accumulated_graphs):
+    batched_graph = _batch_np(accumulated_graphs)
+    if padding_stats is not None:
+      padding_stats.update(batched_graph, n_node, n_edge, n_graph)
+    return jraph.pad_with_graphs(batched_graph, n_node, n_edge, n_graph)
+
+  if lookahead > 0:
+    for accumulated_graphs in _pack_batches(
+        graphs_tuple_iterator, valid_batch_size, lookahead):
+      yield _pad(accumulated_graphs)
+    return
+
   accumulated_graphs = []
   num_accumulated_nodes = 0
   num_accumulated_edges = 0
   num_accumulated_graphs = 0
   for element in graphs_tuple_iterator:
     element_nodes, element_edges, element_graphs = _get_graph_size(element)
-    if _is_over_batch_size(element, valid_batch_size):
-      graph_size = element_nodes, element_edges, element_graphs
-      graph_size = {k: v for k, v in zip(_NUMBER_FIELDS, graph_size)}
-      batch_size = {k: v for k, v in zip(_NUMBER_FIELDS, valid_batch_size)}
-      raise RuntimeError("Found graph bigger than batch size. Valid Batch "
-                         f"Size: {batch_size}, Graph Size: {graph_size}")
+    _check_graph_size(element, valid_batch_size)
 
     if not accumulated_graphs:
       # If this is the first element of the batch, set it and continue.
@@ -81,8 +152,7 @@ def dynamically_batch(graphs_tuple_iterator: Iterator[jraph.GraphsTuple],
           (num_accumulated_nodes + element_nodes > n_node - 1) or
           (num_accumulated_edges + element_edges > n_edge)):
         # If there is, add it to the batch
-        batched_graph = _batch_np(accumulated_graphs)
-        yield jraph.pad_with_graphs(batched_graph, n_node, n_edge, n_graph)
+        yield _pad(accumulated_graphs)
         accumulated_graphs = [element]
         num_accumulated_nodes = element_nodes
         num_accumulated_edges = element_edges
@@ -96,28 +166,120 @@ def dynamically_batch(graphs_tuple_iterator: Iterator[jraph.GraphsTuple],
 
   # We may still have data in batched graph.
   if accumulated_graphs:
-    batched_graph = _batch_np(accumulated_graphs)
-    yield jraph.pad_with_graphs(batched_graph, n_node, n_edge, n_graph)
+    yield _pad(accumulated_graphs)
+
+
+def _pack_batches(
+    graphs_tuple_iterator: Iterator[jraph.GraphsTuple],
+    valid_batch_size: Tuple[int, int, int],
+    lookahead: int,
+) -> Generator[List[jraph.GraphsTuple], None, None]:
+  """Packs graphs from a window of (at least) `lookahead` graphs into batches.
+
+  A batch is only packed once the window holds more than fits in one batch,
+  so the window grows beyond `lookahead` if needed to fill a batch.
+
+  Args:
+    graphs_tuple_iterator: An iterator of `jraph.GraphsTuples`.
+    valid_batch_size: Node, edge and graph budgets.
+    lookahead: Minimum number of graphs to pack each batch from.
+
+  Yields:
+    Lists of graphs, one per batch.
+  """
+  window = collections.deque()
+  window_size = np.zeros([3], dtype=np.int64)
+  for element in graphs_tuple_iterator:
+    _check_graph_size(element, valid_batch_size)
+    element_size = _get_graph_size(element)
+    window.append((element, element_size))
+    window_size += element_size
+    if (len(window) >= lookahead and
+        np.any(window_size > np.array(valid_batch_size))):
+      batch = _pack_batch(window, valid_batch_size)
+      window_size -= np.sum([_get_graph_size(g) for g in batch], axis=0)
+      yield batch
+  while window:
+    yield _pack_batch(window, valid_batch_size)
+
+
+def _pack_batch(window, valid_batch_size: Tuple[int, int, int]):
+  """Removes and returns a batch of graphs from `window`.
+
+  The oldest graph in the window always goes into the batch, which bounds how
+  long any graph waits. The remaining graphs are visited from largest to
+  smallest (by the largest fraction of any budget they use) and added if they
+  fit in all budgets.
+
+  Args:
+    window: Deque of `(graph, graph_size)` tuples, oldest first.
+    valid_batch_size: Node, edge and graph budgets.
+
+  Returns:
+    The list of graphs in the batch.
+  """
+  budgets = np.array(valid_batch_size, dtype=np.float64)
+  sizes = np.array([size for _, size in window], dtype=np.float64)
+  remaining = budgets - sizes[0]
+  selected = [0]
+  order = np.argsort(-np.max(sizes[1:] / budgets, axis=-1), kind="stable") + 1
+  for i in order:
+    if np.all(sizes[i] <= remaining):
+      selected.append(i)
+      remaining -= sizes[i]
+      if not remaining[2]:
+        break
+  selected = set(selected)
+  batch = [element for i, (element, _) in enumerate(window) if i in selected]
+  remaining_elements = [
+      entry for i, entry in enumerate(window) if i not in selected]
+  window.clear()
+  window.extend(remaining_elements)
+  return batch
 
 
 def _batch_np(graphs: Sequence[jraph.GraphsTuple]) -> jraph.GraphsTuple:
+  """Batches graphs into preallocated arrays."""
+  n_node = np.concatenate([g.n_node for g in graphs])
+  n_edge = np.concatenate([g.n_edge for g in graphs])
   # Calculates offsets for sender and receiver arrays, caused by concatenating
   # the nodes arrays.
-  offsets = np.cumsum(np.array([0] + [np.sum(g.n_node) for g in graphs[:-1]]))
+  node_offsets = np.concatenate([[0], np.cumsum([np.sum(g.n_node)
+                                                 for g in graphs])])
+  edge_offsets = np.concatenate([[0], np.cumsum([len(g.senders)
+                                                 for g in graphs])])
 
-  def _map_concat(nests):
-    concat = lambda *args: np.concatenate(args)
-    return tree.tree_map(concat, *nests)
+  senders = np.empty([edge_offsets[-1]], dtype=graphs[0].senders.dtype)
+  receivers = np.empty([edge_offsets[-1]], dtype=graphs[0].receivers.dtype)
+  for g, node_offset, start, end in zip(
+      graphs, node_offsets, edge_offsets[:-1], edge_offsets[1:]):
+    np.add(g.senders, node_offset, out=senders[start:end], casting="unsafe")
+    np.add(g.receivers, node_offset, out=receivers[start:end],
+           casting="unsafe")
 
   return jraph.GraphsTuple(
-      n_node=np.concatenate([g.n_node for g in graphs]),
-      n_edge=np.concatenate([g.n_edge for g in graphs]),
-      nodes=_map_concat([g.nodes for g in graphs]),
-      edges=_map_concat([g.edges for g in graphs]),
-      globals=_map_concat([g.globals for g in graphs]),
-      senders=np.concatenate([g.senders + o for g, o in zip(graphs, offsets)]),
-      receivers=np.concatenate(
-          [g.receivers + o for g, o in zip(graphs, offsets)]))
+      n_node=n_node,
+      n_edge=n_edge,
+      nodes=_concatenate_into_preallocated([g.nodes for g in graphs]),
+      edges=_concatenate_into_preallocated([g.edges for g in graphs]),
+      globals=_concatenate_into_preallocated([g.globals for g in graphs]),
+      senders=senders,
+      receivers=receivers)
+
+
+def _concatenate_into_preallocated(nests):
+  """Concatenates the leaves of `nests`, allocating each output once."""
+  leaves_per_nest = [tree.tree_leaves(nest) for nest in nests]
+  concatenated = []
+  for leaves in zip(*leaves_per_nest):
+    leaves = [np.asarray(leaf) for leaf in leaves]
+    offsets = np.cumsum([0] + [leaf.shape[0] for leaf in leaves])
+    output = np.empty((offsets[-1],) + leaves[0].shape[1:],
+                      dtype=np.result_type(*leaves))
+    for leaf, start, end in zip(leaves, offsets[:-1], offsets[1:]):
+      output[start:end] = leaf
+    concatenated.append(output)
+  return tree.tree_unflatten(tree.tree_structure(nests[0]), concatenated)
 
 
 def _get_graph_size(graph: jraph.GraphsTuple) -> Tuple[int, int, int]:
@@ -127,12 +289,19 @@ def _get_graph_size(graph: jraph.GraphsTuple) -> Tuple[int, int, int]:
   return n_node, n_edge, n_graph
 
 
+def _check_graph_size(graph: jraph.GraphsTuple,
+                      valid_batch_size: Tuple[int, int, int]):
+  if _is_over_batch_size(graph, valid_batch_size):
+    graph_size = _get_graph_size(graph)
+    graph_size = {k: v for k, v in zip(_NUMBER_FIELDS, graph_size)}
+    batch_size = {k: v for k, v in zip(_NUMBER_FIELDS, valid_batch_size)}
+    raise RuntimeError("Found graph bigger than batch size. Valid Batch "
+                       f"Size: {batch_size}, Graph Size: {graph_size}")
+
+
 def _is_over_batch_size(
     graph: jraph.GraphsTuple,
     graph_batch_size: Iterable[int],
 ) -> bool:
   graph_size = _get_graph_size(graph)
   return any([x > y for x, y in zip(graph_size, graph_batch_size)])
-
-
-
@@ -0,0 +1,136 @@
+# Copyright 2021 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for batching_utils, which is shared with ogb_lsc/pcq."""
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import jax.tree_util as tree
+import jraph
+import numpy as np
+
+# pylint: disable=g-bad-import-order
+import batching_utils
+
+_N_NODE = 40
+_N_EDGE = 60
+_N_GRAPH = 6
+
+
+def _make_graphs(num_graphs, seed=0):
+  """Random graphs whose nodes and edges are labelled with the graph id."""
+  rng = np.random.RandomState(seed)
+  graphs = []
+  for graph_id in range(num_graphs):
+    num_nodes = rng.randint(1, _N_NODE // 3)
+    num_edges = rng.randint(0, _N_EDGE // 3)
+    graphs.append(jraph.GraphsTuple(
+        n_node=np.array([num_nodes]),
+        n_edge=np.array([num_edges]),
+        nodes={'id': np.full([num_nodes], graph_id),
+               'features': rng.normal(size=[num_nodes, 2]).astype(np.float32)},
+        edges=np.full([num_edges], graph_id),
+        globals=np.array([graph_id]),
+        senders=rng.randint(num_nodes, size=num_edges).astype(np.int32),
+        receivers=rng.randint(num_nodes, size=num_edges).astype(np.int32)))
+  return graphs
+
+
+def _assert_graphs_equal(graph, expected):
+  tree.tree_map(np.testing.assert_array_equal, graph, expected)
+
+
+class DynamicallyBatchTest(parameterized.TestCase):
+
+  def test_greedy_matches_jraph(self):
+    graphs = _make_graphs(50)
+    batches = list(batching_utils.dynamically_batch(
+        iter(graphs), _N_NODE, _N_EDGE, _N_GRAPH))
+    expected = list(jraph.dynamically_batch(
+        iter(graphs), _N_NODE, _N_EDGE, _N_GRAPH))
+    self.assertLen(batches, len(expected))
+    for batch, expected_batch in zip(batches, expected):
+      _assert_graphs_equal(batch, expected_batch)
+
+  @parameterized.parameters(0, 1, 4, 16, 100)
+  def test_batches_respect_budgets_and_keep_every_graph(self, lookahead):
+    num_graphs = 60
+    padding_stats = batching_utils.PaddingStats()
+    batches = list(batching_utils.dynamically_batch(
+        iter(_make_graphs(num_graphs)), _N_NODE, _N_EDGE, _N_GRAPH,
+        lookahead=lookahead, padding_stats=padding_stats))
+
+    graph_ids = []
+    num_nodes = num_edges = 0
+    for batch in batches:
+      # Padded to the budgets, with at least one padding graph.
+      self.assertEqual(np.sum(batch.n_node), _N_NODE)
+      self.assertEqual(np.sum(batch.n_edge), _N_EDGE)
+      self.assertLen(batch.n_node, _N_GRAPH)
+      graph_mask = jraph.get_graph_padding_mask(batch)
+      node_mask = jraph.get_node_padding_mask(batch)
+      edge_mask = jraph.get_edge_padding_mask(batch)
+      self.assertFalse(graph_mask[-1])
+      graph_ids.extend(batch.globals[graph_mask].tolist())
+      num_nodes += np.sum(node_mask)
+      num_edges += np.sum(edge_mask)
+
+      # Nodes, edges and the nodes they connect all belong to the same graph.
+      node_ids = batch.nodes['id'][node_mask]
+      np.testing.assert_array_equal(
+          node_ids, np.repeat(batch.globals[graph_mask],
+                              batch.n_node[graph_mask]))
+      edge_ids = batch.edges[edge_mask]
+      np.testing.assert_array_equal(
+          batch.nodes['id'][batch.senders[edge_mask]], edge_ids)
+      np.testing.assert_array_equal(
+          batch.nodes['id'][batch.receivers[edge_mask]], edge_ids)
+
+    self.assertCountEqual(graph_ids, range(num_graphs))
+    stats = padding_stats.as_dict()
+    self.assertEqual(stats['num_batches'], len(batches))
+    self.assertAlmostEqual(stats['node_efficiency'],
+                           num_nodes / (_N_NODE * len(batches)))
+    self.assertAlmostEqual(stats['edge_efficiency'],
+                           num_edges / (_N_EDGE * len(batches)))
+    self.assertAlmostEqual(stats['graph_efficiency'],
+                           num_graphs / (_N_GRAPH * len(batches)))
+
+  def test_lookahead_needs_fewer_batches(self):
+    graphs = _make_graphs(200)
+    num_greedy_batches = len(list(batching_utils.dynamically_batch(
+        iter(graphs), _N_NODE, _N_EDGE, _N_GRAPH)))
+    num_packed_batches = len(list(batching_utils.dynamically_batch(
+        iter(graphs), _N_NODE, _N_EDGE, _N_GRAPH, lookahead=32)))
+    self.assertLess(num_packed_batches, num_greedy_batches)
+
+  def test_graph_over_budget_raises(self):
+    graphs = _make_graphs(3)
+    graphs[1] = graphs[1]._replace(n_node=np.array([_N_NODE]))
+    for lookahead in [0, 4]:
+      with self.assertRaisesRegex(RuntimeError, 'bigger than batch size'):
+        list(batching_utils.dynamically_batch(
+            iter(graphs), _N_NODE, _N_EDGE, _N_GRAPH, lookahead=lookahead))
+
+
+class BatchNpTest(absltest.TestCase):
+
+  def test_matches_jraph_batch_np(self):
+    graphs = _make_graphs(5)
+    _assert_graphs_equal(batching_utils._batch_np(graphs),  # pylint: disable=protected-access
+                         jraph.batch_np(graphs))
+
+
+if __name__ == '__main__':
+  absltest.main()
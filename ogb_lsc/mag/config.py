@@ -45,6 +45,12 @@ def get_config(debug: bool = False) -> config_dict.ConfigDict:
                   k_fold_split_id=config_dict.placeholder(int),
                   use_all_labels_when_not_training=False,
                   use_dummy_adjacencies=debug,
+                  # E.g. 256 to sample subgraphs for many roots at once.
+                  sampling_batch_size=config_dict.placeholder(int),
+                  # If set, subgraph shuffling and sampling are reproducible.
+                  sampling_seed=config_dict.placeholder(int),
+                  # Number of sampling processes; 0 samples in-process.
+                  num_sampling_workers=0,
               ),
               optimizer=dict(
                   name='adamw',
@@ -89,6 +95,8 @@ def get_config(debug: bool = False) -> config_dict.ConfigDict:
                       n_node=256 if debug else 340 * 256,
                       n_edge=512 if debug else 720 * 256,
                       n_graph=4 if debug else 256,
+                      # Window size for best-fit packing; 0 batches greedily.
+                      lookahead=0,
                   ),
               ),
               eval=dict(
@@ -101,6 +109,7 @@ def get_config(debug: bool = False) -> config_dict.ConfigDict:
                       n_node=256 if debug else 340 * 128,
                       n_edge=512 if debug else 720 * 128,
                       n_graph=4 if debug else 128,
+                      lookahead=0,
                   ),
               ))))
 
@@ -47,6 +47,10 @@ _DATA_FILES_AND_PARAMETERS = {
 
 flags.DEFINE_string('data_root', None, 'Data root directory')
 flags.DEFINE_boolean('skip_existing', True, 'Skips existing CSR files')
+flags.DEFINE_boolean(
+    'write_csr_arrays', True,
+    'Also writes `indptr`/`indices` as separate `.npy` files, which '
+    '`data_utils.load_csr` memory-maps instead of loading the `.npz`.')
 
 flags.mark_flags_as_required(['data_root'])
 
@@ -83,10 +87,29 @@ def _get_output_paths(directory, content_names, use_boolean):
   return output_path, output_path_t
 
 
-def _write_csr(path, csr):
+def _write_csr_arrays(path, csr, content_names):
+  # Pad to the full number of nodes, so loading needs no copies.
+  shape = tuple(data_utils.SIZES[name] for name in content_names)
+  data_utils.save_csr_arrays(path, csr, shape=shape)
+
+
+def _write_csr(path, csr, content_names):
   path.parent.mkdir(parents=True, exist_ok=True)
   with path.open('wb') as fid:
     scipy.sparse.save_npz(fid, csr)
+  if FLAGS.write_csr_arrays:
+    _write_csr_arrays(path, csr, content_names)
+
+
+def _maybe_write_missing_csr_arrays(path, content_names):
+  """Writes the CSR arrays of an existing `.npz` file if they are missing."""
+  directory = data_utils.get_csr_arrays_directory(path)
+  # `shape.npy` is written last.
+  if not FLAGS.write_csr_arrays or (directory / 'shape.npy').exists():
+    return
+  logging.info('Writing missing CSR arrays for %s', path)
+  _write_csr_arrays(
+      path, scipy.sparse.load_npz(path).tocsr(), content_names)
 
 
 def main(argv):
@@ -105,6 +128,10 @@ def main(argv):
       logging.info(
           '%s and %s exist: skipping. Use flag `--skip_existing=False`'
           'to force overwrite existing.', output_path, output_path_t)
+      _maybe_write_missing_csr_arrays(
+          output_path, parameters['content_names'])
+      _maybe_write_missing_csr_arrays(
+          output_path_t, parameters['content_names'][::-1])
       continue
     logging.info('Reading edge data from: %s', input_path)
     edge_data = _read_edge_data(input_path)
@@ -114,21 +141,26 @@ def main(argv):
     if not FLAGS.skip_existing or not output_path.exists():
       logging.info('Writing CSR matrix to: %s', output_path)
       mat_csr = mat_coo.tocsr()
-      _write_csr(output_path, mat_csr)
+      _write_csr(output_path, mat_csr, parameters['content_names'])
       del mat_csr  # Free up memory asap.
     else:
       logging.info(
           '%s exists: skipping. Use flag `--skip_existing=False`'
           'to force overwrite existing.', output_path)
+      _maybe_write_missing_csr_arrays(
+          output_path, parameters['content_names'])
     if not FLAGS.skip_existing or not output_path_t.exists():
       logging.info('Writing (transposed) CSR matrix to: %s', output_path_t)
       mat_csr_t = mat_coo.transpose().tocsr()
-      _write_csr(output_path_t, mat_csr_t)
+      _write_csr(
+          output_path_t, mat_csr_t, parameters['content_names'][::-1])
       del mat_csr_t  # Free up memory asap.
     else:
       logging.info(
           '%s exists: skipping. Use flag `--skip_existing=False`'
           'to force overwrite existing.', output_path_t)
+      _maybe_write_missing_csr_arrays(
+          output_path_t, parameters['content_names'][::-1])
     del mat_coo  # Free up memory asap.
 
 
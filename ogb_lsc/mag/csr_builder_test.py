@@ -0,0 +1,97 @@
+# Copyright 2021 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for csr_builder."""
+
+import pathlib
+from unittest import mock
+
+from absl import flags
+from absl.testing import absltest
+from absl.testing import flagsaver
+import numpy as np
+import scipy.sparse as sp
+
+# pylint: disable=g-bad-import-order
+import csr_builder
+import data_utils
+import sub_sampler
+
+Path = pathlib.Path
+
+FLAGS = flags.FLAGS
+# `--data_root` is required, and set by each test.
+FLAGS.set_default('data_root', '')
+
+_SIZES = {'paper': 30, 'author': 20, 'institution': 5}
+
+
+class CsrBuilderTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.enter_context(mock.patch.dict(data_utils.SIZES, _SIZES))
+    self._data_root = Path(self.create_tempdir().full_path)
+    raw_dir = self._data_root / data_utils.RAW_DIR
+    raw_dir.mkdir()
+    rng = np.random.RandomState(0)
+    for filename, parameters in (
+        csr_builder._DATA_FILES_AND_PARAMETERS.items()):  # pylint: disable=protected-access
+      sender, receiver = parameters['content_names']
+      # Nodes at the end have no edges, so the matrices need padding.
+      edges = np.stack([
+          rng.randint(_SIZES[sender] - 3, size=40),
+          rng.randint(_SIZES[receiver] - 1, size=40)])
+      np.save(raw_dir / filename, edges)
+
+  def _check_csr_arrays(self):
+    for path in [data_utils.EDGES_PAPER_PAPER_B,
+                 data_utils.EDGES_PAPER_PAPER_B_T,
+                 data_utils.EDGES_AUTHOR_INSTITUTION,
+                 data_utils.EDGES_INSTITUTION_AUTHOR,
+                 data_utils.EDGES_AUTHOR_PAPER, data_utils.EDGES_PAPER_AUTHOR]:
+      path = self._data_root / path
+      csr_arrays = data_utils.load_csr(path)
+      self.assertIsInstance(csr_arrays, sub_sampler.CsrArrays)
+      sender, receiver = path.stem.split('_')[:2]
+      self.assertEqual(csr_arrays.shape, (_SIZES[sender], _SIZES[receiver]))
+      csr = sp.load_npz(path)
+      num_rows = csr.shape[0]
+      np.testing.assert_array_equal(csr_arrays.indptr[:num_rows + 1],
+                                    csr.indptr)
+      np.testing.assert_array_equal(csr_arrays.indptr[num_rows:],
+                                    csr.indptr[-1])
+      np.testing.assert_array_equal(csr_arrays.indices, csr.indices)
+
+  def test_writes_csr_arrays(self):
+    with flagsaver.flagsaver(data_root=str(self._data_root)):
+      csr_builder.main([''])
+    self._check_csr_arrays()
+
+  def test_writes_missing_csr_arrays_of_existing_files(self):
+    with flagsaver.flagsaver(data_root=str(self._data_root),
+                             write_csr_arrays=False):
+      csr_builder.main([''])
+    path = self._data_root / data_utils.EDGES_AUTHOR_PAPER
+    self.assertFalse(data_utils.get_csr_arrays_directory(path).exists())
+    self.assertIsInstance(data_utils.load_csr(path), sp.csr_matrix)
+
+    with flagsaver.flagsaver(data_root=str(self._data_root),
+                             skip_existing=True):
+      csr_builder.main([''])
+    self._check_csr_arrays()
+
+
+if __name__ == '__main__':
+  absltest.main()
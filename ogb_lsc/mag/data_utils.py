@@ -14,8 +14,11 @@
 
 """Dataset utilities."""
 
+import atexit
 import functools
+import itertools
 import pathlib
+import time
 from typing import Dict, Tuple
 
 from absl import logging
@@ -24,9 +27,9 @@ from graph_nets import utils_tf
 import numpy as np
 import scipy.sparse as sp
 import tensorflow as tf
-import tqdm
 
 # pylint: disable=g-bad-import-order
+import parallel_sampler
 import sub_sampler
 
 Path = pathlib.Path
@@ -110,12 +113,65 @@ def _log_path_decorator(fn):
   return _decorated_fn
 
 
+def get_csr_arrays_directory(path):
+  """Returns the memory-mappable CSR directory for the `.npz` at `path`."""
+  path = Path(path)
+  return path.with_name(f"{path.stem}_csr")
+
+
+def save_csr_arrays(path, csr, shape=None):
+  """Saves `indptr`/`indices` of a CSR matrix as separate `.npy` files.
+
+  The files are written to `get_csr_arrays_directory(path)` and can be opened
+  without copies by `load_csr`. Only the sparsity structure is stored.
+
+  Args:
+    path: Path of the corresponding `.npz` file.
+    csr: CSR matrix to save.
+    shape: Optional shape to pad the matrix to, as in `_pad_to_shape`.
+  """
+  shape = tuple(csr.shape if shape is None else shape)
+  assert np.all(np.array(csr.shape) <= np.array(shape))
+  indptr = np.asarray(csr.indptr, dtype=np.int64)
+  if shape[0] > csr.shape[0]:
+    indptr = np.concatenate(
+        [indptr, np.full([shape[0] - csr.shape[0]], indptr[-1])])
+  directory = get_csr_arrays_directory(path)
+  directory.mkdir(parents=True, exist_ok=True)
+  logging.info("Writing CSR arrays to %s", directory)
+  np.save(directory / "indptr.npy", indptr)
+  np.save(directory / "indices.npy", np.asarray(csr.indices))
+  np.save(directory / "shape.npy", np.array(shape, dtype=np.int64))
+
+
 @_log_path_decorator
 def load_csr(path, debug=False):
+  """Loads a CSR matrix, memory-mapping its arrays where possible.
+
+  If `save_csr_arrays` was used for `path`, returns a `sub_sampler.CsrArrays`
+  view over memory-mapped `indptr`/`indices`, so loading is near-instant and
+  the arrays are shared between processes through the page cache. Otherwise,
+  reads the `.npz` file into memory, converting matrices saved in another
+  format (such as fused transposes saved as CSC by earlier versions) to CSR,
+  so that both stores give the same matrix.
+
+  Args:
+    path: Path of the `.npz` file.
+    debug: If True, returns a dummy matrix.
+
+  Returns:
+    The CSR matrix, or a `sub_sampler.CsrArrays` view.
+  """
   if debug:
     # Dummy matrix for debugging.
     return sp.csr_matrix(np.zeros([10, 10]))
-  return sp.load_npz(str(path))
+  directory = get_csr_arrays_directory(path)
+  if (directory / "shape.npy").exists():
+    return sub_sampler.CsrArrays(
+        indptr=np.load(directory / "indptr.npy", mmap_mode="r"),
+        indices=np.load(directory / "indices.npy", mmap_mode="r"),
+        shape=tuple(np.load(directory / "shape.npy").tolist()))
+  return sp.load_npz(str(path)).tocsr()
 
 
 @_log_path_decorator
@@ -131,7 +187,11 @@ def get_arrays(data_root="/data/",
                k_fold_split_id=None,
                return_adjacencies=True,
                use_dummy_adjacencies=False):
-  """Returns all arrays needed for training."""
+  """Returns all arrays needed for training.
+
+  Adjacencies written with `save_csr_arrays` (e.g. by `csr_builder.py`) are
+  returned as `sub_sampler.CsrArrays` views over memory-mapped files.
+  """
   logging.info("Starting to get files")
 
   data_root = Path(data_root)
@@ -246,79 +306,277 @@ def add_nodes_embedding_from_array(graph, array):
 def get_graph_subsampling_dataset(
     prefix, arrays, shuffle_indices, ratio_unlabeled_data_to_labeled_data,
     max_nodes, max_edges,
+    sampling_batch_size=None,
+    sampling_seed=None,
+    num_sampling_workers=0,
     **subsampler_kwargs):
-  """Returns tf_dataset for online sampling."""
+  """Returns tf_dataset for online sampling.
+
+  Args:
+    prefix: Split prefix of the root node indices in `arrays`.
+    arrays: Dictionary of arrays, as returned by `get_arrays`.
+    shuffle_indices: Whether to shuffle the root node indices.
+    ratio_unlabeled_data_to_labeled_data: Ratio of unlabeled roots to add.
+    max_nodes: Node budget per subgraph.
+    max_edges: Edge budget per subgraph.
+    sampling_batch_size: If set, subgraphs are sampled for this many roots at
+      a time with `sub_sampler.subsample_graphs_batched`, rather than one root
+      at a time with `sub_sampler.subsample_graph`.
+    sampling_seed: Seed for shuffling and sampling. Each epoch (i.e. each call
+      of the dataset generator) derives its own seed from it, so that epochs
+      differ but a seeded run is reproducible.
+    num_sampling_workers: If positive, subgraphs are sampled by this many
+      worker processes, each handling a disjoint shard of the roots (see
+      `parallel_sampler`). Uses `sampling_batch_size` roots per call, or 64 if
+      unset. With the same seed and sampling batch size, the workers sample the
+      same graphs as in-process sampling, but yield them in a different order.
+    **subsampler_kwargs: Additional arguments for the subsampler.
+  """
+
+  adjacencies = (
+      arrays["author_institution_index"],
+      arrays["institution_author_index"],
+      arrays["author_paper_index"],
+      arrays["paper_author_index"],
+      arrays["paper_paper_index"],
+      arrays["paper_paper_index_t"],
+  )
+
+  def _subsample_graphs_in_process(root_node_indices, seed_sequence):
+    if sampling_batch_size is None:
+      for index in root_node_indices:
+        yield sub_sampler.subsample_graph(
+            index,
+            *adjacencies,
+            paper_years=arrays["paper_year"],
+            max_nodes=max_nodes,
+            max_edges=max_edges,
+            **subsampler_kwargs)
+    else:
+      yield from parallel_sampler.sample_graphs_in_process(
+          arrays,
+          root_node_indices,
+          sampling_batch_size=sampling_batch_size,
+          seed=seed_sequence,
+          max_nodes=max_nodes,
+          max_edges=max_edges,
+          **subsampler_kwargs)
+
+  shared_arrays = None
+
+  def _subsample_graphs(root_node_indices, seed_sequence):
+    nonlocal shared_arrays
+    if num_sampling_workers <= 0:
+      return _subsample_graphs_in_process(root_node_indices, seed_sequence)
+    if shared_arrays is None:
+      shared_arrays = parallel_sampler.SharedArrays(arrays)
+      atexit.register(shared_arrays.close)
+    return parallel_sampler.sample_graphs_in_parallel(
+        shared_arrays,
+        root_node_indices,
+        num_workers=num_sampling_workers,
+        sampling_batch_size=sampling_batch_size or 64,
+        seed=seed_sequence,
+        max_nodes=max_nodes,
+        max_edges=max_edges,
+        **subsampler_kwargs)
+
+  epochs = itertools.count()
 
   def generator():
+    # Spawn keys give each epoch independent draws from the same seed.
+    epoch_seed_sequence = np.random.SeedSequence(
+        sampling_seed, spawn_key=(next(epochs),))
+    shuffle_seed_sequence, sampling_seed_sequence = (
+        epoch_seed_sequence.spawn(2))
+    rng = np.random.default_rng(shuffle_seed_sequence)
+
     labeled_indices = arrays[f"{prefix}_indices"]
     if ratio_unlabeled_data_to_labeled_data > 0:
       num_unlabeled_data_to_add = int(ratio_unlabeled_data_to_labeled_data *
                                       labeled_indices.shape[0])
-      unlabeled_indices = np.random.choice(
+      unlabeled_indices = rng.choice(
           NUM_PAPERS, size=num_unlabeled_data_to_add, replace=False)
       root_node_indices = np.concatenate([labeled_indices, unlabeled_indices])
     else:
       root_node_indices = labeled_indices
     if shuffle_indices:
-      root_node_indices = root_node_indices.copy()
-      np.random.shuffle(root_node_indices)
-
-    for index in root_node_indices:
-      graph = sub_sampler.subsample_graph(
-          index,
-          arrays["author_institution_index"],
-          arrays["institution_author_index"],
-          arrays["author_paper_index"],
-          arrays["paper_author_index"],
-          arrays["paper_paper_index"],
-          arrays["paper_paper_index_t"],
-          paper_years=arrays["paper_year"],
-          max_nodes=max_nodes,
-          max_edges=max_edges,
-          **subsampler_kwargs)
+      root_node_indices = rng.permutation(root_node_indices)
 
+    for graph in _subsample_graphs(root_node_indices, sampling_seed_sequence):
       graph = add_nodes_label(graph, arrays["paper_label"])
       graph = add_nodes_year(graph, arrays["paper_year"])
       graph = tf_graphs.GraphsTuple(*graph)
       yield graph
 
-  sample_graph = next(generator())
+  # The signature only needs one graph, so sample it in-process.
+  sample_graph = next(_subsample_graphs_in_process(
+      arrays[f"{prefix}_indices"][:1], np.random.SeedSequence(sampling_seed)))
+  sample_graph = add_nodes_label(sample_graph, arrays["paper_label"])
+  sample_graph = add_nodes_year(sample_graph, arrays["paper_year"])
+  sample_graph = tf_graphs.GraphsTuple(*sample_graph)
 
   return tf.data.Dataset.from_generator(
       generator,
       output_signature=utils_tf.specs_from_graphs_tuple(sample_graph))
 
 
+def _row_normalized_adjacency(index_csr):
+  """Returns the adjacency with every row summing to one (or empty)."""
+  degrees = np.diff(index_csr.indptr)
+  weights = 1. / np.maximum(degrees, 1).astype(np.float32)
+  return sp.csr_matrix(
+      (np.repeat(weights, degrees), index_csr.indices, index_csr.indptr),
+      shape=index_csr.shape)
+
+
+def _progress_path(output_path):
+  output_path = Path(output_path)
+  return output_path.with_name(output_path.name + ".progress.npy")
+
+
+def propagate_features(index_csr,
+                       features,
+                       output_path=None,
+                       max_memory_bytes=8 * 2**30,
+                       row_block_size=10_000_000,
+                       resume=False):
+  """Averages `features` over the neighbours of every row of `index_csr`.
+
+  This computes `D^-1 A F` as a sparse matrix product, where `A` is the
+  (binarized) adjacency, `D` its row degrees, and `F` the features. Rows
+  without neighbours get NaN features, as the mean over an empty set.
+
+  The features are processed in blocks of columns, so that only
+  `max_memory_bytes` worth of (dense) feature columns is in memory at once,
+  and every column block in blocks of `row_block_size` output rows.
+
+  Args:
+    index_csr: [num_outputs, num_inputs] CSR adjacency.
+    features: [num_inputs, num_features] array; may be memory-mapped.
+    output_path: If set, the output is written to a memory-mapped `.npy` file
+      at this path, which is returned opened in read mode. Otherwise the output
+      is returned as an in-memory array.
+    max_memory_bytes: Memory budget for the dense feature column blocks.
+    row_block_size: Number of output rows computed per sparse product.
+    resume: If True and `output_path` has a completed output, return it
+      without recomputing it. If it has a partially computed output, skip the
+      column blocks that were already completed.
+
+  Returns:
+    [num_outputs, num_features] array of averaged features.
+  """
+  num_outputs = index_csr.shape[0]
+  num_inputs, num_features = features.shape
+  assert index_csr.shape[1] <= num_inputs
+  dtype = features.dtype
+  bytes_per_column = num_inputs * np.dtype(np.float32).itemsize
+  column_block_size = int(
+      np.clip(max_memory_bytes // bytes_per_column, 1, num_features))
+  num_column_blocks = (num_features - 1) // column_block_size + 1
+
+  num_done_blocks = 0
+  if output_path is None:
+    output = np.empty([num_outputs, num_features], dtype=dtype)
+  else:
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # The progress file exists from before the output is created until it is
+    # complete.
+    progress_path = _progress_path(output_path)
+    if resume and output_path.exists() and not progress_path.exists():
+      logging.info("Reusing completed %s", output_path)
+      output = np.load(str(output_path), mmap_mode="r")
+      assert output.shape == (num_outputs, num_features)
+      assert output.dtype == dtype
+      return output
+    elif resume and output_path.exists():
+      output = np.lib.format.open_memmap(str(output_path), mode="r+")
+      assert output.shape == (num_outputs, num_features)
+      assert output.dtype == dtype
+      num_done_blocks = int(np.load(str(progress_path)))
+      logging.info("Resuming %s after %d/%d column blocks", output_path,
+                   num_done_blocks, num_column_blocks)
+    else:
+      np.save(str(progress_path), 0)
+      output = np.lib.format.open_memmap(
+          str(output_path), mode="w+", dtype=dtype,
+          shape=(num_outputs, num_features))
+
+  normalized_csr = _row_normalized_adjacency(index_csr)
+  is_empty_row = np.diff(index_csr.indptr) == 0
+  start_time = time.time()
+  for block_i in range(num_done_blocks, num_column_blocks):
+    columns = slice(block_i * column_block_size,
+                    (block_i + 1) * column_block_size)
+    feature_block = np.asarray(
+        features[:index_csr.shape[1], columns], dtype=np.float32)
+    for row_start in range(0, num_outputs, row_block_size):
+      rows = slice(row_start, row_start + row_block_size)
+      output[rows, columns] = normalized_csr[rows] @ feature_block
+    output[is_empty_row, columns] = np.nan
+    del feature_block
+
+    if output_path is not None:
+      output.flush()
+      np.save(str(progress_path), block_i + 1)
+    elapsed_time = time.time() - start_time
+    num_blocks_done_now = block_i + 1 - num_done_blocks
+    time_left = elapsed_time / num_blocks_done_now * (
+        num_column_blocks - block_i - 1)
+    logging.info("Column block %d / %d. Elapsed time %.1f. Time left: %.1f",
+                 block_i + 1, num_column_blocks, elapsed_time, time_left)
+
+  if output_path is not None:
+    del output
+    _progress_path(output_path).unlink()
+    output = np.load(str(output_path), mmap_mode="r")
+  return output
+
+
 def paper_features_to_author_features(
-    author_paper_index, paper_features):
-  """Averages paper features to authors."""
+    author_paper_index, paper_features, **kwargs):
+  """Averages paper features to authors.
+
+  Args:
+    author_paper_index: [NUM_AUTHORS, NUM_PAPERS] CSR adjacency.
+    paper_features: [NUM_PAPERS, num_features] array.
+    **kwargs: Additional arguments for `propagate_features`, e.g. an
+      `output_path` to write the features to a memory-mapped file.
+
+  Returns:
+    [NUM_AUTHORS, num_features] array of author features.
+  """
   assert paper_features.shape[0] == NUM_PAPERS
   assert author_paper_index.shape[0] == NUM_AUTHORS
-  author_features = np.zeros(
-      [NUM_AUTHORS, paper_features.shape[1]], dtype=paper_features.dtype)
-  for author_i in range(NUM_AUTHORS):
-    paper_indices = author_paper_index[author_i].indices
-    author_features[author_i] = paper_features[paper_indices].mean(
-        axis=0, dtype=np.float32)
-    if author_i % 10000 == 0:
-      logging.info("%d/%d", author_i, NUM_AUTHORS)
-  return author_features
+  return propagate_features(author_paper_index, paper_features, **kwargs)
 
 
 def author_features_to_institution_features(
-    institution_author_index, author_features):
-  """Averages author features to institutions."""
+    institution_author_index, author_features, **kwargs):
+  """Averages author features to institutions.
+
+  Args:
+    institution_author_index: [NUM_INSTITUTIONS, NUM_AUTHORS] CSR adjacency.
+    author_features: [NUM_AUTHORS, num_features] array.
+    **kwargs: Additional arguments for `propagate_features`.
+
+  Returns:
+    [NUM_INSTITUTIONS, num_features] array of institution features.
+  """
   assert author_features.shape[0] == NUM_AUTHORS
   assert institution_author_index.shape[0] == NUM_INSTITUTIONS
-  institution_features = np.zeros(
-      [NUM_INSTITUTIONS, author_features.shape[1]], dtype=author_features.dtype)
-  for institution_i in range(NUM_INSTITUTIONS):
-    author_indices = institution_author_index[institution_i].indices
-    institution_features[institution_i] = author_features[
-        author_indices].mean(axis=0, dtype=np.float32)
-    if institution_i % 10000 == 0:
-      logging.info("%d/%d", institution_i, NUM_INSTITUTIONS)
-  return institution_features
+  return propagate_features(
+      institution_author_index, author_features, **kwargs)
+
+
+def get_identical_paper_pairs(neighbor_indices, neighbor_distances):
+  """Returns [num_pairs, 2] array of (paper, identical neighbor) pairs."""
+  eps = 0.0
+  mask = ((neighbor_indices != np.arange(neighbor_indices.shape[0])[:, None]) &
+          (neighbor_distances <= eps))
+  rows, cols = np.nonzero(mask)
+  return np.stack([rows, neighbor_indices[rows, cols]], axis=1).astype(np.int64)
 
 
 def generate_fused_paper_adjacency_matrix(neighbor_indices, neighbor_distances,
@@ -330,58 +588,37 @@ def generate_fused_paper_adjacency_matrix(neighbor_indices, neighbor_distances,
   # this method would not necessarily detect A and C being equal.
   # However, this should capture almost all cases.
   logging.info("Generating fused paper adjacency matrix")
-  eps = 0.0
-  mask = ((neighbor_indices != np.mgrid[:neighbor_indices.shape[0], :1]) &
-          (neighbor_distances <= eps))
-  identical_pairs = list(map(tuple, np.nonzero(mask)))
-  del mask
-
-  # Have a csc version for fast column access.
-  paper_paper_csc = paper_paper_csr.tocsc()
-
-  # Construct new matrix as coo, starting off with original rows/cols.
-  paper_paper_coo = paper_paper_csr.tocoo()
-  new_rows = [paper_paper_coo.row]
-  new_cols = [paper_paper_coo.col]
-
-  for pair in tqdm.tqdm(identical_pairs):
-    # STEP ONE: First merge papers being cited by the pair.
-    # Add edges from second paper, to all papers cited by first paper.
-    cited_by_first = paper_paper_csr.getrow(pair[0]).nonzero()[1]
-    if cited_by_first.shape[0] > 0:
-      new_rows.append(pair[1] * np.ones_like(cited_by_first))
-      new_cols.append(cited_by_first)
-
-    # Add edges from first paper, to all papers cited by second paper.
-    cited_by_second = paper_paper_csr.getrow(pair[1]).nonzero()[1]
-    if cited_by_second.shape[0] > 0:
-      new_rows.append(pair[0] * np.ones_like(cited_by_second))
-      new_cols.append(cited_by_second)
-
-    # STEP TWO: Then merge papers that cite the pair.
-    # Add edges to second paper, from all papers citing the first paper.
-    citing_first = paper_paper_csc.getcol(pair[0]).nonzero()[0]
-    if citing_first.shape[0] > 0:
-      new_rows.append(citing_first)
-      new_cols.append(pair[1] * np.ones_like(citing_first))
-
-    # Add edges to first paper, from all papers citing the second paper.
-    citing_second = paper_paper_csc.getcol(pair[1]).nonzero()[0]
-    if citing_second.shape[0] > 0:
-      new_rows.append(citing_second)
-      new_cols.append(pair[0] * np.ones_like(citing_second))
-
-  logging.info("Done with adjacency loop")
-  paper_paper_coo_shape = paper_paper_coo.shape
+  identical_pairs = get_identical_paper_pairs(
+      neighbor_indices, neighbor_distances)
+  logging.info("Found %d identical pairs", identical_pairs.shape[0])
+  shape = paper_paper_csr.shape
+
+  # Symmetric "pair permutation" matrix, with P[a, b] = P[b, a] = 1 for every
+  # identical pair (a, b).
+  pair_rows = np.concatenate([identical_pairs[:, 0], identical_pairs[:, 1]])
+  pair_cols = np.concatenate([identical_pairs[:, 1], identical_pairs[:, 0]])
+  pair_matrix = sp.csr_matrix(
+      (np.ones_like(pair_rows, dtype=np.float32), (pair_rows, pair_cols)),
+      shape=shape)
+  del pair_rows, pair_cols
+  adjacency = sp.csr_matrix(
+      (np.ones_like(paper_paper_csr.indices, dtype=np.float32),
+       paper_paper_csr.indices, paper_paper_csr.indptr), shape=shape)
   del paper_paper_csr
-  del paper_paper_csc
-  del paper_paper_coo
-  # All done; now concatenate everything together and form new matrix.
-  new_rows = np.concatenate(new_rows)
-  new_cols = np.concatenate(new_cols)
+
+  # STEP ONE: First merge papers being cited by the pair: each paper of a pair
+  # cites all papers cited by the other one (rows of `P @ A`).
+  # STEP TWO: Then merge papers that cite the pair: papers citing one paper of
+  # a pair also cite the other one (columns of `A @ P`).
+  fused = adjacency + pair_matrix @ adjacency + adjacency @ pair_matrix
+  del adjacency, pair_matrix
+  logging.info("Done with adjacency products")
+
+  # All done; now form the new (boolean) matrix from the fused edges.
+  fused = fused.tocoo()
   return sp.coo_matrix(
-      (np.ones_like(new_rows, dtype=bool), (new_rows, new_cols)),
-      shape=paper_paper_coo_shape).tocsr()
+      (np.ones_like(fused.row, dtype=bool), (fused.row, fused.col)),
+      shape=shape).tocsr()
 
 
 def generate_k_fold_splits(
@@ -423,22 +660,52 @@ def generate_fused_node_labels(neighbor_indices, neighbor_distances,
                                test_indices):
   """Generates fused adjacency matrix for identical nodes."""
   logging.info("Generating fused node labels")
-  valid_indices = set(valid_indices.tolist())
-  test_indices = set(test_indices.tolist())
-  valid_or_test_indices = valid_indices | test_indices
+  valid_or_test_indices = np.concatenate([valid_indices, test_indices])
 
   train_indices = train_indices[train_indices < neighbor_indices.shape[0]]
   # Go through list of all pairs where one node is in training set, and
-  for i in tqdm.tqdm(train_indices):
-    for j in range(neighbor_indices.shape[1]):
-      other_index = neighbor_indices[i][j]
-      # if the other is not a validation or test node,
-      if other_index in valid_or_test_indices:
-        continue
-      # and they are identical,
-      if neighbor_distances[i][j] == 0:
-        # assign the label of the training node to the other node
-        node_labels[other_index] = node_labels[i]
+  # the other is not a validation or test node, and they are identical.
+  # Pairs are kept in the order in which labels are assigned: by training
+  # index, then by neighbor rank.
+  other_indices = neighbor_indices[train_indices]
+  is_fused = ((neighbor_distances[train_indices] == 0) &
+              ~np.isin(other_indices, valid_or_test_indices))
+  pair_rows, pair_cols = np.nonzero(is_fused)
+  sources = train_indices[pair_rows].astype(np.int64)
+  targets = other_indices[pair_rows, pair_cols].astype(np.int64)
+  del other_indices, is_fused, pair_rows, pair_cols
+  num_pairs = sources.shape[0]
+  logging.info("Fusing labels for %d pairs", num_pairs)
+
+  # Labels are assigned in order, so a source may itself have received a label
+  # from an earlier pair. Find, for every pair, the last earlier pair that
+  # assigned a label to its source (or -1 if none).
+  order = np.lexsort((np.arange(num_pairs), targets))
+  sorted_targets = targets[order]
+  sorted_steps = order
+  position = np.searchsorted(
+      sorted_targets * num_pairs + sorted_steps,
+      sources * num_pairs + np.arange(num_pairs)) - 1
+  position_valid = position >= 0
+  position = np.maximum(position, 0)
+  previous = np.where(
+      position_valid & (sorted_targets[position] == sources),
+      sorted_steps[position], -1)
+
+  # Follow those assignments back to the pair that reads an original label.
+  root = np.where(previous >= 0, previous, np.arange(num_pairs))
+  while True:
+    next_root = root[root]
+    if np.array_equal(next_root, root):
+      break
+    root = next_root
+  values = node_labels[sources[root]]
+
+  # Assign the label of the training node to the other node; for targets
+  # assigned several times, the last assignment wins.
+  is_last = np.ones([num_pairs], dtype=bool)
+  is_last[order[:-1]] = sorted_targets[1:] != sorted_targets[:-1]
+  node_labels[targets[is_last]] = values[is_last]
 
   return node_labels
 
@@ -463,6 +730,13 @@ def _pad_to_shape(
       [sparse_csr_matrix.indptr[-1:]] * required_padding,
       axis=0)
 
+  if isinstance(sparse_csr_matrix, sub_sampler.CsrArrays):
+    # Memory-mapped arrays carry no data; only the `indptr` is copied.
+    return sub_sampler.CsrArrays(
+        indptr=updated_indptr,
+        indices=sparse_csr_matrix.indices,
+        shape=tuple(output_shape))
+
   # The change in trailing size does not have structural implications, it just
   # determines the highest possible value for the indices, so it is sufficient
   # to just pass the new output shape, with the correct trailing size.
@@ -0,0 +1,174 @@
+# Copyright 2021 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for data_utils."""
+
+from absl.testing import absltest
+import numpy as np
+import scipy.sparse as sp
+
+import data_utils
+
+_NUM_PAPERS = 40
+_NUM_AUTHORS = 15
+_NUM_INSTITUTIONS = 4
+
+
+def _random_csr(rng, num_rows, num_cols, density):
+  return sp.csr_matrix(
+      rng.uniform(size=(num_rows, num_cols)) < density, dtype=np.float32)
+
+
+def _make_arrays():
+  rng = np.random.RandomState(0)
+  paper_paper = _random_csr(rng, _NUM_PAPERS, _NUM_PAPERS, 0.1)
+  paper_author = _random_csr(rng, _NUM_PAPERS, _NUM_AUTHORS, 0.2)
+  author_institution = _random_csr(rng, _NUM_AUTHORS, _NUM_INSTITUTIONS, 0.4)
+  return {
+      'train_indices': np.arange(0, _NUM_PAPERS, 2),
+      'paper_paper_index': paper_paper,
+      'paper_paper_index_t': paper_paper.T.tocsr(),
+      'paper_author_index': paper_author,
+      'author_paper_index': paper_author.T.tocsr(),
+      'author_institution_index': author_institution,
+      'institution_author_index': author_institution.T.tocsr(),
+      'paper_year': rng.randint(2000, 2020, size=_NUM_PAPERS),
+      'paper_label': rng.randint(0, 10, size=_NUM_PAPERS),
+  }
+
+
+def _make_dataset(arrays, **kwargs):
+  return data_utils.get_graph_subsampling_dataset(
+      'train',
+      arrays,
+      ratio_unlabeled_data_to_labeled_data=0.,
+      max_nodes=30,
+      max_edges=60,
+      max_nb_neighbours_per_type=[
+          [[4, 2, 0, 4], [0, 0, 0, 0], [0, 0, 0, 0]],
+          [[4, 2, 0, 4], [4, 0, 2, 0], [0, 0, 0, 0]],
+      ],
+      sampling_batch_size=4,
+      **kwargs)
+
+
+def _epoch_roots(dataset):
+  roots = []
+  for graph in dataset:
+    nodes = graph.nodes
+    assert nodes['index'].shape[0] <= 30 and graph.senders.shape[0] <= 60
+    assert nodes['type'][0] == 0
+    roots.append(int(nodes['index'][0]))
+  return roots
+
+
+class GraphSubsamplingDatasetTest(absltest.TestCase):
+
+  def test_batched_sampling_keeps_root_order(self):
+    arrays = _make_arrays()
+    dataset = _make_dataset(arrays, shuffle_indices=False, sampling_seed=0)
+    self.assertEqual(_epoch_roots(dataset), list(arrays['train_indices']))
+
+  def test_shuffle_differs_between_epochs(self):
+    arrays = _make_arrays()
+    dataset = _make_dataset(arrays, shuffle_indices=True, sampling_seed=0)
+    first_epoch = _epoch_roots(dataset)
+    second_epoch = _epoch_roots(dataset)
+    self.assertCountEqual(first_epoch, arrays['train_indices'])
+    self.assertCountEqual(second_epoch, arrays['train_indices'])
+    self.assertNotEqual(first_epoch, second_epoch)
+
+    # The sequence of epochs is reproducible from the seed.
+    dataset = _make_dataset(arrays, shuffle_indices=True, sampling_seed=0)
+    self.assertEqual(_epoch_roots(dataset), first_epoch)
+    self.assertEqual(_epoch_roots(dataset), second_epoch)
+
+  def test_sampling_differs_between_epochs(self):
+    dataset = _make_dataset(_make_arrays(), shuffle_indices=False,
+                            sampling_seed=0)
+    first_epoch = [graph.nodes['index'] for graph in dataset]
+    second_epoch = [graph.nodes['index'] for graph in dataset]
+    self.assertFalse(all(
+        a.shape == b.shape and np.all(a == b)
+        for a, b in zip(first_epoch, second_epoch)))
+
+
+class PropagateFeaturesTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    rng = np.random.RandomState(0)
+    self._index_csr = _random_csr(rng, 30, 50, 0.1)
+    self._features = rng.normal(size=(50, 6)).astype(np.float32)
+    # Two features per column block.
+    self._kwargs = dict(max_memory_bytes=2 * 50 * 4, row_block_size=7)
+    self._expected = data_utils.propagate_features(
+        self._index_csr, self._features, **self._kwargs)
+
+  def _propagate(self, features, output_path, resume):
+    return data_utils.propagate_features(
+        self._index_csr, features, output_path=output_path, resume=resume,
+        **self._kwargs)
+
+  def test_matches_dense_mean(self):
+    adjacency = self._index_csr.toarray() > 0
+    for row, neighbours in zip(self._expected, adjacency):
+      np.testing.assert_allclose(
+          row, self._features[neighbours].mean(axis=0), rtol=1e-5)
+
+  def test_resume_skips_completed_output(self):
+    output_path = self.create_tempdir().full_path + '/features.npy'
+    self._propagate(self._features, output_path, resume=False)
+    # The features are not read again.
+    output = self._propagate(np.zeros_like(self._features), output_path,
+                             resume=True)
+    np.testing.assert_array_equal(output, self._expected)
+    output = self._propagate(np.zeros_like(self._features), output_path,
+                             resume=False)
+    np.testing.assert_array_equal(output[~np.isnan(output)], 0)
+
+  def test_resume_completes_interrupted_output(self):
+    output_path = self.create_tempdir().full_path + '/features.npy'
+    self._propagate(self._features, output_path, resume=False)
+    # Interrupted after the first column block.
+    output = np.lib.format.open_memmap(output_path, mode='r+')
+    output[:, 2:] = 0
+    output.flush()
+    del output
+    np.save(output_path + '.progress.npy', 1)
+
+    output = self._propagate(self._features, output_path, resume=True)
+    np.testing.assert_array_equal(output, self._expected)
+
+
+class LoadCsrTest(absltest.TestCase):
+
+  def test_npz_and_csr_arrays_give_the_same_matrix(self):
+    csr = _random_csr(np.random.RandomState(0), 6, 9, 0.3)
+    path = self.create_tempdir().full_path + '/a_b_t.npz'
+    # Transposes were saved as CSC by earlier versions.
+    sp.save_npz(path, csr.T)
+    from_npz = data_utils.load_csr(path)
+    self.assertIsInstance(from_npz, sp.csr_matrix)
+    np.testing.assert_array_equal(from_npz.toarray(), csr.T.toarray())
+
+    data_utils.save_csr_arrays(path, csr.T.tocsr())
+    from_arrays = data_utils.load_csr(path)
+    self.assertEqual(from_arrays.shape, from_npz.shape)
+    np.testing.assert_array_equal(from_arrays.indptr, from_npz.indptr)
+    np.testing.assert_array_equal(from_arrays.indices, from_npz.indices)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -40,6 +40,8 @@ NUM_CLASSES = data_utils.NUM_CLASSES
 
 _MAX_DEPTH_IN_SUBGRAPH = 3
 
+_PADDING_STATS_LOG_INTERVAL = 1000
+
 
 class Batch(NamedTuple):
   """NamedTuple to represent batches of data."""
@@ -62,6 +64,9 @@ def build_dataset_iterator(
     ratio_unlabeled_data_to_labeled_data: float = 0.0,
     use_all_labels_when_not_training: bool = False,
     use_dummy_adjacencies: bool = False,
+    sampling_batch_size: Optional[int] = None,
+    sampling_seed: Optional[int] = None,
+    num_sampling_workers: int = 0,
 ):
   """Returns an iterator over Batches from the dataset."""
 
@@ -140,6 +145,9 @@ def build_dataset_iterator(
       ratio_unlabeled_data_to_labeled_data=ratio_unlabeled_data_to_labeled_data,
       max_nodes=dynamic_batch_size_config.n_node - 1,  # Keep space for pads.
       max_edges=dynamic_batch_size_config.n_edge,
+      sampling_batch_size=sampling_batch_size,
+      sampling_seed=sampling_seed,
+      num_sampling_workers=num_sampling_workers,
       **online_subsampling_kwargs)
   if debug:
     ds = ds.take(50)
@@ -149,12 +157,14 @@ def build_dataset_iterator(
 
   if is_training:
     ds = ds.shard(jax.process_count(), jax.process_index())
-    ds = ds.shuffle(buffer_size=1 if debug else 128)
+    ds = ds.shuffle(buffer_size=1 if debug else 128, seed=sampling_seed)
     ds = ds.repeat()
   ds = ds.prefetch(1 if debug else tf.data.experimental.AUTOTUNE)
   np_ds = iter(tfds.as_numpy(ds))
   batched_np_ds = batching_utils.dynamically_batch(
       np_ds,
+      padding_stats=batching_utils.PaddingStats(
+          log_interval=_PADDING_STATS_LOG_INTERVAL),
       **dynamic_batch_size_config,
   )
 
@@ -126,10 +126,19 @@ def _write_fused_edges(fused_paper_adjacency_matrix):
   edges_t_path = data_root / data_utils.FUSED_PAPER_EDGES_T_FILENAME
   edges_path.parent.mkdir(parents=True, exist_ok=True)
   edges_t_path.parent.mkdir(parents=True, exist_ok=True)
+  # Both stores hold the transpose as a CSR matrix, as for the other `_t`
+  # adjacencies.
+  fused_paper_adjacency_matrix_t = fused_paper_adjacency_matrix.T.tocsr()
   with open(edges_path, 'wb') as fid:
     sp.save_npz(fid, fused_paper_adjacency_matrix)
   with open(edges_t_path, 'wb') as fid:
-    sp.save_npz(fid, fused_paper_adjacency_matrix.T)
+    sp.save_npz(fid, fused_paper_adjacency_matrix_t)
+  # Memory-mappable copies, read by `data_utils.load_csr` when present.
+  shape = (data_utils.NUM_PAPERS, data_utils.NUM_PAPERS)
+  data_utils.save_csr_arrays(
+      edges_path, fused_paper_adjacency_matrix, shape=shape)
+  data_utils.save_csr_arrays(
+      edges_t_path, fused_paper_adjacency_matrix_t, shape=shape)
 
 
 def _write_fused_nodes(fused_node_labels):
@@ -0,0 +1,292 @@
+# Copyright 2021 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Multi-process subgraph sampling for MAG.
+
+Each worker process samples the subgraphs of a disjoint shard of the root
+paper indices. The adjacencies and the per-paper arrays are shared with the
+workers without copies: memory-mapped arrays are re-opened from their files,
+and in-memory arrays are placed in shared memory once per `SharedArrays`.
+Sampled graphs stream back to the consumer through a bounded queue.
+
+The roots are split into batches that are each sampled with their own random
+generator, so a seed gives the same graphs whether they are sampled in-process
+(`sample_graphs_in_process`) or by any number of workers.
+"""
+
+import mmap
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import queue as queue_lib
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Union
+
+from absl import logging
+import jraph
+import numpy as np
+
+# pylint: disable=g-bad-import-order
+import sub_sampler
+
+# Names of the adjacencies, in the order expected by `sub_sampler`.
+ADJACENCY_KEYS = (
+    'author_institution_index',
+    'institution_author_index',
+    'author_paper_index',
+    'paper_author_index',
+    'paper_paper_index',
+    'paper_paper_index_t',
+)
+
+_QUEUE_POLL_SECONDS = 1.0
+_STATS_INTERVAL_SECONDS = 60.0
+
+Seed = Union[None, int, np.random.SeedSequence]
+
+
+class _ArraySpec(NamedTuple):
+  """Describes how a worker can attach to a shared array."""
+  dtype: str
+  shape: Any
+  filename: Optional[str] = None
+  offset: int = 0
+  shared_memory_name: Optional[str] = None
+
+
+def _attach_array(spec: _ArraySpec, shared_memory_blocks: List[Any]):
+  if spec.filename is not None:
+    return np.memmap(spec.filename, dtype=spec.dtype, mode='r',
+                     offset=spec.offset, shape=spec.shape)
+  block = shared_memory.SharedMemory(name=spec.shared_memory_name)
+  # The block must outlive the array that views into it.
+  shared_memory_blocks.append(block)
+  return np.ndarray(spec.shape, dtype=spec.dtype, buffer=block.buf)
+
+
+class SharedArrays:
+  """Arrays that can be attached to from worker processes without copies.
+
+  Memory-mapped arrays are shared through their backing files; any other
+  array is copied once into a `multiprocessing.shared_memory` block, which is
+  released by `close`.
+  """
+
+  def __init__(self, arrays: Dict[str, Any]):
+    self._blocks = []
+    self._specs = {}
+    for key in ADJACENCY_KEYS:
+      csr = arrays[key]
+      self._specs[key] = (self._share(csr.indptr), self._share(csr.indices),
+                          tuple(csr.shape))
+    self._specs['paper_year'] = self._share(arrays['paper_year'])
+
+  def _share(self, array) -> _ArraySpec:
+    # Only whole memory maps (not views into them) map back onto their file.
+    if isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap):
+      return _ArraySpec(dtype=array.dtype.str, shape=array.shape,
+                        filename=array.filename, offset=array.offset)
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    self._blocks.append(block)
+    return _ArraySpec(dtype=array.dtype.str, shape=array.shape,
+                      shared_memory_name=block.name)
+
+  @property
+  def specs(self):
+    return self._specs
+
+  def close(self):
+    for block in self._blocks:
+      block.close()
+      block.unlink()
+    self._blocks = []
+
+
+def _split_into_batches(root_node_indices, sampling_batch_size, seed: Seed):
+  """Splits the roots into batches, each with its own seed sequence."""
+  if not isinstance(seed, np.random.SeedSequence):
+    seed = np.random.SeedSequence(seed)
+  root_node_indices = np.asarray(root_node_indices)
+  starts = range(0, root_node_indices.shape[0], sampling_batch_size)
+  # Unlike `seed.spawn`, this gives the same children however often it runs.
+  return [
+      (root_node_indices[start:start + sampling_batch_size],
+       np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (i,),
+                              pool_size=seed.pool_size))
+      for i, start in enumerate(starts)
+  ]
+
+
+def _sample_batch(roots, seed_sequence, adjacencies, paper_year,
+                  subsampler_kwargs):
+  return sub_sampler.subsample_graphs_batched(
+      roots,
+      *adjacencies,
+      paper_years=paper_year,
+      rng=np.random.default_rng(seed_sequence),
+      **subsampler_kwargs)
+
+
+def sample_graphs_in_process(
+    arrays: Dict[str, Any],
+    root_node_indices: np.ndarray,
+    sampling_batch_size: int = 64,
+    seed: Seed = None,
+    **subsampler_kwargs) -> Iterator[jraph.GraphsTuple]:
+  """Yields the subgraphs of all roots, sampled in this process.
+
+  Gives the same graphs as `sample_graphs_in_parallel` with the same seed and
+  sampling batch size, in the order of the roots.
+
+  Args:
+    arrays: Dictionary with the adjacencies and `paper_year`.
+    root_node_indices: Root paper indices to sample subgraphs for.
+    sampling_batch_size: Number of roots sampled per batched sampler call.
+    seed: Seed, or seed sequence, from which the generator of each batch of
+      roots is derived.
+    **subsampler_kwargs: Arguments for `sub_sampler.subsample_graphs_batched`.
+
+  Yields:
+    Sampled `jraph.GraphsTuple`s.
+  """
+  adjacencies = [arrays[key] for key in ADJACENCY_KEYS]
+  for roots, seed_sequence in _split_into_batches(
+      root_node_indices, sampling_batch_size, seed):
+    yield from _sample_batch(roots, seed_sequence, adjacencies,
+                             arrays['paper_year'], subsampler_kwargs)
+
+
+def _attach_arrays(specs, shared_memory_blocks):
+  """Rebuilds the adjacencies and paper years from their specs."""
+  adjacencies = []
+  for key in ADJACENCY_KEYS:
+    indptr_spec, indices_spec, shape = specs[key]
+    adjacencies.append(sub_sampler.CsrArrays(
+        indptr=_attach_array(indptr_spec, shared_memory_blocks),
+        indices=_attach_array(indices_spec, shared_memory_blocks),
+        shape=shape))
+  paper_year = _attach_array(specs['paper_year'], shared_memory_blocks)
+  return adjacencies, paper_year
+
+
+def _worker_main(worker_id: int,
+                 specs,
+                 batches,
+                 output_queue,
+                 subsampler_kwargs):
+  """Samples the subgraphs for one shard of root batches into `output_queue`."""
+  shared_memory_blocks = []
+  adjacencies, paper_year = _attach_arrays(specs, shared_memory_blocks)
+  start_time = time.time()
+  num_graphs = 0
+  for roots, seed_sequence in batches:
+    graphs = _sample_batch(roots, seed_sequence, adjacencies, paper_year,
+                           subsampler_kwargs)
+    num_graphs += len(graphs)
+    output_queue.put(('graphs', worker_id, graphs))
+  output_queue.put(('done', worker_id, (num_graphs, time.time() - start_time)))
+  del adjacencies, paper_year
+  for block in shared_memory_blocks:
+    block.close()
+
+
+def sample_graphs_in_parallel(
+    shared_arrays: SharedArrays,
+    root_node_indices: np.ndarray,
+    num_workers: int,
+    sampling_batch_size: int = 64,
+    queue_size: int = 64,
+    seed: Seed = None,
+    **subsampler_kwargs) -> Iterator[jraph.GraphsTuple]:
+  """Yields the subgraphs of all roots, sampled by a pool of processes.
+
+  The batches of roots are dealt round-robin into `num_workers` disjoint
+  shards. Graphs are yielded in the order they are produced, so the order
+  interleaves between workers. The workers are stopped when the consumer
+  closes the generator.
+
+  Args:
+    shared_arrays: Adjacencies and paper years shared with the workers.
+    root_node_indices: Root paper indices to sample subgraphs for.
+    num_workers: Number of worker processes.
+    sampling_batch_size: Number of roots sampled per batched sampler call.
+    queue_size: Maximum number of pending batches of graphs in the queue.
+    seed: Seed, or seed sequence, from which the generator of each batch of
+      roots is derived.
+    **subsampler_kwargs: Arguments for `sub_sampler.subsample_graphs_batched`.
+
+  Yields:
+    Sampled `jraph.GraphsTuple`s.
+  """
+  # Spawn, rather than fork, as the consumer typically runs TensorFlow threads.
+  context = mp.get_context('spawn')
+  output_queue = context.Queue(maxsize=queue_size)
+  batches = _split_into_batches(root_node_indices, sampling_batch_size, seed)
+  workers = [
+      context.Process(
+          target=_worker_main,
+          args=(worker_id, shared_arrays.specs, batches[worker_id::num_workers],
+                output_queue, subsampler_kwargs),
+          daemon=True)
+      for worker_id in range(num_workers)
+  ]
+  for worker in workers:
+    worker.start()
+
+  start_time = time.time()
+  last_stats_time = start_time
+  num_graphs_per_worker = np.zeros([num_workers], dtype=np.int64)
+  num_running = num_workers
+  try:
+    while num_running:
+      try:
+        message, worker_id, payload = output_queue.get(
+            timeout=_QUEUE_POLL_SECONDS)
+      except queue_lib.Empty:
+        for worker in workers:
+          if worker.exitcode not in (None, 0):
+            raise RuntimeError(
+                f'Sampling worker {worker.name} failed with exit code '
+                f'{worker.exitcode}.')
+        continue
+      if message == 'graphs':
+        num_graphs_per_worker[worker_id] += len(payload)
+        yield from payload
+      else:
+        num_running -= 1
+        num_graphs, elapsed = payload
+        logging.info('Sampling worker %d done: %d graphs in %.1fs '
+                     '(%.1f graphs/s).', worker_id, num_graphs, elapsed,
+                     num_graphs / max(elapsed, 1e-6))
+      now = time.time()
+      if now - last_stats_time > _STATS_INTERVAL_SECONDS:
+        last_stats_time = now
+        _log_throughput(num_graphs_per_worker, now - start_time)
+    _log_throughput(num_graphs_per_worker, time.time() - start_time)
+  finally:
+    for worker in workers:
+      if worker.is_alive():
+        worker.terminate()
+      worker.join()
+    output_queue.close()
+
+
+def _log_throughput(num_graphs_per_worker, elapsed):
+  elapsed = max(elapsed, 1e-6)
+  logging.info(
+      'Sampled %d graphs in %.1fs (%.1f graphs/s). Per worker graphs/s: %s',
+      num_graphs_per_worker.sum(), elapsed,
+      num_graphs_per_worker.sum() / elapsed,
+      ', '.join(f'{n / elapsed:.1f}' for n in num_graphs_per_worker))
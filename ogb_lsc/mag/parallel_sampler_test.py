@@ -0,0 +1,163 @@
+# Copyright 2021 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for parallel_sampler."""
+
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import jax.tree_util as tree
+import numpy as np
+import scipy.sparse as sp
+
+# pylint: disable=g-bad-import-order
+import parallel_sampler
+import sub_sampler
+
+_NUM_PAPERS = 60
+_NUM_AUTHORS = 25
+_NUM_INSTITUTIONS = 5
+
+_SUBSAMPLER_KWARGS = dict(
+    max_nodes=30,
+    max_edges=60,
+    max_nb_neighbours_per_type=[
+        [[4, 2, 0, 4], [0, 0, 0, 0], [0, 0, 0, 0]],
+        [[4, 2, 0, 4], [4, 0, 2, 0], [0, 0, 0, 0]],
+    ],
+    remove_future_nodes=True,
+)
+
+
+def _random_csr(rng, num_rows, num_cols, density):
+  return sp.csr_matrix(
+      rng.uniform(size=(num_rows, num_cols)) < density, dtype=np.float32)
+
+
+def _memmap_csr(csr, directory, name):
+  """Returns a `CsrArrays` over memory-mapped copies of the arrays of `csr`."""
+  arrays = {}
+  for key in ['indptr', 'indices']:
+    path = f'{directory}/{name}_{key}.npy'
+    np.save(path, np.asarray(getattr(csr, key), dtype=np.int64))
+    arrays[key] = np.load(path, mmap_mode='r')
+  return sub_sampler.CsrArrays(shape=csr.shape, **arrays)
+
+
+def _make_arrays(directory):
+  """Random adjacencies, half in memory and half memory-mapped."""
+  rng = np.random.RandomState(0)
+  paper_paper = _random_csr(rng, _NUM_PAPERS, _NUM_PAPERS, 0.1)
+  paper_author = _random_csr(rng, _NUM_PAPERS, _NUM_AUTHORS, 0.2)
+  author_institution = _random_csr(rng, _NUM_AUTHORS, _NUM_INSTITUTIONS, 0.4)
+  return {
+      'paper_paper_index': paper_paper,
+      'paper_paper_index_t': _memmap_csr(
+          paper_paper.T.tocsr(), directory, 'paper_paper_t'),
+      'paper_author_index': paper_author,
+      'author_paper_index': _memmap_csr(
+          paper_author.T.tocsr(), directory, 'author_paper'),
+      'author_institution_index': author_institution,
+      'institution_author_index': _memmap_csr(
+          author_institution.T.tocsr(), directory, 'institution_author'),
+      'paper_year': rng.randint(2000, 2020, size=_NUM_PAPERS),
+  }
+
+
+def _graphs_by_root(graphs):
+  graphs_by_root = {}
+  for graph in graphs:
+    root = int(graph.nodes['index'][0])
+    assert root not in graphs_by_root
+    graphs_by_root[root] = graph
+  return graphs_by_root
+
+
+def _flatten_specs(specs):
+  flat_specs = []
+  for spec in specs.values():
+    if isinstance(spec, parallel_sampler._ArraySpec):  # pylint: disable=protected-access
+      flat_specs.append(spec)
+    else:
+      flat_specs.extend(spec[:2])
+  return flat_specs
+
+
+class SampleGraphsInParallelTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._arrays = _make_arrays(self.create_tempdir().full_path)
+    self._shared_arrays = parallel_sampler.SharedArrays(self._arrays)
+    self.addCleanup(self._shared_arrays.close)
+    self._roots = np.random.RandomState(1).permutation(_NUM_PAPERS)[:45]
+
+  def _sample_in_parallel(self, num_workers, seed, **kwargs):
+    return parallel_sampler.sample_graphs_in_parallel(
+        self._shared_arrays, self._roots, num_workers=num_workers,
+        sampling_batch_size=4, seed=seed, **kwargs, **_SUBSAMPLER_KWARGS)
+
+  @parameterized.parameters(1, 3)
+  def test_matches_in_process_sampling(self, num_workers):
+    expected = list(parallel_sampler.sample_graphs_in_process(
+        self._arrays, self._roots, sampling_batch_size=4, seed=7,
+        **_SUBSAMPLER_KWARGS))
+    self.assertEqual([int(graph.nodes['index'][0]) for graph in expected],
+                     self._roots.tolist())
+
+    graphs_by_root = _graphs_by_root(self._sample_in_parallel(num_workers, 7))
+    self.assertCountEqual(graphs_by_root, self._roots.tolist())
+    for expected_graph in expected:
+      tree.tree_map(np.testing.assert_array_equal,
+                    graphs_by_root[int(expected_graph.nodes['index'][0])],
+                    expected_graph)
+
+  def test_seed_sequence_is_not_consumed(self):
+    seed_sequence = np.random.SeedSequence(7)
+    first = list(parallel_sampler.sample_graphs_in_process(
+        self._arrays, self._roots, sampling_batch_size=4, seed=seed_sequence,
+        **_SUBSAMPLER_KWARGS))
+    second = list(parallel_sampler.sample_graphs_in_process(
+        self._arrays, self._roots, sampling_batch_size=4, seed=seed_sequence,
+        **_SUBSAMPLER_KWARGS))
+    tree.tree_map(np.testing.assert_array_equal, first, second)
+
+  def test_early_stop_cleans_up_workers_and_shared_memory(self):
+    shared_memory_names = [
+        spec.shared_memory_name
+        for spec in _flatten_specs(self._shared_arrays.specs)
+        if spec.shared_memory_name is not None]
+    self.assertNotEmpty(shared_memory_names)
+
+    # A small queue, so that the workers block on it once the consumer stops.
+    graphs = self._sample_in_parallel(3, seed=0, queue_size=1)
+    next(graphs)
+    self.assertNotEmpty(mp.active_children())
+    graphs.close()
+    self.assertEmpty(mp.active_children())
+
+    # The shared arrays can still be used for later epochs.
+    self.assertLen(list(self._sample_in_parallel(2, seed=0)), len(self._roots))
+    self.assertEmpty(mp.active_children())
+
+    self._shared_arrays.close()
+    for name in shared_memory_names:
+      with self.assertRaises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+
+if __name__ == '__main__':
+  absltest.main()
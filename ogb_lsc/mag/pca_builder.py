@@ -35,6 +35,14 @@ _NUMBER_OF_PAPERS_TO_ESTIMATE_PCA_ON = 1000000  # None indicates all.
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string('data_root', None, 'Data root directory')
+flags.DEFINE_integer(
+    'feature_propagation_memory_gb', 8,
+    'Memory budget (GB) for paper/author feature columns when averaging '
+    'features to authors and institutions.')
+flags.DEFINE_boolean(
+    'resume', False,
+    'Reuses the paper, author and institution features that were already '
+    'written, and resumes partially written author/institution features.')
 
 
 def _sample_vectors(vectors, num_samples, seed=0):
@@ -110,48 +118,65 @@ def _read_adjacency_indices():
   )
 
 
-def _compute_author_pca_features(paper_pca_features, index_arrays):
+def _feature_propagation_kwargs(output_path):
+  return dict(
+      output_path=output_path,
+      max_memory_bytes=FLAGS.feature_propagation_memory_gb * 2**30,
+      resume=FLAGS.resume)
+
+
+def _compute_author_pca_features(paper_pca_features, index_arrays,
+                                 output_path):
   return data_utils.paper_features_to_author_features(
-      index_arrays['author_paper_index'], paper_pca_features)
+      index_arrays['author_paper_index'], paper_pca_features,
+      **_feature_propagation_kwargs(output_path))
 
 
-def _compute_institution_pca_features(author_pca_features, index_arrays):
+def _compute_institution_pca_features(author_pca_features, index_arrays,
+                                      output_path):
   return data_utils.author_features_to_institution_features(
-      index_arrays['institution_author_index'], author_pca_features)
+      index_arrays['institution_author_index'], author_pca_features,
+      **_feature_propagation_kwargs(output_path))
 
 
 def _write_array(path, array):
+  """Writes `array`, so that `path` only exists once it is complete."""
   path.parent.mkdir(parents=True, exist_ok=True)
-  with open(path, 'wb') as fid:
+  tmp_path = path.with_name(path.name + '.tmp')
+  with open(tmp_path, 'wb') as fid:
     np.save(fid, array)
+  tmp_path.rename(path)
 
 
-def main(unused_argv):
-  data_root = Path(FLAGS.data_root)
-
+def _compute_paper_pca_features(output_path):
+  if FLAGS.resume and output_path.exists():
+    logging.info('Reusing completed %s', output_path)
+    return np.load(output_path, mmap_mode='r')
   raw_paper_features = _read_raw_paper_features()
   principal_components = _get_principal_components(raw_paper_features)
   paper_pca_features = _project_features_onto_principal_components(
       raw_paper_features, principal_components)
-  del raw_paper_features
-  del principal_components
+  _write_array(output_path, paper_pca_features)
+  return paper_pca_features
+
+
+def main(unused_argv):
+  data_root = Path(FLAGS.data_root)
 
   paper_pca_path = data_root / data_utils.PCA_PAPER_FEATURES_FILENAME
   author_pca_path = data_root / data_utils.PCA_AUTHOR_FEATURES_FILENAME
   institution_pca_path = (
       data_root / data_utils.PCA_INSTITUTION_FEATURES_FILENAME)
   merged_pca_path = data_root / data_utils.PCA_MERGED_FEATURES_FILENAME
-  _write_array(paper_pca_path, paper_pca_features)
+  paper_pca_features = _compute_paper_pca_features(paper_pca_path)
 
   # Compute author and institution features from paper PCA features.
   index_arrays = _read_adjacency_indices()
-  author_pca_features = _compute_author_pca_features(paper_pca_features,
-                                                     index_arrays)
-  _write_array(author_pca_path, author_pca_features)
-
+  # These are written to (and returned as) memory-mapped files.
+  author_pca_features = _compute_author_pca_features(
+      paper_pca_features, index_arrays, author_pca_path)
   institution_pca_features = _compute_institution_pca_features(
-      author_pca_features, index_arrays)
-  _write_array(institution_pca_path, institution_pca_features)
+      author_pca_features, index_arrays, institution_pca_path)
 
   merged_pca_features = np.concatenate(
       [paper_pca_features, author_pca_features, institution_pca_features],
@@ -15,11 +15,23 @@
 """Utilities for subsampling the MAG dataset."""
 
 import collections
+from typing import Any, List, NamedTuple
 
 import jraph
 import numpy as np
 
 
+class CsrArrays(NamedTuple):
+  """Minimal CSR view, holding only what the subsamplers need.
+
+  Can be used in place of a `scipy.sparse.csr_matrix`, e.g. over memory-mapped
+  `indptr` and `indices` arrays.
+  """
+  indptr: np.ndarray
+  indices: np.ndarray
+  shape: Any
+
+
 def get_or_sample_row(node_id: int,
                       nb_neighbours: int,
                       csr_matrix, remove_duplicates: bool):
@@ -248,3 +260,391 @@ def subsample_graph(paper_id: int,
                            globals=np.array([0], dtype=np.int16),
                            n_node=sub_n_node.astype(dtype=np.int32),
                            n_edge=sub_n_edge.astype(dtype=np.int32))
+
+
+# Edge features for every (node_type, neighbour_type) pair, indexed as
+# `_EDGE_TYPE_FEATURES[node_type, neighbour_type]`.
+_EDGE_TYPE_FEATURES = np.stack([
+    np.stack([make_edge_type_feature(node_type, neighbour_type)
+              for neighbour_type in range(4)])
+    for node_type in range(3)
+])
+
+# Number of bits used for the original node index in the combined
+# (graph, type, node) keys used for deduplication.
+_KEY_NODE_BITS = 32
+
+
+def _segment_exclusive_cumsum(values, segment_ids, num_segments):
+  """Exclusive cumulative sum of `values` restarting at each segment.
+
+  Assumes that `segment_ids` is sorted.
+  """
+  values = np.asarray(values, dtype=np.int64)
+  cumsum = np.cumsum(values) - values
+  segment_starts = np.searchsorted(segment_ids, np.arange(num_segments))
+  segment_offsets = np.concatenate([cumsum, [0]])[segment_starts]
+  return cumsum - segment_offsets[segment_ids]
+
+
+def sample_rows_batched(node_ids,
+                        nb_neighbours: int,
+                        csr_matrix,
+                        remove_duplicates: bool,
+                        rng: np.random.Generator):
+  """Vectorized version of `get_or_sample_row` over many rows at once.
+
+  Follows the same sampling strategy as `get_or_sample_row` for every row.
+
+  Args:
+    node_ids: [num_rows] array of rows to sample from.
+    nb_neighbours: Number of neighbours to sample per row.
+    csr_matrix: CSR adjacency to sample from.
+    remove_duplicates: Whether to remove duplicates when sampling with
+      replacement.
+    rng: Random number generator used for sampling.
+
+  Returns:
+    A tuple `(row_positions, neighbours)` of flat arrays, with
+    `row_positions` indexing into `node_ids` (in increasing order) and
+    `neighbours` the sampled column indices, in per-row sampling order.
+  """
+  node_ids = np.asarray(node_ids, dtype=np.int64)
+  indptr = csr_matrix.indptr
+  valid = node_ids + 1 < indptr.shape[0]
+  safe_ids = np.where(valid, node_ids, 0)
+  lo = np.where(valid, indptr[safe_ids], 0).astype(np.int64)
+  hi = np.where(valid, indptr[safe_ids + 1], 0).astype(np.int64)
+  degrees = hi - lo
+
+  take_all = (degrees > 0) & (degrees <= nb_neighbours)
+  without_replacement = ((degrees > nb_neighbours) &
+                         (degrees < 5 * nb_neighbours))
+  with_replacement = degrees >= 5 * nb_neighbours
+
+  rows_list = []
+  inds_list = []
+
+  # Small neighbourhoods: take the entire row.
+  rows = np.nonzero(take_all)[0]
+  counts = degrees[rows]
+  row_positions = np.repeat(rows, counts)
+  inds_list.append(lo[row_positions] + _segment_arange(counts))
+  rows_list.append(row_positions)
+
+  # Medium neighbourhoods: random permutation of the row, truncated.
+  rows = np.nonzero(without_replacement)[0]
+  counts = degrees[rows]
+  row_positions = np.repeat(rows, counts)
+  offsets = _segment_arange(counts)
+  order = np.lexsort((rng.random(row_positions.shape[0]), row_positions))
+  row_positions = row_positions[order]
+  offsets = offsets[order]
+  keep = _segment_arange(counts) < nb_neighbours
+  rows_list.append(row_positions[keep])
+  inds_list.append(lo[row_positions[keep]] + offsets[keep])
+
+  # Large neighbourhoods: sample indices with replacement.
+  rows = np.nonzero(with_replacement)[0]
+  row_positions = np.repeat(rows, nb_neighbours)
+  inds = lo[row_positions] + rng.integers(
+      0, degrees[row_positions], size=row_positions.shape[0])
+  if remove_duplicates:
+    # Sorts within each row and drops repeats, matching `np.unique`.
+    order = np.lexsort((inds, row_positions))
+    row_positions = row_positions[order]
+    inds = inds[order]
+    keep = np.ones(inds.shape[0], dtype=bool)
+    keep[1:] = ((inds[1:] != inds[:-1]) |
+                (row_positions[1:] != row_positions[:-1]))
+    row_positions = row_positions[keep]
+    inds = inds[keep]
+  rows_list.append(row_positions)
+  inds_list.append(inds)
+
+  row_positions = np.concatenate(rows_list)
+  inds = np.concatenate(inds_list)
+  # Group by row, keeping the per-row sampling order.
+  order = np.argsort(row_positions, kind='stable')
+  return row_positions[order], csr_matrix.indices[inds[order]]
+
+
+def _segment_arange(counts):
+  """Concatenation of `np.arange(c)` for every `c` in `counts`."""
+  counts = np.asarray(counts, dtype=np.int64)
+  total = counts.sum()
+  starts = np.repeat(np.cumsum(counts) - counts, counts)
+  return np.arange(total, dtype=np.int64) - starts
+
+
+def subsample_graphs_batched(paper_ids,
+                             author_institution_csr,
+                             institution_author_csr,
+                             author_paper_csr,
+                             paper_author_csr,
+                             paper_paper_csr,
+                             paper_paper_transpose_csr,
+                             max_nb_neighbours_per_type,
+                             max_nodes=None,
+                             max_edges=None,
+                             paper_years=None,
+                             remove_future_nodes=False,
+                             deduplicate_nodes=False,
+                             rng=None) -> List[jraph.GraphsTuple]:
+  """Subsamples a graph around each of the given paper IDs.
+
+  Batched equivalent of `subsample_graph`: all subgraphs are expanded one hop
+  at a time, with the sampling, deduplication and budget bookkeeping done with
+  array operations over all roots at once. Each returned graph follows the same
+  node/edge ordering and budget semantics as `subsample_graph` (which expands
+  the same breadth-first order), up to the random draws of the sampler.
+
+  Args:
+    paper_ids: [num_graphs] array of root paper IDs.
+    author_institution_csr: Author to institution adjacency.
+    institution_author_csr: Institution to author adjacency.
+    author_paper_csr: Author to paper adjacency.
+    paper_author_csr: Paper to author adjacency.
+    paper_paper_csr: Paper to cited paper adjacency.
+    paper_paper_transpose_csr: Paper to citing paper adjacency.
+    max_nb_neighbours_per_type: Nested list with the number of neighbours to
+      sample, indexed as `[depth][node_type][neighbour_type]`.
+    max_nodes: Optional node budget per subgraph.
+    max_edges: Optional edge budget per subgraph.
+    paper_years: Optional array with the year of every paper.
+    remove_future_nodes: Whether to drop papers published after the root.
+    deduplicate_nodes: Whether to merge repeated nodes of the same type.
+    rng: Optional `np.random.Generator`. Subgraphs are a deterministic function
+      of the roots and the state of `rng`, so a seeded generator gives
+      reproducible batches.
+
+  Returns:
+    A list with one `jraph.GraphsTuple` per root paper, in input order.
+  """
+  if rng is None:
+    rng = np.random.default_rng()
+  paper_ids = np.asarray(paper_ids, dtype=np.int64)
+  num_graphs = paper_ids.shape[0]
+  graph_range = np.arange(num_graphs)
+  max_depth = len(max_nb_neighbours_per_type)
+  csrs = {
+      (0, 0): paper_paper_transpose_csr,  # Citing
+      (0, 1): paper_author_csr,
+      (0, 3): paper_paper_csr,  # Cited
+      (1, 0): author_paper_csr,
+      (1, 2): author_institution_csr,
+      (2, 1): institution_author_csr,
+  }
+  if paper_years is not None and remove_future_nodes:
+    root_paper_years = paper_years[paper_ids]
+  else:
+    root_paper_years = None
+
+  def make_keys(graph_ids, node_types, node_ids):
+    return (((graph_ids.astype(np.int64) * 3 + node_types) << _KEY_NODE_BITS) |
+            node_ids.astype(np.int64))
+
+  # Per graph state.
+  num_nodes = np.ones([num_graphs], dtype=np.int64)
+  num_edges = np.zeros([num_graphs], dtype=np.int64)
+  reached_edge_budget = np.zeros([num_graphs], dtype=bool)
+
+  # Known nodes, as sorted keys and the (latest) subgraph index for each key.
+  known_keys = make_keys(graph_range, np.zeros_like(graph_range), paper_ids)
+  known_indices = np.zeros([num_graphs], dtype=np.int64)
+  order = np.argsort(known_keys)
+  known_keys = known_keys[order]
+  known_indices = known_indices[order]
+
+  # Nodes and edges of all subgraphs, accumulated per hop.
+  node_graph_ids = [graph_range]
+  node_ids = [paper_ids]
+  node_types = [np.zeros([num_graphs], dtype=np.int64)]
+  node_depths = [np.zeros([num_graphs], dtype=np.int64)]
+  edge_graph_ids = []
+  edge_senders = []
+  edge_receivers = []
+  edge_features = []
+
+  # Frontier of nodes to expand, sorted by graph in breadth-first order.
+  frontier_graph_ids = graph_range
+  frontier_ids = paper_ids
+  frontier_indices = np.zeros([num_graphs], dtype=np.int64)
+  frontier_types = np.zeros([num_graphs], dtype=np.int64)
+
+  for depth in range(max_depth):
+    if not frontier_ids.shape[0]:
+      break
+
+    # STEP ONE: Sample neighbours for every (frontier node, neighbour type).
+    cand_frontier_pos = []
+    cand_neighbour_types = []
+    cand_ids = []
+    for (node_type, neighbour_type), csr in csrs.items():
+      nb_neighbours = max_nb_neighbours_per_type[depth][node_type][
+          neighbour_type]
+      if nb_neighbours <= 0:
+        continue
+      frontier_pos = np.nonzero(frontier_types == node_type)[0]
+      if not frontier_pos.shape[0]:
+        continue
+      row_positions, neighbours = sample_rows_batched(
+          frontier_ids[frontier_pos], nb_neighbours, csr,
+          deduplicate_nodes, rng)
+      frontier_pos = frontier_pos[row_positions]
+      if root_paper_years is not None and neighbour_type in [0, 3]:
+        graph_ids = frontier_graph_ids[frontier_pos]
+        keep = paper_years[neighbours] <= root_paper_years[graph_ids]
+        frontier_pos = frontier_pos[keep]
+        neighbours = neighbours[keep]
+      cand_frontier_pos.append(frontier_pos)
+      cand_neighbour_types.append(
+          np.full(frontier_pos.shape, neighbour_type, dtype=np.int64))
+      cand_ids.append(neighbours.astype(np.int64))
+
+    if not cand_ids:
+      break
+    cand_frontier_pos = np.concatenate(cand_frontier_pos)
+    cand_neighbour_types = np.concatenate(cand_neighbour_types)
+    cand_ids = np.concatenate(cand_ids)
+    # Sort into the order in which `subsample_graph` visits the candidates:
+    # by frontier node, then by neighbour type, then by sampling order.
+    order = np.lexsort((cand_neighbour_types, cand_frontier_pos))
+    cand_frontier_pos = cand_frontier_pos[order]
+    cand_neighbour_types = cand_neighbour_types[order]
+    cand_ids = cand_ids[order]
+    cand_graph_ids = frontier_graph_ids[cand_frontier_pos]
+    cand_types = cand_neighbour_types % 3
+    cand_keys = make_keys(cand_graph_ids, cand_types, cand_ids)
+    num_candidates = cand_ids.shape[0]
+
+    # STEP TWO: Decide which candidates create new nodes.
+    if deduplicate_nodes:
+      _, first_occurrence = np.unique(cand_keys, return_index=True)
+      is_new = np.zeros([num_candidates], dtype=bool)
+      is_new[first_occurrence] = True
+      pos = np.minimum(np.searchsorted(known_keys, cand_keys),
+                       known_keys.shape[0] - 1)
+      is_new &= known_keys[pos] != cand_keys
+    else:
+      is_new = np.ones([num_candidates], dtype=bool)
+    new_rank = _segment_exclusive_cumsum(is_new, cand_graph_ids, num_graphs)
+    num_nodes_before = num_nodes[cand_graph_ids] + new_rank
+    if max_nodes is not None:
+      is_added = is_new & (num_nodes_before < max_nodes)
+      # The node that exhausts the budget is added without an edge.
+      is_last_added = is_added & (num_nodes_before + 1 >= max_nodes)
+    else:
+      is_added = is_new
+      is_last_added = np.zeros([num_candidates], dtype=bool)
+    cand_indices = np.where(is_added, num_nodes_before, -1)
+
+    # Candidates that are not added connect to the latest node with their key.
+    all_keys = np.concatenate([known_keys, cand_keys[is_added]])
+    all_indices = np.concatenate([known_indices, cand_indices[is_added]])
+    order = np.lexsort((all_indices, all_keys))
+    all_keys = all_keys[order]
+    all_indices = all_indices[order]
+    is_latest = np.ones(all_keys.shape[0], dtype=bool)
+    is_latest[:-1] = all_keys[1:] != all_keys[:-1]
+    all_keys = all_keys[is_latest]
+    all_indices = all_indices[is_latest]
+    pos = np.minimum(np.searchsorted(all_keys, cand_keys),
+                     all_keys.shape[0] - 1)
+    found = all_keys[pos] == cand_keys
+    cand_indices = np.where(is_added, cand_indices,
+                            np.where(found, all_indices[pos], -1))
+    has_edge = np.where(is_added, ~is_last_added, found)
+
+    # STEP THREE: Truncate each graph at its edge budget.
+    num_edges_before = num_edges[cand_graph_ids] + _segment_exclusive_cumsum(
+        has_edge, cand_graph_ids, num_graphs)
+    if max_edges is not None:
+      is_processed = num_edges_before < max_edges
+      reached = is_processed & has_edge & (num_edges_before + 1 >= max_edges)
+      reached_edge_budget[cand_graph_ids[reached]] = True
+    else:
+      is_processed = np.ones([num_candidates], dtype=bool)
+    is_added &= is_processed
+    has_edge &= is_processed
+
+    # STEP FOUR: Record the new nodes and edges.
+    num_nodes += np.bincount(cand_graph_ids[is_added], minlength=num_graphs)
+    num_edges += np.bincount(cand_graph_ids[has_edge], minlength=num_graphs)
+    node_graph_ids.append(cand_graph_ids[is_added])
+    node_ids.append(cand_ids[is_added])
+    node_types.append(cand_types[is_added])
+    node_depths.append(np.full([np.sum(is_added)], depth + 1, dtype=np.int64))
+    edge_graph_ids.append(cand_graph_ids[has_edge])
+    edge_senders.append(cand_indices[has_edge])
+    edge_receivers.append(frontier_indices[cand_frontier_pos[has_edge]])
+    edge_features.append(_EDGE_TYPE_FEATURES[
+        frontier_types[cand_frontier_pos[has_edge]],
+        cand_neighbour_types[has_edge]])
+
+    new_keys = np.concatenate([known_keys, cand_keys[is_added]])
+    new_indices = np.concatenate([known_indices, cand_indices[is_added]])
+    order = np.argsort(new_keys, kind='stable')
+    known_keys = new_keys[order]
+    known_indices = new_indices[order]
+    if not deduplicate_nodes:
+      # Keep only the latest index for each key.
+      is_latest = np.ones(known_keys.shape[0], dtype=bool)
+      is_latest[:-1] = known_keys[1:] != known_keys[:-1]
+      known_keys = known_keys[is_latest]
+      known_indices = known_indices[is_latest]
+
+    # STEP FIVE: Enqueue the added nodes for the next hop.
+    expand = (is_added & ~is_last_added &
+              ~reached_edge_budget[cand_graph_ids])
+    frontier_graph_ids = cand_graph_ids[expand]
+    frontier_ids = cand_ids[expand]
+    frontier_indices = cand_indices[expand]
+    frontier_types = cand_types[expand]
+
+  # Stitch the graphs together.
+  node_graph_ids = np.concatenate(node_graph_ids)
+  node_order = np.argsort(node_graph_ids, kind='stable')
+  node_splits = np.cumsum(np.bincount(node_graph_ids,
+                                      minlength=num_graphs))[:-1]
+  node_ids = np.split(np.concatenate(node_ids)[node_order], node_splits)
+  node_types = np.split(np.concatenate(node_types)[node_order], node_splits)
+  node_depths = np.split(np.concatenate(node_depths)[node_order], node_splits)
+
+  if edge_graph_ids:
+    edge_graph_ids = np.concatenate(edge_graph_ids)
+    edge_senders = np.concatenate(edge_senders)
+    edge_receivers = np.concatenate(edge_receivers)
+    edge_features = np.concatenate(edge_features)
+  else:
+    edge_graph_ids = np.zeros([0], dtype=np.int64)
+    edge_senders = np.zeros([0], dtype=np.int64)
+    edge_receivers = np.zeros([0], dtype=np.int64)
+    edge_features = np.zeros([0, 7])
+  edge_order = np.argsort(edge_graph_ids, kind='stable')
+  edge_splits = np.cumsum(np.bincount(edge_graph_ids,
+                                      minlength=num_graphs))[:-1]
+  edge_senders = np.split(edge_senders[edge_order], edge_splits)
+  edge_receivers = np.split(edge_receivers[edge_order], edge_splits)
+  edge_features = np.split(edge_features[edge_order], edge_splits)
+
+  graphs = []
+  for i in range(num_graphs):
+    if max_nodes is not None:
+      assert node_ids[i].shape[0] <= max_nodes
+    if max_edges is not None:
+      assert edge_senders[i].shape[0] <= max_edges
+    sub_nodes = {
+        'index': node_ids[i].astype(np.int32),
+        'type': node_types[i].astype(np.int16),
+        'depth': node_depths[i].astype(np.int16),
+    }
+    graphs.append(jraph.GraphsTuple(
+        nodes=sub_nodes,
+        edges=edge_features[i].astype(np.float16),
+        senders=edge_senders[i].astype(np.int32),
+        receivers=edge_receivers[i].astype(np.int32),
+        globals=np.array([0], dtype=np.int16),
+        n_node=np.array([node_ids[i].shape[0]], dtype=np.int32),
+        n_edge=np.array([edge_senders[i].shape[0]], dtype=np.int32)))
+  return graphs
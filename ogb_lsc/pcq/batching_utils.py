@@ -0,0 +1 @@
+../mag/batching_utils.py
\ No newline at end of file
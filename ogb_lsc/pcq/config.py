@@ -108,6 +108,8 @@ def get_config(debug: bool = False) -> config_dict.ConfigDict:
                       'n_node': 256 if debug else 16 * training_batch_size,
                       'n_edge': 512 if debug else 40 * training_batch_size,
                       'n_graph': 2 if debug else training_batch_size,
+                      # Window size for best-fit packing; 0 batches greedily.
+                      'lookahead': 0,
                   },),
               evaluation=dict(
                   split='valid',
@@ -115,6 +117,7 @@ def get_config(debug: bool = False) -> config_dict.ConfigDict:
                       n_node=256 if debug else 16 * eval_batch_size,
                       n_edge=512 if debug else 40 * eval_batch_size,
                       n_graph=2 if debug else eval_batch_size,
+                      lookahead=0,
                   )))))
 
   ## Training loop config.
@@ -34,6 +34,8 @@ import conformer_utils
 import datasets
 
 
+_PADDING_STATS_LOG_INTERVAL = 1000
+
 curry = lambda f: functools.partial(functools.partial, f)
 
 
@@ -131,6 +133,9 @@ def build_dataset_iterator(
       n_node=dynamic_batch_size_config.n_node + 1,
       n_edge=dynamic_batch_size_config.n_edge,
       n_graph=dynamic_batch_size_config.n_graph + 1,
+      lookahead=dynamic_batch_size_config.get("lookahead", 0),
+      padding_stats=batching_utils.PaddingStats(
+          log_interval=_PADDING_STATS_LOG_INTERVAL),
   )
 
   if is_training:
@@ -13,7 +13,7 @@
 # limitations under the License.
 """Tokenizer implementation mapping strings to their UTF-8 bytes."""
 
-from typing import Union
+from typing import Sequence, Tuple, Union
 import numpy as np
 
 
@@ -36,6 +36,30 @@ class BytesTokenizer:
     encoded = encoded + self._num_reserved_tokens
     return encoded.astype(np.int32)
 
+  def to_int_batch(
+      self, inputs: Sequence[Union[str, bytes]]
+  ) -> Tuple[np.ndarray, np.ndarray]:
+    """Encodes a batch of strings at once.
+
+    Args:
+      inputs: Sequence of strings or bytes.
+    Returns:
+      A tuple of arrays of shape [len(inputs), max_length]: the tokens, padded
+      with `pad_token`, and a mask that is 1 for tokens and 0 for padding.
+    """
+    inputs = [x.encode('utf-8') if isinstance(x, str) else x for x in inputs]
+    lengths = np.array([len(x) for x in inputs], dtype=np.int64)
+    max_length = lengths.max() if len(inputs) else 0
+    mask = np.arange(max_length)[None, :] < lengths[:, None]
+    encoded = np.full(mask.shape, self.pad_token, dtype=np.int32)
+    encoded[mask] = np.frombuffer(b''.join(inputs), np.uint8)
+    encoded[mask] += self._num_reserved_tokens
+    return encoded, mask.astype(np.int32)
+
+  @property
+  def num_reserved_tokens(self) -> int:
+    return self._num_reserved_tokens
+
   @property
   def vocab_size(self) -> int:
     return 256 + self._num_reserved_tokens
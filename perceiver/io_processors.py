@@ -363,15 +363,20 @@ class ImagePreprocessor(hk.Module):
       inputs = jnp.reshape(
           inputs, [batch_size, np.prod(index_dims), -1])
 
-    # Construct the position encoding.
+    # Construct the position encoding. Without explicit positions it is the
+    # same for every example, so build it once and broadcast it.
     pos_enc = self._positional_encoding_ctor(
-        index_dims=index_dims)(batch_size=batch_size, pos=pos)
+        index_dims=index_dims)(
+            batch_size=None if pos is None else batch_size, pos=pos)
 
     for i in range(0, self._n_extra_pos_mlp):
       pos_enc += hk.Linear(pos_enc.shape[-1])(pos_enc)
       if i < (self._n_extra_pos_mlp-1):
         pos_enc = jax.nn.relu(pos_enc)
 
+    if pos is None:
+      pos_enc = jnp.broadcast_to(pos_enc[None], (batch_size,) + pos_enc.shape)
+
     if not network_input_is_1d:
       # Reshape pos to match the input feature shape
       # if the network takes non-1D inputs
@@ -569,15 +574,20 @@ class AudioPreprocessor(hk.Module):
     batch_size = inputs.shape[0]
     index_dims = inputs.shape[1:-1]
 
-    # Construct the position encoding.
+    # Construct the position encoding. Without explicit positions it is the
+    # same for every example, so build it once and broadcast it.
     pos_enc = self._positional_encoding_ctor(
-        index_dims=index_dims)(batch_size=batch_size, pos=pos)
+        index_dims=index_dims)(
+            batch_size=None if pos is None else batch_size, pos=pos)
 
     for i in range(0, self._n_extra_pos_mlp):
       pos_enc += hk.Linear(pos_enc.shape[-1])(pos_enc)
       if i < (self._n_extra_pos_mlp-1):
         pos_enc = jax.nn.relu(pos_enc)
 
+    if pos is None:
+      pos_enc = jnp.broadcast_to(pos_enc[None], (batch_size,) + pos_enc.shape)
+
     if self._concat_or_add_pos == 'concat':
       inputs_with_pos = jnp.concatenate([inputs, pos_enc], axis=-1)
     elif self._concat_or_add_pos == 'add':
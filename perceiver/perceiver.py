@@ -30,7 +30,8 @@ from perceiver import position_encoding
 #  -----------------------------------------------------------
 
 
-def attend(q, k, v, dropout_prob=0.0, attention_mask=None):
+def attend(q, k, v, dropout_prob=0.0, attention_mask=None,
+           query_chunk_size=None, kv_chunk_size=None):
   """Computes multi-head attention using a query, key and value.
 
   Args:
@@ -40,9 +41,19 @@ def attend(q, k, v, dropout_prob=0.0, attention_mask=None):
     dropout_prob: dropout probability on the attention weights.
     attention_mask: Array of shape [batch, q_indices, kv_indices] indicating
       which attentions are valid
+    query_chunk_size: If set, queries are processed in blocks of this size, see
+      `chunked_attend`.
+    kv_chunk_size: If set, keys and values are processed in blocks of this
+      size, see `chunked_attend`.
   Returns:
     Output of the attention with shape [batch, q_indices, hiddens]
   """
+  if query_chunk_size is not None or kv_chunk_size is not None:
+    return chunked_attend(q, k, v, dropout_prob=dropout_prob,
+                          attention_mask=attention_mask,
+                          query_chunk_size=query_chunk_size,
+                          kv_chunk_size=kv_chunk_size)
+
   batch, q_indices, num_heads, q_head_dim = q.shape
   _, _, _, v_head_dim = v.shape
   hiddens = num_heads * v_head_dim
@@ -78,6 +89,116 @@ def attend(q, k, v, dropout_prob=0.0, attention_mask=None):
   return summed
 
 
+def _split_chunks(x, chunk_size, axis=1):
+  """Pads `axis` to a multiple of chunk_size and moves the chunks to axis 0."""
+  num_chunks = -(-x.shape[axis] // chunk_size)
+  padding = [(0, 0)] * x.ndim
+  padding[axis] = (0, num_chunks * chunk_size - x.shape[axis])
+  x = jnp.pad(x, padding)
+  x = jnp.reshape(x, x.shape[:axis] + (num_chunks, chunk_size) +
+                  x.shape[axis + 1:])
+  return jnp.moveaxis(x, axis, 0)
+
+
+def chunked_attend(q, k, v, dropout_prob=0.0, attention_mask=None,
+                   query_chunk_size=None, kv_chunk_size=None):
+  """Computes the same attention as `attend`, in blocks of queries and keys.
+
+  Query blocks are processed one at a time with `jax.lax.map`. Within a query
+  block, the softmax is accumulated online over blocks of keys and values with
+  `jax.lax.scan`, keeping a running maximum and normalizer, so at most a
+  [batch, num_heads, query_chunk_size, kv_chunk_size] block of attention
+  weights is materialized however many queries and keys there are.
+
+  Args:
+    q: Query with shape [batch, q_indices, num_heads, head_dim].
+    k: Key with shape [batch, kv_indices, num_heads, head_dim].
+    v: Value with shape [batch, kv_indices, num_heads, head_dim].
+    dropout_prob: dropout probability on the attention weights.
+    attention_mask: Array of shape [batch, q_indices, kv_indices] indicating
+      which attentions are valid
+    query_chunk_size: Number of queries per block. Defaults to all queries.
+    kv_chunk_size: Number of keys and values per block. Defaults to all keys.
+  Returns:
+    Output of the attention with shape [batch, q_indices, hiddens]
+  """
+  batch, q_indices, num_heads, q_head_dim = q.shape
+  _, kv_indices, _, v_head_dim = v.shape
+  hiddens = num_heads * v_head_dim
+  query_chunk_size = min(query_chunk_size or q_indices, q_indices)
+  kv_chunk_size = min(kv_chunk_size or kv_indices, kv_indices)
+
+  scale = 1. / math.sqrt(q_head_dim)
+  dtype = jnp.result_type(q, k)
+  large_k = jnp.array(1e4 if dtype == jnp.float16 else 1e30, dtype=dtype)
+
+  # [num_chunks, batch, chunk_size, ...]
+  q_chunks = _split_chunks(q, query_chunk_size)
+  k_chunks = _split_chunks(k, kv_chunk_size)
+  v_chunks = _split_chunks(v, kv_chunk_size)
+  num_q_chunks = q_chunks.shape[0]
+  num_kv_chunks = k_chunks.shape[0]
+  # Keys added by padding get no weight.
+  kv_valid = _split_chunks(
+      jnp.ones([1, kv_indices], dtype=bool), kv_chunk_size)[:, 0]
+  if attention_mask is not None:
+    # [num_q_chunks, num_kv_chunks, batch, query_chunk_size, kv_chunk_size]
+    mask_chunks = jnp.moveaxis(_split_chunks(
+        _split_chunks(attention_mask, query_chunk_size, axis=1),
+        kv_chunk_size, axis=3), 0, 1)
+  else:
+    mask_chunks = None
+  if dropout_prob > 0:
+    rngs = jax.random.split(hk.next_rng_key(), num_q_chunks)
+  else:
+    rngs = None
+
+  def attend_query_chunk(args):
+    q_chunk, mask_chunk, rng = args
+    if rng is not None:
+      rng = jax.random.split(rng, num_kv_chunks)
+
+    def kv_step(carry, xs):
+      summed, normalizer, running_max = carry
+      k_chunk, v_chunk, valid, mask, kv_rng = xs
+      attention = jnp.einsum('bthd,bThd->bhtT', q_chunk, k_chunk) * scale
+      if mask is not None:
+        attention = jnp.where(mask[:, None, :, :], attention, -large_k)
+      attention = jnp.where(valid, attention, -jnp.inf)
+
+      new_max = jnp.maximum(running_max, jnp.max(attention, axis=-1))
+      weights = jnp.exp(attention - new_max[..., None])
+      correction = jnp.exp(running_max - new_max)
+      normalizer = normalizer * correction + jnp.sum(weights, axis=-1)
+      if kv_rng is not None:
+        weights = hk.dropout(kv_rng, dropout_prob, weights)
+      summed = (summed * correction[..., None] +
+                jnp.einsum('bhtT,bThd->bhtd', weights, v_chunk))
+      return (summed, normalizer, new_max), None
+
+    stats_shape = [batch, num_heads, query_chunk_size]
+    init = (jnp.zeros(stats_shape + [v_head_dim], dtype=dtype),
+            jnp.zeros(stats_shape, dtype=dtype),
+            jnp.full(stats_shape, -jnp.inf, dtype=dtype))
+    (summed, normalizer, _), _ = jax.lax.scan(
+        kv_step, init, (k_chunks, v_chunks, kv_valid, mask_chunk, rng))
+    summed /= normalizer[..., None]
+    return jnp.reshape(jnp.moveaxis(summed, 1, 2),
+                       [batch, query_chunk_size, hiddens])
+
+  summed = jax.lax.map(attend_query_chunk, (q_chunks, mask_chunks, rngs))
+  summed = jnp.reshape(jnp.moveaxis(summed, 0, 1),
+                       [batch, num_q_chunks * query_chunk_size, hiddens])
+  summed = summed[:, :q_indices]
+
+  if attention_mask is not None:
+    # As in `attend`, force zeros where all attended tokens are masked.
+    wipe_attn = jnp.all(
+        attention_mask == 0, axis=2, keepdims=True)  # shape (B, T, 1)
+    summed = jnp.where(wipe_attn, jnp.zeros_like(summed), summed)
+  return summed
+
+
 def conv_1d(
     output_channels,
     init_scale=1.0,
@@ -121,6 +242,8 @@ class Attention(hk.Module):
                qk_channels=None,
                v_channels=None,
                output_channels=None,
+               query_chunk_size=None,
+               kv_chunk_size=None,
                name=None):
     super(Attention, self).__init__(name=name)
     self._num_heads = num_heads
@@ -134,6 +257,10 @@ class Attention(hk.Module):
     self._v_channels = v_channels
     self._output_channels = output_channels
 
+    # If set, attention is computed in blocks to bound its memory use.
+    self._query_chunk_size = query_chunk_size
+    self._kv_chunk_size = kv_chunk_size
+
   def __call__(self, inputs_q, inputs_kv, attention_mask=None):
     # Q and K must have the same number of channels.
     # Default to preserving Q's input's shape.
@@ -170,7 +297,9 @@ class Attention(hk.Module):
     v = jnp.reshape(v, [batch, kv_time, self._num_heads, v_channels_per_head])
 
     result = attend(q, k, v, dropout_prob=self._dropout_prob,
-                    attention_mask=attention_mask)
+                    attention_mask=attention_mask,
+                    query_chunk_size=self._query_chunk_size,
+                    kv_chunk_size=self._kv_chunk_size)
     return conv_1d(
         self._output_channels,
         with_bias=self._with_final_bias,
@@ -268,6 +397,8 @@ class CrossAttention(hk.Module):
                use_query_residual=True,
                qk_channels=None,
                v_channels=None,
+               query_chunk_size=None,
+               kv_chunk_size=None,
                name=None):
     super(CrossAttention, self).__init__(name=name)
     self._widening_factor = widening_factor
@@ -280,6 +411,8 @@ class CrossAttention(hk.Module):
     self._use_query_residual = use_query_residual
     self._qk_channels = qk_channels
     self._v_channels = v_channels
+    self._query_chunk_size = query_chunk_size
+    self._kv_chunk_size = kv_chunk_size
 
   def __call__(self,
                inputs_q,
@@ -311,7 +444,9 @@ class CrossAttention(hk.Module):
         dropout_prob=dropout_attn_prob,
         qk_channels=qk_channels,
         v_channels=v_channels,
-        output_channels=output_channels)(layer_norm(inputs_q),
+        output_channels=output_channels,
+        query_chunk_size=self._query_chunk_size,
+        kv_chunk_size=self._kv_chunk_size)(layer_norm(inputs_q),
                                          layer_norm(inputs_kv),
                                          attention_mask=attention_mask)
     attention = hk.dropout(hk.next_rng_key(), dropout_prob, attention)
@@ -536,6 +671,7 @@ class BasicDecoder(AbstractPerceiverDecoder):
                num_heads=1,
                name='basic_decoder',
                final_project=True,
+               query_chunk_size=None,
                **position_encoding_kwargs):
     super().__init__(name=name)
     self._position_encoding_type = position_encoding_type
@@ -560,6 +696,9 @@ class BasicDecoder(AbstractPerceiverDecoder):
     self._v_channels = v_channels
     self._final_project = final_project
     self._num_heads = num_heads
+    # If set, the cross-attention attends from blocks of this many queries, so
+    # its memory use doesn't grow with the number of outputs.
+    self._query_chunk_size = query_chunk_size
 
     self._concat_preprocessed_input = concat_preprocessed_input
 
@@ -614,7 +753,8 @@ class BasicDecoder(AbstractPerceiverDecoder):
         shape_for_attn='kv',
         qk_channels=self._qk_channels,
         v_channels=self._v_channels,
-        use_query_residual=self._use_query_residual)
+        use_query_residual=self._use_query_residual,
+        query_chunk_size=self._query_chunk_size)
     final_layer = hk.Linear(
         self._output_num_channels, w_init=self._output_w_init, name='output')
     output = decoding_cross_attn(query, z, is_training=is_training,
@@ -0,0 +1,78 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for perceiver."""
+
+import haiku as hk
+import jax
+import numpy as np
+
+from perceiver import perceiver
+
+
+def _random_qkv(rng, batch=2, q_indices=13, kv_indices=11, num_heads=3):
+  q = rng.normal(size=(batch, q_indices, num_heads, 4)).astype(np.float32)
+  k = rng.normal(size=(batch, kv_indices, num_heads, 4)).astype(np.float32)
+  v = rng.normal(size=(batch, kv_indices, num_heads, 5)).astype(np.float32)
+  return q, k, v
+
+
+def test_chunked_attend():
+  rng = np.random.RandomState(0)
+  q, k, v = _random_qkv(rng)
+  attention_mask = rng.uniform(size=(2, 13, 11)) > 0.3
+  attention_mask[0, 4] = False  # Fully masked query.
+
+  for mask in [None, attention_mask]:
+    expected = perceiver.attend(q, k, v, attention_mask=mask)
+    for query_chunk_size, kv_chunk_size in [(13, None), (4, None), (1, 3),
+                                            (None, 5), (20, 20)]:
+      output = perceiver.attend(q, k, v, attention_mask=mask,
+                                query_chunk_size=query_chunk_size,
+                                kv_chunk_size=kv_chunk_size)
+      assert output.shape == (2, 13, 15)
+      np.testing.assert_allclose(output, expected, atol=1e-5)
+
+
+def test_chunked_attend_dropout():
+  q, k, v = _random_qkv(np.random.RandomState(0))
+  attend = hk.transform(lambda: perceiver.attend(  # pytype: disable=wrong-arg-types
+      q, k, v, dropout_prob=0.5, query_chunk_size=4, kv_chunk_size=3))
+  output = attend.apply({}, jax.random.PRNGKey(0))
+  assert output.shape == (2, 13, 15)
+  assert np.all(np.isfinite(output))
+
+
+def test_basic_decoder_query_chunks():
+  rng = np.random.RandomState(0)
+  inputs = rng.normal(size=(2, 7, 16)).astype(np.float32)
+  z = rng.normal(size=(2, 5, 8)).astype(np.float32)
+
+  def decode(query_chunk_size):
+    decoder = perceiver.BasicDecoder(
+        output_num_channels=3, output_index_dims=(6, 5), num_z_channels=8,
+        position_encoding_type='fourier',
+        fourier_position_encoding_kwargs=dict(
+            num_bands=4, max_resolution=(6, 5), concat_pos=True,
+            sine_only=False),
+        query_chunk_size=query_chunk_size)
+    query = decoder.decoder_query(inputs)
+    return decoder(query, z, is_training=False)
+
+  dense = hk.transform(lambda: decode(None))
+  chunked = hk.transform(lambda: decode(7))
+  params = dense.init(jax.random.PRNGKey(0))
+  expected = dense.apply(params, jax.random.PRNGKey(1))
+  output = chunked.apply(params, jax.random.PRNGKey(1))
+  assert output.shape == (2, 30, 3)
+  np.testing.assert_allclose(output, expected, atol=1e-5)
@@ -150,11 +150,42 @@ def _check_or_build_spatial_positions(pos, index_dims, batch_size):
   return pos
 
 
+@functools.lru_cache(maxsize=32)
+def _cached_fourier_features(index_dims, num_bands, max_resolution,
+                             concat_pos, sine_only, dtype):
+  """Returns Fourier features of the linear positions as a NumPy constant.
+
+  The features only depend on the arguments, so they are computed once, even
+  when called while tracing, and reused by later calls and traces.
+
+  Args:
+    index_dims: Tuple giving the spatial/index size of the data.
+    num_bands: The number of bands (K) to use.
+    max_resolution: Tuple giving the maximum resolution for each dimension.
+    concat_pos: Concatenate the input position encoding to the Fourier features?
+    sine_only: Whether to use a single phase (sin) or two (sin/cos) for each
+      frequency band.
+    dtype: NumPy dtype of the features.
+  Returns:
+    A read-only array of shape [prod(index_dims), n_channels].
+  """
+  with jax.ensure_compile_time_eval():
+    pos = build_linear_positions(index_dims)
+    pos = jnp.reshape(pos, [np.prod(index_dims), -1])
+    features = generate_fourier_features(
+        pos, num_bands=num_bands, max_resolution=max_resolution,
+        concat_pos=concat_pos, sine_only=sine_only)
+  features = np.asarray(features, dtype=dtype)
+  features.setflags(write=False)
+  return features
+
+
 class FourierPositionEncoding(AbstractPositionEncoding):
   """Fourier (Sinusoidal) position encoding."""
 
   def __init__(self, index_dims, num_bands, concat_pos=True,
-               max_resolution=None, sine_only=False, name=None):
+               max_resolution=None, sine_only=False, dtype=jnp.float32,
+               name=None):
     super(FourierPositionEncoding, self).__init__(name=name)
     self._num_bands = num_bands
     self._concat_pos = concat_pos
@@ -162,8 +193,20 @@ class FourierPositionEncoding(AbstractPositionEncoding):
     self._index_dims = index_dims
     # Use the index dims as the maximum resolution if it's not provided.
     self._max_resolution = max_resolution or index_dims
+    self._dtype = dtype
 
   def __call__(self, batch_size, pos=None):
+    if pos is None:
+      # The encoding is identical for every example, so use a cached constant
+      # and broadcast it over the batch rather than building copies.
+      pos_enc = jnp.asarray(_cached_fourier_features(
+          tuple(self._index_dims), self._num_bands,
+          tuple(self._max_resolution), self._concat_pos, self._sine_only,
+          np.dtype(self._dtype)))
+      if batch_size is not None:
+        pos_enc = jnp.broadcast_to(pos_enc[None], (batch_size,) + pos_enc.shape)
+      return pos_enc
+
     pos = _check_or_build_spatial_positions(pos, self._index_dims, batch_size)
     build_ff_fn = functools.partial(
         generate_fourier_features,
@@ -183,6 +226,15 @@ class PositionEncodingProjector(AbstractPositionEncoding):
     self._base_position_encoding = base_position_encoding
 
   def __call__(self, batch_size, pos=None):
+    if pos is None:
+      # Project the encoding once, not once per example.
+      base_pos = self._base_position_encoding(None, pos)
+      projected_pos = hk.Linear(output_size=self._output_size)(base_pos)
+      if batch_size is not None:
+        projected_pos = jnp.broadcast_to(
+            projected_pos[None], (batch_size,) + projected_pos.shape)
+      return projected_pos
+
     base_pos = self._base_position_encoding(batch_size, pos)
     projected_pos = hk.Linear(output_size=self._output_size)(base_pos)
     return projected_pos
@@ -0,0 +1,52 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for position_encoding."""
+
+import haiku as hk
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from perceiver import position_encoding
+
+
+def _fourier_encoding(batch_size, pos=None):
+  return position_encoding.FourierPositionEncoding(
+      index_dims=(5, 7), num_bands=3, max_resolution=(10, 14))(
+          batch_size=batch_size, pos=pos)
+
+
+def test_cached_fourier_position_encoding():
+  linear_pos = jnp.reshape(
+      position_encoding.build_linear_positions((5, 7)), [1, 35, 2])
+  encode = hk.without_apply_rng(hk.transform(_fourier_encoding))
+  expected = encode.apply({}, 2, pos=jnp.tile(linear_pos, [2, 1, 1]))
+
+  output = jax.jit(encode.apply, static_argnums=1)({}, 2)
+  assert output.shape == (2, 35, 2 + 2 * 2 * 3)
+  np.testing.assert_allclose(output, expected, atol=1e-6)
+  np.testing.assert_allclose(encode.apply({}, None), expected[0], atol=1e-6)
+
+
+def test_projected_position_encoding():
+  def encode(batch_size):
+    return position_encoding.build_position_encoding(
+        'fourier', index_dims=(5, 7), project_pos_dim=4,
+        fourier_position_encoding_kwargs=dict(num_bands=3))(batch_size)
+
+  encode = hk.without_apply_rng(hk.transform(encode))
+  params = encode.init(jax.random.PRNGKey(0), 3)
+  output = encode.apply(params, 3)
+  assert output.shape == (3, 35, 4)
+  np.testing.assert_allclose(output[1], encode.apply(params, None), atol=1e-6)
@@ -0,0 +1,319 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming byte-level text pipeline for masked language modelling.
+
+UTF-8 text files are read in large blocks and tokenized with NumPy, one block
+at a time. Documents are packed into fixed-length rows separated by SEP tokens,
+and BERT-style masking is applied to each batch of rows as it is produced.
+"""
+
+import queue
+import threading
+from typing import (Generator, Iterable, Iterator, Mapping, Optional, Sequence,
+                    Text, Tuple)
+
+import numpy as np
+
+from perceiver import bytes_tokenizer
+
+
+Batch = Mapping[Text, np.ndarray]
+
+SEQUENCE_LENGTH = 2048
+
+
+def read_blocks(
+    paths: Sequence[Text],
+    *,
+    read_size: int = 1 << 24,
+    document_separator: bytes = b'\n',
+    repeat: bool = False,
+) -> Generator[np.ndarray, None, None]:
+  """Streams the bytes of text files as uint8 arrays.
+
+  The end of each file is also the end of a document, so it is followed by a
+  `document_separator`.
+
+  Args:
+    paths: Text files to read, in order.
+    read_size: Number of bytes per block.
+    document_separator: Byte separating documents within a file.
+    repeat: Whether to loop over the files forever.
+  Yields:
+    Arrays of bytes of at most `read_size` elements.
+  """
+  separator = np.frombuffer(document_separator, np.uint8)
+  while True:
+    for path in paths:
+      with open(path, 'rb') as f:
+        while True:
+          block = f.read(read_size)
+          if not block:
+            break
+          yield np.frombuffer(block, np.uint8)
+      yield separator
+    if not repeat:
+      return
+
+
+def tokenize_blocks(
+    blocks: Iterable[np.ndarray],
+    tokenizer: bytes_tokenizer.BytesTokenizer,
+    *,
+    document_separator: bytes = b'\n',
+) -> Generator[np.ndarray, None, None]:
+  """Maps blocks of bytes to tokens, replacing separators with SEP tokens.
+
+  Empty documents are dropped, i.e. runs of separators give a single SEP token,
+  including across block boundaries, and the stream never starts with SEP.
+
+  Args:
+    blocks: Arrays of bytes.
+    tokenizer: The tokenizer whose token ids to use.
+    document_separator: Byte separating documents.
+  Yields:
+    int32 arrays of tokens.
+  """
+  if len(document_separator) != 1:
+    raise ValueError('document_separator must be a single byte, got '
+                     f'{document_separator!r}.')
+  separator = document_separator[0]
+  previous_is_separator = True
+  for block in blocks:
+    if not block.size:
+      continue
+    is_separator = block == separator
+    tokens = block.astype(np.int32) + tokenizer.num_reserved_tokens
+    tokens[is_separator] = tokenizer.sep_token
+    follows_separator = np.empty_like(is_separator)
+    follows_separator[0] = previous_is_separator
+    follows_separator[1:] = is_separator[:-1]
+    previous_is_separator = is_separator[-1]
+    yield tokens[~(is_separator & follows_separator)]
+
+
+def pack_rows(
+    token_blocks: Iterable[np.ndarray],
+    *,
+    batch_size: int,
+    sequence_length: int = SEQUENCE_LENGTH,
+    pad_token: int = 0,
+    drop_remainder: bool = False,
+) -> Generator[Tuple[np.ndarray, np.ndarray], None, None]:
+  """Packs a stream of tokens into batches of fixed-length rows.
+
+  Rows are consecutive slices of the token stream, so a document may continue
+  on the next row. Only the last batch contains padding.
+
+  Args:
+    token_blocks: Arrays of tokens.
+    batch_size: Number of rows per batch.
+    sequence_length: Number of tokens per row.
+    pad_token: Token used for padding.
+    drop_remainder: Whether to drop the last, padded, batch.
+  Yields:
+    Tuples of tokens and input masks, both of shape
+    [batch_size, sequence_length], where the mask is 1 for tokens and 0 for
+    padding.
+  """
+  batch_tokens = batch_size * sequence_length
+  pending = []
+  num_pending = 0
+  for tokens in token_blocks:
+    pending.append(tokens)
+    num_pending += tokens.size
+    if num_pending < batch_tokens:
+      continue
+    stream = np.concatenate(pending)
+    num_batches = stream.size // batch_tokens
+    batches = stream[:num_batches * batch_tokens].reshape(
+        num_batches, batch_size, sequence_length)
+    for batch in batches:
+      yield batch, np.ones_like(batch)
+    pending = [stream[num_batches * batch_tokens:]]
+    num_pending = pending[0].size
+
+  if num_pending and not drop_remainder:
+    stream = np.concatenate(pending)
+    batch = np.full([batch_tokens], pad_token, dtype=stream.dtype)
+    batch[:stream.size] = stream
+    mask = (np.arange(batch_tokens) < stream.size).astype(np.int32)
+    yield (batch.reshape(batch_size, sequence_length),
+           mask.reshape(batch_size, sequence_length))
+
+
+def mask_tokens(
+    tokens: np.ndarray,
+    input_mask: np.ndarray,
+    tokenizer: bytes_tokenizer.BytesTokenizer,
+    rng: np.random.Generator,
+    *,
+    mask_prob: float = 0.15,
+    random_token_prob: float = 0.1,
+    keep_token_prob: float = 0.1,
+) -> Batch:
+  """Applies BERT-style masking to a batch of tokens.
+
+  Each byte token is selected for prediction with probability `mask_prob`.
+  Selected tokens are replaced by MASK, except for a `random_token_prob`
+  fraction which are replaced by a random byte and a `keep_token_prob`
+  fraction which are left unchanged. Special tokens are never selected.
+
+  Args:
+    tokens: Array of tokens.
+    input_mask: Array of the same shape, 1 for tokens and 0 for padding.
+    tokenizer: The tokenizer whose token ids to use.
+    rng: Random number generator.
+    mask_prob: Probability of selecting a token for prediction.
+    random_token_prob: Fraction of selected tokens replaced by random bytes.
+    keep_token_prob: Fraction of selected tokens left unchanged.
+  Returns:
+    Dictionary of `inputs` (the masked tokens), `input_mask`, `targets` (the
+    original tokens) and `target_mask` (1 for selected tokens).
+  """
+  is_byte = (tokens >= tokenizer.num_reserved_tokens) & (input_mask > 0)
+  selected = is_byte & (rng.random(tokens.shape, dtype=np.float32) < mask_prob)
+  replacement = rng.random(tokens.shape, dtype=np.float32)
+  use_mask_token = selected & (
+      replacement < 1. - random_token_prob - keep_token_prob)
+  use_random_token = selected & ~use_mask_token & (
+      replacement < 1. - keep_token_prob)
+
+  inputs = np.where(use_mask_token, tokenizer.mask_token, tokens)
+  random_tokens = rng.integers(
+      tokenizer.num_reserved_tokens, tokenizer.vocab_size,
+      size=tokens.shape, dtype=tokens.dtype)
+  inputs = np.where(use_random_token, random_tokens, inputs)
+  return {
+      'inputs': inputs,
+      'input_mask': input_mask,
+      'targets': tokens,
+      'target_mask': selected.astype(np.int32),
+  }
+
+
+def _prefetch(iterator: Iterator[Batch],
+              buffer_size: int) -> Generator[Batch, None, None]:
+  """Runs `iterator` in a background thread, buffering its outputs.
+
+  The thread stops, and `iterator` is closed, when the returned generator is
+  exhausted, closed or garbage collected, e.g. if the consumer stops early.
+  """
+  buffer = queue.Queue(maxsize=buffer_size)
+  stop = threading.Event()
+  end = object()
+
+  def put(item):
+    """Puts `item` in the buffer unless stopped; returns whether it did."""
+    while not stop.is_set():
+      try:
+        buffer.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def produce():
+    try:
+      for item in iterator:
+        if not put(item):
+          return
+    except Exception as e:  # pylint: disable=broad-except
+      put(e)
+      return
+    finally:
+      close = getattr(iterator, 'close', None)
+      if close is not None:
+        close()
+    put(end)
+
+  thread = threading.Thread(target=produce, daemon=True)
+  thread.start()
+  try:
+    while True:
+      item = buffer.get()
+      if item is end:
+        return
+      if isinstance(item, Exception):
+        raise item
+      yield item
+  finally:
+    stop.set()
+    thread.join()
+
+
+def load(
+    paths: Sequence[Text],
+    *,
+    # batch_dims should be:
+    # [device_count, per_device_batch_size] or [total_batch_size]
+    batch_dims: Sequence[int],
+    sequence_length: int = SEQUENCE_LENGTH,
+    repeat: bool = True,
+    drop_remainder: bool = False,
+    mask_prob: float = 0.15,
+    random_token_prob: float = 0.1,
+    keep_token_prob: float = 0.1,
+    document_separator: bytes = b'\n',
+    read_size: int = 1 << 24,
+    prefetch_size: int = 2,
+    seed: Optional[int] = None,
+) -> Generator[Batch, None, None]:
+  """Loads packed, masked batches of bytes from UTF-8 text files.
+
+  Args:
+    paths: Text files with one document per line (see `document_separator`).
+    batch_dims: Leading dimensions of each batch.
+    sequence_length: Number of tokens per row.
+    repeat: Whether to loop over the files forever.
+    drop_remainder: Whether to drop the last, padded, batch. Only used if not
+      repeating.
+    mask_prob: Probability of selecting a token for prediction.
+    random_token_prob: Fraction of selected tokens replaced by random bytes.
+    keep_token_prob: Fraction of selected tokens left unchanged.
+    document_separator: Byte separating documents.
+    read_size: Number of bytes to read from disk at a time.
+    prefetch_size: Number of batches to prepare in a background thread, or 0
+      to prepare them when requested.
+    seed: Seed for masking.
+  Yields:
+    Dictionaries of `inputs`, `input_mask`, `targets` and `target_mask`, each of
+    shape batch_dims + [sequence_length]; see `mask_tokens`.
+  """
+  tokenizer = bytes_tokenizer.BytesTokenizer()
+  rng = np.random.default_rng(seed)
+
+  blocks = read_blocks(paths, read_size=read_size,
+                       document_separator=document_separator, repeat=repeat)
+  token_blocks = tokenize_blocks(blocks, tokenizer,
+                                 document_separator=document_separator)
+  rows = pack_rows(token_blocks, batch_size=int(np.prod(batch_dims)),
+                   sequence_length=sequence_length,
+                   pad_token=tokenizer.pad_token,
+                   drop_remainder=drop_remainder)
+  batches = (
+      mask_tokens(tokens, input_mask, tokenizer, rng, mask_prob=mask_prob,
+                  random_token_prob=random_token_prob,
+                  keep_token_prob=keep_token_prob)
+      for tokens, input_mask in rows)
+  if prefetch_size:
+    batches = _prefetch(batches, prefetch_size)
+
+  shape = list(batch_dims) + [sequence_length]
+  try:
+    for batch in batches:
+      yield {key: value.reshape(shape) for key, value in batch.items()}
+  finally:
+    batches.close()
@@ -0,0 +1,97 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for bytes_dataset."""
+
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from perceiver import bytes_tokenizer
+from perceiver.train import bytes_dataset
+
+
+def _write_files(documents_per_file):
+  directory = tempfile.mkdtemp()
+  paths = []
+  for i, documents in enumerate(documents_per_file):
+    paths.append(os.path.join(directory, f'{i}.txt'))
+    with open(paths[-1], 'w', encoding='utf-8') as f:
+      f.write('\n'.join(documents))
+  return paths
+
+
+def test_to_int_batch():
+  tokenizer = bytes_tokenizer.BytesTokenizer()
+  strings = ['abc', '', 'héllo']
+  tokens, mask = tokenizer.to_int_batch(strings)
+  assert tokens.shape == mask.shape == (3, 6)
+  for string, row, row_mask in zip(strings, tokens, mask):
+    np.testing.assert_array_equal(row[row_mask > 0], tokenizer.to_int(string))
+    assert np.all(row[row_mask == 0] == tokenizer.pad_token)
+
+
+def test_packing():
+  tokenizer = bytes_tokenizer.BytesTokenizer()
+  documents = [['first document', '', 'sécond'], ['third\n', 'fourth']]
+  paths = _write_files(documents)
+
+  batches = list(bytes_dataset.load(
+      paths, batch_dims=[2, 3], sequence_length=5, repeat=False, mask_prob=0.,
+      read_size=4, seed=0))
+  tokens = np.concatenate([b['inputs'].reshape(-1) for b in batches])
+  mask = np.concatenate([b['input_mask'].reshape(-1) for b in batches])
+  assert batches[0]['inputs'].shape == (2, 3, 5)
+  assert np.all(mask[:mask.sum()] == 1) and np.all(tokens[mask == 0] == 0)
+
+  sep = tokenizer.sep_token
+  expected = np.concatenate(
+      [np.append(tokenizer.to_int(document), sep)
+       for document in ['first document', 'sécond', 'third', 'fourth']])
+  np.testing.assert_array_equal(tokens[mask > 0], expected)
+  for batch in batches:
+    np.testing.assert_array_equal(batch['inputs'], batch['targets'])
+    assert not batch['target_mask'].any()
+
+
+def test_masking():
+  tokenizer = bytes_tokenizer.BytesTokenizer()
+  rng = np.random.default_rng(0)
+  tokens = rng.integers(0, tokenizer.vocab_size, size=(64, 2048),
+                        dtype=np.int32)
+  input_mask = (np.arange(2048) < 2000).astype(np.int32)[None].repeat(64, 0)
+  batch = bytes_dataset.mask_tokens(tokens, input_mask, tokenizer, rng)
+
+  selected = batch['target_mask'] > 0
+  assert np.all(tokens[selected] >= tokenizer.num_reserved_tokens)
+  assert not selected[input_mask == 0].any()
+  np.testing.assert_array_equal(batch['inputs'][~selected], tokens[~selected])
+  np.testing.assert_array_equal(batch['targets'], tokens)
+  num_bytes = np.sum((tokens >= tokenizer.num_reserved_tokens) & (
+      input_mask > 0))
+  np.testing.assert_allclose(selected.sum() / num_bytes, 0.15, atol=0.005)
+  masked = batch['inputs'][selected] == tokenizer.mask_token
+  np.testing.assert_allclose(masked.mean(), 0.8, atol=0.01)
+
+
+def test_prefetch_stops_when_closed():
+  paths = _write_files([['some text'] * 100])
+  num_threads = threading.active_count()
+  for _ in range(3):
+    batches = bytes_dataset.load(paths, batch_dims=[2], sequence_length=8,
+                                 repeat=True, prefetch_size=1, seed=0)
+    next(batches)
+    batches.close()
+  assert threading.active_count() == num_threads
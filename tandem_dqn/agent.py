@@ -13,8 +13,9 @@
 # limitations under the License.
 """Tandem DQN agent class."""
 
+import copy
 import typing
-from typing import Any, Callable, Mapping, Set, Text
+from typing import Any, Callable, List, Mapping, Sequence, Set, Text
 
 from absl import logging
 import dm_env
@@ -50,7 +51,7 @@ def replace_module_params(source, target, modules):
   return hk.data_structures.merge(target, source)
 
 
-class TandemDqn(parts.Agent):
+class TandemDqn(parts.BatchedAgent):
   """Tandem DQN agent."""
 
   def __init__(
@@ -69,6 +70,7 @@ class TandemDqn(parts.Agent):
       target_network_update_period: int,
       tied_layers: Set[str],
       rng_key: parts.PRNGKey,
+      num_environments: int = 1,
   ):
     self._preprocessor = preprocessor
     self._replay = replay
@@ -97,6 +99,14 @@ class TandemDqn(parts.Agent):
     self._action = None
     self._frame_t = -1  # Current frame index.
 
+    # Episodic state of each environment for `step_batch`.
+    self._batch_preprocessors = [
+        copy.deepcopy(preprocessor) for _ in range(num_environments)]
+    self._batch_transition_accumulators = [
+        copy.deepcopy(transition_accumulator)
+        for _ in range(num_environments)]
+    self._batch_actions = [None] * num_environments
+
     # Stats.
     stats = [
         'loss_active',
@@ -263,6 +273,7 @@ class TandemDqn(parts.Agent):
       return rng_key, a_t
 
     self._select_action = jax.jit(select_action)
+    self._select_actions = parts.make_batched_epsilon_greedy(network.active)
 
   def step(self, timestep: dm_env.TimeStep) -> parts.Action:
     """Selects action given timestep and potentially learns."""
@@ -278,8 +289,54 @@ class TandemDqn(parts.Agent):
       for transition in self._transition_accumulator.step(timestep, action):
         self._replay.add(transition)
 
+    self._maybe_learn()
+    return action
+
+  def step_batch(
+      self, timesteps: Sequence[dm_env.TimeStep]) -> List[parts.Action]:
+    """Selects actions for several environments and potentially learns.
+
+    Acts for all environments with one network call. Each timestep counts as a
+    frame, so learning happens as often as when stepping them one at a time.
+
+    Args:
+      timesteps: Timestep of each environment.
+
+    Returns:
+      Action for each environment.
+    """
+    first_frame_t = self._frame_t + 1
+    last_frame_t = self._frame_t + len(timesteps)
+    timesteps = [
+        preprocessor(timestep)
+        for preprocessor, timestep in zip(self._batch_preprocessors, timesteps)
+    ]
+    indices, s_t = parts.stack_observations(timesteps)
+    if indices:
+      self._rng_key, a_t = self._select_actions(
+          self._rng_key, self._online_params.active, s_t,
+          self._exploration_epsilon(last_frame_t))
+      a_t = jax.device_get(a_t)
+      for i, index in enumerate(indices):
+        action = self._batch_actions[index] = parts.Action(a_t[i])
+        transition_accumulator = self._batch_transition_accumulators[index]
+        for transition in transition_accumulator.step(timesteps[index], action):
+          self._replay.add(transition, stream=index)
+
+    for frame_t in range(first_frame_t, last_frame_t + 1):
+      self._frame_t = frame_t
+      self._maybe_learn()
+    return list(self._batch_actions)
+
+  def reset_environment(self, index: int) -> None:
+    self._batch_transition_accumulators[index].reset()
+    processors.reset(self._batch_preprocessors[index])
+    self._batch_actions[index] = None
+
+  def _maybe_learn(self) -> None:
+    """Learns and updates the target network periodically, once replay fills."""
     if self._replay.size < self._min_replay_capacity:
-      return action
+      return
 
     if self._frame_t % self._learn_period == 0:
       self._learn()
@@ -287,8 +344,6 @@ class TandemDqn(parts.Agent):
     if self._frame_t % self._target_network_update_period == 0:
       self._target_params = self._online_params
 
-    return action
-
   def reset(self) -> None:
     """Resets the agent's episodic state such as frame stack and action repeat.
 
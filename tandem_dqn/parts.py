@@ -15,10 +15,12 @@
 
 import abc
 import collections
+import copy
 import csv
+import multiprocessing
 import os
 import timeit
-from typing import Any, Iterable, Mapping, Optional, Text, Tuple, Union
+from typing import Any, Callable, Iterable, List, Mapping, Optional, Sequence, Text, Tuple, Union
 
 import dm_env
 import jax
@@ -63,6 +65,89 @@ class Agent(abc.ABC):
     """Returns current agent statistics as a dictionary."""
 
 
+class BatchedAgent(Agent):
+  """Agent that can also act in several environments at once."""
+
+  @abc.abstractmethod
+  def step_batch(
+      self, timesteps: Sequence[dm_env.TimeStep]) -> List[Action]:
+    """Selects an action for the timestep of each environment."""
+
+  @abc.abstractmethod
+  def reset_environment(self, index: int) -> None:
+    """Resets the episodic state of the agent for one environment.
+
+    This method should be called at the beginning of every episode of that
+    environment.
+
+    Args:
+      index: Index of the environment.
+    """
+
+
+def _environment_worker(connection, environment_builder):
+  """Runs an environment, stepping it on commands received from `connection`."""
+  environment = environment_builder()
+  try:
+    while True:
+      command, action = connection.recv()
+      if command == 'reset':
+        connection.send(environment.reset())
+      elif command == 'step':
+        connection.send(environment.step(action))
+      else:
+        break
+  finally:
+    environment.close()
+    connection.close()
+
+
+class BatchedEnvironment:
+  """Environments stepped in lockstep, each in its own process."""
+
+  def __init__(
+      self,
+      environment_builders: Sequence[Callable[[], dm_env.Environment]]):
+    """Starts a process for each environment.
+
+    Args:
+      environment_builders: Picklable functions that each create one of the
+        environments.
+    """
+    # Spawn, rather than fork, as the parent process runs JAX.
+    context = multiprocessing.get_context('spawn')
+    self._connections = []
+    self._processes = []
+    for environment_builder in environment_builders:
+      connection, worker_connection = context.Pipe()
+      process = context.Process(
+          target=_environment_worker,
+          args=(worker_connection, environment_builder),
+          daemon=True)
+      process.start()
+      worker_connection.close()
+      self._connections.append(connection)
+      self._processes.append(process)
+
+  @property
+  def num_environments(self) -> int:
+    return len(self._connections)
+
+  def step(
+      self, actions: Sequence[Optional[Action]]) -> List[dm_env.TimeStep]:
+    """Steps all environments at once, resetting those whose action is None."""
+    for connection, action in zip(self._connections, actions):
+      connection.send(('reset', None) if action is None else ('step', action))
+    return [connection.recv() for connection in self._connections]
+
+  def close(self) -> None:
+    for connection in self._connections:
+      connection.send(('close', None))
+      connection.close()
+    for process in self._processes:
+      process.join()
+
+
 def run_loop(
     agent: Agent,
     environment: dm_env.Environment,
@@ -115,6 +200,58 @@ def run_loop(
         break
 
 
+def run_batched_loop(
+    agent: BatchedAgent,
+    environment: BatchedEnvironment,
+    max_steps_per_episode: int = 0,
+) -> Iterable[Tuple[int, Optional[dm_env.TimeStep], BatchedAgent,
+                    Optional[Action]]]:
+  """`run_loop` for several environments stepped in lockstep.
+
+  Each environment goes through the same sequence of timesteps and agent steps
+  as with `run_loop`, but the agent acts for all environments at once.
+
+  Args:
+    agent: Agent to be run, has methods `step_batch(timesteps)` and
+      `reset_environment(index)`.
+    environment: Environments to run.
+    max_steps_per_episode: If positive, when time t reaches this value within an
+      episode, the episode is truncated.
+
+  Yields:
+    Tuple `(index, timestep_t, agent, a_t)` for each environment at each step,
+    where `index` is the index of the environment and
+    `a_t = agent.step_batch(timesteps)[index]`, or None for LAST timesteps.
+  """
+  num_environments = environment.num_environments
+  for index in range(num_environments):
+    agent.reset_environment(index)
+  timesteps = environment.step([None] * num_environments)  # timestep_0.
+  ts = [0] * num_environments
+
+  while True:
+    actions = list(agent.step_batch(timesteps))
+    for index, (timestep_t, a_t) in enumerate(zip(timesteps, actions)):
+      if timestep_t.last():
+        # Extra agent step, action ignored, then start a new episode.
+        yield index, timestep_t, agent, None
+        actions[index] = None
+        agent.reset_environment(index)
+      else:
+        yield index, timestep_t, agent, a_t
+
+    timesteps = environment.step(actions)
+    for index, a_tm1 in enumerate(actions):
+      if a_tm1 is None:
+        ts[index] = 0
+        continue
+      ts[index] += 1
+      if max_steps_per_episode > 0 and ts[index] >= max_steps_per_episode:
+        assert ts[index] == max_steps_per_episode
+        timesteps[index] = timesteps[index]._replace(
+            step_type=dm_env.StepType.LAST)
+
+
 def generate_statistics(
     trackers: Iterable[Any],
     timestep_action_sequence: Iterable[Tuple[dm_env.Environment,
@@ -292,16 +429,127 @@ class UnbiasedExponentialWeightedAverageAgentTracker:
     return self._statistics
 
 
-def make_default_trackers(initial_agent: Agent):
+def merge_episode_statistics(
+    statistics: Sequence[Mapping[Text, Union[int, float, None]]]
+) -> Mapping[Text, Union[int, float, None]]:
+  """Merges `EpisodeTracker` statistics of several environments."""
+  num_episodes = sum(s['num_episodes'] for s in statistics)
+  if num_episodes:
+    mean_episode_return = sum(
+        s['mean_episode_return'] * s['num_episodes']
+        for s in statistics if s['num_episodes']) / num_episodes
+  else:
+    mean_episode_return = np.nan
+  current_episode_returns = [
+      s['current_episode_return'] for s in statistics
+      if s['num_steps_since_reset'] > 0]
+  if current_episode_returns:
+    current_episode_return = np.mean(current_episode_returns)
+  else:
+    current_episode_return = np.nan
+  return {
+      'mean_episode_return': mean_episode_return,
+      'current_episode_return': current_episode_return,
+      'episode_return': (
+          mean_episode_return if num_episodes else current_episode_return),
+      'num_episodes': num_episodes,
+      'num_steps_over_episodes': sum(
+          s['num_steps_over_episodes'] for s in statistics),
+      'current_episode_step': sum(
+          s['current_episode_step'] for s in statistics),
+      'num_steps_since_reset': sum(
+          s['num_steps_since_reset'] for s in statistics),
+  }
+
+
+class PerEnvironmentTracker:
+  """Keeps a tracker for each environment of `run_batched_loop`.
+
+  Steps are dispatched on the environment index, which `run_batched_loop`
+  yields in place of the environment.
+  """
+
+  def __init__(
+      self,
+      tracker_builder: Callable[[], Any],
+      num_environments: int,
+      merge_fn: Callable[[Sequence[Mapping[Text, Any]]], Mapping[Text, Any]]):
+    self._trackers = [tracker_builder() for _ in range(num_environments)]
+    self._merge_fn = merge_fn
+
+  def step(
+      self,
+      environment: int,
+      timestep_t: Optional[dm_env.TimeStep],
+      agent: Optional[Agent],
+      a_t: Optional[Action],
+  ) -> None:
+    self._trackers[environment].step(None, timestep_t, agent, a_t)
+
+  def reset(self) -> None:
+    for tracker in self._trackers:
+      tracker.reset()
+
+  def get(self) -> Mapping[Text, Any]:
+    return self._merge_fn([tracker.get() for tracker in self._trackers])
+
+
+def make_default_trackers(initial_agent: Agent, num_environments: int = 0):
+  """Makes the default trackers, for a batched loop if `num_environments`."""
+  if num_environments:
+    episode_tracker = PerEnvironmentTracker(
+        EpisodeTracker, num_environments, merge_episode_statistics)
+  else:
+    episode_tracker = EpisodeTracker()
   return [
-      EpisodeTracker(),
+      episode_tracker,
       StepRateTracker(),
       UnbiasedExponentialWeightedAverageAgentTracker(
           step_size=1e-3, initial_agent=initial_agent),
   ]
 
 
-class EpsilonGreedyActor(Agent):
+def make_batched_epsilon_greedy(network: Network):
+  """Returns a jitted function that acts for a batch of states at once."""
+
+  def select_actions(rng_key, network_params, s_t, exploration_epsilon):
+    """Samples actions from eps-greedy policy wrt Q-values at given states."""
+    rng_key, apply_key, policy_key = jax.random.split(rng_key, 3)
+    q_t = network.apply(network_params, apply_key, s_t).q_values
+    policy_keys = jax.random.split(policy_key, s_t.shape[0])
+    a_t = jax.vmap(rlax.epsilon_greedy().sample, in_axes=(0, 0, None))(
+        policy_keys, q_t, exploration_epsilon)
+    return rng_key, a_t
+
+  return jax.jit(select_actions)
+
+
+def stack_observations(
+    timesteps: Sequence[Optional[dm_env.TimeStep]]
+) -> Tuple[List[int], Optional[np.ndarray]]:
+  """Stacks the observations of the timesteps that are not None.
+
+  The stack is padded with zeros to `len(timesteps)`, so that jitted functions
+  always see the same batch size.
+
+  Args:
+    timesteps: Preprocessed timesteps, None when the action is repeated.
+
+  Returns:
+    The indices of the timesteps that are not None, and their stacked
+    observations, or None if there are none.
+  """
+  indices = [i for i, timestep in enumerate(timesteps) if timestep is not None]
+  if not indices:
+    return indices, None
+  observation = timesteps[indices[0]].observation
+  s_t = np.zeros((len(timesteps),) + observation.shape, observation.dtype)
+  for i, index in enumerate(indices):
+    s_t[i] = timesteps[index].observation
+  return indices, s_t
+
+
+class EpsilonGreedyActor(BatchedAgent):
   """Agent that acts with a given set of Q-network parameters and epsilon.
 
   Network parameters are set on the actor. The actor can be serialized,
@@ -314,12 +562,29 @@ class EpsilonGreedyActor(Agent):
       network: Network,
       exploration_epsilon: float,
       rng_key: PRNGKey,
+      num_environments: int = 1,
   ):
+    """Initializes the actor.
+
+    Args:
+      preprocessor: Processor of the timesteps.
+      network: Q-network.
+      exploration_epsilon: Epsilon of the epsilon-greedy policy.
+      rng_key: Random key.
+      num_environments: Number of environments for `step_batch`, each of which
+        gets its own copy of `preprocessor`.
+    """
     self._preprocessor = preprocessor
     self._rng_key = rng_key
     self._action = None
+    self._exploration_epsilon = exploration_epsilon
     self.network_params = None  # Nest of arrays (haiku.Params), set externally.
 
+    self._batch_preprocessors = [
+        copy.deepcopy(preprocessor) for _ in range(num_environments)]
+    self._batch_actions = [None] * num_environments
+    self._select_actions = make_batched_epsilon_greedy(network)
+
     def select_action(rng_key, network_params, s_t):
       """Samples action from eps-greedy policy wrt Q-values at given state."""
       rng_key, apply_key, policy_key = jax.random.split(rng_key, 3)
@@ -350,6 +615,26 @@ class EpsilonGreedyActor(Agent):
     processors.reset(self._preprocessor)
     self._action = None
 
+  def step_batch(
+      self, timesteps: Sequence[dm_env.TimeStep]) -> List[Action]:
+    """Selects actions for several environments with one network call."""
+    timesteps = [
+        preprocessor(timestep)
+        for preprocessor, timestep in zip(self._batch_preprocessors, timesteps)
+    ]
+    indices, s_t = stack_observations(timesteps)
+    if indices:
+      self._rng_key, a_t = self._select_actions(
+          self._rng_key, self.network_params, s_t, self._exploration_epsilon)
+      a_t = jax.device_get(a_t)
+      for i, index in enumerate(indices):
+        self._batch_actions[index] = Action(a_t[i])
+    return list(self._batch_actions)
+
+  def reset_environment(self, index: int) -> None:
+    processors.reset(self._batch_preprocessors[index])
+    self._batch_actions[index] = None
+
   def get_state(self) -> Mapping[Text, Any]:
     """Retrieves agent state as a dictionary (e.g. for serialization)."""
     # State contains network params to make agent easy to run from a checkpoint.
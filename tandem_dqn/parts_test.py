@@ -0,0 +1,201 @@
+# Copyright 2021 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for batched acting in parts."""
+
+import functools
+import itertools
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import dm_env
+from dm_env import specs
+import haiku as hk
+import jax
+import numpy as np
+
+from tandem_dqn import networks
+from tandem_dqn import parts
+
+NUM_ACTIONS = 3
+OBSERVATION_SHAPE = (2, 3)
+
+
+class FakeEnvironment(dm_env.Environment):
+  """Deterministic environment whose episodes last `episode_length` steps."""
+
+  def __init__(self, seed, episode_length):
+    self._seed = seed
+    self._episode_length = episode_length
+    self._num_episodes = 0
+    self._t = 0
+
+  def _observation(self):
+    return np.full(OBSERVATION_SHAPE,
+                   100 * self._seed + 10 * self._num_episodes + self._t,
+                   np.float32)
+
+  def reset(self):
+    self._num_episodes += 1
+    self._t = 0
+    return dm_env.restart(self._observation())
+
+  def step(self, action):
+    self._t += 1
+    reward = float(action + self._t)
+    if self._t == self._episode_length:
+      return dm_env.termination(reward, self._observation())
+    return dm_env.transition(reward, self._observation())
+
+  def observation_spec(self):
+    return specs.Array(OBSERVATION_SHAPE, np.float32)
+
+  def action_spec(self):
+    return specs.DiscreteArray(NUM_ACTIONS)
+
+
+class ObservationAgent(parts.BatchedAgent):
+  """Agent whose actions are a deterministic function of the observation."""
+
+  def _select_action(self, timestep):
+    return parts.Action(int(timestep.observation[0, 0]) % NUM_ACTIONS)
+
+  def step(self, timestep):
+    return self._select_action(timestep)
+
+  def reset(self):
+    pass
+
+  def step_batch(self, timesteps):
+    return [self._select_action(timestep) for timestep in timesteps]
+
+  def reset_environment(self, index):
+    pass
+
+  def get_state(self):
+    return {}
+
+  def set_state(self, state):
+    pass
+
+  @property
+  def statistics(self):
+    return {}
+
+
+def _trajectory(timestep_action_sequence, num_steps):
+  return [(timestep.step_type, timestep.reward, timestep.observation[0, 0],
+           action)
+          for _, timestep, _, action in itertools.islice(
+              timestep_action_sequence, num_steps)]
+
+
+def _make_network():
+  def net_fn(inputs):
+    inputs = hk.Flatten()(inputs)
+    return networks.QNetworkOutputs(q_values=hk.Linear(NUM_ACTIONS)(inputs))
+
+  return hk.transform(net_fn)
+
+
+class BatchedActingTest(parameterized.TestCase):
+
+  @parameterized.parameters(0, 4)
+  def test_run_batched_loop_matches_run_loop(self, max_steps_per_episode):
+    episode_lengths = [3, 5, 7]
+    num_steps = 30
+    batched_environment = parts.BatchedEnvironment([
+        functools.partial(FakeEnvironment, seed, episode_length)
+        for seed, episode_length in enumerate(episode_lengths)
+    ])
+    try:
+      trajectories = [[] for _ in episode_lengths]
+      for index, timestep, _, action in itertools.islice(
+          parts.run_batched_loop(ObservationAgent(), batched_environment,
+                                 max_steps_per_episode),
+          num_steps * len(episode_lengths)):
+        trajectories[index].append(
+            (timestep.step_type, timestep.reward, timestep.observation[0, 0],
+             action))
+    finally:
+      batched_environment.close()
+
+    for seed, episode_length in enumerate(episode_lengths):
+      expected = _trajectory(
+          parts.run_loop(ObservationAgent(),
+                         FakeEnvironment(seed, episode_length),
+                         max_steps_per_episode), num_steps)
+      self.assertEqual(trajectories[seed], expected)
+
+  def test_batched_actor_matches_actor(self):
+    network = _make_network()
+    rng_key = jax.random.PRNGKey(0)
+    network_params = network.init(
+        rng_key, np.zeros((1,) + OBSERVATION_SHAPE, np.float32))
+    num_environments = 4
+    # With an epsilon of zero both actors act greedily, so the actions do not
+    # depend on the random keys.
+    actor = parts.EpsilonGreedyActor(
+        preprocessor=lambda timestep: timestep, network=network,
+        exploration_epsilon=0., rng_key=rng_key,
+        num_environments=num_environments)
+    actor.network_params = network_params
+
+    rng = np.random.RandomState(0)
+    for _ in range(3):
+      timesteps = [
+          dm_env.restart(rng.normal(size=OBSERVATION_SHAPE).astype(np.float32))
+          for _ in range(num_environments)]
+      expected = [actor.step(timestep) for timestep in timesteps]
+      self.assertEqual(actor.step_batch(timesteps), expected)
+
+  def test_stack_observations_pads_skipped_timesteps(self):
+    observations = [np.full(OBSERVATION_SHAPE, i, np.uint8) for i in range(3)]
+    timesteps = [None, dm_env.restart(observations[1]), None,
+                 dm_env.restart(observations[2])]
+    indices, s_t = parts.stack_observations(timesteps)
+    self.assertEqual(indices, [1, 3])
+    self.assertEqual(s_t.shape, (4,) + OBSERVATION_SHAPE)
+    np.testing.assert_array_equal(s_t[0], observations[1])
+    np.testing.assert_array_equal(s_t[1], observations[2])
+    np.testing.assert_array_equal(s_t[2:], 0)
+    self.assertEqual(parts.stack_observations([None, None]), ([], None))
+
+  def test_merged_episode_statistics_match_single_tracker(self):
+    episode_lengths = [3, 5]
+    # A whole number of episodes of each environment, so that a single tracker
+    # can see the episodes one environment after the other.
+    num_steps = 12
+    per_environment_tracker = parts.PerEnvironmentTracker(
+        parts.EpisodeTracker, len(episode_lengths),
+        parts.merge_episode_statistics)
+    single_tracker = parts.EpisodeTracker()
+    per_environment_tracker.reset()
+    single_tracker.reset()
+    for index, episode_length in enumerate(episode_lengths):
+      for _, timestep, agent, action in itertools.islice(
+          parts.run_loop(ObservationAgent(),
+                         FakeEnvironment(index, episode_length)), num_steps):
+        per_environment_tracker.step(index, timestep, agent, action)
+        single_tracker.step(None, timestep, agent, action)
+
+    statistics = per_environment_tracker.get()
+    expected = single_tracker.get()
+    self.assertEqual(statistics['num_episodes'], 5)
+    self.assertCountEqual(statistics, expected)
+    for key, value in expected.items():
+      self.assertAlmostEqual(statistics[key], value, msg=key)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -57,8 +57,9 @@ class TransitionReplay(Generic[ReplayStructure]):
     self._storage = [None] * capacity
     self._num_added = 0
 
-  def add(self, item: ReplayStructure) -> None:
-    """Adds single item to replay."""
+  def add(self, item: ReplayStructure, stream: int = 0) -> None:
+    """Adds single item to replay, `stream` is unused."""
+    del stream
     self._storage[self._num_added % self._capacity] = self._encoder(item)
     self._num_added += 1
 
@@ -97,6 +98,220 @@ class TransitionReplay(Generic[ReplayStructure]):
     self._num_added = state['num_added']
 
 
+class FrameStackedTransitionReplay:
+  """Uniform replay of `Transition`s that stores each observed frame once.
+
+  `s_tm1` and `s_t` are stacks of frames along their last axis, and the stacks
+  of consecutive transitions share most of their frames. Instead of storing
+  both stacks with every transition, frames are written once into a
+  preallocated circular buffer, and each stack is stored as the indices of its
+  frames in that buffer. Stacks are rebuilt by indexing into the frame buffer
+  when sampling.
+
+  Stacks from `processors.atari` are filled from the first channel at the
+  start of an episode, with trailing zero padding: `A000, AB00, ABC0, ABCD,
+  BCDE, ...`. Each stack is compared with the previous stack of the same
+  stream, e.g. of the same environment when acting in several environments;
+  a stack that does not follow on from it in this way is stored with all of
+  its frames, so sampled stacks always equal the added ones. Transitions whose
+  frames have been overwritten are dropped.
+  """
+
+  def __init__(self,
+               capacity: int,
+               structure: Transition,
+               random_state: np.random.RandomState,
+               frame_capacity: Optional[int] = None):
+    """Initializes the replay.
+
+    Args:
+      capacity: Maximum number of transitions.
+      structure: Structure of the transitions, a `Transition`.
+      random_state: Random state used for sampling.
+      frame_capacity: Maximum number of frames. Each transition adds a single
+        frame, plus one for the first transition of each episode. Defaults to
+        10% more than `capacity`.
+    """
+    self._capacity = capacity
+    self._structure = structure
+    self._random_state = random_state
+    self._frame_capacity = frame_capacity or capacity + capacity // 10
+
+    # Arrays are allocated on the first `add`, once shapes are known.
+    self._frames = None
+    self._arrays = None
+    self._num_added = 0
+    self._num_frames_added = 0
+    self._first_valid = 0
+    # Last stack of each stream and the indices of its frames.
+    self._last_stacks = {}
+
+  def _allocate(self, item: Transition) -> None:
+    """Preallocates the storage for transitions like `item`."""
+    num_stacked_frames = item.s_t.shape[-1]
+    if self._frame_capacity < 2 * num_stacked_frames:
+      raise ValueError(
+          'frame_capacity must hold the frames of at least one transition, '
+          'got %d for %d stacked frames.' %
+          (self._frame_capacity, num_stacked_frames))
+    self._frames = np.zeros(
+        (self._frame_capacity,) + item.s_t.shape[:-1], dtype=item.s_t.dtype)
+    self._arrays = {}
+    for field, value in item._asdict().items():
+      if field in ('s_tm1', 's_t'):
+        continue
+      value = np.asarray(value)
+      self._arrays[field] = np.zeros(
+          (self._capacity,) + value.shape, dtype=value.dtype)
+    # Frame indices of each stack, -1 for padding, and the oldest frame index
+    # used by each transition or any later one.
+    for field in ('frames_tm1', 'frames_t'):
+      self._arrays[field] = np.full(
+          (self._capacity, num_stacked_frames), -1, dtype=np.int64)
+    self._arrays['oldest_frame'] = np.zeros((self._capacity,), dtype=np.int64)
+
+  def _add_frame(self, frame: np.ndarray) -> int:
+    """Appends a frame to the frame buffer, returns its index."""
+    self._frames[self._num_frames_added % self._frame_capacity] = frame
+    self._num_frames_added += 1
+    return self._num_frames_added - 1
+
+  def _add_stack(self, stack: np.ndarray, stream: int) -> np.ndarray:
+    """Adds the new frames of `stack`, returns the indices of its frames."""
+    num_stacked_frames = stack.shape[-1]
+    last_stack, last_frames = self._last_stacks.get(stream, (None, None))
+    # Only share frames that the frames added by this transition cannot
+    # overwrite.
+    min_frame = (self._num_frames_added + 2 * num_stacked_frames -
+                 self._frame_capacity)
+    if last_stack is not None and last_frames[0] >= min_frame:
+      num_frames = np.sum(last_frames >= 0)
+      if stack is last_stack or np.array_equal(stack, last_stack):
+        return last_frames
+      if num_frames < num_stacked_frames:
+        follows = (
+            np.array_equal(stack[..., :num_frames],
+                           last_stack[..., :num_frames]) and
+            not stack[..., num_frames + 1:].any())
+        if follows:
+          frames = last_frames.copy()
+          frames[num_frames] = self._add_frame(stack[..., num_frames])
+          return frames
+      elif np.array_equal(stack[..., :-1], last_stack[..., 1:]):
+        return np.append(last_frames[1:], self._add_frame(stack[..., -1]))
+
+    # Store all frames. Trailing zero padding need not be stored.
+    num_frames = num_stacked_frames
+    while num_frames > 1 and not stack[..., num_frames - 1].any():
+      num_frames -= 1
+    frames = np.full((num_stacked_frames,), -1, dtype=np.int64)
+    for i in range(num_frames):
+      frames[i] = self._add_frame(stack[..., i])
+    return frames
+
+  def add(self, item: Transition, stream: int = 0) -> None:
+    """Adds single item to replay.
+
+    Args:
+      item: Transition to add.
+      stream: Identifier of the sequence of transitions `item` belongs to, e.g.
+        the index of the environment it comes from. Frames are only shared
+        between the stacks of the same stream.
+    """
+    if self._frames is None:
+      self._allocate(item)
+    index = self._num_added % self._capacity
+    for field, value in item._asdict().items():
+      if field in self._arrays:
+        self._arrays[field][index] = value
+    for field, stack in (('tm1', item.s_tm1), ('t', item.s_t)):
+      frames = self._add_stack(stack, stream)
+      self._arrays['frames_' + field][index] = frames
+      self._last_stacks[stream] = (stack, frames)
+    oldest_frame = min(self._arrays['frames_tm1'][index, 0],
+                       self._arrays['frames_t'][index, 0])
+    self._arrays['oldest_frame'][index] = oldest_frame
+    # Transitions are dropped oldest first, so earlier transitions must be
+    # dropped no later than this one. With interleaved streams this one may
+    # use older frames than them.
+    i = self._num_added - 1
+    while (i >= max(self._first_valid, self._num_added - self._capacity + 1) and
+           self._arrays['oldest_frame'][i % self._capacity] > oldest_frame):
+      self._arrays['oldest_frame'][i % self._capacity] = oldest_frame
+      i -= 1
+    self._num_added += 1
+
+    # Drop the oldest transitions if some of their frames were overwritten.
+    first_valid = max(self._first_valid, self._num_added - self._capacity)
+    min_frame = self._num_frames_added - self._frame_capacity
+    while (first_valid < self._num_added and
+           self._arrays['oldest_frame'][first_valid % self._capacity] <
+           min_frame):
+      first_valid += 1
+    self._first_valid = first_valid
+
+  def _get_stacks(self, frames: np.ndarray) -> np.ndarray:
+    """Rebuilds a batch of frame stacks from their frame indices."""
+    num_stacked_frames = frames.shape[-1]
+    stacks = np.empty(
+        frames.shape[:1] + self._frames.shape[1:] + (num_stacked_frames,),
+        dtype=self._frames.dtype)
+    # Filling one channel at a time is faster than transposing the frames.
+    for i in range(num_stacked_frames):
+      stacks[..., i] = self._frames[frames[:, i] % self._frame_capacity]
+      stacks[frames[:, i] < 0, ..., i] = 0
+    return stacks
+
+  def get_batch(self, indices: Sequence[int]) -> Transition:
+    """Retrieves a batch of items by their index, from oldest to newest."""
+    indices = (self._first_valid + np.asarray(indices)) % self._capacity
+    arrays = {field: array[indices] for field, array in self._arrays.items()}
+    s_tm1 = self._get_stacks(arrays.pop('frames_tm1'))
+    s_t = self._get_stacks(arrays.pop('frames_t'))
+    del arrays['oldest_frame']
+    return type(self._structure)(s_tm1=s_tm1, s_t=s_t, **arrays)  # pytype: disable=not-callable
+
+  def get(self, indices: Sequence[int]) -> List[Transition]:
+    """Retrieves items by their index, from oldest to newest."""
+    batch = self.get_batch(indices)
+    return [type(self._structure)(*values) for values in zip(*batch)]  # pytype: disable=not-callable
+
+  def sample(self, size: int) -> Transition:
+    """Samples batch of items from replay uniformly, with replacement."""
+    indices = self._random_state.choice(self.size, size=size, replace=True)
+    return self.get_batch(indices)
+
+  @property
+  def size(self) -> int:
+    """Number of items currently contained in replay."""
+    return self._num_added - self._first_valid
+
+  @property
+  def capacity(self) -> int:
+    """Total capacity of replay (max number of items stored at any one time)."""
+    return self._capacity
+
+  def get_state(self) -> Mapping[Text, Any]:
+    """Retrieves replay state as a dictionary (e.g. for serialization)."""
+    return {
+        'frames': self._frames,
+        'arrays': self._arrays,
+        'num_added': self._num_added,
+        'num_frames_added': self._num_frames_added,
+        'first_valid': self._first_valid,
+        'last_stacks': self._last_stacks,
+    }
+
+  def set_state(self, state: Mapping[Text, Any]) -> None:
+    """Sets replay state from a (potentially de-serialized) dictionary."""
+    self._frames = state['frames']
+    self._arrays = state['arrays']
+    self._num_added = state['num_added']
+    self._num_frames_added = state['num_frames_added']
+    self._first_valid = state['first_valid']
+    self._last_stacks = state['last_stacks']
+
+
 class TransitionAccumulatorWithMCReturn:
   """Accumulates timesteps to transitions with MC returns."""
 
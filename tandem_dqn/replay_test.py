@@ -0,0 +1,173 @@
+# Copyright 2021 DeepMind Technologies Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for replay."""
+
+import collections
+import copy
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+
+from tandem_dqn import replay
+
+NUM_STACKED_FRAMES = 4
+FRAME_SHAPE = (6, 5)
+
+
+def make_transitions(episode_lengths, seed=0):
+  """Makes transitions with frame stacks as built by `processors.atari`."""
+  rng = np.random.RandomState(seed)
+  transitions = []
+  for episode_length in episode_lengths:
+    frames = collections.deque(maxlen=NUM_STACKED_FRAMES)
+    stacks = []
+    for _ in range(episode_length + 1):
+      frame = rng.randint(256, size=FRAME_SHAPE).astype(np.uint8)
+      if rng.uniform() < 0.1:
+        frame[:] = 0  # Blank frames must not be mistaken for padding.
+      frames.append(frame)
+      padding = [np.zeros(FRAME_SHAPE, np.uint8)] * (
+          NUM_STACKED_FRAMES - len(frames))
+      stacks.append(np.stack(list(frames) + padding, axis=-1))
+    for t in range(episode_length):
+      transitions.append(replay.Transition(
+          s_tm1=stacks[t],
+          a_tm1=rng.randint(6),
+          r_t=rng.uniform(),
+          discount_t=0.99 * (t < episode_length - 1),
+          s_t=stacks[t + 1],
+          a_t=rng.randint(6),
+          mc_return_tm1=rng.uniform()))
+  return transitions
+
+
+def structure():
+  return replay.Transition(*([None] * len(replay.Transition._fields)))
+
+
+def interleave(transitions_per_stream):
+  """Alternates between streams, as when acting in several environments."""
+  interleaved = []
+  for t in range(max(len(transitions) for transitions in
+                     transitions_per_stream)):
+    for stream, transitions in enumerate(transitions_per_stream):
+      if t < len(transitions):
+        interleaved.append((stream, transitions[t]))
+  return interleaved
+
+
+def assert_transitions_equal(actual, expected):
+  assert len(actual) == len(expected)
+  for expected_transition, actual_transition in zip(expected, actual):
+    for expected_value, actual_value in zip(expected_transition,
+                                            actual_transition):
+      np.testing.assert_array_equal(actual_value, expected_value)
+
+
+class FrameStackedTransitionReplayTest(parameterized.TestCase):
+
+  @parameterized.named_parameters(
+      ('no_wrap', 200, None, False),
+      ('wrap', 37, 100, False),
+      ('frame_eviction', 37, 30, True),
+  )
+  def test_matches_transition_replay(self, capacity, frame_capacity,
+                                     drops_transitions):
+    transitions = make_transitions([1, 3, 50, 7, 20, 2, 60])
+    expected_replay = replay.TransitionReplay(
+        capacity, structure(), np.random.RandomState(0))
+    frame_replay = replay.FrameStackedTransitionReplay(
+        capacity, structure(), np.random.RandomState(0), frame_capacity)
+    for transition in transitions:
+      expected_replay.add(transition)
+      frame_replay.add(transition)
+
+    # Live transitions are the most recent ones, oldest first.
+    if drops_transitions:
+      self.assertLess(frame_replay.size, expected_replay.size)
+    else:
+      self.assertEqual(frame_replay.size, expected_replay.size)
+    assert_transitions_equal(frame_replay.get(range(frame_replay.size)),
+                             transitions[-frame_replay.size:])
+
+  @parameterized.named_parameters(
+      ('no_eviction', 1000, None),
+      ('frame_eviction', 1000, 110),
+  )
+  def test_interleaved_streams(self, capacity, frame_capacity):
+    episode_lengths = [30, 20]
+    interleaved = interleave([
+        make_transitions(episode_lengths, seed=seed) for seed in range(4)])
+    frame_replay = replay.FrameStackedTransitionReplay(
+        capacity, structure(), np.random.RandomState(0), frame_capacity)
+    for stream, transition in interleaved:
+      frame_replay.add(transition, stream=stream)
+
+    transitions = [transition for _, transition in interleaved]
+    if frame_capacity is None:
+      self.assertEqual(frame_replay.size, len(transitions))
+      # Streams share frames as if they were added one after the other.
+      num_frames = frame_replay.get_state()['num_frames_added']
+      num_episodes = 4 * len(episode_lengths)
+      self.assertLess(num_frames, 1.2 * (len(transitions) + num_episodes))
+    else:
+      # About one frame per transition, rather than one per stack frame.
+      self.assertGreater(frame_replay.size, 0.7 * frame_capacity)
+      self.assertLessEqual(frame_replay.size, frame_capacity)
+    assert_transitions_equal(frame_replay.get(range(frame_replay.size)),
+                             transitions[-frame_replay.size:])
+
+  def test_stores_each_frame_once(self):
+    episode_lengths = [30, 40, 50]
+    frame_replay = replay.FrameStackedTransitionReplay(
+        1000, structure(), np.random.RandomState(0))
+    for transition in make_transitions(episode_lengths):
+      frame_replay.add(transition)
+    # One frame per transition, and one for the first state of each episode,
+    # except where a blank frame splits a stack from the previous one.
+    num_frames = frame_replay.get_state()['num_frames_added']
+    self.assertGreaterEqual(num_frames, sum(episode_lengths) + 3)
+    self.assertLess(num_frames, 1.2 * (sum(episode_lengths) + 3))
+
+  def test_sample(self):
+    frame_replay = replay.FrameStackedTransitionReplay(
+        50, structure(), np.random.RandomState(0))
+    for transition in make_transitions([40, 40]):
+      frame_replay.add(transition)
+    batch = frame_replay.sample(8)
+    self.assertEqual(batch.s_tm1.shape, (8,) + FRAME_SHAPE + (4,))
+    self.assertEqual(batch.s_t.shape, (8,) + FRAME_SHAPE + (4,))
+    self.assertEqual(batch.s_t.dtype, np.uint8)
+    self.assertEqual(batch.r_t.shape, (8,))
+
+  def test_get_and_set_state(self):
+    transitions = make_transitions([40, 40])
+    frame_replay = replay.FrameStackedTransitionReplay(
+        50, structure(), np.random.RandomState(0))
+    for transition in transitions[:50]:
+      frame_replay.add(transition)
+    restored_replay = replay.FrameStackedTransitionReplay(
+        50, structure(), np.random.RandomState(0))
+    restored_replay.set_state(copy.deepcopy(frame_replay.get_state()))
+    for transition in transitions[50:]:
+      frame_replay.add(transition)
+      restored_replay.add(transition)
+    for expected, actual in zip(frame_replay.sample(16),
+                                restored_replay.sample(16)):
+      np.testing.assert_array_equal(actual, expected)
+
+
+if __name__ == '__main__':
+  absltest.main()
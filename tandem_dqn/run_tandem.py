@@ -14,6 +14,7 @@
 """A Tandem DQN agent implemented in JAX, training on Atari."""
 
 import collections
+import functools
 import itertools
 import sys
 import typing
@@ -44,6 +45,8 @@ flags.DEFINE_integer('environment_height', 84, '')
 flags.DEFINE_integer('environment_width', 84, '')
 flags.DEFINE_integer('replay_capacity', int(1e6), '')
 flags.DEFINE_bool('compress_state', True, '')
+flags.DEFINE_bool('deduplicate_frames', True, '')  # Overrides compress_state.
+flags.DEFINE_integer('num_environments', 1, '')  # Steps >1 in subprocesses.
 flags.DEFINE_float('min_replay_capacity_fraction', 0.05, '')
 flags.DEFINE_integer('batch_size', 32, '')
 flags.DEFINE_integer('max_frames_per_episode', 108000, '')  # 30 mins.
@@ -107,6 +110,18 @@ def make_optimizer(optimizer_type):
   return optimizer
 
 
+def _make_environment(environment_name, sticky_actions, seed, noop_seed):
+  """Creates Atari environment, defined at module level to be picklable."""
+  env = gym_atari.GymAtari(
+      environment_name, sticky_actions=sticky_actions, seed=seed)
+  return gym_atari.RandomNoopsEnvironmentWrapper(
+      env,
+      min_noop_steps=1,
+      max_noop_steps=30,
+      seed=noop_seed,
+  )
+
+
 def main(argv):
   """Trains Tandem DQN agent on Atari."""
   del argv
@@ -123,16 +138,23 @@ def main(argv):
 
   def environment_builder():
     """Creates Atari environment."""
-    env = gym_atari.GymAtari(
+    return _make_environment(
         FLAGS.environment_name,
-        sticky_actions=FLAGS.use_sticky_actions,
-        seed=random_state.randint(1, 2**32))
-    return gym_atari.RandomNoopsEnvironmentWrapper(
-        env,
-        min_noop_steps=1,
-        max_noop_steps=30,
+        FLAGS.use_sticky_actions,
         seed=random_state.randint(1, 2**32),
-    )
+        noop_seed=random_state.randint(1, 2**32))
+
+  def batched_environment_builder():
+    """Creates Atari environments, each stepped in its own process."""
+    return parts.BatchedEnvironment([
+        functools.partial(
+            _make_environment,
+            FLAGS.environment_name,
+            FLAGS.use_sticky_actions,
+            seed=random_state.randint(1, 2**32),
+            noop_seed=random_state.randint(1, 2**32))
+        for _ in range(FLAGS.num_environments)
+    ])
 
   env = environment_builder()
 
@@ -222,8 +244,13 @@ def main(argv):
       mc_return_tm1=None,
   )
 
-  replay = replay_lib.TransitionReplay(FLAGS.replay_capacity, replay_structure,
-                                       random_state, encoder, decoder)
+  if FLAGS.deduplicate_frames:
+    replay = replay_lib.FrameStackedTransitionReplay(
+        FLAGS.replay_capacity, replay_structure, random_state)
+  else:
+    replay = replay_lib.TransitionReplay(FLAGS.replay_capacity,
+                                         replay_structure, random_state,
+                                         encoder, decoder)
 
   optimizer = TandemTuple(
       active=make_optimizer(FLAGS.optimizer_active),
@@ -247,17 +274,20 @@ def main(argv):
       target_network_update_period=FLAGS.target_network_update_period,
       tied_layers=tied_layers,
       rng_key=train_rng_key,
+      num_environments=FLAGS.num_environments,
   )
   eval_agent_active = parts.EpsilonGreedyActor(
       preprocessor=preprocessor_builder(),
       network=network.active,
       exploration_epsilon=FLAGS.eval_exploration_epsilon,
-      rng_key=eval_rng_key)
+      rng_key=eval_rng_key,
+      num_environments=FLAGS.num_environments)
   eval_agent_passive = parts.EpsilonGreedyActor(
       preprocessor=preprocessor_builder(),
       network=network.passive,
       exploration_epsilon=FLAGS.eval_exploration_epsilon,
-      rng_key=eval_rng_key)
+      rng_key=eval_rng_key,
+      num_environments=FLAGS.num_environments)
 
   # Set up checkpointing.
   checkpoint = parts.NullCheckpoint()
@@ -274,9 +304,13 @@ def main(argv):
 
   # Run single iteration of training or evaluation.
   def run_iteration(agent, env, num_frames):
-    seq = parts.run_loop(agent, env, FLAGS.max_frames_per_episode)
+    if FLAGS.num_environments > 1:
+      seq = parts.run_batched_loop(agent, env, FLAGS.max_frames_per_episode)
+      trackers = parts.make_default_trackers(agent, FLAGS.num_environments)
+    else:
+      seq = parts.run_loop(agent, env, FLAGS.max_frames_per_episode)
+      trackers = parts.make_default_trackers(agent)
     seq_truncated = itertools.islice(seq, num_frames)
-    trackers = parts.make_default_trackers(agent)
     return parts.generate_statistics(trackers, seq_truncated)
 
   def eval_log_output(eval_stats, suffix):
@@ -300,7 +334,10 @@ def main(argv):
 
   while state.iteration <= FLAGS.num_iterations:
     # New environment for each iteration to allow for determinism if preempted.
-    env = environment_builder()
+    if FLAGS.num_environments > 1:
+      env = batched_environment_builder()
+    else:
+      env = environment_builder()
 
     # Set agent to train active and passive nets on each learning step.
     train_agent.set_training_mode('active_passive')
@@ -318,6 +355,7 @@ def main(argv):
     eval_agent_passive.network_params = train_agent.online_params.passive
     eval_stats_passive = run_iteration(eval_agent_passive, env,
                                        FLAGS.num_eval_frames)
+    env.close()
 
     # Logging and checkpointing.
     agent_logs = [
@@ -13,19 +13,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ============================================================================
-"""Threaded batch environment wrapper."""
+"""Threaded and multi-process batch environment wrappers."""
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
 from concurrent import futures
+import multiprocessing
+from multiprocessing import shared_memory
+import traceback
 
+import numpy as np
 from six.moves import range
 from six.moves import zip
 
 from tvt import nest_utils
 
+nest = nest_utils.nest
+
 
 class BatchEnv(object):
   """Wrapper that steps multiple environments in separate threads.
@@ -107,3 +113,213 @@ class BatchEnv(object):
 
   def last_phase_rewards(self):
     return [env.last_phase_reward() for env in self._envs]
+
+  def close(self):
+    self._executor.shutdown(wait=True)
+
+
+def _attach_arrays(names, specs):
+  """Returns shared memory blocks and numpy views onto them."""
+  blocks = [shared_memory.SharedMemory(name=name) for name in names]
+  arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            for block, (shape, dtype) in zip(blocks, specs)]
+  return blocks, arrays
+
+
+def _worker(conn, env_builder, env_kwargs):
+  """Runs a single environment, writing its outputs into shared memory.
+
+  The worker first sends the environment properties and an example
+  observation, then waits for the names of the shared batch buffers and the
+  index of its row in them. After that it serves `(command, data)` requests
+  from the pipe until asked to close.
+
+  Args:
+    conn: Worker end of a `multiprocessing.Pipe`.
+    env_builder: Callable building the environment.
+    env_kwargs: Keyword arguments for `env_builder`.
+  """
+  try:
+    env = env_builder(**env_kwargs)
+    observation, _ = env.reset()
+    conn.send((True, (env.num_actions, env.observation_shape,
+                      env.episode_length, observation)))
+
+    index, names, specs = conn.recv()
+    # The blocks must stay referenced for as long as the views are used.
+    blocks, arrays = _attach_arrays(names, specs)
+    rewards = arrays.pop()
+
+    while True:
+      command, data = conn.recv()
+      if command == 'close':
+        break
+      elif command == 'last_phase_reward':
+        conn.send((True, env.last_phase_reward()))
+        continue
+      elif command == 'reset':
+        observation, reward = env.reset()
+      elif command == 'step':
+        observation, reward = env.step(data)
+      else:
+        raise ValueError('Unknown command "%s".' % command)
+      # Index the buffers on each write: for scalar leaves `array[index]` is a
+      # numpy scalar rather than a view.
+      for array, leaf in zip(arrays, nest.flatten(observation)):
+        array[index] = leaf
+      rewards[index] = reward
+      conn.send((True, None))
+
+    del rewards, arrays
+    for block in blocks:
+      block.close()
+  except KeyboardInterrupt:
+    pass
+  except Exception:  # pylint: disable=broad-except
+    conn.send((False, traceback.format_exc()))
+  finally:
+    conn.close()
+
+
+class ProcessBatchEnv(object):
+  """Wrapper that steps multiple environments in separate processes.
+
+  Each environment lives in its own worker process, so stepping is not
+  serialized by the GIL. Workers write observations and rewards directly into
+  preallocated shared memory buffers of shape [batch_size, ...], and actions
+  are sent to them over pipes. As with `BatchEnv`, the environments are stepped
+  in lock step.
+
+  `env_builder` and `env_kwargs` must be picklable. Since workers are started
+  with the "spawn" method by default, the calling script needs the usual
+  `if __name__ == '__main__':` guard. Each worker resets its environment once
+  on construction to find out the observation structure.
+  """
+
+  def __init__(self, batch_size, env_builder, start_method='spawn',
+               **env_kwargs):
+    self.batch_size = batch_size
+    context = multiprocessing.get_context(start_method)
+    self._conns = []
+    self._processes = []
+    self._blocks = []
+    for _ in range(batch_size):
+      conn, worker_conn = context.Pipe()
+      process = context.Process(
+          target=_worker, args=(worker_conn, env_builder, env_kwargs))
+      process.daemon = True
+      process.start()
+      worker_conn.close()
+      self._conns.append(conn)
+      self._processes.append(process)
+
+    try:
+      env_properties = self._receive_all()
+      (self._num_actions, self._observation_shape, self._episode_length,
+       self._observation_structure) = env_properties[0]
+
+      specs = [((batch_size,) + np.shape(leaf), np.asarray(leaf).dtype)
+               for leaf in nest.flatten(self._observation_structure)]
+      # Rewards are stored as floats whatever the type of the first reward.
+      specs.append(((batch_size,), np.float64))
+      for shape, dtype in specs:
+        size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        self._blocks.append(
+            shared_memory.SharedMemory(create=True, size=size))
+      names = [block.name for block in self._blocks]
+      self._observations = [
+          np.ndarray(shape, dtype=dtype, buffer=block.buf)
+          for block, (shape, dtype) in zip(self._blocks, specs)]
+      self._rewards = self._observations.pop()
+
+      for index, conn in enumerate(self._conns):
+        conn.send((index, names, specs))
+    except:  # pylint: disable=bare-except
+      self.close()
+      raise
+
+  def _receive_all(self):
+    """Receives one result per worker, raising if any of them failed."""
+    responses = [conn.recv() for conn in self._conns]
+    for success, result in responses:
+      if not success:
+        raise RuntimeError('Environment worker failed:\n%s' % result)
+    return [result for _, result in responses]
+
+  def _run(self, commands):
+    """Sends one command per worker, then waits for all of them."""
+    try:
+      for conn, command in zip(self._conns, commands):
+        conn.send(command)
+      return self._receive_all()
+    except KeyboardInterrupt:
+      self.close()
+      raise
+
+  def _outputs(self):
+    observations = nest.pack_sequence_as(
+        self._observation_structure,
+        [np.copy(array) for array in self._observations])
+    return observations, np.copy(self._rewards)
+
+  def reset(self):
+    """Reset the entire batch of environments."""
+    self._run([('reset', None)] * self.batch_size)
+    return self._outputs()
+
+  def step(self, action_list):
+    """Step batch of envs.
+
+    Args:
+      action_list: A list of actions, one per environment in the batch. Each one
+        should be a scalar int or a numpy scaler int.
+
+    Returns:
+      A tuple (observations, rewards):
+        observations: A nest of observations, each one a numpy array where the
+          first dimension has size equal to the number of environments in the
+          batch. The arrays are copies of the shared buffers, so they stay valid
+          after later steps.
+        rewards: An array of rewards with size equal to the number of
+          environments in the batch.
+    """
+    self._run([('step', action) for action in action_list])
+    return self._outputs()
+
+  @property
+  def observation_shape(self):
+    """Observation shape per environment, i.e. with no batch dimension."""
+    return self._observation_shape
+
+  @property
+  def num_actions(self):
+    return self._num_actions
+
+  @property
+  def episode_length(self):
+    return self._episode_length
+
+  def last_phase_rewards(self):
+    return self._run([('last_phase_reward', None)] * self.batch_size)
+
+  def close(self):
+    """Shuts down the worker processes and frees the shared memory."""
+    for conn in self._conns:
+      try:
+        conn.send(('close', None))
+      except (BrokenPipeError, OSError):
+        pass
+    for process in self._processes:
+      process.join(timeout=5)
+      if process.is_alive():
+        process.terminate()
+    for conn in self._conns:
+      conn.close()
+    self._conns = []
+    self._processes = []
+    self._observations = []
+    self._rewards = None
+    for block in self._blocks:
+      block.close()
+      block.unlink()
+    self._blocks = []
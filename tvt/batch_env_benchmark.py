@@ -0,0 +1,103 @@
+# pylint: disable=g-bad-file-header
+# Copyright 2019 DeepMind Technologies Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Throughput of threaded against multi-process batch environments.
+
+Steps a CPU-bound fake environment, holding the GIL for `step_work_ms` per
+step, as Python environments such as pycolab do.
+
+Run with:
+
+$ python3 -m tvt.batch_env_benchmark --batch_sizes=16,32,64
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import time
+
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+from six.moves import range
+
+from tvt import batch_env
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('batch_sizes', ['16', '32', '64'], 'Batch sizes to time.')
+flags.DEFINE_float('step_work_ms', 1., 'CPU time per environment step.')
+flags.DEFINE_integer('image_size', 64, 'Height and width of observations.')
+flags.DEFINE_integer('num_steps', 100, 'Number of timed batch steps.')
+
+
+class _BusyEnv(object):
+  """Environment whose steps spin in Python for a fixed time."""
+
+  num_actions = 4
+  episode_length = 1000
+
+  def __init__(self, image_size, step_work_ms):
+    self.observation_shape = (image_size, image_size, 3)
+    self._step_work = step_work_ms / 1000.
+    self._observation = np.zeros(self.observation_shape, np.uint8)
+
+  def reset(self):
+    return self._observation, 0.
+
+  def step(self, action):
+    end = time.time() + self._step_work
+    while time.time() < end:
+      pass
+    return self._observation, float(action)
+
+  def last_phase_reward(self):
+    return 0.
+
+
+def _steps_per_second(env):
+  """Returns the environment steps per second, summed over the batch."""
+  env.reset()
+  actions = [0] * env.batch_size
+  env.step(actions)
+  start = time.time()
+  for _ in range(FLAGS.num_steps):
+    env.step(actions)
+  return FLAGS.num_steps * env.batch_size / (time.time() - start)
+
+
+def main(argv):
+  del argv
+  logging.info('%d CPUs available.', multiprocessing.cpu_count())
+  env_kwargs = dict(image_size=FLAGS.image_size,
+                    step_work_ms=FLAGS.step_work_ms)
+  for batch_size in [int(b) for b in FLAGS.batch_sizes]:
+    rates = []
+    for env_class in [batch_env.BatchEnv, batch_env.ProcessBatchEnv]:
+      env = env_class(batch_size, _BusyEnv, **env_kwargs)
+      try:
+        rates.append(_steps_per_second(env))
+      finally:
+        env.close()
+    logging.info('Batch size %d: threads %.0f steps/s, processes %.0f steps/s '
+                 '(%.1fx).', batch_size, rates[0], rates[1],
+                 rates[1] / rates[0])
+
+
+if __name__ == '__main__':
+  app.run(main)
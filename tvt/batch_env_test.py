@@ -0,0 +1,114 @@
+# pylint: disable=g-bad-file-header
+# Copyright 2019 DeepMind Technologies Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the batch environment wrappers."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl.testing import absltest
+import numpy as np
+
+from tvt import batch_env
+from tvt import nest_utils
+
+nest = nest_utils.nest
+
+
+class FakeEnv(object):
+  """Environment with nested observations, including scalar leaves."""
+
+  num_actions = 4
+  observation_shape = (3, 3, 3)
+  episode_length = 10
+
+  def __init__(self, offset=0):
+    self._offset = offset
+    self._total = 0
+
+  def _observation(self):
+    image = np.full(self.observation_shape, self._total % 256, np.uint8)
+    return image, {'x': np.float32(self._total + 0.5),
+                   'y': np.array([self._offset, self._total], np.int64)}
+
+  def reset(self):
+    self._total = self._offset
+    return self._observation(), 0
+
+  def step(self, action):
+    if action < 0:
+      raise ValueError('Invalid action %d.' % action)
+    self._total += action
+    return self._observation(), 0.5 * action
+
+  def last_phase_reward(self):
+    return float(self._total)
+
+
+def _assert_outputs_equal(outputs, expected):
+  (observations, rewards), (expected_observations, expected_rewards) = (
+      outputs, expected)
+  nest.assert_same_structure(observations, expected_observations)
+  for observation, expected_observation in zip(
+      nest.flatten(observations), nest.flatten(expected_observations)):
+    np.testing.assert_array_equal(observation, expected_observation)
+    assert observation.dtype == expected_observation.dtype
+  # Rewards are always stored as floats by `ProcessBatchEnv`.
+  np.testing.assert_array_equal(rewards, expected_rewards)
+
+
+class ProcessBatchEnvTest(absltest.TestCase):
+
+  def test_matches_batch_env(self):
+    batch_size = 3
+    thread_env = batch_env.BatchEnv(batch_size, FakeEnv, offset=2)
+    process_env = batch_env.ProcessBatchEnv(batch_size, FakeEnv, offset=2)
+    try:
+      self.assertEqual(process_env.num_actions, FakeEnv.num_actions)
+      self.assertEqual(process_env.observation_shape, FakeEnv.observation_shape)
+      self.assertEqual(process_env.episode_length, FakeEnv.episode_length)
+
+      _assert_outputs_equal(process_env.reset(), thread_env.reset())
+      for actions in [[0, 1, 2], [3, 3, 1], [2, 0, 0]]:
+        _assert_outputs_equal(process_env.step(actions),
+                              thread_env.step(actions))
+      self.assertEqual(process_env.last_phase_rewards(),
+                       thread_env.last_phase_rewards())
+    finally:
+      thread_env.close()
+      process_env.close()
+
+  def test_worker_exception_is_raised(self):
+    env = batch_env.ProcessBatchEnv(2, FakeEnv)
+    try:
+      env.reset()
+      with self.assertRaisesRegex(RuntimeError, 'Invalid action -1'):
+        env.step([1, -1])
+    finally:
+      env.close()
+
+  def test_close_stops_workers(self):
+    env = batch_env.ProcessBatchEnv(2, FakeEnv)
+    processes = list(env._processes)  # pylint: disable=protected-access
+    env.reset()
+    env.close()
+    for process in processes:
+      self.assertFalse(process.is_alive())
+      self.assertEqual(process.exitcode, 0)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -63,6 +63,8 @@ flags.DEFINE_integer('num_episodes', None,
                      'Number of episodes to train for. None means run forever.')
 
 flags.DEFINE_integer('batch_size', 16, 'Batch size')
+flags.DEFINE_boolean('env_processes', False,
+                     'Whether to step each environment in its own process.')
 
 flags.DEFINE_float('learning_rate', 2e-4, 'Adam optimizer learning rate')
 flags.DEFINE_float('beta1', 0., 'Adam optimizer beta1')
@@ -97,7 +99,10 @@ def main(_):
       'final_reward': FLAGS.pycolab_final_reward,
       'crop': FLAGS.pycolab_crop
   }
-  env = batch_env.BatchEnv(batch_size, env_builder, **env_kwargs)
+  if FLAGS.env_processes:
+    env = batch_env.ProcessBatchEnv(batch_size, env_builder, **env_kwargs)
+  else:
+    env = batch_env.BatchEnv(batch_size, env_builder, **env_kwargs)
   ep_length = env.episode_length
 
   agent = rma.Agent(batch_size=batch_size,
@@ -252,6 +257,8 @@ def main(_):
     if FLAGS.num_episodes and ep_num >= FLAGS.num_episodes:
       run = False
 
+  env.close()
+
 
 if __name__ == '__main__':
   app.run(main)
@@ -19,7 +19,6 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from concurrent import futures
 import numpy as np
 from six.moves import range
 from six.moves import zip
@@ -154,6 +153,14 @@ def _tvt_rewards_single_head(read_weights, read_strengths, read_times,
   return tvt_rewards
 
 
+def _no_transport_period(gamma, no_transport_period_when_gamma_1):
+  if gamma < 1:
+    return int(1 / (1 - gamma))
+  if no_transport_period_when_gamma_1 is None:
+    raise ValueError("No transport period must be defined when gamma == 1.")
+  return no_transport_period_when_gamma_1
+
+
 def _compute_tvt_rewards_from_read_info(
     read_weights, read_strengths, read_times, baselines, gamma,
     alpha=0.9, top_k_t1=50,
@@ -177,12 +184,8 @@ def _compute_tvt_rewards_from_read_info(
     An array of TVT rewards with shape (ep_length,).
   """
 
-  if gamma < 1:
-    no_transport_period = int(1 / (1 - gamma))
-  else:
-    if no_transport_period_when_gamma_1 is None:
-      raise ValueError("No transport period must be defined when gamma == 1.")
-    no_transport_period = no_transport_period_when_gamma_1
+  no_transport_period = _no_transport_period(
+      gamma, no_transport_period_when_gamma_1)
 
   # Split read infos by read head.
   num_read_heads = read_weights.shape[1]
@@ -201,6 +204,120 @@ def _compute_tvt_rewards_from_read_info(
   return tvt_rewards
 
 
+def _threshold_read_event_times_batched(read_strengths, threshold):
+  """Batched version of `_threshold_read_event_times`.
+
+  Each run of consecutive read strengths above the threshold is one read event,
+  and its time is the first time of the maximum read strength within the run.
+  The runs are contiguous segments of the flattened strengths above the
+  threshold, so they are reduced with `reduceat` instead of a loop over time.
+
+  Args:
+    read_strengths: shape (..., ep_length).
+    threshold: Read strengths below this value are ignored. Like the loop
+      version, this assumes the threshold is non-negative.
+
+  Returns:
+    A tuple of index arrays `(..., times)` of the read events, ordered by batch
+    index and then by time.
+  """
+  over_threshold = read_strengths > threshold
+  starts = over_threshold.copy()
+  starts[..., 1:] &= ~over_threshold[..., :-1]
+
+  flat_over = np.flatnonzero(over_threshold)
+  if not flat_over.size:
+    return tuple(np.zeros((0,), np.int64) for _ in read_strengths.shape)
+  strengths = read_strengths.ravel()[flat_over]
+  run_starts = np.flatnonzero(starts.ravel()[flat_over])
+  run_lengths = np.diff(np.append(run_starts, len(flat_over)))
+
+  max_strengths = np.maximum.reduceat(strengths, run_starts)
+  is_max = strengths == np.repeat(max_strengths, run_lengths)
+  positions = np.where(is_max, np.arange(len(flat_over)), len(flat_over))
+  max_positions = np.minimum.reduceat(positions, run_starts)
+  return np.unravel_index(flat_over[max_positions], read_strengths.shape)
+
+
+def _compute_tvt_rewards_batched(
+    read_weights, read_strengths, read_times, baselines, gamma,
+    alpha=0.9, top_k_t1=50,
+    read_strength_threshold=2.,
+    no_transport_period_when_gamma_1=25):
+  """Compute TVT rewards for a batch of episodes without Python loops.
+
+  Gives the same rewards as `_compute_tvt_rewards_from_read_info` applied to
+  each batch element, including the order in which rewards are accumulated.
+
+  Args:
+    read_weights: shape (ep_length, batch_size, num_read_heads, top_k).
+    read_strengths: shape (ep_length, batch_size, num_read_heads).
+    read_times: shape (ep_length, batch_size, num_read_heads, top_k).
+    baselines: shape (ep_length, batch_size).
+    gamma: Scalar discount factor used to calculate the no_transport_period.
+    alpha: The multiplier for the temporal value transport rewards.
+    top_k_t1: For each read event time, this determines how many time points
+      to send tvt reward to.
+    read_strength_threshold: Read strengths below this value are ignored.
+    no_transport_period_when_gamma_1: no transport period when gamma == 1.
+
+  Returns:
+    An array of TVT rewards with shape (ep_length, batch_size).
+  """
+  no_transport_period = _no_transport_period(
+      gamma, no_transport_period_when_gamma_1)
+
+  ep_length, batch_size, num_read_heads = read_strengths.shape
+  times = np.arange(ep_length)[:, None, None]
+
+  # Cut read strengths as in _tvt_rewards_single_head.
+  max_read_weight_times = np.take_along_axis(
+      read_times, np.argmax(read_weights, axis=-1)[..., None], axis=-1)[..., 0]
+  read_strengths_cut = np.where(
+      times - max_read_weight_times > no_transport_period,
+      read_strengths, np.zeros_like(read_strengths))
+
+  # Read events, ordered by batch element, read head and t2.
+  batch, head, t2 = _threshold_read_event_times_batched(
+      np.moveaxis(read_strengths_cut, 0, -1), read_strength_threshold)
+  if t2.size and t2.max() >= baselines.shape[0]:
+    raise RuntimeError("Attempting to access baselines array with length {}"
+                       " at index {}. Make sure output_baseline is set in"
+                       " the agent config.".format(baselines.shape[0],
+                                                   t2.max()))
+
+  # Gather the reads from every t2, masking those that read back to times
+  # within no_transport_period of t2, and keep the top_k_t1 of them.
+  event_times = read_times[t2, batch, head]
+  event_weights = read_weights[t2, batch, head]
+  event_weights = np.where(
+      (t2[:, None] - event_times) > no_transport_period,
+      event_weights, np.zeros_like(event_weights))
+  if event_weights.shape[-1] > top_k_t1:
+    top_t1_indices = np.argpartition(
+        event_weights, kth=-top_k_t1, axis=-1)[:, -top_k_t1:]
+    event_weights = np.take_along_axis(event_weights, top_t1_indices, axis=-1)
+    event_times = np.take_along_axis(event_times, top_t1_indices, axis=-1)
+
+  # Scatter-add the transported values into each head's rewards in the same
+  # order as the per head loop, ignoring reads from t2 of times t1 >= t2.
+  head_rewards = np.zeros((batch_size, num_read_heads, ep_length),
+                          dtype=baselines.dtype)
+  baseline_values = baselines[t2, batch][:, None]
+  valid = event_times < t2[:, None]
+  np.add.at(
+      head_rewards,
+      (np.broadcast_to(batch[:, None], valid.shape)[valid],
+       np.broadcast_to(head[:, None], valid.shape)[valid],
+       event_times[valid]),
+      (alpha * event_weights * baseline_values)[valid])
+
+  tvt_rewards = np.zeros_like(baselines)
+  for i in range(num_read_heads):
+    tvt_rewards += head_rewards[:, i].T
+  return tvt_rewards
+
+
 def compute_tvt_rewards(read_infos, baselines, gamma=.96):
   """Compute TVT rewards from EpisodeOutputs.
 
@@ -211,36 +328,11 @@ def compute_tvt_rewards(read_infos, baselines, gamma=.96):
     gamma: Discount factor.
 
   Returns:
-    An array of TVT rewards with shape (ep_length,).
+    An array of TVT rewards with shape (ep_length, batch_size).
   """
   if not read_infos:
     return np.zeros_like(baselines)
 
-  # TVT reward computation is without batch dimension. so we need to process
-  # read_infos and baselines into batchwise components.
-  batch_size = baselines.shape[1]
-
-  # Split each element of read info on batch dim.
-  read_weights = _unstack(read_infos.weights, axis=1)
-  read_strengths = _unstack(read_infos.strengths, axis=1)
-  read_indices = _unstack(read_infos.indices, axis=1)
-  # Split baselines on batch dim.
-  baselines = _unstack(baselines, axis=1)
-
-  # Comute TVT rewards for each element in the batch (threading over batch).
-  tvt_rewards = []
-  with futures.ThreadPoolExecutor(max_workers=batch_size) as executor:
-    for i in range(batch_size):
-      tvt_rewards.append(
-          executor.submit(
-              _compute_tvt_rewards_from_read_info,
-              read_weights[i],
-              read_strengths[i],
-              read_indices[i],
-              baselines[i],
-              gamma)
-          )
-    tvt_rewards = [f.result() for f in tvt_rewards]
-
-  # Process TVT rewards back into an array of shape (ep_length, batch_size).
-  return np.stack(tvt_rewards, axis=1)
+  return _compute_tvt_rewards_batched(
+      read_infos.weights, read_infos.strengths, read_infos.indices, baselines,
+      gamma)
@@ -0,0 +1,96 @@
+# pylint: disable=g-bad-file-header
+# Copyright 2019 DeepMind Technologies Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Microbenchmark of batched against per batch element TVT rewards.
+
+That both give the same rewards is tested in tvt_rewards_test.py.
+
+Run with:
+
+$ python3 -m tvt.tvt_rewards_benchmark --ep_length=1000 --batch_size=16
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from concurrent import futures
+import timeit
+
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+from six.moves import range
+
+from tvt import tvt_rewards
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('ep_length', 600, 'Episode length.')
+flags.DEFINE_integer('batch_size', 16, 'Batch size.')
+flags.DEFINE_integer('num_read_heads', 3, 'Number of memory read heads.')
+flags.DEFINE_integer('top_k', 50, 'Number of memory reads per read head.')
+flags.DEFINE_float('gamma', 0.92, 'Agent discount factor.')
+flags.DEFINE_integer('repeats', 10, 'Number of timed runs of each method.')
+flags.DEFINE_integer('seed', 0, 'Random seed for the read information.')
+
+
+def _per_element_tvt_rewards(read_weights, read_strengths, read_times,
+                             baselines, gamma):
+  """The previous implementation, threading over the batch elements."""
+  batch_size = baselines.shape[1]
+  with futures.ThreadPoolExecutor(max_workers=batch_size) as executor:
+    results = [
+        executor.submit(tvt_rewards._compute_tvt_rewards_from_read_info,  # pylint: disable=protected-access
+                        read_weights[:, i], read_strengths[:, i],
+                        read_times[:, i], baselines[:, i], gamma)
+        for i in range(batch_size)]
+    return np.stack([f.result() for f in results], axis=1)
+
+
+def _random_read_information(rng, ep_length, batch_size, num_read_heads,
+                             top_k):
+  """Returns read information resembling that of the RMA agent."""
+  shape = (ep_length, batch_size, num_read_heads)
+  read_weights = rng.dirichlet(np.ones(top_k), size=shape).astype(np.float32)
+  # Softplus read strengths crossing the default threshold of 2 now and then.
+  read_strengths = np.log1p(np.exp(rng.normal(0., 1.5, size=shape)))
+  read_times = rng.randint(0, ep_length, size=shape + (top_k,))
+  baselines = rng.normal(size=(ep_length, batch_size))
+  return (read_weights, read_strengths.astype(np.float32),
+          read_times.astype(np.int32), baselines.astype(np.float32))
+
+
+def main(_):
+  rng = np.random.RandomState(FLAGS.seed)
+  inputs = _random_read_information(rng, FLAGS.ep_length, FLAGS.batch_size,
+                                    FLAGS.num_read_heads, FLAGS.top_k)
+  methods = {
+      'per_element': lambda: _per_element_tvt_rewards(*inputs, FLAGS.gamma),
+      'batched': lambda: tvt_rewards._compute_tvt_rewards_batched(  # pylint: disable=protected-access
+          *inputs, FLAGS.gamma),
+  }
+
+  timings = {}
+  for name, method in methods.items():
+    timings[name] = min(timeit.repeat(method, number=1, repeat=FLAGS.repeats))
+    logging.info('%s: %.2f ms', name, timings[name] * 1e3)
+  logging.info('Speedup: %.1fx',
+               timings['per_element'] / timings['batched'])
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,112 @@
+# pylint: disable=g-bad-file-header
+# Copyright 2019 DeepMind Technologies Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the batched TVT rewards."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from six.moves import range
+
+from tvt import tvt_rewards
+
+_EP_LENGTH = 120
+_BATCH_SIZE = 4
+_NUM_READ_HEADS = 3
+
+
+def _per_element_tvt_rewards(read_weights, read_strengths, read_times,
+                             baselines, gamma, **kwargs):
+  return np.stack([
+      tvt_rewards._compute_tvt_rewards_from_read_info(  # pylint: disable=protected-access
+          read_weights[:, i], read_strengths[:, i], read_times[:, i],
+          baselines[:, i], gamma, **kwargs)
+      for i in range(baselines.shape[1])], axis=1)
+
+
+def _random_read_information(rng, top_k, ties=False):
+  """Returns read information resembling that of the RMA agent.
+
+  Args:
+    rng: A `np.random.RandomState`.
+    top_k: Number of memory reads per read head.
+    ties: Whether to draw the read weights and strengths from a few values, so
+      that the top reads and the maximum strengths of read events are tied.
+
+  Returns:
+    A tuple of read weights, strengths, times and the baselines.
+  """
+  shape = (_EP_LENGTH, _BATCH_SIZE, _NUM_READ_HEADS)
+  if ties:
+    read_weights = rng.randint(0, 3, size=shape + (top_k,)) / 4.
+    read_strengths = rng.choice([0., 2.5, 3.], size=shape)
+  else:
+    read_weights = rng.dirichlet(np.ones(top_k), size=shape)
+    # Softplus read strengths crossing the default threshold of 2 now and then.
+    read_strengths = np.log1p(np.exp(rng.normal(0., 1.5, size=shape)))
+  read_times = rng.randint(0, _EP_LENGTH, size=shape + (top_k,))
+  baselines = rng.normal(size=(_EP_LENGTH, _BATCH_SIZE))
+  return (read_weights.astype(np.float32), read_strengths.astype(np.float32),
+          read_times.astype(np.int32), baselines.astype(np.float32))
+
+
+class ComputeTvtRewardsBatchedTest(parameterized.TestCase):
+
+  @parameterized.named_parameters(
+      ('all_reads', 8, 50, 0.92, False),
+      # More reads than top_k_t1, so that only the top reads transport value.
+      ('top_reads', 12, 5, 0.92, False),
+      ('top_reads_gamma_1', 12, 5, 1., False),
+      ('all_reads_gamma_1', 8, 50, 1., False),
+      ('top_reads_ties', 12, 5, 0.92, True),
+      ('all_reads_ties', 8, 50, 0.9, True),
+  )
+  def test_matches_per_element(self, top_k, top_k_t1, gamma, ties):
+    inputs = _random_read_information(np.random.RandomState(0), top_k, ties)
+    expected = _per_element_tvt_rewards(*inputs, gamma=gamma,
+                                        top_k_t1=top_k_t1)
+    self.assertTrue(np.any(expected))
+    np.testing.assert_array_equal(
+        tvt_rewards._compute_tvt_rewards_batched(  # pylint: disable=protected-access
+            *inputs, gamma=gamma, top_k_t1=top_k_t1), expected)
+
+  @parameterized.parameters(0.92, 1.)
+  def test_no_read_events(self, gamma):
+    read_weights, read_strengths, read_times, baselines = (
+        _random_read_information(np.random.RandomState(0), top_k=12))
+    # No read strength crosses the threshold.
+    read_strengths = np.minimum(read_strengths, 1.)
+    inputs = (read_weights, read_strengths, read_times, baselines)
+    expected = _per_element_tvt_rewards(*inputs, gamma=gamma, top_k_t1=5)
+    np.testing.assert_array_equal(expected, 0.)
+    np.testing.assert_array_equal(
+        tvt_rewards._compute_tvt_rewards_batched(  # pylint: disable=protected-access
+            *inputs, gamma=gamma, top_k_t1=5), expected)
+
+  def test_tied_read_strengths_pick_the_first_maximum(self):
+    read_strengths = np.array([[0., 3., 3., 1., 2.5, 4., 4., 0., 3.]])
+    times = tvt_rewards._threshold_read_event_times_batched(  # pylint: disable=protected-access
+        read_strengths, 2.)[1]
+    np.testing.assert_array_equal(
+        times, tvt_rewards._threshold_read_event_times(read_strengths[0], 2.))  # pylint: disable=protected-access
+    np.testing.assert_array_equal(times, [1, 5, 8])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -111,6 +111,13 @@ flags.DEFINE_integer('sample_length', 512, 'Length of samples.')
 flags.DEFINE_integer('sample_memory_size', 640, 'Memory size for sampling.')
 flags.DEFINE_integer('num_samples', 1000, 'Maximum number of samples to'
                      ' generate.')
+flags.DEFINE_bool('sample_early_stop', True, 'Whether to stop sampling once'
+                  ' all samples in a batch have generated <eos>.')
+flags.DEFINE_integer('sample_steps_per_chunk', 8, 'Number of sampling steps'
+                     ' between two checks for <eos>.')
+flags.DEFINE_multi_integer('sample_length_buckets', [], 'Lengths that prompts'
+                           ' are padded to, to limit the number of compiled'
+                           ' shapes.')
 
 # Optimization
 flags.DEFINE_float('init_lr', 0.00025, 'Initial learning rate.')
@@ -291,6 +298,7 @@ def _sample(eval_dataset, tokenizer, devices, batch_size=1):
             })
         n_samples += len(samples)
         logging.info('Finished generating %d samples', n_samples)
+        logging.info('Sampler statistics: %s', sampler.statistics)
 
         del futures[future]
 
@@ -30,6 +30,7 @@
 """Utility functions for the training script."""
 
 import collections
+import functools
 import math
 import random
 
@@ -210,18 +211,27 @@ def build_sampler(tokenizer, device=None):
         prompts, is_training=False, cache_steps=FLAGS.sample_memory_size)
     sampler_class = transformer_sampler.TransformerXLSampler
   elif FLAGS.model_type == 'graph2text':
-    def model_fn(graphs, max_graph_size, prompts):
+    def model_fn(graphs, max_graph_size, prompts, encoded_graphs=None):
       return graph2text_model_fn(tokenizer.vocab_size)(
           graphs, max_graph_size, True, prompts, is_training=False,
-          cache_steps=FLAGS.sample_memory_size)
-    sampler_class = transformer_sampler.Graph2TextTransformerSampler
+          cache_steps=FLAGS.sample_memory_size, encoded_graphs=encoded_graphs)
+    def encode_fn(graphs, max_graph_size):
+      return graph2text_model_fn(tokenizer.vocab_size).encode_graphs(
+          graphs, max_graph_size, True)
+    sampler_class = functools.partial(
+        transformer_sampler.Graph2TextTransformerSampler, encode_fn=encode_fn)
   elif FLAGS.model_type == 'bow2text':
     def model_fn(graphs, prompts):
       return bow2text_model_fn(tokenizer.vocab_size)(
           graphs, prompts, is_training=False,
           cache_steps=FLAGS.sample_memory_size)
     sampler_class = transformer_sampler.Bow2TextTransformerSampler
-  sampler = sampler_class(model_fn, FLAGS.sampling_temperature, device)
+  sampler = sampler_class(
+      model_fn, FLAGS.sampling_temperature, device,
+      eos_token=tokenizer.bos_token() if FLAGS.sample_early_stop else None,
+      pad_token=tokenizer.pad_token(),
+      steps_per_chunk=FLAGS.sample_steps_per_chunk,
+      length_buckets=FLAGS.sample_length_buckets)
   return sampler
 
 
@@ -252,6 +252,67 @@ class ParsedDataset(dataset.Dataset):
     return source()
 
 
+class GraphRetrievalPairs:
+  """All (graph, text) cross pairs of a dataset, produced on demand.
+
+  Only the processed graphs and texts of the `n` examples are kept, and pair
+  `k` is built from graph `k // n` and text `k % n` when it is accessed,
+  instead of materializing all `n^2` pairs.  The pairs can be split into
+  contiguous shards, e.g. one for each host.
+  """
+
+  def __init__(self,
+               examples: List[Tuple[Any, Any]],
+               num_shards: int = 1,
+               shard_index: int = 0):
+    """Constructor.
+
+    Args:
+      examples: a list of (graph, text) pairs.
+      num_shards: number of shards to split the pairs into.
+      shard_index: index of the shard of pairs to produce.
+    """
+    if not 0 <= shard_index < num_shards:
+      raise ValueError(f'Shard index {shard_index} not in [0, {num_shards}).')
+    self._graphs = [g for g, _ in examples]
+    self._texts = [t for _, t in examples]
+    n_pairs = len(examples) ** 2
+    self._start = n_pairs * shard_index // num_shards
+    self._end = n_pairs * (shard_index + 1) // num_shards
+
+  def __len__(self) -> int:
+    return self._end - self._start
+
+  def __getitem__(self, k: int) -> Tuple[Tuple[Any, Any], Tuple[int, int]]:
+    """Returns the `k`th pair of the shard as ((graph, text), (i, j))."""
+    if not 0 <= k < len(self):
+      raise IndexError(f'Pair index {k} out of range.')
+    i, j = divmod(self._start + k, len(self._texts))
+    return (self._graphs[i], self._texts[j]), (i, j)
+
+  def iterate(self, shuffle: bool = False, chunk_size: int = 65536):
+    """Iterate over the pairs of the shard, one chunk of indices at a time.
+
+    Args:
+      shuffle: set to True to visit the chunks in a random order, and the pairs
+        within each chunk in a random order, so that memory stays bounded by
+        `chunk_size` rather than the number of pairs.
+      chunk_size: number of pair indices to generate at a time.
+
+    Yields:
+      ((graph, text), (graph_id, text_id)) pairs.
+    """
+    chunk_starts = np.arange(0, len(self), chunk_size)
+    if shuffle:
+      chunk_starts = np.random.permutation(chunk_starts)
+    for chunk_start in chunk_starts:
+      idx = np.arange(chunk_start, min(chunk_start + chunk_size, len(self)))
+      if shuffle:
+        idx = np.random.permutation(idx)
+      for k in idx:
+        yield self[k]
+
+
 class BaseGraph2TextDataset(dataset.Dataset):
   """Base dataset class for graph-to-text tasks."""
 
@@ -267,6 +328,8 @@ class BaseGraph2TextDataset(dataset.Dataset):
                data_dir: str = None,
                subsample_nodes: float = 1.0,
                graph_retrieval_dataset: bool = False,
+               retrieval_num_shards: int = 1,
+               retrieval_shard_index: int = 0,
                debug: bool = False):
     """Constructor.
 
@@ -285,6 +348,10 @@ class BaseGraph2TextDataset(dataset.Dataset):
       subsample_nodes: the proportion of the nodes in a graph to keep.
       graph_retrieval_dataset: whether to construct the dataset for graph
         retrieval tasks.
+      retrieval_num_shards: number of shards to split the graph retrieval pairs
+        into, e.g. one for each host.
+      retrieval_shard_index: index of the shard of graph retrieval pairs to
+        load.
       debug: set to True to use debug mode and only load a small number of
         examples.
     """
@@ -302,6 +369,8 @@ class BaseGraph2TextDataset(dataset.Dataset):
     self._repeat = repeat
     self._subsample_nodes = subsample_nodes
     self._graph_retrieval_dataset = graph_retrieval_dataset
+    self._retrieval_num_shards = retrieval_num_shards
+    self._retrieval_shard_index = retrieval_shard_index
     self._debug = debug
 
     self._dataset = None
@@ -342,15 +411,17 @@ class BaseGraph2TextDataset(dataset.Dataset):
                    self._num_articles, self._subset)
       if self._graph_retrieval_dataset:
         # For graph retrieval tasks we pair all texts and graphs in the dataset,
-        # and indicate their (text_id, graph_id)
-        retrieval_data = []
-        for i, (g1, _) in enumerate(self._dataset):
-          for j, (_, t2) in enumerate(self._dataset):
-            retrieval_data.append(((g1, t2), (i, j)))
-        self._dataset = retrieval_data
+        # and indicate their (graph_id, text_id).  Pairs are built lazily.
+        self._dataset = GraphRetrievalPairs(
+            self._dataset,
+            num_shards=self._retrieval_num_shards,
+            shard_index=self._retrieval_shard_index)
         logging.info('Constructed %d pairs.', len(self._dataset))
 
     def source():
+      if self._graph_retrieval_dataset:
+        yield from self._dataset.iterate(shuffle=self._shuffle_data)
+        return
       n_examples = len(self._dataset)
       if self._shuffle_data:
         idx = np.random.permutation(n_examples)
@@ -557,6 +628,8 @@ class Graph2TextDataset(BaseGraph2TextDataset):
                data_dir: str = None,
                subsample_nodes: float = 1.0,
                graph_retrieval_dataset: bool = False,
+               retrieval_num_shards: int = 1,
+               retrieval_shard_index: int = 0,
                debug: bool = False):
     """Constructor.
 
@@ -575,6 +648,10 @@ class Graph2TextDataset(BaseGraph2TextDataset):
       subsample_nodes: the proportion of the nodes in a graph to keep.
       graph_retrieval_dataset: whether to construct the dataset for graph
         retrieval tasks.
+      retrieval_num_shards: number of shards to split the graph retrieval pairs
+        into, e.g. one for each host.
+      retrieval_shard_index: index of the shard of graph retrieval pairs to
+        load.
       debug: set to True to use debug mode and only load a small number of
         examples.
     """
@@ -590,6 +667,8 @@ class Graph2TextDataset(BaseGraph2TextDataset):
                      data_dir=data_dir,
                      subsample_nodes=subsample_nodes,
                      graph_retrieval_dataset=graph_retrieval_dataset,
+                     retrieval_num_shards=retrieval_num_shards,
+                     retrieval_shard_index=retrieval_shard_index,
                      debug=debug)
     self._placeholder_graph = self._process_graph(
         center_node='<pad>',
@@ -267,6 +267,21 @@ class PairedDatasetTest(absltest.TestCase):
     self.assertEqual(batch['graph_id'].shape, (batch_size,))
     self.assertEqual(batch['seq_id'].shape, (batch_size,))
 
+  def test_graph_retrieval_pairs(self):
+    examples = [(f'g{i}', f't{i}') for i in range(5)]
+    expected = [((f'g{i}', f't{j}'), (i, j))
+                for i in range(5) for j in range(5)]
+    pairs = paired_dataset.GraphRetrievalPairs(examples)
+    self.assertLen(pairs, 25)
+    self.assertEqual(list(pairs.iterate(chunk_size=4)), expected)
+    self.assertCountEqual(
+        list(pairs.iterate(shuffle=True, chunk_size=4)), expected)
+
+    shards = [paired_dataset.GraphRetrievalPairs(
+        examples, num_shards=3, shard_index=i) for i in range(3)]
+    self.assertEqual(
+        sum([list(shard.iterate()) for shard in shards], []), expected)
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -30,7 +30,8 @@
 """Samplers for the graph2text transformers."""
 
 import abc
-from typing import Any, Optional, Mapping
+import time
+from typing import Any, Callable, Optional, Mapping, Sequence, Tuple
 
 import haiku as hk
 import jax
@@ -42,13 +43,23 @@ from wikigraphs.model import graph_net as gn
 
 
 class BaseSampler:
-  """Base class for transformer samplers."""
+  """Base class for transformer samplers.
+
+  Sampling runs a `while_loop` over chunks of `steps_per_chunk` steps, which
+  exits early once every row has generated `eos_token`.  Prompts are padded to
+  the smallest of `length_buckets` that fits them, so that prompts of different
+  lengths share a few compiled shapes.
+  """
 
   def __init__(self,
                model_fn,
                temperature: float = 1.0,
                device: Optional[Any] = None,
-               rng: Optional[np.ndarray] = None):
+               rng: Optional[np.ndarray] = None,
+               eos_token: Optional[int] = None,
+               pad_token: int = 0,
+               steps_per_chunk: int = 8,
+               length_buckets: Optional[Sequence[int]] = None):
     """Constructor.
 
     Args:
@@ -56,9 +67,20 @@ class BaseSampler:
       temperature: sampling temperature.
       device: the sampler will run on this device if provided.
       rng: random number generator.
+      eos_token: if provided, sampling stops once all rows have generated this
+        token, and the generated tokens after it are set to `pad_token`.
+      pad_token: token for the positions after `eos_token`.
+      steps_per_chunk: number of sampling steps between two checks for
+        `eos_token`.
+      length_buckets: if provided, prompts are padded to the smallest of these
+        lengths that fits them.
     """
     self._temperature = temperature
     self._device = device or jax.local_devices()[0]
+    self._eos_token = eos_token
+    self._pad_token = pad_token
+    self._steps_per_chunk = steps_per_chunk
+    self._length_buckets = sorted(length_buckets or [])
     init_fn, apply_fn = hk.transform_with_state(model_fn)
 
     if rng is None:
@@ -68,6 +90,11 @@ class BaseSampler:
     self._init_state = None
     self._jit_model(init_fn, apply_fn)
 
+    self._compiled_shapes = set()
+    self._num_samples = 0
+    self._num_tokens = 0
+    self._sampling_time = 0.
+
   def _jit_model(self, init_fn, apply_fn):
     """Jit the `init_fn` and `apply_fn`."""
     pass
@@ -112,6 +139,116 @@ class BaseSampler:
       output: the generated sequence.
     """
 
+  def _sample_loop(self,
+                   step_fn: Callable[..., Tuple[jnp.ndarray, Any]],
+                   state: Mapping[str, Any],
+                   rng: jnp.ndarray,
+                   x: jnp.ndarray,
+                   num_steps: jnp.ndarray) -> jnp.ndarray:
+    """Fill in the -1 entries of the prompt `x` one step at a time.
+
+    Args:
+      step_fn: function of (state, rng, step_sample) that returns the logits
+        for the next token and the new state.
+      state: state of the transformer.
+      rng: random number generator.
+      x: a prompt of shape [batch_size, padded_len], in which an entry of -1
+        indicates it will be generate at that place. Otherwise it acts as the
+        prompt.
+      num_steps: number of steps to sample, at most `padded_len - 1`.
+
+    Returns:
+      output: [batch_size, padded_len] tensor, the generated sequence.
+    """
+    batch_size = x.shape[0]
+    prompt = x
+
+    def one_step(i, data):
+      state, rng, x, done = data
+      step_sample = jax.lax.dynamic_slice(x, [0, i], [batch_size, 1])
+      rng, rng_ = jax.random.split(rng)
+      # step_sample shape is [batch_size, 1].
+      logits, state = step_fn(state, rng_, step_sample)
+      rng, rng_ = jax.random.split(rng)
+      step_sample = jax.random.categorical(rng_, logits / self._temperature)
+      # Steps past `num_steps` in the last chunk leave `x` unchanged.
+      valid = i < num_steps
+      next_x = jax.lax.dynamic_slice(x, [0, i + 1], [batch_size, 1])
+      update = jnp.where((next_x < 0) & valid, step_sample, next_x)
+      x = jax.lax.dynamic_update_slice(x, update, [0, i + 1])
+      if self._eos_token is not None:
+        done |= (update[:, 0] == self._eos_token) & valid
+      return state, rng, x, done
+
+    def chunk_cond(data):
+      i, _, _, _, done = data
+      return (i < num_steps) & ~jnp.all(done)
+
+    def chunk_body(data):
+      i, state, rng, x, done = data
+      state, rng, x, done = jax.lax.fori_loop(
+          0, self._steps_per_chunk, lambda j, d: one_step(i + j, d),
+          (state, rng, x, done))
+      return i + self._steps_per_chunk, state, rng, x, done
+
+    done = jnp.zeros([batch_size], dtype=bool)
+    _, _, _, x, _ = jax.lax.while_loop(
+        chunk_cond, chunk_body, (0, state, rng, x, done))
+
+    if self._eos_token is not None:
+      # Positions generated after the first <eos>, or not generated because
+      # sampling stopped early, are padded.
+      is_eos = (x == self._eos_token).at[:, 0].set(False)
+      after_eos = jnp.cumsum(is_eos, axis=1) - is_eos > 0
+      x = jnp.where((prompt < 0) & (after_eos | (x < 0)), self._pad_token, x)
+    return x
+
+  def _pad_prompt(self, x: jnp.ndarray) -> Tuple[np.ndarray, int]:
+    """Pad the prompt with -1 to the smallest length bucket that fits it."""
+    x = np.asarray(x)
+    sample_len = x.shape[1]
+    padded_len = min([b for b in self._length_buckets if b >= sample_len],
+                     default=sample_len)
+    x = np.pad(x, [(0, 0), (0, padded_len - sample_len)], constant_values=-1)
+    return x, sample_len
+
+  def _run_sample_fn(self, sample_fn, shapes, *args) -> jnp.ndarray:
+    """Run `sample_fn` on `args` and keep track of sampling statistics.
+
+    Args:
+      sample_fn: the jitted `self._sample`.
+      shapes: the shapes `sample_fn` gets compiled for.
+      *args: arguments of `sample_fn`, the last two are the padded prompt and
+        the number of steps.
+
+    Returns:
+      output: the generated sequence, of the same length as the padded prompt.
+    """
+    prompt, num_steps = args[-2:]
+    start_time = time.time()
+    sample = jax.block_until_ready(sample_fn(*args))
+    elapsed = time.time() - start_time
+    if shapes in self._compiled_shapes:
+      # Calls that compile are left out of the throughput.
+      generated = np.asarray(sample)[:, 1:num_steps + 1][
+          prompt[:, 1:num_steps + 1] < 0]
+      if self._eos_token is not None:
+        generated = generated[generated != self._pad_token]
+      self._num_samples += prompt.shape[0]
+      self._num_tokens += generated.size
+      self._sampling_time += elapsed
+    self._compiled_shapes.add(shapes)
+    return sample
+
+  @property
+  def statistics(self) -> Mapping[str, float]:
+    """Sampling throughput, excluding calls that compiled."""
+    return dict(
+        num_samples=self._num_samples,
+        num_tokens=self._num_tokens,
+        tokens_per_second=self._num_tokens / max(self._sampling_time, 1e-6),
+        num_compiles=len(self._compiled_shapes))
+
 
 class TransformerXLSampler(BaseSampler):
   """Sampling from the TransformerXL model."""
@@ -126,7 +263,8 @@ class TransformerXLSampler(BaseSampler):
               params: Mapping[str, Any],
               state: Mapping[str, Any],
               rng: jnp.ndarray,
-              x: jnp.ndarray) -> np.ndarray:
+              x: jnp.ndarray,
+              num_steps: jnp.ndarray) -> np.ndarray:
     """Generate unconditional samples.
 
     Args:
@@ -136,32 +274,16 @@ class TransformerXLSampler(BaseSampler):
       x: a prompt of shape [batch_size, sample_len], in which an entry of -1
         indicates it will be generate at that place. Otherwise it acts as the
         prompt.
+      num_steps: number of steps to sample, at most `sample_len - 1`.
 
     Returns:
       output: [batch_size, sample_len] tensor, the generated sequence.
     """
-    batch_size, sample_len = x.shape
-
-    def one_step(params, state, rng, i, x):
-      step_sample = jax.lax.dynamic_slice(x, [0, i], [batch_size, 1])
-      rng, rng_ = jax.random.split(rng)
-      # step_sample shape is [batch_size, 1].
-      logits, state = self._apply_fn(params, state, rng_, step_sample)
-      rng, rng_ = jax.random.split(rng)
-      step_sample = jax.random.categorical(rng_, logits / self._temperature)
-      update = jnp.where(x[:, i + 1] < 0, step_sample[:, 0], x[:, i + 1])[:,
-                                                                          None]
-      x = jax.lax.dynamic_update_slice(x, update, [0, i + 1])
-      return state, rng, x
-
-    def loop_body(i, data):
-      state, rng, x = data
-      return one_step(params, state, rng, i, x)
 
-    _, _, x = jax.lax.fori_loop(0, sample_len - 1, loop_body,
-                                (state, rng, x))
+    def step_fn(state, rng, step_sample):
+      return self._apply_fn(params, state, rng, step_sample)
 
-    return x
+    return self._sample_loop(step_fn, state, rng, x, num_steps)
 
   def sample(self,
              params: Mapping[str, Any],
@@ -183,9 +305,12 @@ class TransformerXLSampler(BaseSampler):
     if params is None:
       params = self._init_params
 
+    x, sample_len = self._pad_prompt(x)
     self._rng, rng = jax.random.split(self._rng)
-    sample = self._sample_fn(params, self._init_state, rng, x)
-    return sample
+    sample = self._run_sample_fn(
+        self._sample_fn, x.shape,
+        params, self._init_state, rng, x, sample_len - 1)
+    return sample[:, :sample_len]
 
 
 class Bow2TextTransformerSampler(BaseSampler):
@@ -202,7 +327,8 @@ class Bow2TextTransformerSampler(BaseSampler):
               state: Mapping[str, Any],
               rng: jnp.ndarray,
               bow: jnp.ndarray,
-              x: jnp.ndarray) -> np.ndarray:
+              x: jnp.ndarray,
+              num_steps: jnp.ndarray) -> np.ndarray:
     """Generate samples conditioned on the bag-of-words of the graph.
 
     Args:
@@ -213,32 +339,16 @@ class Bow2TextTransformerSampler(BaseSampler):
       x: a prompt of shape [batch_size, sample_len], in which an entry of -1
         indicates it will be generate at that place. Otherwise it acts as the
         prompt.
+      num_steps: number of steps to sample, at most `sample_len - 1`.
 
     Returns:
       output: [batch_size, sample_len] tensor, the generated sequence.
     """
-    batch_size, sample_len = x.shape
-
-    def one_step(params, state, rng, i, x):
-      step_sample = jax.lax.dynamic_slice(x, [0, i], [batch_size, 1])
-      rng, rng_ = jax.random.split(rng)
-      # step_sample shape is [batch_size, 1].
-      logits, state = self._apply_fn(params, state, rng_, bow, step_sample)
-      rng, rng_ = jax.random.split(rng)
-      step_sample = jax.random.categorical(rng_, logits / self._temperature)
-      update = jnp.where(x[:, i + 1] < 0, step_sample[:, 0], x[:, i + 1])[:,
-                                                                          None]
-      x = jax.lax.dynamic_update_slice(x, update, [0, i + 1])
-      return state, rng, x
 
-    def loop_body(i, data):
-      state, rng, x = data
-      return one_step(params, state, rng, i, x)
+    def step_fn(state, rng, step_sample):
+      return self._apply_fn(params, state, rng, bow, step_sample)
 
-    _, _, x = jax.lax.fori_loop(0, sample_len - 1, loop_body,
-                                (state, rng, x))
-
-    return x
+    return self._sample_loop(step_fn, state, rng, x, num_steps)
 
   def sample(self,
              params: Mapping[str, Any],
@@ -262,14 +372,42 @@ class Bow2TextTransformerSampler(BaseSampler):
     if params is None:
       params = self._init_params
 
+    x, sample_len = self._pad_prompt(x)
     self._rng, rng = jax.random.split(self._rng)
-    sample = self._sample_fn(params, self._init_state, rng, bow, x)
-    return sample
+    sample = self._run_sample_fn(
+        self._sample_fn, (np.shape(bow), x.shape),
+        params, self._init_state, rng, bow, x, sample_len - 1)
+    return sample[:, :sample_len]
 
 
 class Graph2TextTransformerSampler(BaseSampler):
   """Sampling from the Graph2Text TransformerXL model."""
 
+  def __init__(self,
+               model_fn,
+               temperature: float = 1.0,
+               device: Optional[Any] = None,
+               rng: Optional[np.ndarray] = None,
+               encode_fn=None,
+               **kwargs):
+    """Constructor.
+
+    Args:
+      model_fn: a transformer language model defined in model.transformer.
+      temperature: sampling temperature.
+      device: the sampler will run on this device if provided.
+      rng: random number generator.
+      encode_fn: if provided, a function of (graphs, pad_n_nodes) that returns
+        the graph encodings, which `model_fn` must then accept as an
+        `encoded_graphs` keyword argument.  Graphs are then encoded once per
+        call to `sample` instead of at every sampling step.
+      **kwargs: other arguments of `BaseSampler`.
+    """
+    self._encode_fn = None
+    if encode_fn is not None:
+      self._encode_fn = hk.transform_with_state(encode_fn).apply
+    super().__init__(model_fn, temperature, device, rng, **kwargs)
+
   def _jit_model(self, init_fn, apply_fn):
     """Jit `init_fn` and `apply_fn`, the latter is used in `self._sample`."""
     # `pad_n_nodes` is set as a static argument.
@@ -284,7 +422,8 @@ class Graph2TextTransformerSampler(BaseSampler):
               rng: jnp.ndarray,
               graphs: jraph.GraphsTuple,
               pad_n_nodes: int,
-              x: jnp.ndarray) -> np.ndarray:
+              x: jnp.ndarray,
+              num_steps: jnp.ndarray) -> np.ndarray:
     """Generate samples conditioned on the bag-of-words reprensation of graph.
 
     Args:
@@ -296,33 +435,26 @@ class Graph2TextTransformerSampler(BaseSampler):
       x: a prompt of shape [batch_size, sample_len], in which an entry of -1
         indicates it will be generate at that place. Otherwise it acts as the
         prompt.
+      num_steps: number of steps to sample, at most `sample_len - 1`.
 
     Returns:
       output: [batch_size, sample_len] tensor, the generated sequence.
     """
-    batch_size, sample_len = x.shape
-
-    def one_step(params, state, rng, i, x):
-      step_sample = jax.lax.dynamic_slice(x, [0, i], [batch_size, 1])
-      rng, rng_ = jax.random.split(rng)
-      # step_sample shape is [batch_size, 1].
-      logits, state = self._apply_fn(
-          params, state, rng_, graphs, pad_n_nodes, step_sample)
-      rng, rng_ = jax.random.split(rng)
-      step_sample = jax.random.categorical(rng_, logits / self._temperature)
-      update = jnp.where(x[:, i + 1] < 0, step_sample[:, 0], x[:, i + 1])[:,
-                                                                          None]
-      x = jax.lax.dynamic_update_slice(x, update, [0, i + 1])
-      return state, rng, x
-
-    def loop_body(i, data):
-      state, rng, x = data
-      return one_step(params, state, rng, i, x)
+    if self._encode_fn is None:
+      def step_fn(state, rng, step_sample):
+        return self._apply_fn(
+            params, state, rng, graphs, pad_n_nodes, step_sample)
+    else:
+      # The graphs are encoded once and reused by every sampling step.
+      encoded_graphs, _ = self._encode_fn(
+          params, state, None, graphs, pad_n_nodes)
 
-    _, _, x = jax.lax.fori_loop(0, sample_len - 1, loop_body,
-                                (state, rng, x))
+      def step_fn(state, rng, step_sample):
+        return self._apply_fn(
+            params, state, rng, graphs, pad_n_nodes, step_sample,
+            encoded_graphs=encoded_graphs)
 
-    return x
+    return self._sample_loop(step_fn, state, rng, x, num_steps)
 
   def sample(self,
              params: Mapping[str, Any],
@@ -355,7 +487,11 @@ class Graph2TextTransformerSampler(BaseSampler):
     if params is None:
       params = self._init_params
 
+    x, sample_len = self._pad_prompt(x)
     self._rng, rng = jax.random.split(self._rng)
-    sample = self._sample_fn(
-        params, self._init_state, rng, graphs, max_graph_size, x)
-    return sample
+    graph_shapes = tuple(np.shape(a) for a in jax.tree_util.tree_leaves(graphs))
+    sample = self._run_sample_fn(
+        self._sample_fn, (graph_shapes, max_graph_size, x.shape),
+        params, self._init_state, rng, graphs, max_graph_size, x,
+        sample_len - 1)
+    return sample[:, :sample_len]
@@ -30,6 +30,7 @@
 """Tests for wikigraphs.model.sampler."""
 
 from absl.testing import absltest
+import jax
 import jraph
 import numpy as np
 
@@ -135,6 +136,76 @@ class SamplerTest(absltest.TestCase):
     self.assertEqual(sample2.shape, prompt.shape)
     self.assertTrue((sample != sample2).any())
 
+  def test_early_stopping_sampler_matches_full_sampler(self):
+    prompt = np.array([[0, 1, 2, -1, -1, -1, -1, -1, -1, -1],
+                       [0, 2, -1, -1, -1, -1, -1, -1, -1, -1]], dtype=np.int32)
+    vocab_size = 4
+    eos_token = 3
+    pad_token = 0
+    memory_size = 2
+
+    def model_fn(x):
+      return models.TransformerXL(
+          vocab_size=vocab_size,
+          emb_dim=8,
+          num_layers=2,
+          num_heads=4,
+          cutoffs=[])(x, is_training=False, cache_steps=memory_size)
+
+    full_sampler = sampler.TransformerXLSampler(
+        model_fn, rng=jax.random.PRNGKey(0))
+    early_stopping_sampler = sampler.TransformerXLSampler(
+        model_fn, rng=jax.random.PRNGKey(0), eos_token=eos_token,
+        pad_token=pad_token, steps_per_chunk=3, length_buckets=[16, 32])
+    for _ in range(3):
+      expected = np.array(full_sampler.sample(None, prompt))
+      for row in expected:
+        eos_positions = np.nonzero(row[1:] == eos_token)[0]
+        if eos_positions.size:
+          row[eos_positions[0] + 2:] = pad_token
+      sample = early_stopping_sampler.sample(None, prompt)
+      np.testing.assert_array_equal(sample, expected)
+    self.assertEqual(early_stopping_sampler.statistics['num_compiles'], 1)
+
+  def test_graph2text_sampler_reuses_graph_encoding(self):
+    graphs = jraph.GraphsTuple(
+        nodes=np.ones((4, 3), dtype=np.float32),
+        edges=np.ones((3, 1), dtype=np.float32),
+        senders=np.array([0, 2, 3], dtype=np.int32),
+        receivers=np.array([1, 3, 2], dtype=np.int32),
+        n_node=np.array([2, 2], dtype=np.int32),
+        n_edge=np.array([1, 2], dtype=np.int32),
+        globals=None,
+        )
+    prompt = np.array([[0, 1, 2, -1, -1, -1],
+                       [0, 1, 2, -1, -1, -1]], dtype=np.int32)
+
+    def build_model():
+      return models.Graph2TextTransformer(
+          vocab_size=3,
+          emb_dim=8,
+          num_layers=2,
+          num_heads=4,
+          cutoffs=[],
+          gnn_embed_dim=8,
+          gnn_num_layers=2)
+
+    def model_fn(graphs, max_graph_size, x, encoded_graphs=None):
+      return build_model()(
+          graphs, max_graph_size, True, x, is_training=False, cache_steps=2,
+          encoded_graphs=encoded_graphs)
+
+    def encode_fn(graphs, max_graph_size):
+      return build_model().encode_graphs(graphs, max_graph_size, True)
+
+    graph_sampler = sampler.Graph2TextTransformerSampler(
+        model_fn, rng=jax.random.PRNGKey(0))
+    encoding_sampler = sampler.Graph2TextTransformerSampler(
+        model_fn, rng=jax.random.PRNGKey(0), encode_fn=encode_fn)
+    np.testing.assert_array_equal(
+        encoding_sampler.sample(None, prompt, graphs),
+        graph_sampler.sample(None, prompt, graphs))
+
 
 if __name__ == '__main__':
   absltest.main()
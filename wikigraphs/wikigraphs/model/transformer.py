@@ -368,10 +368,10 @@ class Graph2TextTransformer(hk.Module):
         num_layers=gnn_num_layers,
         use_layer_norm=gnn_layer_norm)
 
-  def _encode_graphs(self,
-                     graphs: jraph.GraphsTuple,
-                     pad_n_nodes: Optional[int] = None,
-                     padded: bool = False) -> Tuple[jnp.ndarray, jnp.ndarray]:
+  def encode_graphs(self,
+                    graphs: jraph.GraphsTuple,
+                    pad_n_nodes: Optional[int] = None,
+                    padded: bool = False) -> Tuple[jnp.ndarray, jnp.ndarray]:
     """Encode graphs so that it can be used in the transformer.
 
     Args:
@@ -397,7 +397,9 @@ class Graph2TextTransformer(hk.Module):
                graphs: jraph.GraphsTuple,
                pad_n_nodes: int,
                batch_padded: bool,
-               *args, **kwargs):
+               *args,
+               encoded_graphs: Optional[Tuple[jnp.ndarray, jnp.ndarray]] = None,
+               **kwargs):
     """Computes the outputs of the graph2text TransformerXL.
 
     Args:
@@ -405,12 +407,16 @@ class Graph2TextTransformer(hk.Module):
       pad_n_nodes: size for each node to pad to.
       batch_padded: whether the graph batch is padded or not.
       *args: args to the TransformerXL model.
+      encoded_graphs: if provided, the output of `encode_graphs` for `graphs`,
+        which is then used instead of encoding the graphs again.
       **kwargs: kwargs to the TransformerXL model.
 
     Returns:
       output: transformer output [batch, timesteps].
     """
-    extra, extra_mask = self._encode_graphs(graphs, pad_n_nodes, batch_padded)
+    if encoded_graphs is None:
+      encoded_graphs = self.encode_graphs(graphs, pad_n_nodes, batch_padded)
+    extra, extra_mask = encoded_graphs
     return self._transformer(
         *args, extra=extra, extra_mask=extra_mask, **kwargs)
 
@@ -436,7 +442,7 @@ class Graph2TextTransformer(hk.Module):
     Returns:
       output: loss and a dict containing metrics.
     """
-    extra, extra_mask = self._encode_graphs(graphs, pad_n_nodes, batch_padded)
+    extra, extra_mask = self.encode_graphs(graphs, pad_n_nodes, batch_padded)
     return self._transformer.loss(
         inputs, labels, mask, extra=extra, extra_mask=extra_mask, **kwargs)
 